@@ -0,0 +1,123 @@
+/**
+ * 帧向量检索两种引擎的耗时对比
+ *
+ * 运行方式: node scripts/benchmark_frame_search.js [videos] [framesPerVideo] [queries]
+ *
+ * - npy:     frame_vector_store.py，memmap 矩阵 + 一次矩阵乘法批量检索（常驻 worker）
+ * - lancedb: 现有路径，每个查询向量单独一次 LanceDB 余弦检索
+ *
+ * 向量为随机 255 维（与本地帧描述子同维度），写到临时目录，不影响线上数据。
+ */
+
+const fs = require('fs');
+const os = require('os');
+const path = require('path');
+const crypto = require('crypto');
+const { writeFrameVectors, searchFrameVectors } = require('../server/services/frameVectorStore');
+const { shutdownVisualCutWorkers } = require('../server/services/visualCutDetector');
+
+const DIMENSIONS = 255;
+const ROUNDS = 20;
+
+function randomVector() {
+  return Array.from({ length: DIMENSIONS }, () => Math.random() * 2 - 1);
+}
+
+function loadLanceDb() {
+  try {
+    return require(require.resolve('@lancedb/lancedb', { paths: [path.join(__dirname, '../server')] }));
+  } catch (error) {
+    return null;
+  }
+}
+
+async function timeRounds(fn) {
+  await fn(); // 预热：首轮包含 worker 启动和 memmap 打开
+  const startedAt = process.hrtime.bigint();
+  for (let i = 0; i < ROUNDS; i++) await fn();
+  return Number(process.hrtime.bigint() - startedAt) / 1e6 / ROUNDS;
+}
+
+async function run() {
+  const videoCount = Number(process.argv[2]) || 20;
+  const framesPerVideo = Number(process.argv[3]) || 3000;
+  const queryCount = Number(process.argv[4]) || 16;
+  const topK = 5;
+  const workDir = fs.mkdtempSync(path.join(os.tmpdir(), 'frame-search-'));
+  const storeDir = path.join(workDir, 'npy');
+
+  const videos = Array.from({ length: videoCount }, (_, index) => `BVbench${index}`);
+  const pointsByVideo = new Map(videos.map(bvid => [bvid, Array.from({ length: framesPerVideo }, (_, index) => ({
+    timestamp: index * 0.5,
+    vector: randomVector()
+  }))]));
+  const queries = Array.from({ length: queryCount }, randomVector);
+  const target = videos[0];
+
+  let startedAt = Date.now();
+  for (const [bvid, points] of pointsByVideo) await writeFrameVectors(bvid, points, { storeDir });
+  const npyWriteMs = Date.now() - startedAt;
+
+  const rows = [];
+  rows.push({
+    engine: 'npy',
+    scope: 'video',
+    ms: await timeRounds(() => searchFrameVectors({ bvid: target, queries, topK }, { storeDir }))
+  });
+  rows.push({
+    engine: 'npy',
+    scope: 'all',
+    ms: await timeRounds(() => searchFrameVectors({ bvid: null, queries, topK }, { storeDir }))
+  });
+
+  let lanceWriteMs = null;
+  const lancedb = loadLanceDb();
+  if (lancedb) {
+    const db = await lancedb.connect(path.join(workDir, 'lancedb'));
+    const data = [];
+    for (const [bvid, points] of pointsByVideo) {
+      for (const point of points) data.push({ id: crypto.randomUUID(), vector: point.vector, bvid, timestamp: point.timestamp });
+    }
+    startedAt = Date.now();
+    await db.createTable('frames', data);
+    lanceWriteMs = Date.now() - startedAt;
+
+    // 与 vectorDb 原实现一致：每次检索都 tableNames() + openTable()，逐条查询
+    const searchOne = async (bvid, vector) => {
+      const names = await db.tableNames();
+      if (!names.includes('frames')) return [];
+      let query = (await db.openTable('frames')).search(vector).distanceType('cosine').limit(topK);
+      if (bvid) query = query.where(`bvid = '${bvid}'`);
+      return query.toArray();
+    };
+    rows.push({
+      engine: 'lancedb',
+      scope: 'video',
+      ms: await timeRounds(() => Promise.all(queries.map(vector => searchOne(target, vector))))
+    });
+    rows.push({
+      engine: 'lancedb',
+      scope: 'all',
+      ms: await timeRounds(() => Promise.all(queries.map(vector => searchOne(null, vector))))
+    });
+  } else {
+    console.warn('未安装 @lancedb/lancedb（server/node_modules），跳过 LanceDB 对比');
+  }
+
+  console.log(`视频 ${videoCount} 个 × ${framesPerVideo} 帧，${DIMENSIONS} 维，每批 ${queryCount} 个查询，top${topK}`);
+  console.log(`写入耗时: npy ${npyWriteMs}ms${lanceWriteMs === null ? '' : `，lancedb ${lanceWriteMs}ms`}`);
+  console.log('engine   scope   每批 ms   每查询 ms');
+  for (const row of rows) {
+    console.log(
+      `${row.engine.padEnd(8)} ${row.scope.padEnd(7)} ${row.ms.toFixed(2).padStart(8)} ${(row.ms / queryCount).toFixed(3).padStart(10)}`
+    );
+  }
+
+  await shutdownVisualCutWorkers();
+  fs.rmSync(workDir, { recursive: true, force: true });
+}
+
+run().catch(error => {
+  console.error(error);
+  process.exitCode = 1;
+});
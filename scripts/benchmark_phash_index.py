@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+跨视频 pHash 索引基准测试
+
+用随机 64 位哈希构造指定规模的索引，测量建表耗时、查询吞吐、每百万帧内存，
+并与暴力扫描对比召回（多索引哈希在半径内应当零漏检）。
+查询哈希取自索引中的已有帧并随机翻转若干位，模拟重新编码后的同一画面。
+
+使用方法:
+  python scripts/benchmark_phash_index.py
+  python scripts/benchmark_phash_index.py --frames 1000000 --queries 2000 --radius 8 --output json
+
+输出 (stdout): 表格；--output json 时输出 JSON
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "server" / "services"))
+
+import phash_index  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="跨视频 pHash 索引基准测试")
+    parser.add_argument("--frames", default="100000,1000000", help="索引帧数，逗号分隔")
+    parser.add_argument("--frames-per-video", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=1000, help="每轮查询帧数")
+    parser.add_argument("--radius", default="4,8", help="汉明半径，逗号分隔")
+    parser.add_argument("--brute-force-queries", type=int, default=100, help="用于核对召回的查询数，0 表示跳过")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", default="text", choices=["text", "json"])
+    return parser.parse_args()
+
+
+def elapsed_ms(started):
+    return round((time.perf_counter() - started) * 1000.0, 2)
+
+
+def random_hashes(rng, count):
+    return rng.integers(0, np.iinfo(np.uint64).max, size=count, dtype=np.uint64, endpoint=True)
+
+
+def flip_bits(rng, hashes, max_bits):
+    flipped = hashes.copy()
+    for position in range(flipped.size):
+        bits = rng.choice(64, size=rng.integers(0, max_bits + 1), replace=False)
+        for bit in bits:
+            flipped[position] ^= np.uint64(1) << np.uint64(int(bit))
+    return flipped
+
+
+def build_index(rng, frame_count, frames_per_video):
+    video_count = max(1, frame_count // frames_per_video)
+    return phash_index.PhashIndex.from_arrays(
+        random_hashes(rng, frame_count),
+        np.arange(frame_count, dtype=np.int32) % video_count,
+        rng.random(frame_count, dtype=np.float32) * 600.0,
+        [f"BV{position:08d}" for position in range(video_count)],
+    )
+
+
+def brute_force(index, hashes, radius):
+    found = set()
+    for position, value in enumerate(hashes):
+        distances = phash_index.popcount64(index.hashes ^ value)
+        found.update((position, int(row)) for row in np.flatnonzero(distances <= radius))
+    return found
+
+
+def run_case(rng, args, frame_count, radius):
+    index = build_index(rng, frame_count, args.frames_per_video)
+    started = time.perf_counter()
+    index.build_tables()
+    build_ms = elapsed_ms(started)
+
+    sources = rng.integers(0, frame_count, size=args.queries)
+    queries = flip_bits(rng, index.hashes[sources], radius)
+    started = time.perf_counter()
+    probes, rows, _ = index.query(queries, radius)
+    query_ms = elapsed_ms(started)
+
+    recall = None
+    if args.brute_force_queries:
+        subset = min(args.brute_force_queries, args.queries)
+        expected = brute_force(index, queries[:subset], radius)
+        got = {(int(probe), int(row)) for probe, row in zip(probes, rows) if probe < subset}
+        recall = round(len(expected & got) / len(expected), 4) if expected else 1.0
+
+    return {
+        "frames": frame_count,
+        "radius": radius,
+        "buildMs": build_ms,
+        "queryMs": query_ms,
+        "queriesPerSecond": round(args.queries / (query_ms / 1000.0)) if query_ms else None,
+        "matches": int(probes.size),
+        "recall": recall,
+        "indexBytes": index.nbytes(),
+        "mbPerMillionFrames": round(index.nbytes() / frame_count * 1e6 / 1024 / 1024, 1),
+    }
+
+
+def print_table(results):
+    header = f"{'frames':>9} {'radius':>6} {'build ms':>9} {'query ms':>9} {'queries/s':>10} {'matches':>8} {'recall':>7} {'MB/1M':>7}"
+    print(header)
+    print("-" * len(header))
+    for run in results["runs"]:
+        recall = "-" if run["recall"] is None else f"{run['recall']:.4f}"
+        print(
+            f"{run['frames']:>9} {run['radius']:>6} {run['buildMs']:>9.1f} {run['queryMs']:>9.1f} "
+            f"{run['queriesPerSecond']:>10} {run['matches']:>8} {recall:>7} {run['mbPerMillionFrames']:>7.1f}"
+        )
+
+
+def main():
+    args = parse_args()
+    rng = np.random.default_rng(args.seed)
+    runs = []
+    for frame_count in [int(value) for value in args.frames.split(",") if value]:
+        for radius in [int(value) for value in args.radius.split(",") if value]:
+            print(f"[Benchmark] frames={frame_count} radius={radius}", file=sys.stderr)
+            runs.append(run_case(rng, args, frame_count, radius))
+
+    results = {
+        "generatedAt": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "queries": args.queries,
+        "framesPerVideo": args.frames_per_video,
+        "runs": runs,
+    }
+    if args.output == "json":
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        print_table(results)
+
+
+if __name__ == "__main__":
+    main()
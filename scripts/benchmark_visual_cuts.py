@@ -0,0 +1,482 @@
+#!/usr/bin/env python3
+"""
+视觉切点引擎离线基准测试
+
+生成确定性的合成帧序列（硬切、淡入淡出、静止画面、噪声段，附带真值切点），
+逐阶段测量 visual_cut_metrics.py 的耗时、峰值内存和帧率，并计算准确率/召回率。
+
+使用方法:
+  python scripts/benchmark_visual_cuts.py
+  python scripts/benchmark_visual_cuts.py --lengths 100,900 --resolutions 320x180 --save-baseline bench.json
+  python scripts/benchmark_visual_cuts.py --baseline bench.json --fail-on-regression
+  python scripts/benchmark_visual_cuts.py --check-parity --lengths 100,900
+
+输出 (stdout): 表格；--output json 时输出 JSON
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "server" / "services"))
+
+import visual_cut_metrics as engine  # noqa: E402
+
+GENERATOR_VERSION = 1
+PARITY_ATOL = 1e-6
+STAGES = ("decode", "resize", "histogram", "ssim", "phash", "select")
+SEGMENT_KINDS = ("motion", "motion", "static", "noise")
+
+
+def parse_resolution(value):
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def scene_image(rng, width, height):
+    # 平滑渐变背景 + 若干色块，保证不同场景之间颜色和结构都不同
+    y = np.linspace(0.0, 1.0, height, dtype=np.float32)[:, None, None]
+    x = np.linspace(0.0, 1.0, width, dtype=np.float32)[None, :, None]
+    start, end, tilt = rng.uniform(0, 255, size=(3, 3)).astype(np.float32)
+    image = start * (1 - x) + end * x + (tilt - 128.0) * 0.4 * y
+    for _ in range(int(rng.integers(3, 7))):
+        w = int(rng.integers(width // 8, width // 2))
+        h = int(rng.integers(height // 8, height // 2))
+        left = int(rng.integers(0, width - w))
+        top = int(rng.integers(0, height - h))
+        image[top:top + h, left:left + w] = rng.uniform(0, 255, size=3)
+    return np.clip(image, 0, 255)
+
+
+def build_timeline(frame_count, seed):
+    rng = np.random.default_rng(seed)
+    segments = []
+    position = 0
+    while position < frame_count:
+        length = int(rng.integers(20, 61))
+        if frame_count - (position + length) < 20:
+            length = frame_count - position
+        kind = SEGMENT_KINDS[int(rng.integers(0, len(SEGMENT_KINDS)))]
+        transition = "fade" if segments and rng.random() < 0.3 else "cut"
+        segments.append({"start": position, "length": length, "kind": kind, "transition": transition})
+        position += length
+    return segments
+
+
+def render_sequence(frame_dir, frame_count, resolution, seed, fade_frames=6, quality=85):
+    width, height = resolution
+    rng = np.random.default_rng(seed + 1)
+    segments = build_timeline(frame_count, seed)
+    scenes = [scene_image(rng, width, height) for _ in segments]
+    cuts = []
+
+    paths = []
+    for index, segment in enumerate(segments):
+        base = scenes[index]
+        for offset in range(segment["length"]):
+            frame_index = segment["start"] + offset
+            if segment["kind"] == "static":
+                image = base
+            elif segment["kind"] == "noise":
+                image = base + rng.normal(0.0, 12.0, size=base.shape).astype(np.float32)
+            else:
+                shift = offset % max(1, width // 20)
+                image = np.roll(base, shift, axis=1) + rng.normal(0.0, 2.0, size=base.shape).astype(np.float32)
+
+            if index > 0 and segment["transition"] == "fade" and offset < fade_frames:
+                alpha = (offset + 1) / (fade_frames + 1)
+                image = scenes[index - 1] * (1 - alpha) + image * alpha
+
+            frame_path = frame_dir / f"frame_{frame_index:06d}.jpg"
+            Image.fromarray(np.clip(image, 0, 255).astype(np.uint8)).save(frame_path, quality=quality)
+            paths.append(frame_path)
+
+        if index > 0:
+            cut_time = segment["start"] + (fade_frames / 2.0 if segment["transition"] == "fade" else 0.0)
+            cuts.append({"time": float(cut_time), "type": segment["transition"]})
+
+    return paths, cuts, segments
+
+
+def load_or_render(work_dir, frame_count, resolution, seed):
+    name = f"{frame_count}f_{resolution[0]}x{resolution[1]}_s{seed}"
+    frame_dir = work_dir / name
+    truth_path = frame_dir / "truth.json"
+    if truth_path.exists():
+        truth = json.loads(truth_path.read_text(encoding="utf-8"))
+        if truth.get("generatorVersion") == GENERATOR_VERSION:
+            paths = [frame_dir / f"frame_{index:06d}.jpg" for index in range(frame_count)]
+            if all(path.exists() for path in paths):
+                return name, paths, truth
+
+    frame_dir.mkdir(parents=True, exist_ok=True)
+    paths, cuts, segments = render_sequence(frame_dir, frame_count, resolution, seed)
+    truth = {
+        "generatorVersion": GENERATOR_VERSION,
+        "frameCount": frame_count,
+        "resolution": list(resolution),
+        "seed": seed,
+        "cuts": cuts,
+        "segments": segments,
+    }
+    truth_path.write_text(json.dumps(truth, ensure_ascii=False, indent=2), encoding="utf-8")
+    return name, paths, truth
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    # Linux 下 ru_maxrss 以 KB 计，macOS 以字节计
+    scale = 1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1)
+
+
+class StageTimer:
+    # trace=True 时只用于统计分配：tracemalloc 会拖慢每次分配，计时与分配统计分两遍跑
+    def __init__(self, frame_count, trace=False):
+        self.frame_count = frame_count
+        self.trace = trace
+        self.results = {}
+
+    def add(self, stage, seconds, alloc_bytes=0):
+        entry = self.results.setdefault(stage, {"seconds": 0.0, "allocBytes": 0})
+        entry["seconds"] += seconds
+        entry["allocBytes"] = max(entry["allocBytes"], alloc_bytes)
+
+    def measure(self, stage, func, *args):
+        if not self.trace:
+            started = time.perf_counter()
+            value = func(*args)
+            self.add(stage, time.perf_counter() - started)
+            return value
+        tracemalloc.reset_peak()
+        started = time.perf_counter()
+        value = func(*args)
+        self.add(stage, time.perf_counter() - started, tracemalloc.get_traced_memory()[1])
+        return value
+
+    def report(self):
+        report = {}
+        for stage in STAGES:
+            entry = self.results.get(stage)
+            if entry is None:
+                continue
+            seconds = entry["seconds"]
+            report[stage] = {
+                "wallMs": round(seconds * 1000.0, 2),
+                "fps": round(self.frame_count / seconds, 1) if seconds > 0 else None,
+                "peakAllocMb": round(entry["allocBytes"] / 1024.0 / 1024.0, 2),
+            }
+        return report
+
+
+def decode_images(paths, draft):
+    images = []
+    for path in paths:
+        with Image.open(path) as source:
+            if draft:
+                source.draft("RGB", engine.ANALYSIS_SIZE)
+            images.append(source.convert("RGB"))
+    return images
+
+
+def resize_images(images):
+    rgb = [np.asarray(image.resize(engine.ANALYSIS_SIZE, Image.Resampling.BILINEAR), dtype=np.uint8) for image in images]
+    gray = [
+        np.asarray(image.convert("L").resize(engine.PHASH_SIZE, Image.Resampling.LANCZOS), dtype=np.uint8)
+        for image in images
+    ]
+    return rgb, gray
+
+
+def run_stages(paths, options, trace=False):
+    hist_bins = engine.resolve_hist_bins(options)
+    draft = options.get("draftDecode", True) is not False
+    timer = StageTimer(len(paths), trace)
+    rgb_frames, phash_frames = [], []
+
+    # 分块解码，避免 5000 帧全分辨率图像同时驻留内存
+    for start in range(0, len(paths), engine.FEATURE_CHUNK):
+        images = timer.measure("decode", decode_images, paths[start:start + engine.FEATURE_CHUNK], draft)
+        rgb, gray = timer.measure("resize", resize_images, images)
+        rgb_frames.extend(rgb)
+        phash_frames.extend(gray)
+        del images
+
+    rgb = np.stack(rgb_frames)
+    del rgb_frames
+    hist_diff = timer.measure(
+        "histogram",
+        lambda: engine.histogram_diff_batch(engine.histogram_batch(rgb, hist_bins)),
+    )
+    ssim_diff = timer.measure("ssim", lambda: engine.ssim_diff_batch(engine.grayscale_batch(rgb)))
+    phash_diff = timer.measure(
+        "phash",
+        lambda: engine.phash_diff_batch(engine.perceptual_hash_batch(np.stack(phash_frames))),
+    )
+    metrics = {"ssimDiff": ssim_diff, "histDiff": hist_diff, "phashDiff": phash_diff}
+    times = np.arange(len(paths), dtype=np.float64)
+    selection = timer.measure("select", engine.select_cuts, times, metrics, options)
+    return timer.report(), selection["visualCuts"]
+
+
+def run_end_to_end(paths, options):
+    frames = [{"framePath": str(path), "time": float(index)} for index, path in enumerate(paths)]
+    started = time.perf_counter()
+    result = engine.detect_visual_cuts(frames, options)
+    seconds = time.perf_counter() - started
+    return {
+        "wallMs": round(seconds * 1000.0, 2),
+        "fps": round(len(paths) / seconds, 1) if seconds > 0 else None,
+        "timings": result["stats"].get("timings"),
+        "workers": result["stats"].get("workers"),
+    }, result["visualCuts"]
+
+
+def score_cuts(predicted, truth, tolerance):
+    expected = [cut["time"] for cut in truth]
+    used = set()
+    matched = 0
+    errors = []
+    for cut in sorted(predicted, key=lambda item: item["time"]):
+        best = None
+        for index, time_value in enumerate(expected):
+            if index in used:
+                continue
+            distance = abs(cut["time"] - time_value)
+            if distance <= tolerance and (best is None or distance < best[1]):
+                best = (index, distance)
+        if best is not None:
+            used.add(best[0])
+            matched += 1
+            errors.append(best[1])
+
+    precision = matched / len(predicted) if predicted else (1.0 if not expected else 0.0)
+    recall = matched / len(expected) if expected else 1.0
+    missed_by_type = {}
+    for index, cut in enumerate(truth):
+        if index not in used:
+            missed_by_type[cut["type"]] = missed_by_type.get(cut["type"], 0) + 1
+    return {
+        "predicted": len(predicted),
+        "expected": len(expected),
+        "matched": matched,
+        "precision": round(precision, 4),
+        "recall": round(recall, 4),
+        "meanTimeError": round(float(np.mean(errors)), 3) if errors else None,
+        "missedByType": missed_by_type,
+    }
+
+
+def run_case(work_dir, frame_count, resolution, seed, options, tolerance):
+    name, paths, truth = load_or_render(work_dir, frame_count, resolution, seed)
+    stages, stage_cuts = run_stages(paths, options)
+    rss_after_stages = peak_rss_mb()
+    end_to_end, cuts = run_end_to_end(paths, options)
+    rss_end_to_end = peak_rss_mb()
+
+    # 分配统计单独一遍（串行分阶段，tracemalloc 开启），耗时取上面不带追踪的那遍
+    tracemalloc.start()
+    try:
+        traced, _ = run_stages(paths, options, trace=True)
+    finally:
+        tracemalloc.stop()
+    for stage, entry in stages.items():
+        entry["peakAllocMb"] = traced[stage]["peakAllocMb"]
+    return {
+        "case": name,
+        "frameCount": frame_count,
+        "resolution": f"{resolution[0]}x{resolution[1]}",
+        "stages": stages,
+        "endToEnd": end_to_end,
+        "peakRssMb": {"stages": rss_after_stages, "endToEnd": rss_end_to_end},
+        "accuracy": score_cuts(cuts, truth["cuts"], tolerance),
+        "stageAccuracy": score_cuts(stage_cuts, truth["cuts"], tolerance),
+    }
+
+
+def check_parity(work_dir, frame_count, resolution, seed, options):
+    # 回归检查：逐对引擎（engine=pairwise）与批量引擎（全尺寸解码）在同一组帧上
+    # 三项指标应一致（SSIM 只允许浮点误差），选出的切点必须完全相同
+    name, paths, _ = load_or_render(work_dir, frame_count, resolution, seed)
+    frame_paths = [str(path) for path in paths]
+    hist_bins = engine.resolve_hist_bins(options)
+    times = np.arange(len(paths), dtype=np.float64)
+    outputs = {}
+    for label, overrides in (("pairwise", {"engine": "pairwise"}), ("batch", {"engine": "batch", "draftDecode": False})):
+        metrics, _ = engine.compute_metrics(frame_paths, hist_bins, {**options, **overrides})
+        outputs[label] = (metrics, engine.select_cuts(times, metrics, options)["visualCuts"])
+
+    (pairwise_metrics, pairwise_cuts), (batch_metrics, batch_cuts) = outputs["pairwise"], outputs["batch"]
+    failures = []
+    max_diff = {}
+    for metric in ("ssimDiff", "histDiff", "phashDiff"):
+        expected = np.asarray(pairwise_metrics[metric], dtype=np.float64)
+        actual = np.asarray(batch_metrics[metric], dtype=np.float64)
+        if expected.shape != actual.shape:
+            failures.append(f"{metric} 长度不一致: {expected.shape} != {actual.shape}")
+            continue
+        max_diff[metric] = float(np.max(np.abs(expected - actual))) if expected.size else 0.0
+        if max_diff[metric] > PARITY_ATOL:
+            failures.append(f"{metric} 最大偏差 {max_diff[metric]:.3g} 超过 {PARITY_ATOL:g}")
+    if len(pairwise_cuts) != len(batch_cuts):
+        failures.append(f"visualCuts 数量不一致: pairwise {len(pairwise_cuts)} != batch {len(batch_cuts)}")
+    else:
+        for expected, actual in zip(pairwise_cuts, batch_cuts):
+            if expected != actual:
+                failures.append(f"visualCuts 不一致: pairwise {expected} != batch {actual}")
+                break
+    return {"case": name, "cuts": len(pairwise_cuts), "maxDiff": max_diff, "failures": failures}
+
+
+def run_parity(work_dir, lengths, resolutions, seed, options):
+    failed = False
+    for frame_count in lengths:
+        for resolution in resolutions:
+            result = check_parity(work_dir, frame_count, resolution, seed, options)
+            diffs = "  ".join(f"{metric}={value:.2g}" for metric, value in result["maxDiff"].items())
+            status = "OK" if not result["failures"] else "FAIL"
+            print(f"{status:<5}{result['case']:<24}cuts={result['cuts']:<4}{diffs}")
+            for failure in result["failures"]:
+                print(f"     - {failure}")
+            failed = failed or bool(result["failures"])
+    return not failed
+
+
+def compare_with_baseline(results, baseline, threshold):
+    baseline_cases = {case["case"]: case for case in baseline.get("cases", [])}
+    comparisons = []
+    regressions = []
+    for case in results["cases"]:
+        previous = baseline_cases.get(case["case"])
+        if previous is None:
+            continue
+        entry = {"case": case["case"], "stages": {}, "accuracy": {}}
+        for stage, current in list(case["stages"].items()) + [("endToEnd", case["endToEnd"])]:
+            old = previous["stages"].get(stage) if stage != "endToEnd" else previous.get("endToEnd")
+            if not old or not old.get("wallMs"):
+                continue
+            ratio = current["wallMs"] / old["wallMs"]
+            entry["stages"][stage] = round(ratio, 3)
+            # 很短的阶段受计时抖动影响大，忽略 5ms 以内的绝对差异
+            if ratio > 1.0 + threshold and current["wallMs"] - old["wallMs"] > 5.0:
+                regressions.append(f"{case['case']} {stage}: {old['wallMs']}ms -> {current['wallMs']}ms")
+        for metric in ("precision", "recall"):
+            delta = case["accuracy"][metric] - previous["accuracy"][metric]
+            entry["accuracy"][metric] = round(delta, 4)
+            if delta < -1e-9:
+                regressions.append(
+                    f"{case['case']} {metric}: {previous['accuracy'][metric]} -> {case['accuracy'][metric]}"
+                )
+        comparisons.append(entry)
+    return comparisons, regressions
+
+
+def print_table(results, comparisons, regressions):
+    for case in results["cases"]:
+        accuracy = case["accuracy"]
+        print(f"\n== {case['case']} ({case['frameCount']} frames, {case['resolution']})")
+        print(f"{'stage':<10}{'wall ms':>12}{'fps':>12}{'alloc MB':>12}")
+        for stage, entry in case["stages"].items():
+            print(f"{stage:<10}{entry['wallMs']:>12.1f}{entry['fps'] or 0:>12.1f}{entry['peakAllocMb']:>12.2f}")
+        end_to_end = case["endToEnd"]
+        print(f"{'pipeline':<10}{end_to_end['wallMs']:>12.1f}{end_to_end['fps'] or 0:>12.1f}")
+        print(
+            f"peak RSS {case['peakRssMb']['endToEnd']}MB | precision {accuracy['precision']} "
+            f"recall {accuracy['recall']} ({accuracy['matched']}/{accuracy['expected']}, "
+            f"predicted {accuracy['predicted']}, missed {accuracy['missedByType']})"
+        )
+
+    if comparisons:
+        print("\n== baseline comparison (time ratio, accuracy delta)")
+        for entry in comparisons:
+            stages = ", ".join(f"{stage} x{ratio}" for stage, ratio in entry["stages"].items())
+            print(f"{entry['case']}: {stages}; precision {entry['accuracy']['precision']:+} "
+                  f"recall {entry['accuracy']['recall']:+}")
+        if regressions:
+            print("\nregressions:")
+            for line in regressions:
+                print(f"  - {line}")
+        else:
+            print("no regressions")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="视觉切点引擎基准测试")
+    parser.add_argument("--lengths", default="100,900,5000", help="帧数列表，逗号分隔")
+    parser.add_argument("--resolutions", default="320x180,640x360", help="分辨率列表，如 320x180,640x360")
+    parser.add_argument("--seed", type=int, default=7, help="合成序列随机种子")
+    parser.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(), "visionmark_visual_bench"),
+                        help="合成帧缓存目录（同参数重复运行时复用）")
+    parser.add_argument("--tolerance", type=float, default=4.0, help="切点匹配容差（秒，1 帧 = 1 秒）")
+    parser.add_argument("--options", default="{}", help="传给 visual_cut_metrics 的 JSON 选项")
+    parser.add_argument("--baseline", help="与已保存的基线结果对比")
+    parser.add_argument("--save-baseline", help="把本次结果保存为基线文件")
+    parser.add_argument("--regression-threshold", type=float, default=0.15, help="耗时回退判定比例")
+    parser.add_argument("--fail-on-regression", action="store_true", help="有回退时以退出码 1 结束")
+    parser.add_argument("--check-parity", action="store_true",
+                        help="只做回归检查：pairwise 与 batch（draftDecode=false）的指标和切点必须一致")
+    parser.add_argument("--output", default="table", choices=["table", "json"], help="输出格式")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    work_dir = Path(args.work_dir)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    options = engine.deep_merge(engine.DEFAULT_OPTIONS, json.loads(args.options))
+    options["featureCache"] = False
+    lengths = [int(value) for value in args.lengths.split(",") if value]
+    resolutions = [parse_resolution(value) for value in args.resolutions.split(",") if value]
+
+    if args.check_parity:
+        sys.exit(0 if run_parity(work_dir, lengths, resolutions, args.seed, options) else 1)
+
+    cases = []
+    for frame_count in lengths:
+        for resolution in resolutions:
+            print(f"[Benchmark] {frame_count} frames @ {resolution[0]}x{resolution[1]}", file=sys.stderr)
+            cases.append(run_case(work_dir, frame_count, resolution, args.seed, options, args.tolerance))
+
+    results = {
+        "generatedAt": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "cpuCount": os.cpu_count(),
+        "options": {key: value for key, value in options.items() if key != "weights"},
+        "cases": cases,
+    }
+
+    comparisons, regressions = [], []
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        comparisons, regressions = compare_with_baseline(results, baseline, args.regression_threshold)
+        results["comparison"] = {"baseline": args.baseline, "cases": comparisons, "regressions": regressions}
+
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    if args.output == "json":
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        print_table(results, comparisons, regressions)
+
+    if args.fail_on_regression and regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
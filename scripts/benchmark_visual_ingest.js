@@ -0,0 +1,76 @@
+/**
+ * 视觉切点两种输入路径的耗时对比
+ *
+ * 运行方式: node scripts/benchmark_visual_ingest.js <video.mp4> [sampleFps]
+ *
+ * - jpeg:   ffmpeg 抽取 visual_%06d.jpg -> Python 读取并解码 JPEG
+ * - stream: Python 直接读取 ffmpeg rawvideo 管道
+ */
+
+const fs = require('fs');
+const os = require('os');
+const path = require('path');
+const VideoAnalyzer = require('../server/services/videoAnalyzer');
+const { analyzeVisualCuts, shutdownVisualCutWorkers } = require('../server/services/visualCutDetector');
+
+function cutTimes(result) {
+  return (result.visualCuts || []).map(cut => cut.time);
+}
+
+function matchedCuts(reference, candidate, toleranceSeconds) {
+  return reference.filter(time => candidate.some(other => Math.abs(other - time) <= toleranceSeconds)).length;
+}
+
+async function run() {
+  const videoPath = process.argv[2];
+  const sampleFps = Number(process.argv[3]) || 1;
+  if (!videoPath || !fs.existsSync(videoPath)) {
+    console.error('用法: node scripts/benchmark_visual_ingest.js <video.mp4> [sampleFps]');
+    process.exitCode = 1;
+    return;
+  }
+
+  const workDir = fs.mkdtempSync(path.join(os.tmpdir(), 'visual-ingest-'));
+  const analyzer = new VideoAnalyzer(workDir);
+  const duration = await analyzer.getVideoDuration(videoPath);
+  const visualCutOptions = { featureCache: false };
+
+  // 先预热 worker，避免把 Python 启动时间算进第一条路径
+  await analyzeVisualCuts([], visualCutOptions);
+
+  let startedAt = Date.now();
+  const frames = await analyzer.extractVisualProbeFrames(videoPath, 'bench', duration, null, { sampleFps });
+  const extractMs = Date.now() - startedAt;
+  startedAt = Date.now();
+  const jpegResult = await analyzeVisualCuts(frames, visualCutOptions);
+  const jpegAnalyzeMs = Date.now() - startedAt;
+  const jpegBytes = fs.readdirSync(path.join(workDir, 'bench_visual_frames'))
+    .filter(file => file.endsWith('.jpg'))
+    .reduce((sum, file) => sum + fs.statSync(path.join(workDir, 'bench_visual_frames', file)).size, 0);
+
+  startedAt = Date.now();
+  const streamResult = await analyzer.detectVisualCuts(videoPath, 'bench', duration, null, {
+    visualProbe: { mode: 'stream', sampleFps },
+    visualCuts: visualCutOptions
+  });
+  const streamMs = Date.now() - startedAt;
+
+  const jpegCuts = cutTimes(jpegResult);
+  const streamCuts = cutTimes(streamResult);
+  const tolerance = 1.5 / sampleFps;
+
+  console.log(`\nvideo=${videoPath} duration=${duration.toFixed(1)}s sampleFps=${sampleFps}`);
+  console.log(`jpeg:   frames=${jpegResult.stats?.frameCount} extract=${extractMs}ms analyze=${jpegAnalyzeMs}ms total=${extractMs + jpegAnalyzeMs}ms disk=${(jpegBytes / 1024 / 1024).toFixed(2)}MB cuts=${jpegCuts.length}`);
+  console.log(`stream: frames=${streamResult.stats?.frameCount} total=${streamMs}ms disk=0MB cuts=${streamCuts.length}`);
+  console.log(`speedup=${((extractMs + jpegAnalyzeMs) / Math.max(streamMs, 1)).toFixed(2)}x`);
+  console.log(`cut agreement (±${tolerance}s): ${matchedCuts(jpegCuts, streamCuts, tolerance)}/${jpegCuts.length}`);
+
+  fs.rmSync(workDir, { recursive: true, force: true });
+}
+
+run()
+  .catch(error => {
+    console.error(error);
+    process.exitCode = 1;
+  })
+  .finally(shutdownVisualCutWorkers);
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Whisper 分块并行转写基准测试
+
+对同一段音频分别跑单次整段转写和不同进程数的分块转写，比较总耗时、实时率、
+相对单次转写的加速比，以及拼接后的文本与单次转写结果的相似度（检查切块是否丢字/重复）。
+
+使用方法:
+  python scripts/benchmark_whisper_chunked.py --audio input.wav
+  python scripts/benchmark_whisper_chunked.py --audio input.wav --model small --workers 1,2,4 --output json
+
+输出 (stdout): 表格；--output json 时输出 JSON
+"""
+
+import argparse
+import difflib
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import whisper_transcribe as transcriber  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Whisper 分块并行转写基准测试")
+    parser.add_argument("--audio", required=True, help="16 kHz 单声道 WAV（其他格式会先整段解码）")
+    parser.add_argument("--model", default="base", choices=transcriber.MODEL_CHOICES)
+    parser.add_argument("--language", default="zh")
+    parser.add_argument("--workers", default="1,2,4", help="分块模式要测的进程数，逗号分隔")
+    parser.add_argument("--chunk-seconds", type=float, default=0, help="目标块长，0 表示按进程数自动选择")
+    parser.add_argument("--overlap-seconds", type=float, default=1.0)
+    parser.add_argument("--output", default="text", choices=["text", "json"])
+    return parser.parse_args()
+
+
+def joined_text(segments):
+    return "".join(seg["text"] for seg in segments)
+
+
+def run_single(args):
+    whisper = transcriber.import_whisper()
+    started = time.perf_counter()
+    model = whisper.load_model(args.model)
+    load_ms = transcriber.elapsed_ms(started)
+    segments, timings = transcriber.transcribe_file(model, args.audio, args.language)
+    return {
+        "mode": "single",
+        "workers": 1,
+        "wallMs": transcriber.elapsed_ms(started),
+        "modelLoadMs": load_ms,
+        "transcribeMs": timings["transcribeMs"],
+        "segments": len(segments),
+    }, segments
+
+
+def run_chunked(args, workers):
+    started = time.perf_counter()
+    # 每轮新建进程池，墙钟时间包含各子进程加载模型的开销
+    transcriber.shutdown_chunk_executor()
+    segments, timings = transcriber.transcribe_chunked(
+        args.audio, args.language, args.model,
+        workers=workers,
+        chunk_seconds=args.chunk_seconds,
+        overlap_seconds=args.overlap_seconds,
+    )
+    transcriber.shutdown_chunk_executor()
+    chunked = timings["chunked"]
+    return {
+        "mode": "chunked",
+        "workers": chunked["workers"],
+        "wallMs": transcriber.elapsed_ms(started),
+        "modelLoadMs": None,
+        "transcribeMs": timings["transcribeMs"],
+        "segments": len(segments),
+        "chunks": chunked["chunks"],
+        "silenceSplits": chunked["silenceSplits"],
+        "hardSplits": chunked["hardSplits"],
+        "overlapDropped": chunked["overlapDropped"],
+        "duplicateDropped": chunked["duplicateDropped"],
+    }, segments
+
+
+def print_table(results):
+    print(f"音频 {results['audio']}  时长 {results['audioSeconds']}s  模型 {results['model']}  CPU {results['cpuCount']}")
+    header = f"{'mode':<8} {'workers':>7} {'chunks':>6} {'wall ms':>10} {'RTF':>7} {'speedup':>8} {'segs':>5} {'similar':>8}"
+    print(header)
+    print("-" * len(header))
+    for run in results["runs"]:
+        print(
+            f"{run['mode']:<8} {run['workers']:>7} {run.get('chunks', 1):>6} {run['wallMs']:>10.0f} "
+            f"{run['realTimeFactor']:>7.3f} {run['speedup']:>7.2f}x {run['segments']:>5} {run['textSimilarity']:>8.3f}"
+        )
+
+
+def main():
+    args = parse_args()
+    if not os.path.exists(args.audio):
+        print(f"音频文件不存在: {args.audio}", file=sys.stderr)
+        sys.exit(1)
+
+    samples, _ = transcriber.load_samples(args.audio)
+    audio_seconds = len(samples) / float(transcriber.SAMPLE_RATE)
+    del samples
+
+    print("[Benchmark] 单次整段转写", file=sys.stderr)
+    baseline, baseline_segments = run_single(args)
+    reference = joined_text(baseline_segments)
+    runs = [(baseline, baseline_segments)]
+    for workers in [int(value) for value in args.workers.split(",") if value]:
+        print(f"[Benchmark] 分块转写 workers={workers}", file=sys.stderr)
+        runs.append(run_chunked(args, workers))
+
+    for run, segments in runs:
+        run["realTimeFactor"] = round(run["wallMs"] / 1000.0 / audio_seconds, 3) if audio_seconds else 0.0
+        run["speedup"] = round(baseline["wallMs"] / run["wallMs"], 2) if run["wallMs"] else 0.0
+        run["textSimilarity"] = round(difflib.SequenceMatcher(None, reference, joined_text(segments)).ratio(), 3)
+
+    results = {
+        "generatedAt": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "audio": args.audio,
+        "audioSeconds": round(audio_seconds, 2),
+        "model": args.model,
+        "cpuCount": os.cpu_count(),
+        "runs": [run for run, _ in runs],
+    }
+    if args.output == "json":
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        print_table(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Whisper CPU 推理配置基准测试
+
+对同一段音频比较几种 CPU 推理配置（fp32 / 动态 int8 量化、torch 线程数、贪心 / beam search）：
+每种配置在新的子进程里加载模型并转写，可同时起多个任务模拟并发，记录模型加载耗时、
+转写耗时、实时率（RTF = 转写耗时 / 音频时长）、并发时的总吞吐，以及文本准确度。
+
+准确度：给了 --reference（人工转写文本）时计算字错率 CER；否则以第一个配置（默认 fp32，
+即现有配置）的输出为参照，计算文本相似度。
+
+使用方法:
+  python scripts/benchmark_whisper_cpu.py --audio input.wav
+  python scripts/benchmark_whisper_cpu.py --audio input.wav --model small --variants fp32,int8,int8+beam5 --jobs 1,2
+  python scripts/benchmark_whisper_cpu.py --audio input.wav --reference transcript.txt --output json
+
+配置写法: fp32 或 int8，后面可接 +tN（每个任务 N 个线程）、+beamN、+bestofN、+nofallback；
+不写 +tN 时，并发 K 个任务的每个任务分到 CPU 数 / K 个线程（--no-budget 时保持 torch 默认，即现状）。
+
+输出 (stdout): 表格；--output json 时输出 JSON
+"""
+
+import argparse
+import difflib
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import whisper_transcribe as transcriber  # noqa: E402
+
+VARIANT_PART = re.compile(r"^(t|beam|bestof)(\d+)$")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Whisper CPU 推理配置基准测试")
+    parser.add_argument("--audio", required=True, help="16 kHz 单声道 WAV（其他格式会先整段解码）")
+    parser.add_argument("--model", default="base", choices=transcriber.MODEL_CHOICES)
+    parser.add_argument("--language", default="zh")
+    parser.add_argument("--variants", default="fp32,int8,int8+beam5,int8+nofallback", help="要比较的配置，逗号分隔")
+    parser.add_argument("--jobs", default="1,2", help="同时运行的任务数，逗号分隔")
+    parser.add_argument("--no-budget", action="store_true", help="未指定 +tN 时不分配线程（torch 默认）")
+    parser.add_argument("--reference", help="人工转写文本文件，用于计算字错率")
+    parser.add_argument("--output", default="text", choices=["text", "json"])
+    return parser.parse_args()
+
+
+def parse_variant(name):
+    base, *parts = name.split("+")
+    if base not in ("fp32", "int8"):
+        raise ValueError(f"未知配置: {name}")
+    inference = {"quantize": base == "int8"}
+    for part in parts:
+        if part == "nofallback":
+            inference["temperatureFallback"] = False
+            continue
+        match = VARIANT_PART.match(part)
+        if not match:
+            raise ValueError(f"未知配置: {name}")
+        field = {"t": "threads", "beam": "beamSize", "bestof": "bestOf"}[match.group(1)]
+        inference[field] = int(match.group(2))
+    return inference
+
+
+def normalize_text(text):
+    # 只比较文字本身，忽略空白和标点
+    return re.sub(r"[\s\W_]+", "", text)
+
+
+def char_error_rate(reference, hypothesis):
+    """字级编辑距离 / 参照长度，按行推进的向量化动态规划"""
+    if not reference:
+        return 0.0 if not hypothesis else 1.0
+    ref = np.frombuffer(reference.encode("utf-32-le"), dtype=np.uint32)
+    hyp = np.frombuffer(hypothesis.encode("utf-32-le"), dtype=np.uint32)
+    previous = np.arange(len(ref) + 1)
+    for index, char in enumerate(hyp, start=1):
+        substitute = previous[:-1] + (ref != char)
+        current = np.empty_like(previous)
+        current[0] = index
+        current[1:] = np.minimum(substitute, previous[1:] + 1)
+        # 插入代价沿行累积：current[j] = min(current[j], current[j-1] + 1)
+        current = np.minimum.accumulate(current - np.arange(len(current))) + np.arange(len(current))
+        previous = current
+    return round(float(previous[-1]) / len(ref), 4)
+
+
+_barrier = None
+
+
+def init_job(barrier):
+    global _barrier
+    _barrier = barrier
+    sys.stdout = sys.stderr
+
+
+def run_job(task):
+    """子进程：固定线程数、加载模型，等所有任务加载完后同时开始转写"""
+    inference = transcriber.resolve_inference(task["inference"])
+    threads = transcriber.apply_thread_budget(inference["threads"])
+    started = time.perf_counter()
+    model = transcriber.load_model_variant(transcriber.model_key(task["model"], inference))
+    load_ms = transcriber.elapsed_ms(started)
+    model_mb = transcriber.model_size_mb(model)
+    _barrier.wait()
+    began = time.time()
+    segments, timings = transcriber.transcribe_file(model, task["audio"], task["language"], inference=inference)
+    return {
+        "threads": threads,
+        "modelLoadMs": load_ms,
+        "modelMb": model_mb,
+        "transcribeMs": timings["transcribeMs"],
+        "began": began,
+        "finished": time.time(),
+        "text": "".join(seg["text"] for seg in segments),
+        "segments": len(segments),
+    }
+
+
+def run_variant(args, name, jobs):
+    inference = parse_variant(name)
+    if "threads" not in inference and not args.no_budget:
+        inference["threads"] = max(1, (os.cpu_count() or 1) // jobs)
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(jobs)
+    task = {"model": args.model, "audio": args.audio, "language": args.language, "inference": inference}
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=context, initializer=init_job, initargs=(barrier,)) as pool:
+        results = list(pool.map(run_job, [task] * jobs))
+    wall_seconds = max(item["finished"] for item in results) - min(item["began"] for item in results)
+    return {
+        "variant": name,
+        "jobs": jobs,
+        "threads": results[0]["threads"],
+        "modelMb": results[0]["modelMb"],
+        "modelLoadMs": round(float(np.mean([item["modelLoadMs"] for item in results])), 1),
+        "transcribeMs": round(float(np.mean([item["transcribeMs"] for item in results])), 1),
+        "wallMs": round(wall_seconds * 1000.0, 1),
+        "segments": results[0]["segments"],
+    }, results[0]["text"]
+
+
+def print_table(results):
+    print(f"音频 {results['audio']}  时长 {results['audioSeconds']}s  模型 {results['model']}  CPU {results['cpuCount']}")
+    accuracy = "CER" if results["reference"] else "similar"
+    header = (f"{'variant':<22} {'jobs':>4} {'threads':>7} {'model MB':>8} {'load ms':>8} "
+              f"{'RTF':>6} {'audio s/s':>9} {accuracy:>8}")
+    print(header)
+    print("-" * len(header))
+    for run in results["runs"]:
+        value = run["cer"] if results["reference"] else run["textSimilarity"]
+        print(
+            f"{run['variant']:<22} {run['jobs']:>4} {str(run['threads']):>7} {str(run['modelMb']):>8} "
+            f"{run['modelLoadMs']:>8.0f} {run['realTimeFactor']:>6.3f} {run['throughput']:>9.2f} {value:>8.3f}"
+        )
+
+
+def main():
+    args = parse_args()
+    if not os.path.exists(args.audio):
+        print(f"音频文件不存在: {args.audio}", file=sys.stderr)
+        sys.exit(1)
+
+    samples, _ = transcriber.load_samples(args.audio)
+    audio_seconds = len(samples) / float(transcriber.SAMPLE_RATE)
+    del samples
+    reference = normalize_text(Path(args.reference).read_text(encoding="utf-8")) if args.reference else None
+
+    runs = []
+    for name in [value for value in args.variants.split(",") if value]:
+        for jobs in [int(value) for value in args.jobs.split(",") if value]:
+            print(f"[Benchmark] {name} × {jobs} 个任务", file=sys.stderr)
+            runs.append(run_variant(args, name, jobs))
+
+    baseline_text = normalize_text(runs[0][1])
+    for run, text in runs:
+        # RTF 为单个任务的转写耗时 / 音频时长；吞吐为所有任务合计每秒处理的音频秒数
+        run["realTimeFactor"] = round(run["transcribeMs"] / 1000.0 / audio_seconds, 3) if audio_seconds else 0.0
+        run["throughput"] = round(run["jobs"] * audio_seconds / (run["wallMs"] / 1000.0), 2) if run["wallMs"] else 0.0
+        text = normalize_text(text)
+        if reference is not None:
+            run["cer"] = char_error_rate(reference, text)
+        run["textSimilarity"] = round(difflib.SequenceMatcher(None, baseline_text, text).ratio(), 3)
+
+    results = {
+        "generatedAt": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "audio": args.audio,
+        "audioSeconds": round(audio_seconds, 2),
+        "model": args.model,
+        "cpuCount": os.cpu_count(),
+        "reference": args.reference,
+        "runs": [run for run, _ in runs],
+    }
+    if args.output == "json":
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        print_table(results)
+
+
+if __name__ == "__main__":
+    main()
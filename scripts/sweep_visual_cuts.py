@@ -0,0 +1,472 @@
+#!/usr/bin/env python3
+"""
+视觉切点参数扫描
+
+一次性读入多个视频的逐帧差异指标（visual_cut_metrics.py 的 .feature_cache，缺失时现算并写缓存），
+用数据库里已标注的广告片段（annotations.content_json 的 ad_segments）起止时间作为真值切点，
+对一批参数组合向量化地重跑 select_cuts 的选点逻辑，输出每组参数的 precision / recall / F1 / 时间误差。
+选点只涉及几百个数的矩阵运算，几千组参数几分钟内即可跑完，不需要重新解码任何帧。
+
+使用方法:
+  python scripts/sweep_visual_cuts.py                                  # 默认搜索空间随机 2000 组
+  python scripts/sweep_visual_cuts.py --trials 5000 --tolerance 5
+  python scripts/sweep_visual_cuts.py --space @space.json --grid       # 网格搜索
+  python scripts/sweep_visual_cuts.py --videos BV1xx,BV2xx --save sweep.json --verify 20
+
+搜索空间 (--space): {"参数": [候选值...] 或 {"min": a, "max": b, "steps": n}}，
+weights 用 "weights.ssim" 这样的点号写法。随机搜索在 min/max 间均匀采样，网格搜索按 steps 等分。
+
+输出 (stdout): 表格；--output json 时输出 JSON
+"""
+
+import argparse
+import itertools
+import json
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "server" / "services"))
+
+import visual_cut_metrics as engine  # noqa: E402
+
+DEFAULT_DB = ROOT / "server" / "database" / "app.db"
+DEFAULT_FRAMES_ROOT = ROOT / "downloads"
+CHUNK_SIZE = 256
+
+DEFAULT_SPACE = {
+    "baseThreshold": {"min": 0.35, "max": 0.75, "steps": 3},
+    "peakStdFactor": {"min": 0.8, "max": 2.0, "steps": 3},
+    "ssimThreshold": {"min": 0.4, "max": 0.8, "steps": 3},
+    "histThreshold": {"min": 0.25, "max": 0.55, "steps": 3},
+    "phashThreshold": {"min": 0.2, "max": 0.45, "steps": 3},
+    "minGapSeconds": [5.0, 10.0, 15.0, 20.0, 30.0],
+    "weights.ssim": {"min": 0.2, "max": 0.6, "steps": 3},
+    "weights.histogram": {"min": 0.15, "max": 0.5, "steps": 3},
+    "weights.phash": {"min": 0.1, "max": 0.35, "steps": 3},
+}
+
+# select_cuts 用到的标量参数；histBins 等特征参数影响缓存本身，不参与扫描
+SCALAR_PARAMS = {
+    "baseThreshold": 0.55,
+    "peakStdFactor": 1.35,
+    "maxDynamicThreshold": 0.92,
+    "ssimThreshold": 0.6,
+    "histThreshold": 0.38,
+    "phashThreshold": 0.32,
+    "warmupSeconds": 1.5,
+    "minGapSeconds": 2.0,
+    "ignoreEndSeconds": 0.0,
+    "ignoreEndMinDuration": 60.0,
+    "maxCuts": 80,
+}
+WEIGHT_PARAMS = (("ssim", 0.45), ("histogram", 0.35), ("phash", 0.20))
+
+
+def load_json_arg(value):
+    if value.startswith("@"):
+        return json.loads(Path(value[1:]).read_text(encoding="utf-8"))
+    return json.loads(value)
+
+
+def apply_override(options, override):
+    nested = {}
+    for key, value in override.items():
+        if "." in key:
+            group, name = key.split(".", 1)
+            nested.setdefault(group, {})[name] = value
+        else:
+            nested[key] = value
+    return engine.deep_merge(options, nested)
+
+
+def parse_content(content_json):
+    try:
+        return json.loads(content_json) if content_json else None
+    except ValueError:
+        return None
+
+
+def load_ground_truth(db_path, bvids=None, include_ai=False):
+    """每个视频的广告片段；有人工标注时只用人工标注，include_ai 时没有人工标注的视频退回最新一条 AI 全量分析。"""
+    connection = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        rows = connection.execute(
+            """
+            SELECT v.bvid, a.source_type, a.annotation_type, a.content_json
+            FROM annotations a
+            JOIN videos v ON a.video_id = v.id
+            ORDER BY a.id DESC
+            """
+        ).fetchall()
+    finally:
+        connection.close()
+
+    human, ai = {}, {}
+    for bvid, source_type, annotation_type, content_json in rows:
+        if bvids and bvid not in bvids:
+            continue
+        content = parse_content(content_json) or {}
+        segments = (content.get("content_analysis") or {}).get("ad_segments") or content.get("ad_segments") or []
+        if not isinstance(segments, list):
+            continue
+        if source_type == "AI":
+            # 只取最新一条 AI 全量分析
+            if annotation_type == "full_analysis" and bvid not in ai:
+                ai[bvid] = segments
+        else:
+            human.setdefault(bvid, []).extend(segments)
+
+    truth = {}
+    for bvid in set(human) | (set(ai) if include_ai else set()):
+        segments = human.get(bvid) or ai.get(bvid) or []
+        spans = []
+        for segment in segments:
+            start = engine.as_float(segment.get("start_time"), float("nan"))
+            end = engine.as_float(segment.get("end_time"), float("nan"))
+            if end > start:
+                spans.append((start, end))
+        if spans:
+            truth[bvid] = {"source": "human" if bvid in human else "ai", "segments": spans}
+    return truth
+
+
+def segment_boundaries(segments, first_time, last_time, tolerance):
+    # 片段起止点即期望切点；相邻片段首尾相接时只算一个，落在可检测范围外的丢弃
+    points = sorted(point for segment in segments for point in segment if first_time < point < last_time)
+    merged = []
+    for point in points:
+        if merged and point - merged[-1] <= tolerance:
+            continue
+        merged.append(point)
+    return np.asarray(merged, dtype=np.float64)
+
+
+def load_video_metrics(frames_dir, options, cached_only):
+    manifest = json.loads((frames_dir / "manifest.json").read_text(encoding="utf-8"))
+    frames = engine.collect_frames(
+        {"framePath": str(frames_dir / frame["file"]), "time": frame.get("time")}
+        for frame in manifest.get("frames") or []
+        if frame.get("file")
+    )
+    if len(frames) < 2:
+        raise ValueError("not enough frames")
+    request = dict(options, rescoreOnly=bool(cached_only))
+    metrics, info = engine.compute_metrics(
+        [frame["framePath"] for frame in frames],
+        engine.resolve_hist_bins(options),
+        request,
+    )
+    times = np.asarray([frame["time"] for frame in frames], dtype=np.float64)
+    stacked = np.stack([np.asarray(metrics[name], dtype=np.float64) for name in engine.TRANSITION_METRICS])
+    return times, stacked, info.get("featureCache", {}).get("status")
+
+
+def load_videos(truth, frames_root, options, tolerance, cached_only, log):
+    videos = []
+    for bvid in sorted(truth):
+        frames_dir = frames_root / f"{bvid}_visual_frames"
+        if not (frames_dir / "manifest.json").exists():
+            log(f"[Sweep] {bvid}: 没有 {frames_dir.name}/manifest.json，跳过")
+            continue
+        try:
+            times, metrics, cache_status = load_video_metrics(frames_dir, options, cached_only)
+        except (OSError, ValueError) as error:
+            log(f"[Sweep] {bvid}: 读取指标失败，跳过: {error}")
+            continue
+
+        point_times = times[1:]
+        boundaries = segment_boundaries(truth[bvid]["segments"], point_times[0], point_times[-1], tolerance)
+        distance = np.abs(point_times[:, None] - boundaries[None, :])
+        videos.append({
+            "bvid": bvid,
+            "source": truth[bvid]["source"],
+            "times": times,
+            "metrics": metrics,
+            "boundaries": boundaries,
+            "distance": distance,
+            "within": distance <= tolerance,
+        })
+        log(f"[Sweep] {bvid}: {times.size} 帧，{boundaries.size} 个真值切点，特征缓存 {cache_status}")
+    return videos
+
+
+def build_params(overrides, base_options):
+    """参数组合 -> 每个参数一列的数组，供向量化选点使用。"""
+    resolved = [apply_override(base_options, override) for override in overrides]
+    params = {
+        name: np.asarray([engine.as_float(options.get(name), default) for options in resolved])
+        for name, default in SCALAR_PARAMS.items()
+    }
+    params["weights"] = np.asarray([
+        [engine.as_float((options.get("weights") or {}).get(name), default) for name, default in WEIGHT_PARAMS]
+        for options in resolved
+    ])
+    params["maxCuts"] = params["maxCuts"].astype(np.int64)
+    return params
+
+
+def space_values(spec, steps=None):
+    if isinstance(spec, dict):
+        count = int(steps or spec.get("steps") or 3)
+        return [round(float(value), 4) for value in np.linspace(spec["min"], spec["max"], max(1, count))]
+    return list(spec)
+
+
+def grid_overrides(space):
+    names = list(space)
+    return [dict(zip(names, values)) for values in itertools.product(*(space_values(space[name]) for name in names))]
+
+
+def random_overrides(space, trials, seed):
+    rng = np.random.default_rng(seed)
+    overrides = []
+    for _ in range(trials):
+        override = {}
+        for name, spec in space.items():
+            if isinstance(spec, dict):
+                override[name] = round(float(rng.uniform(spec["min"], spec["max"])), 4)
+            else:
+                override[name] = spec[int(rng.integers(len(spec)))]
+        overrides.append(override)
+    return overrides
+
+
+def select_mask(video, params):
+    """与 engine.select_cuts 相同的选点规则，一次算 C 组参数；返回 (C, T) 的选中掩码。"""
+    times = video["times"]
+    point_times = times[1:]
+    scores = np.clip(params["weights"] @ video["metrics"], 0.0, 1.0)
+    count = scores.shape[0]
+
+    mean = scores.mean(axis=1)
+    std = scores.std(axis=1)
+    threshold = np.minimum(
+        params["maxDynamicThreshold"],
+        np.maximum(params["baseThreshold"], mean + params["peakStdFactor"] * std),
+    )
+
+    padded = np.pad(scores, ((0, 0), (1, 1)), constant_values=-1.0)
+    is_local_peak = (scores >= padded[:, :-2]) & (scores >= padded[:, 2:])
+    ssim, hist, phash = video["metrics"]
+    has_metric_trigger = (
+        (ssim[None, :] >= params["ssimThreshold"][:, None])
+        | (hist[None, :] >= params["histThreshold"][:, None])
+        | (phash[None, :] >= params["phashThreshold"][:, None])
+    )
+    candidate = (
+        (point_times[None, :] >= params["warmupSeconds"][:, None])
+        & (scores >= threshold[:, None])
+        & is_local_peak
+        & has_metric_trigger
+    )
+    video_end_time = float(times[-1])
+    guard_end = (video_end_time >= params["ignoreEndMinDuration"]) & (params["ignoreEndSeconds"] > 0)
+    candidate &= ~guard_end[:, None] | (video_end_time - point_times[None, :] > params["ignoreEndSeconds"][:, None])
+
+    # merge_nearby_cuts 是按时间顺序的贪心合并，逐个候选时间点推进，每步对所有参数组同时更新；
+    # 原实现比较的是 build_cut 取整后的时间和分数，这里同样取整
+    point_times = np.round(point_times, 3)
+    scores = np.round(scores, 4)
+    selected = np.zeros_like(candidate)
+    rows = np.arange(count)
+    last_index = np.zeros(count, dtype=np.int64)
+    last_time = np.full(count, -np.inf)
+    last_score = np.zeros(count)
+    for index in np.flatnonzero(candidate.any(axis=0)):
+        active = candidate[:, index]
+        close = active & (point_times[index] - last_time < params["minGapSeconds"])
+        replace = close & (scores[:, index] > last_score)
+        selected[rows[replace], last_index[replace]] = False
+        take = (active & ~close) | replace
+        selected[take, index] = True
+        last_index[take] = index
+        last_time[take] = point_times[index]
+        last_score[take] = scores[take, index]
+
+    max_cuts = params["maxCuts"]
+    over = (max_cuts > 0) & (selected.sum(axis=1) > max_cuts)
+    if over.any():
+        ranked = np.where(selected[over], scores[over], -np.inf)
+        order = np.argsort(-ranked, axis=1, kind="stable")
+        rank = np.empty_like(order)
+        np.put_along_axis(rank, order, np.arange(order.shape[1])[None, :], axis=1)
+        selected[over] &= rank < max_cuts[over][:, None]
+    return selected
+
+
+def score_selection(video, selected):
+    """precision 按落在任一真值切点容差内的预测计；recall 按容差内至少有一个预测的真值切点计。"""
+    within = video["within"]
+    predicted = selected.sum(axis=1)
+    near = within.any(axis=1)
+    matched_predicted = (selected & near[None, :]).sum(axis=1)
+    if not video["boundaries"].size:
+        return predicted, matched_predicted, np.zeros_like(predicted), np.zeros(predicted.shape)
+
+    # 只看落在某个真值切点附近的转场，三维掩码很小
+    columns = np.flatnonzero(near)
+    candidates = selected[:, columns][:, :, None] & within[columns][None, :, :]
+    distance = np.where(candidates, video["distance"][columns][None, :, :], np.inf)
+    nearest = distance.min(axis=1)
+    hit = np.isfinite(nearest)
+    error_sum = np.where(hit, nearest, 0.0).sum(axis=1)
+    return predicted, matched_predicted, hit.sum(axis=1), error_sum
+
+
+def evaluate(videos, params):
+    count = params["weights"].shape[0]
+    totals = {name: np.zeros(count) for name in ("predicted", "matchedPredicted", "matchedTruth", "errorSum")}
+    expected = 0
+    for video in videos:
+        selected = select_mask(video, params)
+        for name, values in zip(totals, score_selection(video, selected)):
+            totals[name] += values
+        expected += int(video["boundaries"].size)
+
+    precision = np.divide(totals["matchedPredicted"], totals["predicted"],
+                          out=np.zeros(count), where=totals["predicted"] > 0)
+    recall = totals["matchedTruth"] / expected if expected else np.ones(count)
+    f1 = np.divide(2 * precision * recall, precision + recall, out=np.zeros(count), where=precision + recall > 0)
+    time_error = np.divide(totals["errorSum"], totals["matchedTruth"],
+                           out=np.full(count, np.nan), where=totals["matchedTruth"] > 0)
+    return {
+        "precision": precision,
+        "recall": recall,
+        "f1": f1,
+        "meanTimeError": time_error,
+        "predicted": totals["predicted"],
+        "expected": expected,
+    }
+
+
+def verify(videos, overrides, base_options):
+    """抽查若干组参数，确认向量化选点与 engine.select_cuts 结果一致。"""
+    mismatches = []
+    params = build_params(overrides, base_options)
+    for video in videos:
+        selected = select_mask(video, params)
+        metrics = dict(zip(engine.TRANSITION_METRICS, video["metrics"]))
+        for index, override in enumerate(overrides):
+            expected = [cut["time"] for cut in engine.select_cuts(video["times"], metrics, apply_override(base_options, override))["visualCuts"]]
+            actual = [round(float(value), 3) for value in video["times"][1:][selected[index]]]
+            if expected != actual:
+                mismatches.append({"bvid": video["bvid"], "override": override, "expected": expected, "actual": actual})
+    return mismatches
+
+
+def summarize(index, override, metrics):
+    error = metrics["meanTimeError"][index]
+    return {
+        "override": override,
+        "precision": round(float(metrics["precision"][index]), 4),
+        "recall": round(float(metrics["recall"][index]), 4),
+        "f1": round(float(metrics["f1"][index]), 4),
+        "meanTimeError": None if np.isnan(error) else round(float(error), 3),
+        "predicted": int(metrics["predicted"][index]),
+    }
+
+
+def print_table(results):
+    print(f"{results['videoCount']} 个视频，{results['expected']} 个真值切点，容差 {results['tolerance']}s，"
+          f"{results['configCount']} 组参数，选点耗时 {results['timings']['evaluateMs']}ms"
+          f"（{results['configsPerSecond']} 组/s）")
+    header = f"{'rank':>4} {'precision':>9} {'recall':>7} {'f1':>6} {'err(s)':>7} {'cuts':>6}  override"
+    print(header)
+    baseline = results["baseline"]
+    rows = [("base", baseline)] + [(str(rank), entry) for rank, entry in enumerate(results["top"], start=1)]
+    for rank, entry in rows:
+        error = "-" if entry["meanTimeError"] is None else f"{entry['meanTimeError']:.2f}"
+        override = json.dumps(entry["override"], ensure_ascii=False) if entry["override"] else "(当前参数)"
+        print(f"{rank:>4} {entry['precision']:>9.3f} {entry['recall']:>7.3f} {entry['f1']:>6.3f} "
+              f"{error:>7} {entry['predicted']:>6}  {override}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="视觉切点参数扫描")
+    parser.add_argument("--db", default=str(DEFAULT_DB), help="SQLite 数据库（读取已标注的 ad_segments）")
+    parser.add_argument("--frames-root", default=str(DEFAULT_FRAMES_ROOT), help="{bvid}_visual_frames 所在目录")
+    parser.add_argument("--videos", help="只用这些视频，逗号分隔的 bvid")
+    parser.add_argument("--include-ai", action="store_true", help="没有人工标注的视频使用最新一条 AI 分析作为真值")
+    parser.add_argument("--cached-only", action="store_true", help="只用已有特征缓存，缺失的视频跳过而不是现场解码")
+    parser.add_argument("--options", default="{}", help="基础选项 JSON 或 @file.json（未扫描的参数取这里的值）")
+    parser.add_argument("--space", help="搜索空间 JSON 或 @file.json，默认见 DEFAULT_SPACE")
+    parser.add_argument("--grid", action="store_true", help="网格搜索（默认随机搜索）")
+    parser.add_argument("--trials", type=int, default=2000, help="随机搜索的参数组数")
+    parser.add_argument("--seed", type=int, default=7, help="随机搜索种子")
+    parser.add_argument("--tolerance", type=float, default=3.0, help="切点匹配容差（秒）")
+    parser.add_argument("--rank-by", default="f1", choices=["f1", "precision", "recall"], help="排序指标")
+    parser.add_argument("--top", type=int, default=10, help="输出前 N 组")
+    parser.add_argument("--verify", type=int, default=0, help="抽查 N 组参数与 select_cuts 的结果是否一致")
+    parser.add_argument("--save", help="把全部参数组的结果写入 JSON 文件")
+    parser.add_argument("--output", default="table", choices=["table", "json"], help="输出格式")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    log = lambda message: print(message, file=sys.stderr, flush=True)  # noqa: E731
+    base_options = engine.deep_merge(engine.DEFAULT_OPTIONS, load_json_arg(args.options))
+    space = load_json_arg(args.space) if args.space else DEFAULT_SPACE
+    bvids = {value.strip() for value in args.videos.split(",") if value.strip()} if args.videos else None
+
+    started = time.perf_counter()
+    truth = load_ground_truth(args.db, bvids, args.include_ai)
+    videos = load_videos(truth, Path(args.frames_root), base_options, args.tolerance, args.cached_only, log)
+    load_ms = engine.elapsed_ms(started)
+    if not videos:
+        log("[Sweep] 没有同时具备标注和视觉检测帧的视频")
+        sys.exit(1)
+
+    overrides = [{}] + (grid_overrides(space) if args.grid else random_overrides(space, args.trials, args.seed))
+    log(f"[Sweep] {len(videos)} 个视频，{len(overrides) - 1} 组参数")
+
+    started = time.perf_counter()
+    chunks = []
+    for offset in range(0, len(overrides), CHUNK_SIZE):
+        chunks.append(evaluate(videos, build_params(overrides[offset:offset + CHUNK_SIZE], base_options)))
+    metrics = {name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0] if name != "expected"}
+    evaluate_seconds = time.perf_counter() - started
+
+    order = np.argsort(-metrics[args.rank_by][1:], kind="stable") + 1
+    results = {
+        "generatedAt": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "videoCount": len(videos),
+        "videos": [{"bvid": video["bvid"], "truth": video["source"], "frames": int(video["times"].size),
+                    "boundaries": int(video["boundaries"].size)} for video in videos],
+        "expected": chunks[0]["expected"],
+        "tolerance": args.tolerance,
+        "rankBy": args.rank_by,
+        "configCount": len(overrides) - 1,
+        "configsPerSecond": round((len(overrides) - 1) / evaluate_seconds, 1) if evaluate_seconds > 0 else None,
+        "timings": {"loadMs": load_ms, "evaluateMs": round(evaluate_seconds * 1000.0, 2)},
+        "baseline": summarize(0, {}, metrics),
+        "top": [summarize(int(index), overrides[index], metrics) for index in order[:args.top]],
+    }
+
+    if args.verify:
+        rng = np.random.default_rng(args.seed)
+        picked = rng.choice(len(overrides), size=min(args.verify, len(overrides)), replace=False)
+        mismatches = verify(videos, [overrides[int(index)] for index in picked], base_options)
+        results["verify"] = {"checked": int(picked.size), "mismatches": mismatches}
+        log(f"[Sweep] 抽查 {picked.size} 组参数，{len(mismatches)} 处与 select_cuts 不一致")
+
+    if args.save:
+        saved = dict(results, all=[summarize(index, overrides[index], metrics) for index in range(1, len(overrides))])
+        Path(args.save).write_text(json.dumps(saved, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    if args.output == "json":
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        print_table(results)
+
+    if args.verify and results["verify"]["mismatches"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,8 @@
 const path = require('path');
 const {
   analyzeVisualCuts,
-  framesFromTimestampedDirectory
+  framesFromTimestampedDirectory,
+  shutdownVisualCutWorkers
 } = require('../server/services/visualCutDetector');
 
 const DEFAULT_DIRS = [
@@ -30,6 +31,10 @@ async function run() {
 
     console.log(`\n${dir}`);
     console.log(`frames=${result.stats?.frameCount || 0} threshold=${result.stats?.threshold ?? 'n/a'} cuts=${result.visualCuts.length}`);
+    const worker = result.stats?.worker;
+    if (worker) {
+      console.log(`worker=${worker.mode} cold=${worker.cold} startup=${worker.startupMs ?? 0}ms latency=${worker.latencyMs}ms`);
+    }
 
     if (result.visualCuts.length === 0) {
       console.log('  no visual cuts');
@@ -47,7 +52,9 @@ async function run() {
   }
 }
 
-run().catch(error => {
-  console.error(error);
-  process.exit(1);
-});
+run()
+  .catch(error => {
+    console.error(error);
+    process.exitCode = 1;
+  })
+  .finally(shutdownVisualCutWorkers);
@@ -5,52 +5,385 @@ Whisper 本地语音转写脚本
 
 使用方法:
   python whisper_transcribe.py --audio input.wav --model base --language zh --output-format json
+  python whisper_transcribe.py --server --max-models 2 --memory-cap-mb 4096
+  python whisper_transcribe.py --audio input.wav --chunked --workers 4
+  python whisper_transcribe.py --audio input.wav --ndjson
+  python whisper_transcribe.py --audio input.wav --vad
+  python whisper_transcribe.py --audio input.wav --quantize --threads 4 --beam-size 0
+
+常驻模式 (--server): 从 stdin 逐行读取 JSON 请求，stdout 逐行返回结果，
+已加载的模型按大小缓存（LRU 淘汰，受数量和内存上限约束），避免每次重新 load_model
+  -> {"id": 1, "type": "transcribe", "payload": {"audio": "a.wav", "model": "base", "language": "zh"}}
+  <- {"id": 1, "type": "result", "result": {"segments": [...], "timings": {...}}}
 
 输出 (stdout): JSON 格式的转录结果
-  {"segments": [{"start": 0.0, "end": 2.5, "text": "文本"}]}
+  {"segments": [{"start": 0.0, "end": 2.5, "text": "文本"}], "timings": {...}}
+
+  timings 记录各阶段耗时（importMs / modelLoadMs / transcribeMs / serializeMs）、
+  段数、音频时长和内存占用；--profile DIR 时额外输出 cProfile 文件
+
+分块模式 (--chunked): 在静音处把音频切成若干块，由进程池并行转写，
+再按全局时间戳拼接（块边界无静音时两侧留重叠，拼接时去重）
+
+CPU 推理 (--quantize / --threads / --beam-size，常驻模式请求带 "inference"): 线性层动态 int8 量化，
+torch 线程数固定为给定值（多个任务并发时按预算分配，避免互相抢核），贪心 / beam search 解码可选；
+timings.inference 记录实际配置，timings.realTimeFactor 为转写耗时 / 音频时长
+
+VAD 预筛 (--vad): 按帧能量和过零率找出语音区间，只把语音拼接后送入模型，
+时间戳映射回原时间轴；timings.vad 记录跳过的比例和估算节省的耗时
+
+流式输出 (--ndjson，常驻模式请求带 "stream": true): 每解码出一段立即输出，附带真实进度
+  {"type": "event", "event": "segment", "index": 0, "segment": {"start": 0.0, "end": 2.5, "text": "文本"}}
+  {"type": "event", "event": "progress", "processedSeconds": 2.5, "totalSeconds": 60.0, "percent": 4}
+  {"type": "result", "result": {"segments": [...], "timings": {...}}}
 """
 
 import argparse
+import bisect
+import contextlib
+import cProfile
+import gc
+import hashlib
 import json
+import math
+import multiprocessing
+import struct
 import sys
 import os
+import re
+import signal
+import time
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
 
+import numpy as np
 
-def main():
-    parser = argparse.ArgumentParser(description='Whisper 语音转写')
-    parser.add_argument('--audio', required=True, help='音频文件路径')
-    parser.add_argument('--model', default='base', 
-                        choices=['tiny', 'base', 'small', 'medium', 'large'],
-                        help='Whisper 模型大小')
-    parser.add_argument('--language', default='zh', help='语言提示')
-    parser.add_argument('--output-format', default='json', choices=['json', 'text'],
-                        help='输出格式')
-    args = parser.parse_args()
+PROCESS_STARTED = time.perf_counter()
 
-    # 检查音频文件
-    if not os.path.exists(args.audio):
-        print(json.dumps({"error": f"音频文件不存在: {args.audio}"}), file=sys.stderr)
-        sys.exit(1)
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
 
+
+def elapsed_ms(started):
+    return round((time.perf_counter() - started) * 1000.0, 2)
+
+
+def memory_usage():
+    """当前 / 峰值常驻内存 (MB)，平台不支持时为 None"""
+    usage = {"rssMb": None, "peakRssMb": None}
+    if resource is not None:
+        # ru_maxrss 在 Linux 上以 KB 计，macOS 上以字节计
+        scale = 1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0
+        usage["peakRssMb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1)
+    try:
+        with open("/proc/self/statm", encoding="ascii") as statm:
+            pages = int(statm.read().split()[1])
+        usage["rssMb"] = round(pages * os.sysconf("SC_PAGE_SIZE") / 1024.0 / 1024.0, 1)
+    except (OSError, ValueError, AttributeError):
+        pass
+    return usage
+
+
+MODEL_CHOICES = ['tiny', 'base', 'small', 'medium', 'large']
+
+# 各模型参数量（百万），加载前用于估算 float32 权重占用的内存
+MODEL_PARAMS_M = {'tiny': 39, 'base': 74, 'small': 244, 'medium': 769, 'large': 1550}
+
+
+def import_whisper():
     try:
         import whisper
     except ImportError:
-        print(json.dumps({"error": "未安装 openai-whisper，请运行: pip install openai-whisper"}), 
-              file=sys.stderr)
-        sys.exit(1)
+        raise RuntimeError("未安装 openai-whisper，请运行: pip install openai-whisper")
+    return whisper
 
-    # 加载模型
-    print(f"[Whisper] 加载模型: {args.model}", file=sys.stderr)
-    model = whisper.load_model(args.model)
 
-    # 执行转写
-    print(f"[Whisper] 开始转写: {args.audio}", file=sys.stderr)
-    result = model.transcribe(
-        args.audio,
-        language=args.language,
-        verbose=False,
-        word_timestamps=False
-    )
+def estimate_model_mb(key):
+    name, _, variant = key.partition(":")
+    # int8 只量化线性层，词嵌入等仍是 float32，按每参数 2 字节粗估
+    return MODEL_PARAMS_M.get(name, 1550) * (2.0 if variant == "int8" else 4.0)
+
+
+def model_size_mb(model):
+    # 量化后的线性层权重打包在 state_dict 的元组里，不在 parameters() 中
+    try:
+        total = 0
+        for value in model.state_dict().values():
+            for tensor in value if isinstance(value, tuple) else (value,):
+                if hasattr(tensor, "element_size"):
+                    total += tensor.numel() * tensor.element_size()
+        return round(total / 1024.0 / 1024.0, 1)
+    except (AttributeError, RuntimeError):
+        return None
+
+
+# ---------- CPU 推理配置 ----------
+
+DEFAULT_INFERENCE = {
+    "quantize": False,          # 线性层动态 int8 量化（只在 CPU 上运行）
+    "threads": 0,               # torch 算子线程数，0 表示保持 torch 默认
+    "beamSize": 0,              # 0/1 为贪心解码，>1 为 beam search
+    "bestOf": 0,                # 温度回退采样时的候选数，0 用 whisper 默认
+    "temperatureFallback": True,  # 解码质量差时按更高温度重试；关闭后只解码一次
+}
+
+
+def resolve_inference(options=None, defaults=None):
+    """合并推理参数：请求 > 启动参数 > DEFAULT_INFERENCE，None 表示未指定"""
+    merged = dict(DEFAULT_INFERENCE)
+    for source in (defaults, options):
+        merged.update({key: value for key, value in (source or {}).items() if value is not None})
+    return {
+        "quantize": bool(merged["quantize"]),
+        "threads": max(0, int(merged["threads"] or 0)),
+        "beamSize": max(0, int(merged["beamSize"] or 0)),
+        "bestOf": max(0, int(merged["bestOf"] or 0)),
+        "temperatureFallback": merged["temperatureFallback"] is not False,
+    }
+
+
+def model_key(name, inference):
+    """模型缓存键：同一模型的 fp32 和 int8 版本分别缓存"""
+    return f"{name}:int8" if inference and inference["quantize"] else name
+
+
+def transcript_model_key(name, inference, vad=False):
+    """转录缓存里的模型标识：量化、解码参数和 VAD 都会改变输出，各自单独缓存（格式与 whisperFallback.js 一致）"""
+    key = model_key(name, inference)
+    if inference["beamSize"] > 1:
+        key += f"+beam{inference['beamSize']}"
+    if inference["bestOf"] > 0:
+        key += f"+best{inference['bestOf']}"
+    if not inference["temperatureFallback"]:
+        key += "+t0"
+    if vad:
+        key += "+vad"
+    return key
+
+
+def apply_thread_budget(threads):
+    """固定本进程 torch 的算子线程数（0 表示不改），返回当前线程数；未安装 torch 时为 None"""
+    try:
+        import torch
+    except ImportError:
+        return None
+    if threads and torch.get_num_threads() != threads:
+        torch.set_num_threads(threads)
+    return torch.get_num_threads()
+
+
+def quantize_model(model):
+    """
+    对所有线性层做动态 int8 量化（权重 int8，激活按批动态量化），只适用于 CPU。
+    whisper 自带的 Linear 是 nn.Linear 的子类，quantize_dynamic 按精确类型匹配，先换成 nn.Linear
+    """
+    import torch
+    from torch import nn
+
+    for module in list(model.modules()):
+        for child_name, child in list(module.named_children()):
+            if isinstance(child, nn.Linear) and type(child) is not nn.Linear:
+                plain = nn.Linear(child.in_features, child.out_features, bias=child.bias is not None)
+                plain.weight = child.weight
+                plain.bias = child.bias
+                setattr(module, child_name, plain)
+    return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+def load_model_variant(key):
+    """按缓存键加载模型：name 或 name:int8"""
+    name, _, variant = key.partition(":")
+    whisper = import_whisper()
+    if variant == "int8":
+        return quantize_model(whisper.load_model(name, device="cpu"))
+    return whisper.load_model(name)
+
+
+def decode_options(model, inference):
+    """传给 model.transcribe 的解码参数"""
+    options = {}
+    device = getattr(model, "device", None)
+    if getattr(device, "type", None) == "cpu":
+        # CPU 上 whisper 本来就会退回 fp32，显式关闭避免每次打印警告
+        options["fp16"] = False
+    if inference["beamSize"] > 1:
+        options["beam_size"] = inference["beamSize"]
+    if inference["bestOf"] > 0:
+        options["best_of"] = inference["bestOf"]
+    if not inference["temperatureFallback"]:
+        options["temperature"] = 0.0
+    return options
+
+
+def inference_timings(inference, threads):
+    return {
+        "quantized": inference["quantize"],
+        "threads": threads,
+        "decoding": f"beam{inference['beamSize']}" if inference["beamSize"] > 1 else "greedy",
+        "bestOf": inference["bestOf"] or None,
+        "temperatureFallback": inference["temperatureFallback"],
+    }
+
+
+class ModelCache:
+    """按模型大小缓存已加载的 Whisper 模型，LRU 淘汰，受数量和内存上限约束"""
+
+    def __init__(self, loader, max_models=2, memory_cap_mb=0):
+        self.loader = loader
+        self.max_models = max(1, int(max_models))
+        self.memory_cap_mb = float(memory_cap_mb or 0)
+        self.models = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def cached_mb(self):
+        return sum(entry["sizeMb"] for entry in self.models.values())
+
+    def evict_for(self, name):
+        needed = estimate_model_mb(name)
+        while self.models and (
+            len(self.models) >= self.max_models
+            or (self.memory_cap_mb and self.cached_mb() + needed > self.memory_cap_mb)
+        ):
+            evicted, _ = self.models.popitem(last=False)
+            self.evictions += 1
+            print(f"[Whisper] 淘汰模型: {evicted}", file=sys.stderr)
+        gc.collect()
+
+    def get(self, name):
+        if name in self.models:
+            self.models.move_to_end(name)
+            self.hits += 1
+            return self.models[name]["model"], {"cacheHit": True, "modelLoadMs": 0.0}
+
+        self.misses += 1
+        self.evict_for(name)
+        print(f"[Whisper] 加载模型: {name}", file=sys.stderr)
+        started = time.perf_counter()
+        model = self.loader(name)
+        load_ms = elapsed_ms(started)
+        self.models[name] = {"model": model, "sizeMb": model_size_mb(model) or estimate_model_mb(name)}
+        return model, {"cacheHit": False, "modelLoadMs": load_ms}
+
+    def stats(self):
+        return {
+            "models": list(self.models.keys()),
+            "cachedMb": round(self.cached_mb(), 1),
+            "maxModels": self.max_models,
+            "memoryCapMb": self.memory_cap_mb or None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class TranscriptStream:
+    """把解码出的段以 segment / progress 事件推送出去，progress 按整数百分比节流"""
+
+    def __init__(self, emit, total_seconds):
+        self.emit = emit
+        self.total_seconds = total_seconds
+        self.count = 0
+        self.last_percent = -1
+
+    def segment(self, seg):
+        self.emit({"event": "segment", "index": self.count, "segment": seg})
+        self.count += 1
+        self.progress(seg["end"])
+
+    def progress(self, processed_seconds):
+        processed_seconds = min(processed_seconds, self.total_seconds)
+        percent = int(processed_seconds * 100 / self.total_seconds) if self.total_seconds else 100
+        if percent <= self.last_percent:
+            return
+        self.last_percent = percent
+        self.emit({
+            "event": "progress",
+            "processedSeconds": round(processed_seconds, 2),
+            "totalSeconds": round(self.total_seconds, 2),
+            "percent": percent,
+        })
+
+
+class SegmentTap:
+    """
+    whisper 的 verbose 模式每解码出一段就 print 一行 "[00:01.000 --> 00:03.500] 文本"，
+    transcribe 期间把 stdout 换成它，截获这些行转成段，其余输出转到 stderr
+    """
+
+    LINE = re.compile(r"^\[((?:\d+:)?\d+:\d+\.\d+) --> ((?:\d+:)?\d+:\d+\.\d+)\]\s?(.*)$")
+    encoding = "utf-8"
+
+    def __init__(self, on_segment):
+        self.on_segment = on_segment
+        self.buffer = ""
+
+    @staticmethod
+    def parse_timestamp(value):
+        seconds = 0.0
+        for part in value.split(":"):
+            seconds = seconds * 60 + float(part)
+        return seconds
+
+    def write(self, text):
+        self.buffer += text
+        while "\n" in self.buffer:
+            line, self.buffer = self.buffer.split("\n", 1)
+            match = self.LINE.match(line)
+            if match:
+                self.on_segment({
+                    "start": round(self.parse_timestamp(match.group(1)), 2),
+                    "end": round(self.parse_timestamp(match.group(2)), 2),
+                    "text": match.group(3).strip(),
+                })
+            elif line.strip():
+                print(line, file=sys.stderr)
+        return len(text)
+
+    def flush(self):
+        sys.stderr.flush()
+
+
+def transcribe_file(model, audio, language, emit=None, inference=None):
+    """
+    转写单个音频文件（或 16 kHz float32 数组），返回 (segments, timings)；
+    传入 emit 时边解码边推送段和进度
+    """
+    started = time.perf_counter()
+    inference = resolve_inference(inference)
+    threads = apply_thread_budget(inference["threads"])
+    options = decode_options(model, inference)
+    stream = None
+    if emit is not None:
+        if isinstance(audio, str):
+            # 先解码到内存以得到总时长（whisper 内部本来也要整段解码）
+            samples, _ = load_samples(audio)
+            audio = to_float_audio(samples)
+        stream = TranscriptStream(emit, len(audio) / float(SAMPLE_RATE))
+
+    if stream is None:
+        result = model.transcribe(
+            audio,
+            language=language,
+            verbose=False,
+            word_timestamps=False,
+            **options
+        )
+    else:
+        with contextlib.redirect_stdout(SegmentTap(stream.segment)):
+            result = model.transcribe(
+                audio,
+                language=language,
+                verbose=True,
+                word_timestamps=False,
+                **options
+            )
+        stream.progress(stream.total_seconds)
 
     # 构造输出
     segments = []
@@ -61,16 +394,1051 @@ def main():
             "text": seg["text"].strip()
         })
 
-    output = {"segments": segments}
+    transcribe_ms = elapsed_ms(started)
+    if stream is not None:
+        audio_seconds = round(stream.total_seconds, 2)
+    elif not isinstance(audio, str):
+        audio_seconds = round(len(audio) / float(SAMPLE_RATE), 2)
+    else:
+        # 16 kHz PCM WAV 从头部直接得到时长，其他格式只能以最后一段的结束时间近似
+        wav = open_wav_samples(audio)
+        audio_seconds = round(len(wav) / float(SAMPLE_RATE), 2) if wav is not None else (segments[-1]["end"] if segments else 0.0)
+    timings = {
+        "transcribeMs": transcribe_ms,
+        "segments": len(segments),
+        "audioSeconds": audio_seconds,
+        "realTimeFactor": round(transcribe_ms / 1000.0 / audio_seconds, 3) if audio_seconds else None,
+        "inference": inference_timings(inference, threads),
+    }
+    return segments, timings
+
+
+# ---------- 分块并行转写 ----------
+
+SAMPLE_RATE = 16000
+# 与 segment/audioCuts.js 中 silencedetect 的参数保持一致
+SILENCE_NOISE_DB = -30.0
+SILENCE_MIN_DURATION = 0.5
+SILENCE_FRAME_SECONDS = 0.02
+# 短于一个 Whisper 窗口（30 秒）的块会被补齐，切得再细也不会更快
+MIN_CHUNK_SECONDS = 30.0
+MAX_CHUNK_SECONDS = 600.0
+
+
+def read_wav_layout(audio_path):
+    """解析 RIFF/WAVE 头，返回 (fmt, data 偏移, data 字节数)；不是 WAV 时返回 None"""
+    fmt = None
+    with open(audio_path, "rb") as handle:
+        header = handle.read(12)
+        if len(header) < 12 or header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+            return None
+        while True:
+            chunk = handle.read(8)
+            if len(chunk) < 8:
+                return None
+            chunk_id, size = chunk[:4], struct.unpack("<I", chunk[4:])[0]
+            if chunk_id == b"data":
+                offset = handle.tell()
+                break
+            if chunk_id == b"fmt " and size >= 16:
+                fmt = struct.unpack("<HHIIHH", handle.read(16))
+                size -= 16
+            handle.seek(size + (size & 1), 1)
+
+    # 流式写出的 WAV 里 data 长度可能是占位值，以实际文件大小为准，并按整样本截断
+    length = max(0, min(size, os.path.getsize(audio_path) - offset))
+    return fmt, offset, length - length % 2
+
+
+def open_wav_samples(audio_path):
+    """以 memmap 方式打开 16 kHz 单声道 16-bit PCM WAV，返回 int16 样本；其他格式返回 None"""
+    layout = read_wav_layout(audio_path)
+    if layout is None or layout[0] is None:
+        return None
+    (audio_format, channels, sample_rate, _, _, bits), offset, length = layout
+    if audio_format != 1 or channels != 1 or sample_rate != SAMPLE_RATE or bits != 16:
+        return None
+    if length <= 0:
+        return np.zeros(0, dtype=np.int16)
+    return np.memmap(audio_path, dtype="<i2", mode="r", offset=offset, shape=(length // 2,))
+
+
+def load_samples(audio_path):
+    """返回 (samples, memmapped)；非 16 kHz PCM WAV 时用 whisper.load_audio 解码到内存"""
+    samples = open_wav_samples(audio_path)
+    if samples is not None:
+        return samples, True
+    return import_whisper().load_audio(audio_path), False
+
+
+def to_float_audio(samples):
+    if np.issubdtype(samples.dtype, np.integer):
+        return np.asarray(samples, dtype=np.float32) / 32768.0
+    return np.asarray(samples, dtype=np.float32)
+
+
+def frame_features(samples, frame_seconds=SILENCE_FRAME_SECONDS, with_zcr=False):
+    """逐帧 RMS 电平 (dBFS) 和过零率，返回 (levels_db, zcr)；不需要过零率时 zcr 为 None"""
+    frame = int(SAMPLE_RATE * frame_seconds)
+    count = len(samples) // frame
+    levels = np.empty(count, dtype=np.float32)
+    zcr = np.empty(count, dtype=np.float32) if with_zcr else None
+
+    # 分批换算成 float，避免长音频整段复制一份 float32
+    batch = 4096
+    for begin in range(0, count, batch):
+        end = min(count, begin + batch)
+        pcm = to_float_audio(samples[begin * frame:end * frame]).reshape(-1, frame)
+        levels[begin:end] = np.sqrt(np.mean(pcm * pcm, axis=1))
+        if with_zcr:
+            signs = np.signbit(pcm)
+            zcr[begin:end] = np.mean(signs[:, 1:] != signs[:, :-1], axis=1)
+    return 20.0 * np.log10(np.maximum(levels, 1e-10)), zcr
+
+
+def find_runs(mask):
+    """布尔序列中连续 True 的区间，返回 (starts, ends)，end 不含"""
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], mask.astype(np.int8), [0]))))
+    return edges[0::2], edges[1::2]
+
+
+def find_silences(samples, noise_db=SILENCE_NOISE_DB, min_duration=SILENCE_MIN_DURATION):
+    """按 20ms 帧的 RMS 电平找静音区间，返回 [(start, end)]（秒）"""
+    levels, _ = frame_features(samples)
+    if len(levels) == 0:
+        return []
+    starts, ends = find_runs(levels < noise_db)
+    min_frames = int(math.ceil(min_duration / SILENCE_FRAME_SECONDS))
+    return [
+        (start * SILENCE_FRAME_SECONDS, end * SILENCE_FRAME_SECONDS)
+        for start, end in zip(starts, ends)
+        if end - start >= min_frames
+    ]
+
+
+def plan_chunks(duration, silences, chunk_seconds, overlap_seconds):
+    """
+    在目标块长附近（±25%）最近的静音中点处切分；找不到静音时硬切，
+    两侧各多解码 overlap_seconds，拼接时只保留中点落在本块范围内的段
+    """
+    search = chunk_seconds * 0.25
+    midpoints = [(start + end) / 2.0 for start, end in silences]
+    boundaries = [(0.0, True)]
+    position = 0.0
+    # 剩余不足 1.25 块时不再切，避免末尾出现很短的块
+    while duration - position > chunk_seconds * 1.25:
+        target = position + chunk_seconds
+        candidates = [mid for mid in midpoints if abs(mid - target) <= search]
+        if candidates:
+            boundaries.append((min(candidates, key=lambda mid: abs(mid - target)), True))
+        else:
+            boundaries.append((target, False))
+        position = boundaries[-1][0]
+    boundaries.append((duration, True))
+
+    chunks = []
+    for index, ((start, start_silent), (end, end_silent)) in enumerate(zip(boundaries, boundaries[1:])):
+        chunks.append({
+            "index": index,
+            "start": start,
+            "end": end,
+            "decodeStart": start if start_silent else max(0.0, start - overlap_seconds),
+            "decodeEnd": end if end_silent else min(duration, end + overlap_seconds),
+            "splitAtSilence": end_silent,
+        })
+    return chunks
+
+
+class ChunkStitcher:
+    """按块顺序把段换算成全局时间戳并拼接，丢弃重叠区内属于相邻块的段"""
+
+    def __init__(self, chunk_count):
+        self.last_index = chunk_count - 1
+        self.segments = []
+        self.overlap_dropped = 0
+        self.duplicate_dropped = 0
+
+    def add(self, chunk, items):
+        """拼接一块的段，返回本块新增的段"""
+        added = len(self.segments)
+        for seg in items:
+            start = seg["start"] + chunk["decodeStart"]
+            end = seg["end"] + chunk["decodeStart"]
+            middle = (start + end) / 2.0
+            if middle < chunk["start"] or (middle >= chunk["end"] and chunk["index"] != self.last_index):
+                self.overlap_dropped += 1
+                continue
+            if self.segments:
+                previous = self.segments[-1]
+                # 重叠区两侧都识别出的同一句话，只保留前一块的
+                if seg["text"] == previous["text"] and start < previous["end"]:
+                    self.duplicate_dropped += 1
+                    continue
+                start = max(start, previous["end"])
+            self.segments.append({"start": round(start, 2), "end": round(max(start, end), 2), "text": seg["text"]})
+        return self.segments[added:]
+
+    def stats(self):
+        return {"overlapDropped": self.overlap_dropped, "duplicateDropped": self.duplicate_dropped}
+
+
+def resolve_chunk_workers(workers, model_name, memory_cap_mb=0, threads=0):
+    """
+    并行度默认取 CPU 数（最多 4）；给了线程预算时不超过预算；
+    设了内存上限时按模型大小收紧，每个进程各载一份模型（model_name 为缓存键，区分 int8）
+    """
+    cpu_count = int(threads or 0) or os.cpu_count() or 1
+    workers = int(workers or 0) or min(4, cpu_count)
+    if memory_cap_mb:
+        workers = min(workers, max(1, int(memory_cap_mb // estimate_model_mb(model_name))))
+    return max(1, workers)
+
+
+_chunk_model = None
+
+
+def init_chunk_worker(key, threads):
+    """进程池初始化：每个子进程只加载一次模型，并限制 torch 线程数避免互相抢核"""
+    global _chunk_model
+    # 子进程继承父进程的 stdout（常驻模式下是协议通道），打印一律转到 stderr
+    sys.stdout = sys.stderr
+    apply_thread_budget(threads)
+    _chunk_model = load_model_variant(key)
+
+
+def transcribe_chunk(task, model=None):
+    """转写单个块，段时间戳相对块的解码起点"""
+    started = time.perf_counter()
+    samples = task.get("samples")
+    if samples is None:
+        samples = open_wav_samples(task["audio"])[task["begin"]:task["end"]]
+    model = model or _chunk_model
+    result = model.transcribe(
+        to_float_audio(samples),
+        language=task["language"],
+        verbose=None,
+        word_timestamps=False,
+        **decode_options(model, resolve_inference(task.get("inference")))
+    )
+    segments = [
+        {"start": float(seg["start"]), "end": float(seg["end"]), "text": seg["text"].strip()}
+        for seg in result.get("segments", [])
+    ]
+    return segments, {"index": task["index"], "pid": os.getpid(), "ms": elapsed_ms(started)}
+
+
+_chunk_executor = None
+_chunk_executor_key = None
+
+
+def chunk_worker_threads(workers, threads=0):
+    """线程预算（默认 CPU 数）平分给各子进程"""
+    return max(1, (int(threads or 0) or os.cpu_count() or 1) // workers)
+
+
+def get_chunk_executor(model_name, workers, threads=0):
+    """按 (模型, 并行度, 线程预算) 复用进程池；参数变化时关闭旧池，同一时刻只保留一组子进程的模型"""
+    global _chunk_executor, _chunk_executor_key
+    threads = chunk_worker_threads(workers, threads)
+    key = (model_name, workers, threads)
+    if _chunk_executor is not None and _chunk_executor_key == key:
+        return _chunk_executor, True
+    shutdown_chunk_executor()
+    # spawn 而非 fork：父进程可能已加载 torch，fork 后 OpenMP 线程池容易死锁
+    _chunk_executor = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_chunk_worker,
+        initargs=(model_name, threads),
+    )
+    _chunk_executor_key = key
+    return _chunk_executor, False
+
+
+def shutdown_chunk_executor(wait=True):
+    global _chunk_executor, _chunk_executor_key
+    if _chunk_executor is not None:
+        _chunk_executor.shutdown(wait=wait, cancel_futures=True)
+    _chunk_executor = None
+    _chunk_executor_key = None
+
+
+def transcribe_chunked(audio_path, language, model_name, workers=0, chunk_seconds=0,
+                       overlap_seconds=1.0, memory_cap_mb=0, model=None, emit=None, samples=None,
+                       inference=None):
+    """
+    分块并行转写，返回 (segments, timings)
+    workers 为 1 且传入 model 时直接在当前进程逐块转写，不启动进程池；
+    传入 emit 时每拼接完一块就推送该块的段和进度（块按顺序完成拼接）；
+    传入 samples（如 VAD 拼接后的语音）时转写该数组而不是 audio_path；
+    inference 的 threads 为整个任务的线程预算，多进程时平分给各子进程
+    """
+    started = time.perf_counter()
+    inference = resolve_inference(inference)
+    key = model_key(model_name, inference)
+    if samples is None:
+        samples, memmapped = load_samples(audio_path)
+    else:
+        memmapped = False
+    duration = len(samples) / float(SAMPLE_RATE)
+    workers = resolve_chunk_workers(workers, key, memory_cap_mb, inference["threads"])
+    if not chunk_seconds:
+        # 默认让块数不少于并行度，单块长度限制在 30 秒到 10 分钟之间
+        chunk_seconds = duration / workers
+    chunk_seconds = min(MAX_CHUNK_SECONDS, max(MIN_CHUNK_SECONDS, float(chunk_seconds)))
+
+    silences = find_silences(samples)
+    chunks = plan_chunks(duration, silences, chunk_seconds, overlap_seconds)
+    split_ms = elapsed_ms(started)
+
+    tasks = []
+    for chunk in chunks:
+        begin = int(round(chunk["decodeStart"] * SAMPLE_RATE))
+        end = int(round(chunk["decodeEnd"] * SAMPLE_RATE))
+        task = {
+            "index": chunk["index"], "language": language, "audio": audio_path,
+            "begin": begin, "end": end, "inference": inference,
+        }
+        if not memmapped:
+            # 解码到内存的音频只能把样本切片传给子进程
+            task["samples"] = samples[begin:end]
+        tasks.append(task)
+
+    print(f"[Whisper] 分块转写: {len(chunks)} 块, {workers} 进程, 静音点 {len(silences)} 个", file=sys.stderr)
+    transcribe_started = time.perf_counter()
+    pool_reused = None
+    if workers == 1 and model is not None:
+        threads = apply_thread_budget(inference["threads"])
+        results = (transcribe_chunk(task, model) for task in tasks)
+    else:
+        threads = chunk_worker_threads(workers, inference["threads"])
+        executor, pool_reused = get_chunk_executor(key, workers, inference["threads"])
+        results = executor.map(transcribe_chunk, tasks)
+
+    stitcher = ChunkStitcher(len(chunks))
+    stream = TranscriptStream(emit, duration) if emit is not None else None
+    infos = []
+    for chunk, (items, info) in zip(chunks, results):
+        added = stitcher.add(chunk, items)
+        infos.append(info)
+        if stream is not None:
+            for seg in added:
+                stream.segment(seg)
+            stream.progress(chunk["end"])
+    transcribe_ms = elapsed_ms(transcribe_started)
+
+    segments = stitcher.segments
+    total_ms = elapsed_ms(started)
+    timings = {
+        "transcribeMs": total_ms,
+        "segments": len(segments),
+        "audioSeconds": round(duration, 2),
+        "realTimeFactor": round(total_ms / 1000.0 / duration, 3) if duration else None,
+        "inference": inference_timings(inference, threads),
+        "chunked": {
+            "workers": workers,
+            "chunks": len(chunks),
+            "chunkSeconds": round(chunk_seconds, 2),
+            "silences": len(silences),
+            "silenceSplits": sum(1 for chunk in chunks[:-1] if chunk["splitAtSilence"]),
+            "hardSplits": sum(1 for chunk in chunks[:-1] if not chunk["splitAtSilence"]),
+            "memmap": memmapped,
+            "poolReused": pool_reused,
+            "splitMs": split_ms,
+            "parallelMs": transcribe_ms,
+            "chunkMs": [info["ms"] for info in infos],
+            "processes": len({info["pid"] for info in infos}),
+            **stitcher.stats(),
+        },
+    }
+    return segments, timings
+
+
+# ---------- 语音活动检测（VAD）预筛 ----------
+
+DEFAULT_VAD_OPTIONS = {
+    "frameSeconds": 0.02,
+    # 阈值 = 噪声底（第 10 百分位电平）+ marginDb，限制在 [minEnergyDb, maxThresholdDb] 内；
+    # 上限取 silencedetect 的 -30dB，背景音乐较响时宁可多送也不漏掉压在音乐下的人声
+    "marginDb": 10.0,
+    "minEnergyDb": -45.0,
+    "maxThresholdDb": -30.0,
+    # 清音（擦音、送气音）能量低但过零率高，电平过半阈值且过零率高于该值也算语音
+    "zcrThreshold": 0.25,
+    # 拖尾 / 预留：语音帧之后保留 hangover、之前保留 preroll，避免切掉词尾和起音
+    "hangoverSeconds": 0.3,
+    "prerollSeconds": 0.2,
+    "minGapSeconds": 0.8,
+    "minSpeechSeconds": 0.25,
+    # 拼接语音区间时插入的静音，避免相邻区间的词在 Whisper 里粘连
+    "joinGapSeconds": 0.3,
+    # 可跳过的比例低于该值时直接整段转写，省下的时间不值得打断上下文
+    "minSkipFraction": 0.05,
+}
+
+
+def detect_speech_regions(samples, options=None):
+    """
+    按帧能量和过零率找语音区间，返回 ([(start, end)]（秒）, stats)
+    帧特征全部向量化计算，hangover / preroll 用前缀和实现区间膨胀
+    """
+    options = {**DEFAULT_VAD_OPTIONS, **(options or {})}
+    frame_seconds = options["frameSeconds"]
+    levels, zcr = frame_features(samples, frame_seconds, with_zcr=True)
+    count = len(levels)
+    if count == 0:
+        return [], {"thresholdDb": None, "noiseFloorDb": None, "speechFrames": 0}
+
+    noise_floor = float(np.percentile(levels, 10))
+    high = min(max(noise_floor + options["marginDb"], options["minEnergyDb"]), options["maxThresholdDb"])
+    low = min(max(noise_floor + options["marginDb"] / 2.0, options["minEnergyDb"]), high)
+    speech = (levels > high) | ((levels > low) & (zcr > options["zcrThreshold"]))
+
+    # 帧 i 处于语音区间：[i - hangover, i + preroll] 内有任一语音帧
+    hangover = int(round(options["hangoverSeconds"] / frame_seconds))
+    preroll = int(round(options["prerollSeconds"] / frame_seconds))
+    prefix = np.concatenate(([0], np.cumsum(speech, dtype=np.int64)))
+    index = np.arange(count)
+    active = prefix[np.minimum(index + preroll + 1, count)] - prefix[np.maximum(index - hangover, 0)] > 0
+
+    # 合并间隔过短的区间，丢弃实际语音帧太少的区间
+    starts, ends = find_runs(active)
+    min_gap = int(round(options["minGapSeconds"] / frame_seconds))
+    min_speech = int(round(options["minSpeechSeconds"] / frame_seconds))
+    regions = []
+    for start, end in zip(starts, ends):
+        if regions and start - regions[-1][1] < min_gap:
+            regions[-1][1] = end
+        else:
+            regions.append([start, end])
+    regions = [
+        (start * frame_seconds, end * frame_seconds)
+        for start, end in regions
+        if prefix[end] - prefix[start] >= min_speech
+    ]
+    return regions, {
+        "thresholdDb": round(high, 1),
+        "noiseFloorDb": round(noise_floor, 1),
+        "speechFrames": int(prefix[-1]),
+    }
+
+
+class SpeechTimeline:
+    """语音区间拼接后的时间轴与原时间轴之间的分段线性映射"""
+
+    def __init__(self, regions, join_gap_seconds):
+        self.original_starts = []
+        self.compact_starts = []
+        self.lengths = []
+        position = 0.0
+        for start, end in regions:
+            self.original_starts.append(start)
+            self.compact_starts.append(position)
+            self.lengths.append(end - start)
+            position += end - start + join_gap_seconds
+
+    def region_index(self, seconds):
+        return max(0, bisect.bisect_right(self.compact_starts, seconds) - 1)
+
+    def to_original(self, seconds):
+        index = self.region_index(seconds)
+        offset = min(max(seconds - self.compact_starts[index], 0.0), self.lengths[index])
+        return round(self.original_starts[index] + offset, 2)
+
+    def map_segment(self, seg):
+        """
+        段跨过拼接处时截断在起点所在区间的末尾：start、end 分别映射的话，
+        中间被 VAD 去掉的非语音（音乐等）会整段算进这一句
+        """
+        start = seg["start"]
+        first = self.region_index(start)
+        # 起点落在区间之间插入的静音里时，语音实际从下一个区间开始
+        if start - self.compact_starts[first] >= self.lengths[first] and first + 1 < len(self.lengths):
+            first += 1
+            start = self.compact_starts[first]
+        mapped_start = self.to_original(start)
+        if self.region_index(seg["end"]) > first:
+            mapped_end = round(self.original_starts[first] + self.lengths[first], 2)
+        else:
+            mapped_end = max(self.to_original(seg["end"]), mapped_start)
+        return {**seg, "start": mapped_start, "end": mapped_end}
+
+    def wrap_emit(self, emit, total_seconds):
+        """流式事件里的时间换算回原时间轴，进度百分比保持按已送入模型的语音计算"""
+        def mapped(event):
+            if event.get("event") == "segment":
+                event = {**event, "segment": self.map_segment(event["segment"])}
+            elif event.get("event") == "progress":
+                event = {
+                    **event,
+                    "processedSeconds": self.to_original(event["processedSeconds"]),
+                    "totalSeconds": round(total_seconds, 2),
+                }
+            emit(event)
+        return mapped
+
+
+def compact_speech(samples, regions, join_gap_seconds):
+    """把语音区间拼接成一段 float32 音频（区间之间插入静音），返回 (audio, timeline)"""
+    gap = np.zeros(int(round(join_gap_seconds * SAMPLE_RATE)), dtype=np.float32)
+    pieces = []
+    for start, end in regions:
+        if pieces:
+            pieces.append(gap)
+        pieces.append(to_float_audio(samples[int(round(start * SAMPLE_RATE)):int(round(end * SAMPLE_RATE))]))
+    return np.concatenate(pieces), SpeechTimeline(regions, join_gap_seconds)
+
+
+def transcribe_speech_only(audio_path, vad_options, run, emit=None):
+    """
+    VAD 预筛后转写：只把语音区间拼接起来交给 run(samples, emit)，再把时间戳映射回原时间轴
+    run 的 samples 为 None 时表示整段转写原文件；返回 (segments, timings)
+    """
+    options = {**DEFAULT_VAD_OPTIONS, **(vad_options or {})}
+    started = time.perf_counter()
+    samples, _ = load_samples(audio_path)
+    duration = len(samples) / float(SAMPLE_RATE)
+    regions, detail = detect_speech_regions(samples, options)
+    speech_seconds = sum(end - start for start, end in regions)
+    skipped_fraction = 1.0 - speech_seconds / duration if duration else 0.0
+    vad = {
+        "totalSeconds": round(duration, 2),
+        "speechSeconds": round(speech_seconds, 2),
+        "skippedSeconds": round(duration - speech_seconds, 2),
+        "skippedFraction": round(skipped_fraction, 3),
+        "regions": len(regions),
+        **detail,
+        "vadMs": elapsed_ms(started),
+    }
+
+    if not regions:
+        print("[Whisper] VAD 未检测到语音，跳过转写", file=sys.stderr)
+        if emit is not None:
+            TranscriptStream(emit, duration).progress(duration)
+        return [], {
+            "transcribeMs": 0.0, "segments": 0, "audioSeconds": round(duration, 2), "realTimeFactor": 0.0,
+            "vad": {**vad, "applied": True, "estimatedSavedMs": None},
+        }
+
+    if skipped_fraction < options["minSkipFraction"]:
+        segments, timings = run(None, emit)
+        timings["vad"] = {**vad, "applied": False, "estimatedSavedMs": 0.0}
+        return segments, timings
+
+    print(
+        f"[Whisper] VAD: {len(regions)} 个语音区间，跳过 {vad['skippedSeconds']}s"
+        f" ({skipped_fraction * 100:.1f}%)",
+        file=sys.stderr,
+    )
+    audio, timeline = compact_speech(samples, regions, options["joinGapSeconds"])
+    mapped_emit = timeline.wrap_emit(emit, duration) if emit is not None else None
+    segments, timings = run(audio, mapped_emit)
+    segments = [timeline.map_segment(seg) for seg in segments]
+
+    # 按本次实测的每秒转写耗时估算被跳过部分原本要花的时间
+    transcribed_seconds = len(audio) / float(SAMPLE_RATE)
+    saved_ms = timings["transcribeMs"] / transcribed_seconds * vad["skippedSeconds"] if transcribed_seconds else 0.0
+    timings.update({
+        "audioSeconds": round(duration, 2),
+        "realTimeFactor": round((timings["transcribeMs"] + vad["vadMs"]) / 1000.0 / duration, 3) if duration else None,
+        "vad": {**vad, "applied": True, "estimatedSavedMs": round(saved_ms, 1)},
+    })
+    return segments, timings
+
+
+# ---------- 转录缓存 ----------
+
+TRANSCRIPT_CACHE_VERSION = 1
+
+
+def audio_content_hash(audio_path):
+    """音频内容的 sha256：WAV 只算 data 块（重新抽取时头部变化不影响），其他格式算整个文件"""
+    layout = read_wav_layout(audio_path)
+    offset, remaining = (layout[1], layout[2]) if layout else (0, None)
+    digest = hashlib.sha256()
+    with open(audio_path, "rb") as handle:
+        handle.seek(offset)
+        while remaining is None or remaining > 0:
+            block = handle.read(1 << 20 if remaining is None else min(1 << 20, remaining))
+            if not block:
+                break
+            digest.update(block)
+            if remaining is not None:
+                remaining -= len(block)
+    return digest.hexdigest()
+
+
+class TranscriptCache:
+    """
+    磁盘转录缓存，键和条目格式与 server/services/asr/transcriptCache.js 一致，两边可共用目录；
+    条目 mtime 记录最近访问，总大小超过上限时淘汰最久未用的
+    """
+
+    def __init__(self, directory, max_mb=256):
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = float(max_mb or 256) * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    @staticmethod
+    def build_key(audio_hash, model, language, provider="whisper"):
+        return hashlib.sha256(f"{audio_hash}|{provider}|{model}|{language}".encode("utf-8")).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path, encoding="utf-8") as handle:
+                entry = json.load(handle)
+            if entry.get("version") != TRANSCRIPT_CACHE_VERSION or entry.get("key") != key:
+                raise ValueError("缓存条目版本不匹配")
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except (OSError, ValueError) as error:
+            print(f"[Whisper] 读取转录缓存失败，忽略: {error}", file=sys.stderr)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        os.makedirs(self.directory, exist_ok=True)
+        created_at = datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+        payload = {"version": TRANSCRIPT_CACHE_VERSION, "key": key, "createdAt": created_at, **entry}
+        temp_path = f"{self.path(key)}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as handle:
+            json.dump(payload, handle, ensure_ascii=False)
+        os.replace(temp_path, self.path(key))
+        self.writes += 1
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            "dir": self.directory,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "evictions": self.evictions,
+        }
+
+
+_transcript_caches = {}
+
+
+def get_transcript_cache(directory, max_mb=256):
+    """常驻模式按目录复用 TranscriptCache，命中计数跨请求累计"""
+    key = os.path.abspath(directory)
+    if key not in _transcript_caches:
+        _transcript_caches[key] = TranscriptCache(key, max_mb)
+    return _transcript_caches[key]
+
+
+def lookup_transcript(transcript_cache, audio_path, cache_model, language):
+    """返回 (缓存键, 音频哈希, 命中的条目或 None, 计算耗时)；cache_model 见 transcript_model_key"""
+    started = time.perf_counter()
+    audio_hash = audio_content_hash(audio_path)
+    key = TranscriptCache.build_key(audio_hash, cache_model, language)
+    return key, audio_hash, transcript_cache.get(key), elapsed_ms(started)
+
+
+def cached_result(entry, hash_ms, model_name, emit=None):
+    """缓存命中时的结果；流式请求照常推送段和进度，调用方无需区分"""
+    segments = entry["transcript"]
+    if emit is not None:
+        stream = TranscriptStream(emit, segments[-1]["end"] if segments else 0.0)
+        for seg in segments:
+            stream.segment(seg)
+        stream.progress(stream.total_seconds)
+    print("[Whisper] 命中转录缓存，跳过转写", file=sys.stderr)
+    return {
+        "segments": segments,
+        "timings": {
+            "transcriptCache": "hit",
+            "hashMs": hash_ms,
+            "transcribeMs": 0.0,
+            "segments": len(segments),
+            "model": model_name,
+            **memory_usage(),
+        },
+    }
+
+
+def dump_profile(profiler, directory):
+    profiler.disable()
+    os.makedirs(directory, exist_ok=True)
+    profile_path = os.path.join(directory, f"whisper_{os.getpid()}_{int(time.time() * 1000)}.prof")
+    profiler.dump_stats(profile_path)
+    return os.path.abspath(profile_path)
+
+
+def handle_transcribe(cache, payload, emit=None, inference_defaults=None):
+    audio_path = payload.get("audio")
+    if not audio_path or not os.path.exists(audio_path):
+        raise FileNotFoundError(f"音频文件不存在: {audio_path}")
+    model_name = payload.get("model") or "base"
+    if model_name not in MODEL_CHOICES:
+        raise ValueError(f"不支持的模型: {model_name}")
+
+    profiler = None
+    if payload.get("profile"):
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    language = payload.get("language") or "zh"
+    chunked = payload.get("chunked")
+    inference = resolve_inference(payload.get("inference"), inference_defaults)
+    key = model_key(model_name, inference)
+    vad = payload.get("vad")
+    cache_model = transcript_model_key(model_name, inference, bool(vad))
+    # 只有请求方要流式结果时才推送段和进度
+    if not payload.get("stream"):
+        emit = None
+
+    # 带 cacheDir 时先查转录缓存，命中则不加载模型
+    transcript_cache = None
+    if payload.get("cacheDir"):
+        transcript_cache = get_transcript_cache(payload["cacheDir"], payload.get("cacheMaxMb") or 256)
+        cache_key, audio_hash, entry, hash_ms = lookup_transcript(transcript_cache, audio_path, cache_model, language)
+        if entry is not None:
+            result = cached_result(entry, hash_ms, model_name, emit)
+            if profiler is not None:
+                result["timings"]["profilePath"] = dump_profile(profiler, payload["profile"])
+            return result
+
+    print(f"[Whisper] 开始转写: {audio_path}", file=sys.stderr)
+    load_info = {"cacheHit": False, "modelLoadMs": 0.0}
+
+    def run(samples, run_emit):
+        # 模型在真正需要转写时才取，VAD 判定整段无语音时不必加载
+        if chunked:
+            options = chunked if isinstance(chunked, dict) else {}
+            workers = resolve_chunk_workers(options.get("workers"), key, cache.memory_cap_mb, inference["threads"])
+            # 多进程时模型由子进程各自加载，常驻进程里不必再载一份
+            model = None
+            if workers == 1:
+                model, info = cache.get(key)
+                load_info.update(info)
+            return transcribe_chunked(
+                audio_path, language, model_name,
+                workers=workers,
+                chunk_seconds=options.get("chunkSeconds") or 0,
+                overlap_seconds=options.get("overlapSeconds", 1.0),
+                model=model,
+                emit=run_emit,
+                samples=samples,
+                inference=inference,
+            )
+        model, info = cache.get(key)
+        load_info.update(info)
+        return transcribe_file(model, audio_path if samples is None else samples, language,
+                               emit=run_emit, inference=inference)
+
+    if vad:
+        segments, timings = transcribe_speech_only(audio_path, vad if isinstance(vad, dict) else None, run, emit)
+    else:
+        segments, timings = run(None, emit)
+    timings.update({**load_info, "model": model_name, **memory_usage()})
+    if transcript_cache is not None:
+        transcript_cache.put(cache_key, {
+            "audioHash": audio_hash,
+            "provider": "whisper",
+            "model": cache_model,
+            "language": language,
+            "transcript": segments,
+        })
+        timings.update({"transcriptCache": "miss", "hashMs": hash_ms})
+    if profiler is not None:
+        timings["profilePath"] = dump_profile(profiler, payload["profile"])
+    return {"segments": segments, "timings": timings}
+
+
+def write_message(stream, message):
+    stream.write(json.dumps(message, ensure_ascii=False) + "\n")
+    stream.flush()
 
-    if args.output_format == 'json':
-        print(json.dumps(output, ensure_ascii=False))
+
+def serve(args):
+    # stdout 只用于协议输出，其余打印一律转到 stderr
+    protocol = sys.stdout
+    sys.stdout = sys.stderr
+
+    started = time.perf_counter()
+    try:
+        import_whisper()
+    except RuntimeError as error:
+        print(json.dumps({"error": str(error)}, ensure_ascii=False), file=sys.stderr)
+        sys.exit(1)
+    import_ms = elapsed_ms(started)
+
+    # 启动参数给出的线程预算和量化设置作为所有请求的默认值
+    inference_defaults = inference_from_args(args)
+    apply_thread_budget(inference_defaults["threads"])
+    cache = ModelCache(load_model_variant, max_models=args.max_models, memory_cap_mb=args.memory_cap_mb)
+    for name in filter(None, (args.preload or "").split(",")):
+        cache.get(model_key(name, inference_defaults))
+
+    # Node 侧用 SIGTERM 回收空闲进程，转成 SystemExit 以便关闭分块进程池
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    served = 0
+    write_message(protocol, {
+        "type": "ready",
+        "pid": os.getpid(),
+        "startupMs": elapsed_ms(PROCESS_STARTED),
+        "importMs": import_ms,
+    })
+
+    try:
+        for line in sys.stdin:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                message = json.loads(line)
+            except ValueError as error:
+                write_message(protocol, {"id": None, "type": "error", "error": f"无效请求: {error}"})
+                continue
+
+            request_id = message.get("id")
+            kind = message.get("type") or "transcribe"
+            if kind == "ping":
+                write_message(protocol, {"id": request_id, "type": "pong", "pid": os.getpid(), "served": served})
+                continue
+            if kind == "shutdown":
+                break
+            if kind == "stats":
+                write_message(protocol, {"id": request_id, "type": "result", "result": cache.stats(), "served": served})
+                continue
+            if kind != "transcribe":
+                write_message(protocol, {"id": request_id, "type": "error", "error": f"未知请求类型: {kind}"})
+                continue
+
+            def emit(event, request_id=request_id):
+                write_message(protocol, {"id": request_id, "type": "event", **event})
+
+            started = time.perf_counter()
+            try:
+                result = handle_transcribe(cache, message.get("payload") or {}, emit=emit,
+                                           inference_defaults=inference_defaults)
+                result["timings"]["modelCache"] = cache.stats()
+                served += 1
+                write_message(protocol, {
+                    "id": request_id,
+                    "type": "result",
+                    "result": result,
+                    "elapsedMs": elapsed_ms(started),
+                    "served": served,
+                })
+            except Exception as error:
+                write_message(protocol, {
+                    "id": request_id,
+                    "type": "error",
+                    "error": str(error),
+                    "traceback": traceback.format_exc(),
+                })
+    finally:
+        shutdown_chunk_executor(wait=False)
+
+
+def write_output(args, protocol, segments, timings):
+    """按 --ndjson / --output-format 输出结果"""
+    # 序列化耗时无法写进同一份输出，先对转录段单独计时
+    started = time.perf_counter()
+    encoded_segments = json.dumps(segments, ensure_ascii=False)
+    timings["serializeMs"] = elapsed_ms(started)
+    timings["totalMs"] = elapsed_ms(PROCESS_STARTED)
+
+    if args.ndjson:
+        protocol.write(f'{{"type": "result", "result": {{"segments": {encoded_segments}, '
+                       f'"timings": {json.dumps(timings, ensure_ascii=False)}}}}}\n')
+        protocol.flush()
+    elif args.output_format == 'json':
+        print(f'{{"segments": {encoded_segments}, "timings": {json.dumps(timings, ensure_ascii=False)}}}')
     else:
         for seg in segments:
             print(f"[{seg['start']:.1f}-{seg['end']:.1f}] {seg['text']}")
+        print(f"[Whisper] timings: {json.dumps(timings, ensure_ascii=False)}", file=sys.stderr)
 
     print(f"[Whisper] 转写完成，共 {len(segments)} 段", file=sys.stderr)
 
 
+def inference_from_args(args):
+    return resolve_inference({
+        "quantize": args.quantize,
+        "threads": args.threads,
+        "beamSize": args.beam_size,
+        "bestOf": args.best_of,
+        "temperatureFallback": not args.no_temperature_fallback,
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Whisper 语音转写')
+    parser.add_argument('--audio', help='音频文件路径')
+    parser.add_argument('--model', default='base', choices=MODEL_CHOICES, help='Whisper 模型大小')
+    parser.add_argument('--language', default='zh', help='语言提示')
+    parser.add_argument('--output-format', default='json', choices=['json', 'text'],
+                        help='输出格式')
+    parser.add_argument('--vad', action='store_true', help='先用能量 + 过零率检测语音区间，只转写有语音的部分')
+    parser.add_argument('--cache-dir', help='转录缓存目录（与 Node 侧 TRANSCRIPT_CACHE_DIR 格式相同），命中时跳过转写')
+    parser.add_argument('--cache-max-mb', type=float, default=256, help='转录缓存容量上限 (MB)，超出按 LRU 淘汰')
+    parser.add_argument('--ndjson', action='store_true',
+                        help='逐行输出 JSON：解码出的段和进度作为 event 记录，最后一行为 result')
+    parser.add_argument('--profile', metavar='DIR', help='把 cProfile 结果写入该目录')
+    parser.add_argument('--server', action='store_true', help='常驻模式：stdin/stdout 逐行 JSON 请求')
+    parser.add_argument('--max-models', type=int, default=2, help='常驻模式最多缓存的模型数')
+    parser.add_argument('--memory-cap-mb', type=float, default=0,
+                        help='常驻模式模型缓存内存上限 (MB)，0 表示不限制')
+    parser.add_argument('--preload', default='', help='常驻模式启动时预加载的模型，逗号分隔')
+    parser.add_argument('--chunked', action='store_true', help='在静音处分块，多进程并行转写')
+    parser.add_argument('--workers', type=int, default=0, help='分块模式的进程数，0 表示按 CPU 数自动选择')
+    parser.add_argument('--chunk-seconds', type=float, default=0,
+                        help='分块模式的目标块长（秒），0 表示按音频时长和进程数自动选择')
+    parser.add_argument('--overlap-seconds', type=float, default=1.0,
+                        help='块边界没有静音时两侧多解码的时长（秒）')
+    parser.add_argument('--quantize', action='store_true', help='CPU 推理：线性层动态 int8 量化')
+    parser.add_argument('--threads', type=int, default=0,
+                        help='本任务的 torch 线程预算（分块模式平分给各进程），0 表示 torch 默认')
+    parser.add_argument('--beam-size', type=int, default=0, help='beam search 宽度，0/1 为贪心解码')
+    parser.add_argument('--best-of', type=int, default=0, help='温度回退采样时的候选数，0 用 whisper 默认')
+    parser.add_argument('--no-temperature-fallback', action='store_true',
+                        help='只以温度 0 解码一次，不因压缩比/置信度不达标而重试')
+    args = parser.parse_args()
+
+    if args.server:
+        serve(args)
+        return
+
+    if not args.audio:
+        parser.error('缺少 --audio')
+
+    # 流式输出时 stdout 只写 NDJSON 记录（transcribe 期间 stdout 会被临时替换）
+    protocol = sys.stdout
+    emit = None
+    if args.ndjson:
+        emit = lambda event: write_message(protocol, {"type": "event", **event})  # noqa: E731
+
+    profiler = None
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    # 检查音频文件
+    if not os.path.exists(args.audio):
+        print(json.dumps({"error": f"音频文件不存在: {args.audio}"}), file=sys.stderr)
+        sys.exit(1)
+
+    timings = {}
+    inference = inference_from_args(args)
+    cache_model = transcript_model_key(args.model, inference, args.vad)
+    transcript_cache = None
+    if args.cache_dir:
+        transcript_cache = TranscriptCache(args.cache_dir, args.cache_max_mb)
+        cache_key, audio_hash, entry, hash_ms = lookup_transcript(
+            transcript_cache, args.audio, cache_model, args.language
+        )
+        if entry is not None:
+            result = cached_result(entry, hash_ms, args.model, emit)
+            segments, timings = result["segments"], result["timings"]
+            if profiler is not None:
+                timings["profilePath"] = dump_profile(profiler, args.profile)
+            write_output(args, protocol, segments, timings)
+            return
+        timings.update({"transcriptCache": "miss", "hashMs": hash_ms})
+
+    started = time.perf_counter()
+    try:
+        import_whisper()
+    except RuntimeError as error:
+        print(json.dumps({"error": str(error)}, ensure_ascii=False), file=sys.stderr)
+        sys.exit(1)
+    timings["importMs"] = elapsed_ms(started)
+
+    key = model_key(args.model, inference)
+    workers = resolve_chunk_workers(args.workers, key, threads=inference["threads"]) if args.chunked else 1
+
+    # 加载模型（分块多进程时由子进程各自加载）
+    model = None
+    timings["modelLoadMs"] = 0.0
+    if workers == 1:
+        print(f"[Whisper] 加载模型: {key}", file=sys.stderr)
+        apply_thread_budget(inference["threads"])
+        started = time.perf_counter()
+        model = load_model_variant(key)
+        timings["modelLoadMs"] = elapsed_ms(started)
+
+    # 执行转写
+    print(f"[Whisper] 开始转写: {args.audio}", file=sys.stderr)
+    def run(samples, run_emit):
+        if args.chunked:
+            return transcribe_chunked(
+                args.audio, args.language, args.model,
+                workers=workers,
+                chunk_seconds=args.chunk_seconds,
+                overlap_seconds=args.overlap_seconds,
+                model=model,
+                emit=run_emit,
+                samples=samples,
+                inference=inference,
+            )
+        return transcribe_file(model, args.audio if samples is None else samples, args.language,
+                               emit=run_emit, inference=inference)
+
+    try:
+        if args.vad:
+            segments, transcribe_timings = transcribe_speech_only(args.audio, None, run, emit)
+        else:
+            segments, transcribe_timings = run(None, emit)
+        shutdown_chunk_executor()
+    except Exception as error:
+        if not args.ndjson:
+            raise
+        write_message(protocol, {"type": "error", "error": str(error), "traceback": traceback.format_exc()})
+        sys.exit(1)
+    timings.update(transcribe_timings)
+    timings.update({"model": args.model, **memory_usage()})
+
+    if transcript_cache is not None:
+        transcript_cache.put(cache_key, {
+            "audioHash": audio_hash,
+            "provider": "whisper",
+            "model": cache_model,
+            "language": args.language,
+            "transcript": segments,
+        })
+
+    if profiler is not None:
+        timings["profilePath"] = dump_profile(profiler, args.profile)
+
+    write_output(args, protocol, segments, timings)
+
+
 if __name__ == '__main__':
     main()
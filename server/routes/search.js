@@ -50,6 +50,64 @@ router.get('/semantic', authenticateToken, async (req, res) => {
   }
 });
 
+/**
+ * 以帧搜帧（本地帧描述子，不调用任何外部接口）
+ * GET /api/v1/search/similar
+ * Query Params:
+ *  - bvid: 必填。作为查询的视频。
+ *  - t: 必填。查询帧的时间（秒），取该视频中最近的一帧。
+ *  - scope: 选填。video 只在本视频内搜索，默认 all 在所有已处理视频中搜索。
+ *  - topk: 选填。返回的结果数，默认 5。
+ */
+router.get('/similar', authenticateToken, async (req, res) => {
+  try {
+    const { bvid, t, scope, topk } = req.query;
+    const timestamp = Number(t);
+    if (!bvid || !Number.isFinite(timestamp)) {
+      return res.status(400).json({ error: '必须提供 bvid 和时间 t' });
+    }
+
+    const k = topk ? parseInt(topk, 10) : 5;
+    const { engine, results: [first] } = await vectorDb.searchSimilarToFrames(bvid, [timestamp], k, { scope });
+    if (!first || !first.query) {
+      return res.status(404).json({ error: '该视频还没有帧向量' });
+    }
+
+    res.json({
+      success: true,
+      engine,
+      query: first.query,
+      results: first.results
+    });
+  } catch (error) {
+    console.error('[SemanticSearch] 相似帧搜索失败:', error);
+    res.status(500).json({ error: '相似帧搜索失败', message: error.message });
+  }
+});
+
+/**
+ * 批量以帧搜帧
+ * POST /api/v1/search/similar/batch
+ * Body: { bvid, timestamps: number[], scope?: 'video' | 'all', topk?: number }
+ * 返回的 results 与 timestamps 一一对应；找不到帧向量的时间点 query 为 null
+ */
+router.post('/similar/batch', authenticateToken, async (req, res) => {
+  try {
+    const { bvid, timestamps, scope, topk } = req.body || {};
+    const times = Array.isArray(timestamps) ? timestamps.map(Number).filter(Number.isFinite) : [];
+    if (!bvid || times.length === 0) {
+      return res.status(400).json({ error: '必须提供 bvid 和非空的 timestamps' });
+    }
+
+    const k = topk ? parseInt(topk, 10) : 5;
+    const { engine, searchMs, results } = await vectorDb.searchSimilarToFrames(bvid, times, k, { scope });
+    res.json({ success: true, engine, searchMs, results });
+  } catch (error) {
+    console.error('[SemanticSearch] 批量相似帧搜索失败:', error);
+    res.status(500).json({ error: '批量相似帧搜索失败', message: error.message });
+  }
+});
+
 router.get('/frames', authenticateToken, async (req, res) => {
   try {
     const { bvid } = req.query;
@@ -57,7 +115,11 @@ router.get('/frames', authenticateToken, async (req, res) => {
     if (!vectorDb.isReady()) {
       return res.status(503).json({ error: '系统未配置 Qdrant 向量引擎' });
     }
-    const frames = await vectorDb.getAllFrames(bvid);
+    // 优先返回本地帧描述子表，没有时再查 Embedding API 向量表
+    let frames = await vectorDb.getAllFrames(bvid, { table: vectorDb.LOCAL_TABLE_NAME });
+    if (frames.length === 0) {
+      frames = await vectorDb.getAllFrames(bvid);
+    }
     res.json({ success: true, frames });
   } catch (error) {
     console.error('[SemanticSearch] 获取视频帧失败:', error);
@@ -2,6 +2,7 @@ const express = require('express');
 const router = express.Router();
 const path = require('path');
 const Database = require('better-sqlite3');
+const { getTranscriptCacheStats } = require('../services/asr/transcriptCache');
 
 // 连接数据库（和server.js保持一致的路径）
 const db = new Database(path.join(__dirname, '../database', 'app.db'));
@@ -117,4 +118,14 @@ router.get('/top-users', (req, res) => {
   }
 });
 
+// 5. 转录缓存API - GET /api/v1/stats/transcript-cache
+router.get('/transcript-cache', (req, res) => {
+  try {
+    // 命中/未命中计数为当前进程启动以来的累计值
+    res.status(200).json({ code: 200, msg: 'success', data: getTranscriptCacheStats() });
+  } catch (err) {
+    res.status(500).json({ code: 500, msg: '查询失败', error: err.message });
+  }
+});
+
 module.exports = router;
\ No newline at end of file
@@ -141,6 +141,7 @@ function createVideoAnalysisRouter(wss = null) {
 
     // 调用新的 VideoAnalyzer
     const result = await videoAnalyzer.analyzeVideo(videoUrl, true, userConfig, {
+      userId,
       onProgress: reportProgress,
       onVectorProgress: (percent, status, message) => {
         setVectorProgress(bvid, { percent, status, message });
@@ -317,7 +318,7 @@ function createVideoAnalysisRouter(wss = null) {
     for (const video of videos) {
       try {
         const videoUrl = `https://www.bilibili.com/video/${video.bvid}`;
-        const result = await videoAnalyzer.analyzeVideo(videoUrl, true, userConfig);
+        const result = await videoAnalyzer.analyzeVideo(videoUrl, true, userConfig, { userId });
 
         // 转换数据格式
         const adaptedData = {
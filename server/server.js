@@ -24,6 +24,14 @@ app.use('/api/v1/model-config', modelConfigRouter);
 wss.on('connection', (ws, req) => {
   console.log('[WS] Client connected');
 
+  // 插件连接时带 ?token=，记下用户ID，按用户推送的消息（如在线视觉切点）只发给本人
+  try {
+    const token = new URL(req.url, `http://${req.headers.host}`).searchParams.get('token');
+    ws.userId = token ? jwt.verify(token, JWT_SECRET).userId : null;
+  } catch (error) {
+    ws.userId = null;
+  }
+
   // 心跳检测
   ws.isAlive = true;
   ws.on('pong', () => {
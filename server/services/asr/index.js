@@ -5,6 +5,7 @@
  *   1. 尝试 DashScope paraformer-v2（需要 OSS + API Key）
  *   2. 若失败 -> 尝试本地 Whisper
  *   3. 若都失败 -> 返回空结果 + 错误信息
+ *   转写前先按音频内容哈希查转录缓存（见 transcriptCache.js），命中则完全跳过 ASR
  * 
  * 使用方式：
  *   const { transcribe } = require('./services/asr');
@@ -12,11 +13,27 @@
  */
 
 const { transcribeWithDashScope } = require('./transcribeAudio');
-const { transcribeWithWhisper, isWhisperAvailable } = require('./whisperFallback');
+const { transcribeWithWhisper, whisperCacheModel, isWhisperAvailable } = require('./whisperFallback');
 const { buildEffectiveModelConfig } = require('../modelConfigService');
+const {
+  hashAudioContent,
+  buildCacheKey,
+  getCachedTranscript,
+  setCachedTranscript,
+  isTranscriptCacheEnabled
+} = require('./transcriptCache');
 
 const TAG = '[ASR]';
 
+/** DashScope 请求中的 language_hints */
+const DASHSCOPE_LANGUAGE = 'zh,en';
+const WHISPER_LANGUAGE = 'zh';
+
+function cacheTranscript(audioHash, keyParts, transcript) {
+  if (!audioHash) return;
+  setCachedTranscript(buildCacheKey({ audioHash, ...keyParts }), { audioHash, ...keyParts, transcript });
+}
+
 /**
  * 转写音频文件（自动 fallback）
  * @param {string} audioPath - 音频文件路径（WAV 格式）
@@ -26,7 +43,8 @@ const TAG = '[ASR]';
  * @param {string} [options.whisperModel='base'] - Whisper 模型大小
  * @param {string} [options.pythonPath='python'] - Python 路径
  * @param {function} [options.onProgress] - 进度回调 (stage, percent)
- * @returns {Promise<{transcript: Array<{start: number, end: number, text: string}>, provider: string, error?: string}>}
+ * @param {boolean} [options.cache=true] - 是否使用转录缓存（TRANSCRIPT_CACHE=0 全局关闭）
+ * @returns {Promise<{transcript: Array<{start: number, end: number, text: string}>, provider: string, cached?: boolean, timings?: object, error?: string}>}
  */
 async function transcribe(audioPath, options = {}) {
   const {
@@ -34,23 +52,47 @@ async function transcribe(audioPath, options = {}) {
     bvid = 'unknown',
     whisperModel = 'base',
     pythonPath = 'python',
-    onProgress
+    onProgress,
+    cache = true
   } = options;
 
   const modelConfig = buildEffectiveModelConfig(userConfig);
+  const asrModel = modelConfig.asrModel || 'paraformer-v2';
+  const dashscopeKey = { provider: 'dashscope', model: asrModel, language: DASHSCOPE_LANGUAGE };
+  // 模型标识带上量化 / 解码参数 / VAD，不同配置的转写结果互不复用
+  const whisperKey = { provider: 'whisper', model: whisperCacheModel(whisperModel), language: WHISPER_LANGUAGE };
+
+  // 查缓存：任一方案的已有转录都可直接复用，优先 DashScope
+  let audioHash = null;
+  if (cache && isTranscriptCacheEnabled()) {
+    try {
+      audioHash = await hashAudioContent(audioPath);
+      const keys = [dashscopeKey, whisperKey].map(keyParts => buildCacheKey({ audioHash, ...keyParts }));
+      const entry = getCachedTranscript(keys);
+      if (entry && Array.isArray(entry.transcript) && entry.transcript.length > 0) {
+        console.log(`${TAG} 命中转录缓存 (${entry.provider}/${entry.model})，跳过 ASR`);
+        if (onProgress) onProgress('done', 100);
+        return { transcript: entry.transcript, provider: entry.provider, cached: true };
+      }
+    } catch (error) {
+      console.warn(`${TAG} 计算音频哈希失败，不使用缓存: ${error.message}`);
+      audioHash = null;
+    }
+  }
 
   // 尝试方案 1: DashScope paraformer-v2
   try {
     console.log(`${TAG} 尝试 DashScope paraformer-v2...`);
     const result = await transcribeWithDashScope(audioPath, {
       apiKey: modelConfig.apiKey,
-      asrModel: modelConfig.asrModel || 'paraformer-v2',
+      asrModel,
       bvid,
       onProgress
     });
 
     if (result.transcript && result.transcript.length > 0) {
       console.log(`${TAG} DashScope 转写成功，共 ${result.transcript.length} 条`);
+      cacheTranscript(audioHash, dashscopeKey, result.transcript);
       return {
         transcript: result.transcript,
         provider: 'dashscope'
@@ -77,16 +119,18 @@ async function transcribe(audioPath, options = {}) {
     console.log(`${TAG} 尝试本地 Whisper (model=${whisperModel})...`);
     const result = await transcribeWithWhisper(audioPath, {
       model: whisperModel,
-      language: 'zh',
+      language: WHISPER_LANGUAGE,
       pythonPath,
       onProgress
     });
 
     if (result.transcript && result.transcript.length > 0) {
       console.log(`${TAG} Whisper 转写成功，共 ${result.transcript.length} 条`);
+      cacheTranscript(audioHash, whisperKey, result.transcript);
       return {
         transcript: result.transcript,
-        provider: 'whisper'
+        provider: 'whisper',
+        timings: result.timings
       };
     }
 
@@ -0,0 +1,258 @@
+/**
+ * 转录结果缓存（按音频内容寻址）
+ *
+ * 键 = sha256(PCM 内容哈希 | provider | model | language)，同一视频被再次分析
+ * （换用户、改选项）时直接复用转录，跳过 OSS 上传和 ASR。
+ * Whisper 的 model 是带推理配置的标识（如 base:int8+vad，见 whisperCacheModel），量化、beam、VAD 不同的结果分开存。
+ * 只对 WAV 的 data 块求哈希，重新抽取音频时头部元数据变化不影响命中；非 WAV 文件对整个文件求哈希。
+ *
+ * 条目以 `<key>.json` 存在本地磁盘，按总大小做 LRU 淘汰（文件 mtime 记录最近访问）。
+ * scripts/whisper_transcribe.py --cache-dir 使用同样的键和条目格式，两边可共用目录。
+ */
+
+const crypto = require('crypto');
+const fs = require('fs');
+const path = require('path');
+
+const TAG = '[ASR:Cache]';
+const CACHE_VERSION = 1;
+const DEFAULT_CACHE_DIR = path.join(__dirname, '../../../cache/transcripts');
+const DEFAULT_MAX_MB = 256;
+
+const counters = {
+  hits: 0,
+  misses: 0,
+  writes: 0,
+  evictions: 0,
+  errors: 0
+};
+
+/** key -> { size, accessedAt }，首次使用时扫描目录建立 */
+let index = null;
+let indexDir = null;
+
+function getConfig() {
+  const maxMb = Number(process.env.TRANSCRIPT_CACHE_MAX_MB);
+  return {
+    enabled: process.env.TRANSCRIPT_CACHE !== '0',
+    dir: process.env.TRANSCRIPT_CACHE_DIR ? path.resolve(process.env.TRANSCRIPT_CACHE_DIR) : DEFAULT_CACHE_DIR,
+    maxBytes: (Number.isFinite(maxMb) && maxMb > 0 ? maxMb : DEFAULT_MAX_MB) * 1024 * 1024
+  };
+}
+
+function isTranscriptCacheEnabled() {
+  return getConfig().enabled;
+}
+
+/**
+ * 找到 WAV 文件 data 块的位置，不是 RIFF/WAVE 时返回 null
+ * @returns {{offset: number, length: number}|null}
+ */
+function findPcmRange(audioPath) {
+  const fd = fs.openSync(audioPath, 'r');
+  try {
+    const fileSize = fs.fstatSync(fd).size;
+    const header = Buffer.alloc(12);
+    if (fs.readSync(fd, header, 0, 12, 0) < 12) return null;
+    if (header.toString('ascii', 0, 4) !== 'RIFF' || header.toString('ascii', 8, 12) !== 'WAVE') return null;
+
+    const chunk = Buffer.alloc(8);
+    let position = 12;
+    while (position + 8 <= fileSize) {
+      fs.readSync(fd, chunk, 0, 8, position);
+      const id = chunk.toString('ascii', 0, 4);
+      const size = chunk.readUInt32LE(4);
+      position += 8;
+      if (id === 'data') {
+        // 流式写出的 WAV 里 data 长度可能是占位值，以实际文件大小为准；与 Python 一致按整样本截断
+        const length = Math.min(size, fileSize - position);
+        return { offset: position, length: length - (length % 2) };
+      }
+      position += size + (size % 2);
+    }
+    return null;
+  } finally {
+    fs.closeSync(fd);
+  }
+}
+
+/**
+ * 计算音频内容哈希（WAV 只算 PCM 数据）
+ * @param {string} audioPath
+ * @returns {Promise<string>} sha256 十六进制
+ */
+function hashAudioContent(audioPath) {
+  const range = findPcmRange(audioPath);
+  const streamOptions = range
+    ? { start: range.offset, end: range.offset + range.length - 1 }
+    : {};
+
+  return new Promise((resolve, reject) => {
+    const hash = crypto.createHash('sha256');
+    if (range && range.length === 0) {
+      resolve(hash.digest('hex'));
+      return;
+    }
+    fs.createReadStream(audioPath, streamOptions)
+      .on('data', data => hash.update(data))
+      .on('end', () => resolve(hash.digest('hex')))
+      .on('error', reject);
+  });
+}
+
+/**
+ * @param {object} parts
+ * @param {string} parts.audioHash - hashAudioContent 的结果
+ * @param {string} parts.provider - whisper / dashscope 等
+ * @param {string} parts.model - 模型名
+ * @param {string} parts.language - 语言提示
+ */
+function buildCacheKey({ audioHash, provider, model, language }) {
+  return crypto
+    .createHash('sha256')
+    .update(`${audioHash}|${provider}|${model}|${language}`)
+    .digest('hex');
+}
+
+function entryPath(dir, key) {
+  return path.join(dir, `${key}.json`);
+}
+
+function loadIndex(dir) {
+  if (index && indexDir === dir) return index;
+  index = new Map();
+  indexDir = dir;
+  if (!fs.existsSync(dir)) return index;
+  for (const name of fs.readdirSync(dir)) {
+    if (!name.endsWith('.json')) continue;
+    try {
+      const stat = fs.statSync(path.join(dir, name));
+      index.set(name.slice(0, -5), { size: stat.size, accessedAt: stat.mtimeMs });
+    } catch (error) {
+      // 扫描期间被其他进程删除
+    }
+  }
+  return index;
+}
+
+function totalBytes(entries) {
+  let total = 0;
+  for (const entry of entries.values()) total += entry.size;
+  return total;
+}
+
+function evict(dir, maxBytes) {
+  const entries = loadIndex(dir);
+  let total = totalBytes(entries);
+  if (total <= maxBytes) return;
+
+  const oldestFirst = [...entries.entries()].sort((a, b) => a[1].accessedAt - b[1].accessedAt);
+  for (const [key, entry] of oldestFirst) {
+    if (total <= maxBytes) break;
+    try {
+      fs.unlinkSync(entryPath(dir, key));
+    } catch (error) {
+      if (error.code !== 'ENOENT') continue;
+    }
+    entries.delete(key);
+    total -= entry.size;
+    counters.evictions++;
+  }
+}
+
+function readEntry(dir, key) {
+  const file = entryPath(dir, key);
+  try {
+    const entry = JSON.parse(fs.readFileSync(file, 'utf8'));
+    if (entry.version !== CACHE_VERSION || entry.key !== key) throw new Error('缓存条目版本不匹配');
+    const now = new Date();
+    fs.utimesSync(file, now, now);
+    loadIndex(dir).set(key, { size: fs.statSync(file).size, accessedAt: now.getTime() });
+    return entry;
+  } catch (error) {
+    if (error.code !== 'ENOENT') {
+      counters.errors++;
+      console.warn(`${TAG} 读取缓存失败，忽略: ${error.message}`);
+    }
+    return null;
+  }
+}
+
+/**
+ * 读取缓存条目，命中时刷新访问时间
+ * 传入多个键时按顺序返回第一个命中的条目，一次查找只计一次命中或未命中
+ * @param {string|string[]} keys
+ * @returns {object|null} { key, transcript, provider, model, language, createdAt, ... }
+ */
+function getCachedTranscript(keys) {
+  const { enabled, dir } = getConfig();
+  if (!enabled) return null;
+
+  for (const key of Array.isArray(keys) ? keys : [keys]) {
+    const entry = readEntry(dir, key);
+    if (entry) {
+      counters.hits++;
+      return entry;
+    }
+  }
+  counters.misses++;
+  return null;
+}
+
+/**
+ * 写入缓存条目（先写临时文件再 rename），超过容量时按 LRU 淘汰
+ * @param {string} key
+ * @param {object} entry - { transcript, audioHash, provider, model, language, ... }
+ */
+function setCachedTranscript(key, entry) {
+  const { enabled, dir, maxBytes } = getConfig();
+  if (!enabled) return;
+
+  try {
+    fs.mkdirSync(dir, { recursive: true });
+    const payload = JSON.stringify({
+      version: CACHE_VERSION,
+      key,
+      createdAt: new Date().toISOString(),
+      ...entry
+    });
+    const file = entryPath(dir, key);
+    const temp = `${file}.${process.pid}.tmp`;
+    fs.writeFileSync(temp, payload);
+    fs.renameSync(temp, file);
+
+    loadIndex(dir).set(key, { size: Buffer.byteLength(payload), accessedAt: Date.now() });
+    counters.writes++;
+    evict(dir, maxBytes);
+  } catch (error) {
+    counters.errors++;
+    console.warn(`${TAG} 写入缓存失败: ${error.message}`);
+  }
+}
+
+/**
+ * 缓存状态（routes/stats.js 暴露）
+ */
+function getTranscriptCacheStats() {
+  const { enabled, dir, maxBytes } = getConfig();
+  const entries = enabled ? loadIndex(dir) : new Map();
+  const lookups = counters.hits + counters.misses;
+  return {
+    enabled,
+    dir,
+    entries: entries.size,
+    bytes: totalBytes(entries),
+    maxBytes,
+    ...counters,
+    hitRate: lookups ? Number((counters.hits / lookups).toFixed(3)) : null
+  };
+}
+
+module.exports = {
+  hashAudioContent,
+  buildCacheKey,
+  getCachedTranscript,
+  setCachedTranscript,
+  getTranscriptCacheStats,
+  isTranscriptCacheEnabled
+};
@@ -1,46 +1,39 @@
 /**
  * ASR Fallback - 本地 Whisper 转写
  * 当 DashScope 不可用时的降级方案
- * 通过 child_process 调用 Python whisper 脚本
+ * 优先走常驻 Whisper 服务，必要时通过 child_process 单次调用 Python whisper 脚本
  */
 
 const { spawn } = require('child_process');
 const path = require('path');
 const fs = require('fs');
+const readline = require('readline');
+
+const { PROFILE_DIR } = require('../segmentPipeline/debugArtifactWriter');
+const {
+  runWhisperServerTask,
+  isWhisperServerEnabled,
+  shutdownWhisperServers,
+  resolveWhisperThreads
+} = require('./whisperServer');
 
 const TAG = '[ASR:Whisper]';
 const SCRIPT_PATH = path.join(__dirname, '../../../scripts/whisper_transcribe.py');
 
+function normalizeTranscript(result) {
+  return (result.segments || result || []).map(seg => ({
+    start: Number(seg.start) || 0,
+    end: Number(seg.end) || 0,
+    text: (seg.text || '').trim()
+  }));
+}
+
 /**
- * 使用本地 Whisper 模型进行语音识别
- * @param {string} audioPath - 音频文件路径
- * @param {object} options
- * @param {string} [options.model='base'] - Whisper 模型大小 (tiny/base/small/medium/large)
- * @param {string} [options.language='zh'] - 语言提示
- * @param {string} [options.pythonPath='python'] - Python 可执行文件路径
- * @param {function} [options.onProgress] - 进度回调
- * @returns {Promise<{transcript: Array<{start: number, end: number, text: string}>}>}
+ * 单次启动 whisper_transcribe.py 转写（常驻服务不可用时的兜底路径）
+ * 以 --ndjson 运行：解码出的段和进度逐行作为 event 输出，最后一行是 result / error
  */
-async function transcribeWithWhisper(audioPath, options = {}) {
-  const {
-    model = 'base',
-    language = 'zh',
-    pythonPath = 'python',
-    onProgress
-  } = options;
-
-  // 检查 Python 脚本是否存在
-  if (!fs.existsSync(SCRIPT_PATH)) {
-    throw new Error(`Whisper 脚本不存在: ${SCRIPT_PATH}`);
-  }
-
-  // 检查音频文件
-  if (!fs.existsSync(audioPath)) {
-    throw new Error(`音频文件不存在: ${audioPath}`);
-  }
-
-  console.log(`${TAG} 开始本地 Whisper 转写 (model=${model})...`);
-  if (onProgress) onProgress('whisper_starting', 10);
+function runWhisperProcess(audioPath, options) {
+  const { model, language, pythonPath, onEvent, profileDir, chunked, vad, inference } = options;
 
   return new Promise((resolve, reject) => {
     const args = [
@@ -48,8 +41,32 @@ async function transcribeWithWhisper(audioPath, options = {}) {
       '--audio', audioPath,
       '--model', model,
       '--language', language,
-      '--output-format', 'json'
+      '--ndjson'
     ];
+    if (profileDir) {
+      args.push('--profile', profileDir);
+    }
+    if (chunked) {
+      args.push('--chunked', '--workers', String(chunked.workers || 0));
+    }
+    if (vad) {
+      args.push('--vad');
+    }
+    if (inference.quantize) {
+      args.push('--quantize');
+    }
+    if (inference.threads) {
+      args.push('--threads', String(inference.threads));
+    }
+    if (inference.beamSize) {
+      args.push('--beam-size', String(inference.beamSize));
+    }
+    if (inference.bestOf) {
+      args.push('--best-of', String(inference.bestOf));
+    }
+    if (!inference.temperatureFallback) {
+      args.push('--no-temperature-fallback');
+    }
 
     const proc = spawn(pythonPath, args, {
       cwd: path.dirname(SCRIPT_PATH),
@@ -57,44 +74,46 @@ async function transcribeWithWhisper(audioPath, options = {}) {
       stdio: ['pipe', 'pipe', 'pipe']
     });
 
-    let stdout = '';
     let stderr = '';
+    let finalMessage = null;
 
-    proc.stdout.on('data', (data) => {
-      stdout += data.toString();
+    readline.createInterface({ input: proc.stdout }).on('line', (line) => {
+      if (!line.trim()) return;
+      let message;
+      try {
+        message = JSON.parse(line);
+      } catch (parseError) {
+        console.warn(`${TAG} 无法解析 Whisper 输出: ${line.substring(0, 200)}`);
+        return;
+      }
+      if (message.type === 'event') {
+        onEvent(message);
+      } else {
+        finalMessage = message;
+      }
     });
 
     proc.stderr.on('data', (data) => {
-      const msg = data.toString();
-      stderr += msg;
-      // 解析进度信息
-      if (msg.includes('%|')) {
-        if (onProgress) onProgress('whisper_transcribing', 50);
-      }
+      stderr += data.toString();
     });
 
     proc.on('close', (code) => {
+      clearTimeout(timer);
+      if (finalMessage?.type === 'error') {
+        reject(new Error(`Whisper 转写失败: ${finalMessage.error}`));
+        return;
+      }
       if (code !== 0) {
         console.error(`${TAG} Whisper 进程退出码: ${code}`);
         console.error(`${TAG} stderr: ${stderr.substring(0, 500)}`);
         reject(new Error(`Whisper 转写失败 (exit code ${code}): ${stderr.substring(0, 200)}`));
         return;
       }
-
-      try {
-        const result = JSON.parse(stdout);
-        const transcript = (result.segments || result || []).map(seg => ({
-          start: Number(seg.start) || 0,
-          end: Number(seg.end) || 0,
-          text: (seg.text || '').trim()
-        }));
-
-        console.log(`${TAG} 转写完成，共 ${transcript.length} 条记录`);
-        if (onProgress) onProgress('done', 100);
-        resolve({ transcript });
-      } catch (parseError) {
-        reject(new Error(`解析 Whisper 输出失败: ${parseError.message}`));
+      if (!finalMessage) {
+        reject(new Error('解析 Whisper 输出失败: 缺少 result 记录'));
+        return;
       }
+      resolve(finalMessage.result);
     });
 
     proc.on('error', (err) => {
@@ -102,13 +121,182 @@ async function transcribeWithWhisper(audioPath, options = {}) {
     });
 
     // 超时处理（10分钟）
-    setTimeout(() => {
+    const timer = setTimeout(() => {
       proc.kill('SIGTERM');
       reject(new Error('Whisper 转写超时（10分钟）'));
     }, 10 * 60 * 1000);
   });
 }
 
+/**
+ * 把脚本推送的 segment / progress 事件转成回调：
+ * 进度映射到 10%-95%（开始前 10%，完成后 100%），段按解码顺序交给 onSegment
+ */
+function createEventHandler({ onProgress, onSegment }) {
+  return (message) => {
+    try {
+      if (message.event === 'progress' && onProgress) {
+        onProgress('whisper_transcribing', Math.round(10 + (Number(message.percent) || 0) * 0.85));
+      } else if (message.event === 'segment' && message.segment && onSegment) {
+        onSegment(normalizeTranscript([message.segment])[0], message.index);
+      }
+    } catch (error) {
+      console.warn(`${TAG} 转写事件回调异常: ${error.message}`);
+    }
+  };
+}
+
+/**
+ * 影响转写结果的推理参数在环境变量里的默认值，transcribeWithWhisper 与缓存键共用
+ */
+function readDecodeDefaults() {
+  return {
+    vad: process.env.WHISPER_VAD === '1',
+    quantize: process.env.WHISPER_QUANTIZE === '1',
+    beamSize: Number(process.env.WHISPER_BEAM_SIZE) || 0,
+    bestOf: Number(process.env.WHISPER_BEST_OF) || 0,
+    temperatureFallback: process.env.WHISPER_TEMPERATURE_FALLBACK !== '0'
+  };
+}
+
+/**
+ * 转录缓存里的模型标识，如 base、base:int8+beam5+vad
+ * 量化、解码参数和 VAD 都会改变输出，各自单独缓存；格式与 whisper_transcribe.py 的 transcript_model_key 一致
+ * @param {string} model - Whisper 模型大小
+ * @param {object} [options] - 同 transcribeWithWhisper 的 vad / quantize / beamSize / bestOf / temperatureFallback
+ * @returns {string}
+ */
+function whisperCacheModel(model, options = {}) {
+  const { vad, quantize, beamSize, bestOf, temperatureFallback } = { ...readDecodeDefaults(), ...options };
+  let key = quantize ? `${model}:int8` : model;
+  if (beamSize > 1) key += `+beam${beamSize}`;
+  if (bestOf > 0) key += `+best${bestOf}`;
+  if (!temperatureFallback) key += '+t0';
+  if (vad) key += '+vad';
+  return key;
+}
+
+/**
+ * 使用本地 Whisper 模型进行语音识别
+ *
+ * 默认交给常驻 Whisper 服务（模型只加载一次，见 whisperServer.js）；
+ * 服务无法启动或设置 WHISPER_SERVER=0 时退回单次进程。
+ * @param {string} audioPath - 音频文件路径
+ * @param {object} options
+ * @param {string} [options.model='base'] - Whisper 模型大小 (tiny/base/small/medium/large)
+ * @param {string} [options.language='zh'] - 语言提示
+ * @param {string} [options.pythonPath='python'] - Python 可执行文件路径
+ * @param {function} [options.onProgress] - 进度回调 (stage, percent)，按已解码的音频时长计算
+ * @param {function} [options.onSegment] - 每解码出一段即回调 (segment, index)，可在转写完成前处理已有前缀
+ * @param {boolean|string} [options.profile] - 输出 cProfile 文件（true 或 WHISPER_PROFILE=1 时写到调试目录）
+ * @param {boolean} [options.server=true] - 是否使用常驻服务
+ * @param {boolean} [options.chunked] - 在静音处分块、多进程并行转写（默认读 WHISPER_CHUNKED=1）
+ * @param {number} [options.workers] - 分块模式进程数，0 按 CPU 数自动选择（默认读 WHISPER_CHUNK_WORKERS）
+ * @param {boolean} [options.vad] - 先做语音活动检测，只转写有语音的区间（默认读 WHISPER_VAD=1）
+ * @param {boolean} [options.quantize] - CPU 推理时线性层动态 int8 量化（默认读 WHISPER_QUANTIZE=1）
+ * @param {number} [options.threads] - 本任务的 torch 线程数，0 为 torch 默认（默认按 WHISPER_CPU_THREADS / 并发数分配）
+ * @param {number} [options.beamSize] - beam search 宽度，0/1 为贪心解码（默认读 WHISPER_BEAM_SIZE）
+ * @param {number} [options.bestOf] - 温度回退采样的候选数，0 为 whisper 默认（默认读 WHISPER_BEST_OF）
+ * @param {boolean} [options.temperatureFallback] - 解码质量差时按更高温度重试（WHISPER_TEMPERATURE_FALLBACK=0 关闭）
+ * @returns {Promise<{transcript: Array<{start: number, end: number, text: string}>, timings: object|null}>}
+ */
+async function transcribeWithWhisper(audioPath, options = {}) {
+  const defaults = readDecodeDefaults();
+  const {
+    model = 'base',
+    language = 'zh',
+    pythonPath = 'python',
+    onProgress,
+    onSegment,
+    profile = process.env.WHISPER_PROFILE === '1',
+    server = true,
+    chunked = process.env.WHISPER_CHUNKED === '1',
+    workers = Number(process.env.WHISPER_CHUNK_WORKERS) || 0,
+    vad = defaults.vad,
+    quantize = defaults.quantize,
+    threads = resolveWhisperThreads(),
+    beamSize = defaults.beamSize,
+    bestOf = defaults.bestOf,
+    temperatureFallback = defaults.temperatureFallback
+  } = options;
+
+  // 检查 Python 脚本是否存在
+  if (!fs.existsSync(SCRIPT_PATH)) {
+    throw new Error(`Whisper 脚本不存在: ${SCRIPT_PATH}`);
+  }
+
+  // 检查音频文件
+  if (!fs.existsSync(audioPath)) {
+    throw new Error(`音频文件不存在: ${audioPath}`);
+  }
+
+  const inference = { quantize, threads, beamSize, bestOf, temperatureFallback };
+  console.log(
+    `${TAG} 开始本地 Whisper 转写 (model=${model}${quantize ? ', int8' : ''}` +
+    `${threads ? `, threads=${threads}` : ''}${beamSize > 1 ? `, beam=${beamSize}` : ''})...`
+  );
+  if (onProgress) onProgress('whisper_starting', 10);
+
+  const profileDir = profile ? (typeof profile === 'string' ? path.resolve(profile) : PROFILE_DIR) : null;
+  const chunkOptions = chunked ? { workers } : null;
+  const onEvent = createEventHandler({ onProgress, onSegment });
+  let result = null;
+  let serverMeta = null;
+
+  if (server && isWhisperServerEnabled()) {
+    try {
+      const response = await runWhisperServerTask({
+        audio: path.resolve(audioPath),
+        model,
+        language,
+        profile: profileDir,
+        chunked: chunkOptions,
+        vad,
+        inference,
+        stream: Boolean(onProgress || onSegment)
+      }, { pythonPath, onEvent });
+      result = response.result;
+      serverMeta = response.meta;
+    } catch (error) {
+      if (error.code !== 'WHISPER_SERVER_START_FAILED') throw error;
+      console.warn(`${TAG} 常驻服务不可用，改为单次进程: ${error.message}`);
+    }
+  }
+
+  if (!result) {
+    result = await runWhisperProcess(audioPath, {
+      model, language, pythonPath, onEvent, profileDir, chunked: chunkOptions, vad, inference
+    });
+  }
+
+  const transcript = normalizeTranscript(result);
+  const timings = result.timings ? { ...result.timings, server: serverMeta } : null;
+
+  console.log(`${TAG} 转写完成，共 ${transcript.length} 条记录`);
+  if (timings) {
+    console.log(
+      `${TAG} 耗时: 模型加载 ${timings.modelLoadMs}ms${timings.cacheHit ? '（已缓存）' : ''}, ` +
+      `转写 ${timings.transcribeMs}ms, 实时率 ${timings.realTimeFactor ?? '-'}, 峰值内存 ${timings.peakRssMb}MB`
+    );
+    if (timings.vad) {
+      const { skippedSeconds, skippedFraction, regions, estimatedSavedMs, applied } = timings.vad;
+      console.log(
+        `${TAG} VAD: ${regions} 个语音区间, 跳过 ${skippedSeconds}s (${(skippedFraction * 100).toFixed(1)}%)` +
+        (applied ? `, 估计节省 ${estimatedSavedMs}ms` : '，比例过低未启用')
+      );
+    }
+    if (timings.chunked) {
+      const { chunks, workers: processes, silenceSplits, hardSplits } = timings.chunked;
+      console.log(
+        `${TAG} 分块: ${chunks} 块 / ${processes} 进程, 静音切分 ${silenceSplits}, 硬切 ${hardSplits}, ` +
+        `实时率 ${timings.realTimeFactor}`
+      );
+    }
+  }
+  if (onProgress) onProgress('done', 100);
+  return { transcript, timings };
+}
+
 /**
  * 检查 Whisper 是否可用
  */
@@ -135,5 +323,7 @@ async function isWhisperAvailable(pythonPath = 'python') {
 
 module.exports = {
   transcribeWithWhisper,
-  isWhisperAvailable
+  whisperCacheModel,
+  isWhisperAvailable,
+  shutdownWhisperServers
 };
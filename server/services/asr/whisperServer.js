@@ -0,0 +1,108 @@
+/**
+ * 常驻 Whisper 转写服务
+ *
+ * 以 `whisper_transcribe.py --server` 启动常驻进程，模型加载一次后按 LRU 缓存，
+ * 避免 DashScope 不可用、所有任务都降级到 Whisper 时反复 load_model。
+ * 进程数即并发上限（WHISPER_CONCURRENCY，默认 1），超出的请求在池中排队。
+ * CPU 线程预算（WHISPER_CPU_THREADS）平分给各进程，每个进程启动时固定 torch 线程数，
+ * 并发转写不会互相抢核。
+ */
+
+const os = require('os');
+const path = require('path');
+const { PythonWorkerPool, resolvePythonCommand } = require('../pythonWorkerPool');
+
+const SCRIPT_PATH = path.join(__dirname, '../../../scripts/whisper_transcribe.py');
+
+/** 启动时需要 import torch / whisper，比视觉 worker 慢得多 */
+const READY_TIMEOUT_MS = 120000;
+/** 单次转写超时（与一次性脚本保持一致） */
+const TRANSCRIBE_TIMEOUT_MS = 10 * 60 * 1000;
+
+function readNumberEnv(name, fallback) {
+  const value = Number(process.env[name]);
+  return Number.isFinite(value) && value >= 0 ? value : fallback;
+}
+
+/**
+ * 每个转写任务的 torch 线程数：线程预算（WHISPER_CPU_THREADS，默认 CPU 数）按并发数平分。
+ * 只有一个并发且没有设置预算时返回 0，保持 torch 默认
+ * @param {number} [concurrency] - 默认读 WHISPER_CONCURRENCY
+ */
+function resolveWhisperThreads(concurrency = Math.max(1, Math.floor(readNumberEnv('WHISPER_CONCURRENCY', 1)))) {
+  const budget = Math.floor(readNumberEnv('WHISPER_CPU_THREADS', 0));
+  if (!budget && concurrency <= 1) return 0;
+  return Math.max(1, Math.floor((budget || os.cpus().length) / concurrency));
+}
+
+function getServerConfig() {
+  const concurrency = Math.max(1, Math.floor(readNumberEnv('WHISPER_CONCURRENCY', 1)));
+  return {
+    concurrency,
+    threads: resolveWhisperThreads(concurrency),
+    maxModels: Math.max(1, Math.floor(readNumberEnv('WHISPER_MAX_MODELS', 2))),
+    memoryCapMb: readNumberEnv('WHISPER_MODEL_MEMORY_MB', 0),
+    idleShutdownMs: readNumberEnv('WHISPER_IDLE_SHUTDOWN_MS', 15 * 60 * 1000)
+  };
+}
+
+const pools = new Map();
+
+function getWhisperServerPool(pythonPath = null) {
+  const command = pythonPath || resolvePythonCommand();
+  if (!pools.has(command)) {
+    const config = getServerConfig();
+    pools.set(command, new PythonWorkerPool({
+      size: config.concurrency,
+      pythonCommand: command,
+      args: [
+        SCRIPT_PATH,
+        '--server',
+        '--max-models', String(config.maxModels),
+        '--memory-cap-mb', String(config.memoryCapMb),
+        '--threads', String(config.threads)
+      ],
+      cwd: path.dirname(SCRIPT_PATH),
+      label: 'Whisper 服务',
+      tag: '[ASR:WhisperServer]',
+      codePrefix: 'WHISPER_SERVER',
+      readyTimeoutMs: READY_TIMEOUT_MS,
+      idleShutdownMs: config.idleShutdownMs,
+      defaultTimeoutMs: TRANSCRIBE_TIMEOUT_MS
+    }));
+  }
+  return pools.get(command);
+}
+
+/**
+ * 通过常驻 Whisper 服务转写
+ * @param {object} payload - { audio, model, language, profile, inference }
+ * @param {object} [options={}]
+ * @param {string} [options.pythonPath] - Python 可执行文件
+ * @param {number} [options.timeoutMs] - 单次请求超时
+ * @param {Function} [options.onEvent] - 服务推送的 event 消息回调
+ * @returns {Promise<{result: object, meta: object}>}
+ */
+async function runWhisperServerTask(payload, options = {}) {
+  return getWhisperServerPool(options.pythonPath).run('transcribe', payload, {
+    timeoutMs: options.timeoutMs,
+    onEvent: options.onEvent
+  });
+}
+
+function isWhisperServerEnabled() {
+  return process.env.WHISPER_SERVER !== '0';
+}
+
+function shutdownWhisperServers() {
+  for (const pool of pools.values()) pool.shutdown();
+  pools.clear();
+}
+
+module.exports = {
+  runWhisperServerTask,
+  isWhisperServerEnabled,
+  shutdownWhisperServers,
+  getWhisperServerPool,
+  resolveWhisperThreads
+};
@@ -0,0 +1,88 @@
+/**
+ * 帧向量精确检索（memmap .npy）
+ *
+ * 每个视频的本地帧描述子另存为一份 L2 归一化的 float32 矩阵（frame_vector_store.py），
+ * 常驻 Python worker 以 memmap 打开并做 LRU 缓存；一批查询只需一次矩阵乘法加 argpartition，
+ * 单个视频几千帧的检索比逐条走 LanceDB 快得多。结果与 LanceDB 余弦检索一致（精确搜索）。
+ *
+ * FRAME_SEARCH_ENGINE=lancedb 关闭，全部走 LanceDB；FRAME_VECTOR_DIR 指定矩阵目录
+ * （默认仓库根目录 cache/frame_vectors）；FRAME_VECTOR_CACHE 为 worker 缓存的视频数（默认 64）。
+ */
+
+const path = require('path');
+const { runVisualMetricsRequest } = require('./visualCutDetector');
+
+const FRAME_VECTOR_SCRIPT_PATH = path.join(__dirname, 'frame_vector_store.py');
+const DEFAULT_STORE_DIR = path.join(__dirname, '../../cache/frame_vectors');
+const SEARCH_TIMEOUT_MS = 30000;
+
+function isFrameVectorStoreEnabled() {
+  return process.env.FRAME_SEARCH_ENGINE !== 'lancedb';
+}
+
+function resolveStoreDir(options = {}) {
+  if (options.storeDir) return path.resolve(options.storeDir);
+  return process.env.FRAME_VECTOR_DIR ? path.resolve(process.env.FRAME_VECTOR_DIR) : DEFAULT_STORE_DIR;
+}
+
+async function runFrameVectorRequest(payload, options = {}) {
+  const cacheSize = Number(process.env.FRAME_VECTOR_CACHE);
+  const { parsed, workerStats } = await runVisualMetricsRequest({
+    storeDir: resolveStoreDir(options),
+    cacheSize: Number.isFinite(cacheSize) && cacheSize > 0 ? cacheSize : undefined,
+    ...payload
+  }, {
+    timeoutMs: options.timeoutMs || SEARCH_TIMEOUT_MS,
+    pythonCommand: options.pythonCommand,
+    worker: options.worker,
+    type: 'frame_vectors',
+    scriptPath: FRAME_VECTOR_SCRIPT_PATH
+  });
+  return { ...parsed, stats: parsed.stats ? { ...parsed.stats, worker: workerStats } : null };
+}
+
+/**
+ * 写入（覆盖）一个视频的帧向量
+ * @param {string} bvid
+ * @param {Array<{ timestamp: number, vector: number[] }>} points
+ * @param {object} [options={}] - { storeDir }
+ */
+async function writeFrameVectors(bvid, points, options = {}) {
+  return runFrameVectorRequest({
+    action: 'write',
+    bvid,
+    vectors: points.map(point => point.vector),
+    timestamps: points.map(point => point.timestamp)
+  }, options);
+}
+
+/**
+ * 批量检索
+ * @param {object} request
+ * @param {string|null} request.bvid - 只在该视频内检索，为空时检索全部视频
+ * @param {number[][]} [request.queries] - 查询向量
+ * @param {Array<{bvid: string, timestamp: number}>} [request.queryFrames] - 以已入库的帧作为查询（取最近的一帧）
+ * @param {number} [request.topK=5]
+ * @param {object} [options={}] - { storeDir, timeoutMs, worker }
+ * @returns {Promise<{results: Array<{query: object|null, matches: Array<{score, bvid, timestamp}>|null}>, stats: object}>}
+ *   results 顺序为 queries 在前、queryFrames 在后；找不到的查询帧 matches 为 null
+ */
+async function searchFrameVectors(request, options = {}) {
+  const parsed = await runFrameVectorRequest({
+    action: 'search',
+    bvid: request.bvid || null,
+    queries: request.queries || [],
+    queryFrames: request.queryFrames || [],
+    topK: request.topK
+  }, options);
+  return {
+    results: Array.isArray(parsed.results) ? parsed.results : [],
+    stats: parsed.stats
+  };
+}
+
+module.exports = {
+  isFrameVectorStoreEnabled,
+  writeFrameVectors,
+  searchFrameVectors
+};
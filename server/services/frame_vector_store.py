@@ -0,0 +1,267 @@
+import argparse
+import json
+import math
+import os
+import re
+import sys
+import time
+import traceback
+from collections import OrderedDict
+from pathlib import Path
+
+PROCESS_STARTED = time.perf_counter()
+
+import numpy as np
+
+IMPORTS_FINISHED = time.perf_counter()
+
+
+# Exact cosine search over per-video frame descriptor matrices. Each bvid is
+# one <bvid>.npy of L2-normalized float32 rows plus <bvid>.times.npy. Files
+# are opened memory-mapped and kept in a small LRU, so searching a hot video
+# is one matrix multiply per query batch plus argpartition, with no copy of
+# the matrix into the heap.
+DEFAULT_STORE_DIR = Path(__file__).resolve().parents[2] / "cache" / "frame_vectors"
+DEFAULT_CACHE_SIZE = 64
+DEFAULT_TOP_K = 5
+# Matrices are named after the bvid itself, so only ids that are already
+# safe file names are accepted; anything else could be renamed or collide.
+BVID = re.compile(r"^BV[0-9A-Za-z_]+$", re.IGNORECASE)
+
+
+def as_float(value, default=0.0):
+    try:
+        number = float(value)
+        if math.isfinite(number):
+            return number
+    except (TypeError, ValueError):
+        pass
+    return default
+
+
+def elapsed_ms(started):
+    return round((time.perf_counter() - started) * 1000.0, 2)
+
+
+def normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix[None, :]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def top_k(scores, k):
+    # Per-row indices of the k largest scores, best first.
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.zeros((scores.shape[0], 0), dtype=np.int64)
+    if k < scores.shape[1]:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.broadcast_to(np.arange(scores.shape[1]), scores.shape).copy()
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+class FrameVectorStore:
+    def __init__(self, directory=None, cache_size=DEFAULT_CACHE_SIZE):
+        self.directory = Path(directory or DEFAULT_STORE_DIR)
+        self.cache_size = max(1, int(cache_size))
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def paths(self, bvid):
+        name = str(bvid)
+        if not BVID.match(name):
+            raise ValueError(f"invalid bvid for frame vector store: {name!r}")
+        return self.directory / f"{name}.npy", self.directory / f"{name}.times.npy"
+
+    def write(self, bvid, vectors, times):
+        vectors = normalize_rows(vectors)
+        times = np.asarray(times, dtype=np.float64)
+        if vectors.shape[0] != times.shape[0]:
+            raise ValueError(f"{vectors.shape[0]} vectors but {times.shape[0]} timestamps")
+        self.directory.mkdir(parents=True, exist_ok=True)
+        matrix_path, times_path = self.paths(bvid)
+        # Timestamps first: a reader that sees the new matrix also sees them.
+        for path, array in ((times_path, times), (matrix_path, vectors)):
+            temp = path.with_name(f"{path.name}.{os.getpid()}.tmp.npy")
+            np.save(temp, array)
+            os.replace(temp, path)
+        self.cache.pop(bvid, None)
+        return int(vectors.shape[0])
+
+    def load(self, bvid):
+        if not BVID.match(str(bvid)):
+            return None
+        matrix_path, times_path = self.paths(bvid)
+        try:
+            mtime = matrix_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            self.cache.pop(bvid, None)
+            return None
+        cached = self.cache.get(bvid)
+        if cached is not None and cached[0] == mtime:
+            self.cache.move_to_end(bvid)
+            self.hits += 1
+            return cached[1], cached[2]
+
+        self.misses += 1
+        matrix = np.load(matrix_path, mmap_mode="r")
+        times = np.load(times_path)
+        self.cache[bvid] = (mtime, matrix, times)
+        self.cache.move_to_end(bvid)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return matrix, times
+
+    def videos(self):
+        if not self.directory.exists():
+            return []
+        return sorted(
+            path.name[:-4] for path in self.directory.glob("*.npy")
+            if not path.name.endswith(".times.npy") and BVID.match(path.name[:-4])
+        )
+
+    def lookup(self, bvid, timestamp):
+        loaded = self.load(bvid)
+        if loaded is None or not loaded[1].size:
+            return None
+        matrix, times = loaded
+        row = int(np.argmin(np.abs(times - timestamp)))
+        return np.asarray(matrix[row]), float(times[row])
+
+    def search(self, queries, bvids, k):
+        queries = normalize_rows(queries)
+        best_scores = np.full((queries.shape[0], 0), -np.inf, dtype=np.float32)
+        best_videos = np.zeros((queries.shape[0], 0), dtype=np.int64)
+        best_times = np.zeros((queries.shape[0], 0), dtype=np.float64)
+        searched = []
+        rows = 0
+        for bvid in bvids:
+            loaded = self.load(bvid)
+            if loaded is None or not loaded[1].size:
+                continue
+            matrix, times = loaded
+            scores = queries @ matrix.T
+            picked = top_k(scores, k)
+            # Merge this video's top k into the running top k.
+            best_scores = np.concatenate([best_scores, np.take_along_axis(scores, picked, axis=1)], axis=1)
+            best_videos = np.concatenate([best_videos, np.full(picked.shape, len(searched))], axis=1)
+            best_times = np.concatenate([best_times, times[picked]], axis=1)
+            keep = top_k(best_scores, k)
+            best_scores = np.take_along_axis(best_scores, keep, axis=1)
+            best_videos = np.take_along_axis(best_videos, keep, axis=1)
+            best_times = np.take_along_axis(best_times, keep, axis=1)
+            searched.append(bvid)
+            rows += int(times.size)
+
+        results = [
+            [
+                {
+                    "score": round(max(0.0, float(score)), 6),
+                    "bvid": searched[int(video)],
+                    "timestamp": round(float(timestamp), 3),
+                }
+                for score, video, timestamp in zip(scores, videos, times)
+            ]
+            for scores, videos, times in zip(best_scores, best_videos, best_times)
+        ]
+        return results, {"videosSearched": len(searched), "rowsSearched": rows}
+
+
+STORES = {}
+
+
+def get_store(directory, cache_size):
+    key = str(Path(directory or DEFAULT_STORE_DIR).resolve())
+    if key not in STORES:
+        STORES[key] = FrameVectorStore(key, cache_size)
+    store = STORES[key]
+    store.cache_size = max(1, int(cache_size))
+    return store
+
+
+def handle_request(payload, emit=None):
+    started = time.perf_counter()
+    action = payload.get("action") or "search"
+    store = get_store(payload.get("storeDir"), as_float(payload.get("cacheSize"), DEFAULT_CACHE_SIZE))
+    hits, misses = store.hits, store.misses
+    stats = {"action": action, "storeDir": str(store.directory)}
+    result = {}
+
+    if action == "write":
+        stats["frames"] = store.write(payload["bvid"], payload.get("vectors") or [], payload.get("timestamps") or [])
+    elif action == "search":
+        queries = [list(vector) for vector in payload.get("queries") or []]
+        resolved = [None] * len(queries)
+        for frame in payload.get("queryFrames") or []:
+            found = store.lookup(str(frame.get("bvid") or ""), as_float(frame.get("timestamp"), 0.0))
+            resolved.append({"bvid": frame.get("bvid"), "timestamp": found[1]} if found else None)
+            queries.append(found[0] if found else None)
+
+        present = [index for index, query in enumerate(queries) if query is not None]
+        bvid = payload.get("bvid")
+        bvids = [str(bvid)] if bvid else store.videos()
+        k = max(1, int(as_float(payload.get("topK"), DEFAULT_TOP_K)))
+        searched = time.perf_counter()
+        matches, search_stats = store.search(np.asarray([queries[index] for index in present]), bvids, k) \
+            if present else ([], {"videosSearched": 0, "rowsSearched": 0})
+        stats.update(search_stats)
+        stats["searchMs"] = elapsed_ms(searched)
+
+        by_query = dict(zip(present, matches))
+        result["results"] = [
+            {"query": resolved[index], "matches": by_query.get(index)}
+            for index in range(len(queries))
+        ]
+        stats["queryCount"] = len(present)
+    elif action == "stats":
+        stats["videos"] = len(store.videos())
+    else:
+        raise ValueError(f"unknown frame vector action: {action}")
+
+    stats.update({
+        "cachedVideos": len(store.cache),
+        "cacheHits": store.hits - hits,
+        "cacheMisses": store.misses - misses,
+        "timings": {
+            "importMs": round((IMPORTS_FINISHED - PROCESS_STARTED) * 1000.0, 2),
+            "requestMs": elapsed_ms(started),
+        },
+    })
+    result["stats"] = stats
+    return result
+
+
+def error_payload(error):
+    return {
+        "error": str(error),
+        "traceback": traceback.format_exc(),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Memory-mapped frame vector search")
+    parser.add_argument("--store-dir", help=f"matrix directory (default {DEFAULT_STORE_DIR})")
+    parser.add_argument("--stats", action="store_true", help="print store statistics; otherwise read a JSON payload from stdin")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    try:
+        if args.stats:
+            payload = {"action": "stats", "storeDir": args.store_dir}
+        else:
+            payload = json.load(sys.stdin)
+        json.dump(handle_request(payload), sys.stdout, ensure_ascii=False)
+    except Exception as error:
+        json.dump(error_payload(error), sys.stdout, ensure_ascii=False)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
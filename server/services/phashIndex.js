@@ -0,0 +1,271 @@
+/**
+ * 跨视频探测帧 pHash 索引
+ *
+ * 每次分析把视觉切点检测用的密集探测帧的 64 位 pHash 写入本地索引（phash_index.py，多索引哈希），
+ * 新视频的探测帧先在索引里按汉明半径查找；命中已有人工/AI 标注的视频时，
+ * 把对方的 ad_segments 按匹配帧的时间偏移投影到当前视频，作为可直接复用的片段。
+ * 同一份素材（恰饭口播、重新上传）因此不必每次从零分析。
+ * 探测帧的 pHash 直接取自统一媒体分析（probe_phash.npy）或探测帧目录的特征缓存，不重复解码；
+ * 两者都没有时（流式/粗到细模式）退回给视觉模型用的关键帧。
+ *
+ * PHASH_INDEX=0 关闭；PHASH_INDEX_DIR 指定索引目录（默认仓库根目录 cache/phash_index）。
+ */
+
+const fs = require('fs');
+const path = require('path');
+const { runVisualMetricsRequest } = require('./visualCutDetector');
+
+const TAG = '[PhashIndex]';
+const PHASH_INDEX_SCRIPT_PATH = path.join(__dirname, 'phash_index.py');
+const DEFAULT_INDEX_DIR = path.join(__dirname, '../../cache/phash_index');
+const FRAME_NAME_PATTERN = /^frame_\d+_(\d+)\.jpg$/;
+
+/** 投影片段至少需要落在源片段内的匹配帧数 */
+const MIN_SEGMENT_FRAMES = 2;
+/** 两个投影片段重叠超过较短者的该比例时视为同一片段 */
+const SEGMENT_OVERLAP_RATIO = 0.5;
+
+function isPhashIndexEnabled() {
+  return process.env.PHASH_INDEX !== '0';
+}
+
+function resolveIndexDir() {
+  return process.env.PHASH_INDEX_DIR ? path.resolve(process.env.PHASH_INDEX_DIR) : DEFAULT_INDEX_DIR;
+}
+
+/**
+ * 读取关键帧目录，文件名 frame_NNN_<ms>.jpg
+ * @returns {Array<{framePath: string, time: number}>}
+ */
+function listIndexFrames(framesDir) {
+  return fs.readdirSync(framesDir)
+    .map(file => ({ file, match: file.match(FRAME_NAME_PATTERN) }))
+    .filter(item => item.match)
+    .map(item => ({ framePath: path.join(framesDir, item.file), time: Number(item.match[1]) / 1000 }))
+    .sort((a, b) => a.time - b.time);
+}
+
+/**
+ * 读取视觉探测帧目录（extractVisualProbeFrames 输出，manifest.json 列出帧和时间）
+ * @param {string} probeDir
+ * @param {string} [videoPath] - 给出时要求 manifest 来自同一视频文件
+ * @returns {Array<{framePath: string, time: number}>}
+ */
+function listProbeFrames(probeDir, videoPath) {
+  const manifestPath = path.join(probeDir, 'manifest.json');
+  if (!fs.existsSync(manifestPath)) return [];
+  const manifest = JSON.parse(fs.readFileSync(manifestPath, 'utf8'));
+  if (videoPath && path.resolve(String(manifest.source_video || '')) !== path.resolve(videoPath)) return [];
+  return (Array.isArray(manifest.frames) ? manifest.frames : [])
+    .map(frame => ({ framePath: path.join(probeDir, frame.file), time: Number(frame.time) }))
+    .filter(frame => Number.isFinite(frame.time) && fs.existsSync(frame.framePath));
+}
+
+/**
+ * 选择写入索引的帧：统一媒体分析的探测帧 pHash > 探测帧目录 > 关键帧目录
+ * @param {object} sources
+ * @param {object} [sources.mediaPass] - runMediaPass 的结果
+ * @param {string} [sources.probeDir] - 视觉探测帧目录
+ * @param {string} [sources.videoPath]
+ * @param {string} [sources.keyframesDir] - extractFrames 输出目录
+ * @returns {{source: string, frames?: Array, probeHashes?: object}}
+ */
+function resolveIndexProbe({ mediaPass, probeDir, videoPath, keyframesDir } = {}) {
+  const hashes = mediaPass?.probeHashes;
+  if (hashes?.path && hashes.count > 0 && Number(mediaPass.sampleFps) > 0 && fs.existsSync(hashes.path)) {
+    return { source: 'media_pass', probeHashes: { path: hashes.path, sampleFps: Number(mediaPass.sampleFps) } };
+  }
+  if (probeDir) {
+    const frames = listProbeFrames(probeDir, videoPath);
+    if (frames.length > 0) return { source: 'visual_probe', frames };
+  }
+  return { source: 'keyframes', frames: keyframesDir ? listIndexFrames(keyframesDir) : [] };
+}
+
+/**
+ * 在索引中查找与这些帧相近的其他视频，并（默认）把它们加入索引
+ * @param {string} bvid
+ * @param {{frames?: Array<{framePath: string, time: number}>, probeHashes?: {path: string, sampleFps: number}}} probe
+ * @param {object} [options={}] - { radius, maxVideosPerFrame, minFrames, add, indexDir, timeoutMs, worker }
+ * @returns {Promise<{matches: Array, stats: object}>}
+ */
+async function matchIndexFrames(bvid, probe, options = {}) {
+  const payload = {
+    action: 'match',
+    bvid,
+    indexDir: options.indexDir || resolveIndexDir(),
+    frames: probe.frames || [],
+    probeHashes: probe.probeHashes || null,
+    options: {
+      radius: options.radius,
+      maxVideosPerFrame: options.maxVideosPerFrame,
+      minFrames: options.minFrames,
+      add: options.add
+    }
+  };
+  const { parsed, workerStats } = await runVisualMetricsRequest(payload, {
+    timeoutMs: Number.isFinite(Number(options.timeoutMs)) ? Number(options.timeoutMs) : 60000,
+    pythonCommand: options.pythonCommand,
+    worker: options.worker,
+    type: 'phash_index',
+    scriptPath: PHASH_INDEX_SCRIPT_PATH
+  });
+  return {
+    matches: Array.isArray(parsed.matches) ? parsed.matches : [],
+    stats: parsed.stats ? { ...parsed.stats, worker: workerStats } : null
+  };
+}
+
+function parseContent(contentJson) {
+  try {
+    return contentJson ? JSON.parse(contentJson) : null;
+  } catch (error) {
+    return null;
+  }
+}
+
+/**
+ * 读取这些视频已有的广告片段（annotations.content_json 里的 ad_segments）
+ * AI 全量分析只取每个视频最新的一条，人工标注全部保留
+ * @param {string[]} bvids
+ * @returns {Map<string, Array<{start_time, end_time, ad_type, description, source_type}>>}
+ */
+function loadKnownAdSegments(bvids) {
+  const segmentsByBvid = new Map();
+  if (!bvids.length) return segmentsByBvid;
+
+  // 延迟加载，脚本单独使用索引时不打开数据库
+  const db = require('../database/db');
+  const placeholders = bvids.map(() => '?').join(',');
+  const rows = db.prepare(`
+    SELECT v.bvid, a.id, a.source_type, a.annotation_type, a.content_json
+    FROM annotations a
+    JOIN videos v ON a.video_id = v.id
+    WHERE v.bvid IN (${placeholders})
+    ORDER BY a.id DESC
+  `).all(...bvids);
+
+  const latestAI = new Set();
+  for (const row of rows) {
+    if (row.source_type === 'AI' && row.annotation_type === 'full_analysis') {
+      if (latestAI.has(row.bvid)) continue;
+      latestAI.add(row.bvid);
+    }
+    const content = parseContent(row.content_json);
+    const segments = content?.content_analysis?.ad_segments || content?.ad_segments || [];
+    if (!Array.isArray(segments)) continue;
+
+    const list = segmentsByBvid.get(row.bvid) || [];
+    for (const seg of segments) {
+      const start = Number(seg.start_time);
+      const end = Number(seg.end_time);
+      if (!Number.isFinite(start) || !Number.isFinite(end) || end <= start) continue;
+      list.push({
+        start_time: start,
+        end_time: end,
+        ad_type: seg.ad_type || 'soft_ad',
+        description: seg.description || null,
+        source_type: row.source_type
+      });
+    }
+    segmentsByBvid.set(row.bvid, list);
+  }
+  return segmentsByBvid;
+}
+
+function median(values) {
+  const sorted = [...values].sort((a, b) => a - b);
+  const middle = Math.floor(sorted.length / 2);
+  return sorted.length % 2 ? sorted[middle] : (sorted[middle - 1] + sorted[middle]) / 2;
+}
+
+function overlapRatio(a, b) {
+  const overlap = Math.min(a.end_time, b.end_time) - Math.max(a.start_time, b.start_time);
+  const shorter = Math.min(a.end_time - a.start_time, b.end_time - b.start_time);
+  return overlap > 0 && shorter > 0 ? overlap / shorter : 0;
+}
+
+/**
+ * 把匹配视频的广告片段投影到当前视频时间轴
+ * 偏移取落在源片段内的匹配帧 (time - knownTime) 的中位数
+ * @param {Array} matches - matchIndexFrames 的结果
+ * @param {Map<string, Array>} segmentsByBvid - loadKnownAdSegments 的结果
+ * @param {number} [duration] - 当前视频时长，用于裁剪
+ * @returns {Array<{start_time, end_time, ad_type, description, source}>}
+ */
+function projectKnownSegments(matches, segmentsByBvid, duration) {
+  const projected = [];
+  for (const match of matches) {
+    for (const segment of segmentsByBvid.get(match.bvid) || []) {
+      const pairs = match.pairs.filter(pair => pair.knownTime >= segment.start_time && pair.knownTime <= segment.end_time);
+      if (pairs.length < MIN_SEGMENT_FRAMES) continue;
+
+      const offset = median(pairs.map(pair => pair.time - pair.knownTime));
+      const limit = Number.isFinite(duration) && duration > 0 ? duration : Infinity;
+      const start = Math.max(0, segment.start_time + offset);
+      const end = Math.min(limit, segment.end_time + offset);
+      if (end <= start) continue;
+
+      projected.push({
+        start_time: Math.round(start * 100) / 100,
+        end_time: Math.round(end * 100) / 100,
+        ad_type: segment.ad_type,
+        description: segment.description,
+        source: {
+          bvid: match.bvid,
+          start_time: segment.start_time,
+          end_time: segment.end_time,
+          source_type: segment.source_type,
+          offset: Math.round(offset * 1000) / 1000,
+          matchedFrames: pairs.length
+        }
+      });
+    }
+  }
+
+  // 多个源视频投影出同一片段时保留匹配帧最多的一个
+  projected.sort((a, b) => b.source.matchedFrames - a.source.matchedFrames);
+  const kept = [];
+  for (const segment of projected) {
+    if (!kept.some(existing => overlapRatio(existing, segment) > SEGMENT_OVERLAP_RATIO)) {
+      kept.push(segment);
+    }
+  }
+  return kept.sort((a, b) => a.start_time - b.start_time);
+}
+
+/**
+ * 用探测帧查找可复用的已标注片段，同时把这些帧加入索引
+ * @param {string} bvid
+ * @param {object} probe - resolveIndexProbe 的结果
+ * @param {number} [duration]
+ * @param {object} [options={}] - 透传给 matchIndexFrames
+ * @returns {Promise<{segments: Array, matches: Array, stats: object}>}
+ */
+async function findKnownSegments(bvid, probe, duration, options = {}) {
+  const startedAt = Date.now();
+  const { matches, stats } = await matchIndexFrames(bvid, probe, options);
+  const segmentsByBvid = loadKnownAdSegments(matches.map(match => match.bvid));
+  const segments = projectKnownSegments(matches, segmentsByBvid, duration);
+
+  console.log(
+    `${TAG} ${bvid}: 匹配 ${matches.length} 个已索引视频，可复用片段 ${segments.length} 个` +
+    `（${probe.source} ${stats?.probeFrames ?? 0} 帧，索引 ${stats?.indexedFrames ?? 0} 帧，${Date.now() - startedAt}ms）`
+  );
+  return {
+    segments,
+    matches: matches.map(({ pairs, ...match }) => match),
+    stats: stats ? { ...stats, probeSource: probe.source } : null
+  };
+}
+
+module.exports = {
+  isPhashIndexEnabled,
+  listIndexFrames,
+  listProbeFrames,
+  resolveIndexProbe,
+  matchIndexFrames,
+  loadKnownAdSegments,
+  projectKnownSegments,
+  findKnownSegments
+};
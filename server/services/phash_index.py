@@ -0,0 +1,428 @@
+import argparse
+import json
+import math
+import os
+import re
+import sys
+import time
+import traceback
+from pathlib import Path
+
+PROCESS_STARTED = time.perf_counter()
+
+import numpy as np
+
+IMPORTS_FINISHED = time.perf_counter()
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# Cross-video index of 64-bit pHashes of the dense visual probe frames
+# (perceptual_hash_batch in visual_cut_metrics.py). Rows live in three flat arrays (hash, video id,
+# time) saved as one .npz. Lookups use multi-index hashing: the hash is split
+# into four 16-bit chunks, and two hashes within Hamming radius r agree on at
+# least one chunk to within r // 4 bits, so a query only visits the buckets
+# whose chunk lies within that radius and verifies candidates by popcount.
+INDEX_VERSION = 1
+INDEX_FILE = "index.npz"
+LOCK_FILE = "index.lock"
+DEFAULT_INDEX_DIR = Path(__file__).resolve().parents[2] / "cache" / "phash_index"
+DEFAULT_OPTIONS = {
+    "radius": 8,
+    # A probe frame that matches this many different videos is a logo, black
+    # screen or title card, not evidence of shared footage.
+    "maxVideosPerFrame": 20,
+    "minFrames": 2,
+    "add": True,
+}
+CHUNKS = 4
+CHUNK_BITS = 16
+CHUNK_VALUES = 1 << CHUNK_BITS
+POPCOUNT_8 = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+POPCOUNT_16 = POPCOUNT_8[np.arange(CHUNK_VALUES) & 0xFF] + POPCOUNT_8[np.arange(CHUNK_VALUES) >> 8]
+FRAME_NAME = re.compile(r"frame_\d+_(\d+)\.jpg$")
+
+
+def as_float(value, default=0.0):
+    try:
+        number = float(value)
+        if math.isfinite(number):
+            return number
+    except (TypeError, ValueError):
+        pass
+    return default
+
+
+def elapsed_ms(started):
+    return round((time.perf_counter() - started) * 1000.0, 2)
+
+
+def popcount64(values):
+    values = np.ascontiguousarray(values, dtype=np.uint64)
+    return POPCOUNT_8[values.view(np.uint8).reshape(-1, 8)].sum(axis=1, dtype=np.int64)
+
+
+def chunk_keys(hashes, chunk):
+    return ((hashes >> np.uint64(chunk * CHUNK_BITS)) & np.uint64(CHUNK_VALUES - 1)).astype(np.int64)
+
+
+def flip_masks(bits):
+    return np.flatnonzero(POPCOUNT_16 <= bits).astype(np.int64)
+
+
+def expand_ranges(starts, lengths):
+    # Concatenation of arange(start, start + length) for every range, without
+    # a Python loop.
+    total = int(lengths.sum())
+    if not total:
+        return np.zeros(0, dtype=np.int64)
+    ends = np.cumsum(lengths)
+    shifts = np.repeat(starts - (ends - lengths), lengths)
+    return np.arange(total, dtype=np.int64) + shifts
+
+
+class PhashIndex:
+    def __init__(self, directory=None):
+        self.directory = Path(directory or DEFAULT_INDEX_DIR)
+        self.hashes = np.zeros(0, dtype=np.uint64)
+        self.video_ids = np.zeros(0, dtype=np.int32)
+        self.times = np.zeros(0, dtype=np.float32)
+        self.videos = []
+        self.video_lookup = {}
+        self.tables = None
+        self.loaded_mtime = None
+
+    @property
+    def path(self):
+        return self.directory / INDEX_FILE
+
+    @classmethod
+    def from_arrays(cls, hashes, video_ids, times, videos, directory=None):
+        index = cls(directory)
+        index.hashes = np.asarray(hashes, dtype=np.uint64)
+        index.video_ids = np.asarray(video_ids, dtype=np.int32)
+        index.times = np.asarray(times, dtype=np.float32)
+        index.videos = list(videos)
+        index.video_lookup = {bvid: position for position, bvid in enumerate(index.videos)}
+        return index
+
+    def refresh(self):
+        # Other workers write the same file; reload only when it changed.
+        try:
+            mtime = self.path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return self
+        if mtime == self.loaded_mtime:
+            return self
+        with np.load(self.path, allow_pickle=False) as data:
+            if int(data["version"]) != INDEX_VERSION:
+                raise ValueError(f"unsupported phash index version in {self.path}")
+            loaded = PhashIndex.from_arrays(data["hashes"], data["videoIds"], data["times"], data["videos"].tolist())
+        self.hashes, self.video_ids, self.times = loaded.hashes, loaded.video_ids, loaded.times
+        self.videos, self.video_lookup = loaded.videos, loaded.video_lookup
+        self.tables = None
+        self.loaded_mtime = mtime
+        return self
+
+    def save(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        temp = self.directory / f"{INDEX_FILE}.{os.getpid()}.tmp.npz"
+        np.savez(
+            temp,
+            version=np.int32(INDEX_VERSION),
+            hashes=self.hashes,
+            videoIds=self.video_ids,
+            times=self.times,
+            videos=np.asarray(self.videos, dtype=str),
+        )
+        os.replace(temp, self.path)
+        self.loaded_mtime = self.path.stat().st_mtime_ns
+
+    def build_tables(self):
+        # Per chunk: row order sorted by chunk value plus CSR-style bucket
+        # offsets, so a bucket lookup is two array reads.
+        if self.tables is None:
+            self.tables = []
+            for chunk in range(CHUNKS):
+                keys = chunk_keys(self.hashes, chunk)
+                order = np.argsort(keys, kind="stable").astype(np.int32)
+                offsets = np.zeros(CHUNK_VALUES + 1, dtype=np.int64)
+                np.cumsum(np.bincount(keys, minlength=CHUNK_VALUES), out=offsets[1:])
+                self.tables.append((order, offsets))
+        return self.tables
+
+    def nbytes(self):
+        tables = sum(order.nbytes + offsets.nbytes for order, offsets in self.tables or [])
+        return int(self.hashes.nbytes + self.video_ids.nbytes + self.times.nbytes + tables)
+
+    def add(self, bvid, hashes, times):
+        # Re-analyzing a video replaces its rows.
+        if bvid in self.video_lookup:
+            video_id = self.video_lookup[bvid]
+            keep = self.video_ids != video_id
+            self.hashes, self.video_ids, self.times = self.hashes[keep], self.video_ids[keep], self.times[keep]
+        else:
+            video_id = len(self.videos)
+            self.videos.append(bvid)
+            self.video_lookup[bvid] = video_id
+        count = len(hashes)
+        self.hashes = np.concatenate([self.hashes, np.asarray(hashes, dtype=np.uint64)])
+        self.video_ids = np.concatenate([self.video_ids, np.full(count, video_id, dtype=np.int32)])
+        self.times = np.concatenate([self.times, np.asarray(times, dtype=np.float32)])
+        self.tables = None
+        return count
+
+    def query(self, hashes, radius, exclude=None):
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        empty = np.zeros(0, dtype=np.int64)
+        if not hashes.size or not self.hashes.size:
+            return empty, empty, empty
+        masks = flip_masks(int(radius) // CHUNKS)
+        probe_ids = np.arange(hashes.shape[0], dtype=np.int64)
+        pair_probes = []
+        pair_rows = []
+        for chunk, (order, offsets) in enumerate(self.build_tables()):
+            variants = (chunk_keys(hashes, chunk)[:, None] ^ masks[None, :]).ravel()
+            starts = offsets[variants]
+            lengths = offsets[variants + 1] - starts
+            pair_probes.append(np.repeat(np.repeat(probe_ids, masks.size), lengths))
+            pair_rows.append(order[expand_ranges(starts, lengths)])
+
+        probes = np.concatenate(pair_probes)
+        rows = np.concatenate(pair_rows).astype(np.int64)
+        # Verify first: almost every candidate is out of range, and dropping
+        # those before removing rows found through several chunks keeps the
+        # dedupe sort small.
+        distances = popcount64(hashes[probes] ^ self.hashes[rows])
+        within = distances <= radius
+        unique = np.unique(probes[within] * self.hashes.shape[0] + rows[within])
+        probes, rows = unique // self.hashes.shape[0], unique % self.hashes.shape[0]
+        distances = popcount64(hashes[probes] ^ self.hashes[rows])
+        keep = np.ones(probes.size, dtype=bool)
+        if exclude is not None and exclude in self.video_lookup:
+            keep &= self.video_ids[rows] != self.video_lookup[exclude]
+        return probes[keep], rows[keep], distances[keep]
+
+
+def match_videos(index, bvid, hashes, times, options):
+    radius = int(as_float(options.get("radius"), 8))
+    max_videos = int(as_float(options.get("maxVideosPerFrame"), 20))
+    min_frames = int(as_float(options.get("minFrames"), 2))
+    probes, rows, distances = index.query(hashes, radius, exclude=bvid)
+    candidates = int(probes.size)
+    if not probes.size:
+        return [], candidates, 0
+
+    # Best row per (probe, video), then drop probes shared by too many videos.
+    videos = index.video_ids[rows].astype(np.int64)
+    ranking = np.lexsort((distances, videos, probes))
+    probes, rows, distances, videos = probes[ranking], rows[ranking], distances[ranking], videos[ranking]
+    first = np.ones(probes.size, dtype=bool)
+    first[1:] = (probes[1:] != probes[:-1]) | (videos[1:] != videos[:-1])
+    probes, rows, distances, videos = probes[first], rows[first], distances[first], videos[first]
+    spread = np.bincount(probes, minlength=len(hashes))
+    common = spread[probes] > max_videos
+    probes, rows, distances, videos = probes[~common], rows[~common], distances[~common], videos[~common]
+
+    matches = []
+    for video in np.unique(videos):
+        selected = videos == video
+        pair_times = times[probes[selected]]
+        known_times = index.times[rows[selected]].astype(np.float64)
+        if selected.sum() < min_frames:
+            continue
+        matches.append({
+            "bvid": index.videos[int(video)],
+            "matchedFrames": int(selected.sum()),
+            "coverage": round(float(selected.sum()) / len(hashes), 3),
+            "offset": round(float(np.median(pair_times - known_times)), 3),
+            "pairs": [
+                {"time": round(float(probe_time), 3), "knownTime": round(float(known_time), 3), "distance": int(distance)}
+                for probe_time, known_time, distance in zip(pair_times, known_times, distances[selected])
+            ],
+        })
+    matches.sort(key=lambda match: (-match["matchedFrames"], match["bvid"]))
+    return matches, candidates, int(common.sum())
+
+
+def unpack_hashes(packed):
+    packed = np.ascontiguousarray(packed, dtype=np.uint8)
+    return packed.view(">u8").ravel().astype(np.uint64)
+
+
+def hash_frames(frame_paths, metrics=None):
+    # Resident workers pass their own visual_cut_metrics module (it runs as
+    # __main__ there) so it is not imported a second time.
+    if metrics is None:
+        import visual_cut_metrics as metrics
+
+    if not frame_paths:
+        return np.zeros(0, dtype=np.uint64), "none"
+    # Probe frames that already went through cut detection have their pHashes
+    # in the directory's feature cache.
+    cached = metrics.load_cached_phash(frame_paths)
+    if cached is not None and cached.shape[0] == len(frame_paths):
+        return unpack_hashes(cached), "feature_cache"
+    gray = np.stack([metrics.decode_frame(frame_path)[1] for frame_path in frame_paths])
+    return unpack_hashes(metrics.perceptual_hash_batch(gray)), "decoded"
+
+
+def load_probe_hashes(probe):
+    # Packed pHashes of the media pass probe frames (probe_phash.npy written by
+    # visual_cut_metrics.analyze_media); frame i was sampled at i / sampleFps.
+    fps = as_float(probe.get("sampleFps"), 0.0)
+    if fps <= 0:
+        raise ValueError("probeHashes.sampleFps must be positive")
+    hashes = unpack_hashes(np.load(str(probe.get("path") or "")))
+    return hashes, np.round(np.arange(hashes.size, dtype=np.float64) / fps, 3)
+
+
+def collect_frames(frames):
+    collected = []
+    for frame in frames or []:
+        frame_path = str(frame.get("framePath") or "")
+        time_value = as_float(frame.get("time"), -1.0)
+        if frame_path and time_value >= 0 and Path(frame_path).exists():
+            collected.append((time_value, frame_path))
+    collected.sort()
+    return [path for _, path in collected], np.asarray([time for time, _ in collected], dtype=np.float64)
+
+
+def frames_from_dir(frames_dir):
+    # A visual probe directory lists its frames in manifest.json; keyframe
+    # directories carry the time in the file name.
+    manifest = Path(frames_dir) / "manifest.json"
+    if manifest.exists():
+        entries = json.loads(manifest.read_text(encoding="utf-8")).get("frames") or []
+        return [{"framePath": str(Path(frames_dir) / entry["file"]), "time": entry["time"]} for entry in entries]
+    frames = []
+    for name in sorted(os.listdir(frames_dir)):
+        match = FRAME_NAME.search(name)
+        if match:
+            frames.append({"framePath": str(Path(frames_dir) / name), "time": int(match.group(1)) / 1000.0})
+    return frames
+
+
+class IndexLock:
+    # Resident workers and standalone runs share one index file; writers
+    # serialize read-modify-write on a lock file (no-op where fcntl is missing).
+    def __init__(self, directory):
+        self.path = Path(directory) / LOCK_FILE
+        self.handle = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.handle = open(self.path, "w")
+            fcntl.flock(self.handle, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self.handle is not None:
+            fcntl.flock(self.handle, fcntl.LOCK_UN)
+            self.handle.close()
+        return False
+
+
+INDEXES = {}
+
+
+def get_index(directory):
+    directory = str(Path(directory or DEFAULT_INDEX_DIR).resolve())
+    if directory not in INDEXES:
+        INDEXES[directory] = PhashIndex(directory)
+    return INDEXES[directory].refresh()
+
+
+def handle_request(payload, emit=None, metrics=None):
+    started = time.perf_counter()
+    options = dict(DEFAULT_OPTIONS)
+    options.update({key: value for key, value in (payload.get("options") or {}).items() if value is not None})
+    action = payload.get("action") or "match"
+    bvid = str(payload.get("bvid") or "")
+    index = get_index(payload.get("indexDir"))
+
+    stats = {"action": action, "indexDir": str(index.directory)}
+    matches = []
+    if action in ("match", "add"):
+        if not bvid:
+            raise ValueError("bvid is required")
+        hashed = time.perf_counter()
+        if payload.get("probeHashes"):
+            hashes, times = load_probe_hashes(payload["probeHashes"])
+            stats["hashSource"] = "media_pass"
+        else:
+            frame_paths, times = collect_frames(payload.get("frames"))
+            hashes, stats["hashSource"] = hash_frames(frame_paths, metrics)
+        stats["hashMs"] = elapsed_ms(hashed)
+        stats["probeFrames"] = int(hashes.size)
+
+        if action == "match":
+            queried = time.perf_counter()
+            matches, candidates, common = match_videos(index, bvid, hashes, times, options)
+            stats.update({"queryMs": elapsed_ms(queried), "candidates": candidates, "commonFramesDropped": common})
+
+        if action == "add" or options.get("add"):
+            added = time.perf_counter()
+            with IndexLock(index.directory):
+                index.refresh()
+                stats["addedFrames"] = index.add(bvid, hashes, times)
+                index.save()
+            stats["addMs"] = elapsed_ms(added)
+    elif action != "stats":
+        raise ValueError(f"unknown phash index action: {action}")
+
+    stats.update({
+        "indexedFrames": int(index.hashes.size),
+        "indexedVideos": len(index.videos),
+        "indexBytes": index.nbytes(),
+        "timings": {
+            "importMs": round((IMPORTS_FINISHED - PROCESS_STARTED) * 1000.0, 2),
+            "requestMs": elapsed_ms(started),
+        },
+    })
+    return {"matches": matches, "stats": stats}
+
+
+def error_payload(error):
+    return {
+        "error": str(error),
+        "traceback": traceback.format_exc(),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Cross-video probe frame pHash index")
+    parser.add_argument("--index-dir", help=f"index directory (default {DEFAULT_INDEX_DIR})")
+    parser.add_argument("--bvid", help="video id; without it a JSON payload is read from stdin")
+    parser.add_argument("--frames-dir", help="visual probe directory (manifest.json) or frame_NNN_<ms>.jpg keyframes")
+    parser.add_argument("--action", default="match", choices=["match", "add", "stats"])
+    parser.add_argument("--no-add", action="store_true", help="match without adding the frames to the index")
+    parser.add_argument("--radius", type=int, default=DEFAULT_OPTIONS["radius"], help="Hamming radius in bits")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    try:
+        if args.bvid or args.action == "stats":
+            payload = {
+                "action": args.action,
+                "indexDir": args.index_dir,
+                "bvid": args.bvid,
+                "frames": frames_from_dir(args.frames_dir) if args.frames_dir else [],
+                "options": {"radius": args.radius, "add": not args.no_add},
+            }
+        else:
+            payload = json.load(sys.stdin)
+        json.dump(handle_request(payload), sys.stdout, ensure_ascii=False)
+    except Exception as error:
+        json.dump(error_payload(error), sys.stdout, ensure_ascii=False)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
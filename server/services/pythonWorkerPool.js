@@ -0,0 +1,402 @@
+/**
+ * 常驻 Python worker 池（视觉切点、Whisper 转写共用）
+ *
+ * 每个 worker 以常驻模式运行，协议为按行分隔的 JSON：
+ *   <- {"type": "ready", "pid": 123}                      （启动完成）
+ *   -> {"id": 1, "type": "analyze", "payload": {...}}
+ *   <- {"id": 1, "type": "event", "event": "cut", ...}   （可选，0..n 条）
+ *   <- {"id": 1, "type": "result", "result": {...}, "elapsedMs": 12.3}
+ * 避免每个任务都重新启动 Python、重新 import 依赖或加载模型。
+ */
+
+const readline = require('readline');
+const { spawn, spawnSync } = require('child_process');
+
+/** 空闲超过该时长的 worker 在复用前先做一次 ping 健康检查 */
+const HEALTH_CHECK_IDLE_MS = 60000;
+/** 健康检查超时 */
+const HEALTH_CHECK_TIMEOUT_MS = 5000;
+
+let cachedPythonCommand = null;
+
+function resolvePythonCommand() {
+  if (cachedPythonCommand) return cachedPythonCommand;
+
+  const candidates = ['python3', 'python'];
+  for (const command of candidates) {
+    const result = spawnSync(command, ['--version'], { encoding: 'utf8' });
+    if (!result.error && result.status === 0) {
+      cachedPythonCommand = command;
+      return command;
+    }
+  }
+  cachedPythonCommand = 'python';
+  return cachedPythonCommand;
+}
+
+function workerError(message, code) {
+  const error = new Error(message);
+  error.code = code;
+  return error;
+}
+
+class PythonWorker {
+  /**
+   * @param {object} config
+   * @param {string} config.pythonCommand - Python 可执行文件
+   * @param {string[]} config.args - 启动参数（脚本路径 + 常驻模式参数）
+   * @param {string} [config.cwd] - 工作目录
+   * @param {string} config.label - 日志/错误信息中的名称
+   * @param {string} config.tag - 日志前缀
+   * @param {string} config.codePrefix - 错误码前缀
+   * @param {number} config.readyTimeoutMs - 启动超时
+   */
+  constructor(config) {
+    this.config = config;
+    this.child = null;
+    this.pid = null;
+    this.alive = false;
+    this.pending = new Map();
+    this.nextId = 1;
+    this.served = 0;
+    this.startupMs = null;
+    this.lastUsedAt = 0;
+    this.idleTimer = null;
+    this.stderrTail = '';
+    this.readyPromise = null;
+    this.onExit = null;
+  }
+
+  start() {
+    if (this.readyPromise) return this.readyPromise;
+
+    const { pythonCommand, args, cwd, label, readyTimeoutMs } = this.config;
+    const spawnedAt = Date.now();
+    const child = spawn(pythonCommand, args, {
+      cwd,
+      windowsHide: true
+    });
+    this.child = child;
+    this.alive = true;
+
+    this.readyPromise = new Promise((resolve, reject) => {
+      const timer = setTimeout(() => {
+        this.readyHandlers = null;
+        reject(new Error(`${label} 启动超时(${readyTimeoutMs}ms)`));
+        this.kill();
+      }, readyTimeoutMs);
+
+      this.readyHandlers = {
+        resolve: message => {
+          clearTimeout(timer);
+          this.readyHandlers = null;
+          this.pid = message.pid || child.pid;
+          this.startupMs = Date.now() - spawnedAt;
+          this.lastUsedAt = Date.now();
+          resolve(this);
+        },
+        reject: error => {
+          clearTimeout(timer);
+          this.readyHandlers = null;
+          reject(error);
+        }
+      };
+    });
+
+    readline.createInterface({ input: child.stdout }).on('line', line => this.handleLine(line));
+
+    child.stderr.on('data', chunk => {
+      this.stderrTail = (this.stderrTail + chunk.toString()).slice(-4000);
+    });
+    child.stdin.on('error', () => {});
+    child.on('error', error => this.handleExit(error));
+    child.on('exit', (code, signal) => {
+      const reason = this.stderrTail.trim() || `${label} 退出 (code=${code}, signal=${signal})`;
+      this.handleExit(new Error(reason));
+    });
+
+    // 常驻进程本身不应阻止 Node 退出；进行中的请求有自己的计时器保活。
+    child.unref();
+    for (const stream of [child.stdin, child.stdout, child.stderr]) {
+      if (stream && typeof stream.unref === 'function') stream.unref();
+    }
+
+    return this.readyPromise;
+  }
+
+  handleLine(line) {
+    if (!line.trim()) return;
+
+    let message;
+    try {
+      message = JSON.parse(line);
+    } catch (error) {
+      console.warn(`${this.config.tag} 无法解析 worker 输出: ${line.slice(0, 200)}`);
+      return;
+    }
+
+    if (message.type === 'ready') {
+      if (this.readyHandlers) this.readyHandlers.resolve(message);
+      return;
+    }
+
+    const entry = this.pending.get(message.id);
+    if (!entry) return;
+
+    // 请求进行中的增量事件（如在线检测确认的切点），不结束请求
+    if (message.type === 'event') {
+      if (typeof entry.onEvent === 'function') {
+        try {
+          entry.onEvent(message);
+        } catch (error) {
+          console.warn(`${this.config.tag} 事件回调异常: ${error.message}`);
+        }
+      }
+      return;
+    }
+
+    this.pending.delete(message.id);
+    clearTimeout(entry.timer);
+
+    if (message.type === 'error') {
+      const error = new Error(message.error || `${this.config.label} 返回错误`);
+      error.traceback = message.traceback;
+      entry.reject(error);
+      return;
+    }
+
+    this.served = Number(message.served) || this.served + 1;
+    entry.resolve(message);
+  }
+
+  handleExit(error) {
+    if (!this.alive) return;
+    this.alive = false;
+    this.child = null;
+    clearTimeout(this.idleTimer);
+
+    if (this.readyHandlers) this.readyHandlers.reject(error);
+
+    for (const entry of this.pending.values()) {
+      clearTimeout(entry.timer);
+      entry.reject(workerError(`${this.config.label} 异常退出: ${error.message}`, `${this.config.codePrefix}_CRASHED`));
+    }
+    this.pending.clear();
+
+    if (typeof this.onExit === 'function') this.onExit(this);
+  }
+
+  request(type, payload, timeoutMs, onEvent = null) {
+    const { label, codePrefix } = this.config;
+    if (!this.alive || !this.child) {
+      return Promise.reject(workerError(`${label} 不可用`, `${codePrefix}_CRASHED`));
+    }
+
+    const id = this.nextId++;
+    return new Promise((resolve, reject) => {
+      const timer = setTimeout(() => {
+        if (!this.pending.has(id)) return;
+        this.pending.delete(id);
+        reject(workerError(`${label} 请求超时(${timeoutMs}ms)`, `${codePrefix}_TIMEOUT`));
+        // 超时的 worker 状态未知，直接重启；立即按已退出处理并移出池，
+        // 不等异步的 exit 事件，否则 release 会把这个将死的 worker 放回空闲队列
+        this.kill();
+        this.handleExit(new Error(`请求超时(${timeoutMs}ms)`));
+      }, timeoutMs);
+
+      this.pending.set(id, { resolve, reject, timer, onEvent });
+
+      try {
+        this.child.stdin.write(`${JSON.stringify({ id, type, payload })}\n`);
+      } catch (error) {
+        this.pending.delete(id);
+        clearTimeout(timer);
+        reject(new Error(`${label} 输入失败: ${error.message}`));
+      }
+    });
+  }
+
+  async ping(timeoutMs = HEALTH_CHECK_TIMEOUT_MS) {
+    return this.request('ping', null, timeoutMs);
+  }
+
+  kill() {
+    if (!this.child) return;
+    try {
+      this.child.kill();
+    } catch (_) {}
+  }
+}
+
+class PythonWorkerPool {
+  /**
+   * @param {object} options
+   * @param {string[]} options.args - Python 启动参数
+   * @param {number} [options.size=1] - 最多同时运行的 worker 数（即并发上限，超出的请求排队）
+   * @param {string} [options.pythonCommand] - Python 可执行文件
+   * @param {string} [options.cwd] - 工作目录
+   * @param {string} [options.label='Python worker'] - 日志/错误信息中的名称
+   * @param {string} [options.tag='[PythonWorker]'] - 日志前缀
+   * @param {string} [options.codePrefix='PYTHON_WORKER'] - 错误码前缀（*_CRASHED / *_START_FAILED / *_TIMEOUT）
+   * @param {number} [options.readyTimeoutMs=30000] - worker 启动超时
+   * @param {number} [options.idleShutdownMs=600000] - 空闲超过该时长的 worker 自动退出
+   * @param {number} [options.defaultTimeoutMs=120000] - 单次请求默认超时
+   */
+  constructor(options = {}) {
+    this.size = Math.max(1, Math.floor(Number(options.size) || 1));
+    this.workerConfig = {
+      pythonCommand: options.pythonCommand || resolvePythonCommand(),
+      args: options.args || [],
+      cwd: options.cwd,
+      label: options.label || 'Python worker',
+      tag: options.tag || '[PythonWorker]',
+      codePrefix: options.codePrefix || 'PYTHON_WORKER',
+      readyTimeoutMs: Number(options.readyTimeoutMs) || 30000
+    };
+    this.idleShutdownMs = Number(options.idleShutdownMs) || 10 * 60 * 1000;
+    this.defaultTimeoutMs = Number(options.defaultTimeoutMs) || 120000;
+    this.workers = new Set();
+    this.idle = [];
+    this.waiters = [];
+    this.closed = false;
+  }
+
+  get pythonCommand() {
+    return this.workerConfig.pythonCommand;
+  }
+
+  spawnWorker() {
+    const worker = new PythonWorker(this.workerConfig);
+    worker.onExit = exited => this.removeWorker(exited);
+    this.workers.add(worker);
+    return worker;
+  }
+
+  removeWorker(worker) {
+    this.workers.delete(worker);
+    this.idle = this.idle.filter(item => item !== worker);
+    this.wakeWaiter();
+  }
+
+  wakeWaiter() {
+    const waiter = this.waiters.shift();
+    if (waiter) waiter();
+  }
+
+  async acquire() {
+    const { tag, label, codePrefix } = this.workerConfig;
+
+    while (!this.closed) {
+      while (this.idle.length > 0) {
+        const worker = this.idle.pop();
+        clearTimeout(worker.idleTimer);
+        if (!worker.alive) continue;
+
+        if (Date.now() - worker.lastUsedAt > HEALTH_CHECK_IDLE_MS) {
+          try {
+            await worker.ping();
+          } catch (error) {
+            console.warn(`${tag} 健康检查失败，重启 worker(pid=${worker.pid}): ${error.message}`);
+            worker.kill();
+            this.removeWorker(worker);
+            continue;
+          }
+        }
+        return { worker, cold: false };
+      }
+
+      if (this.workers.size < this.size) {
+        const worker = this.spawnWorker();
+        try {
+          await worker.start();
+        } catch (error) {
+          worker.kill();
+          this.removeWorker(worker);
+          throw workerError(`${label} 启动失败: ${error.message}`, `${codePrefix}_START_FAILED`);
+        }
+        console.log(`${tag} worker 已启动 pid=${worker.pid} (${worker.startupMs}ms)`);
+        return { worker, cold: true };
+      }
+
+      await new Promise(resolve => this.waiters.push(resolve));
+    }
+
+    throw new Error(`${label} 池已关闭`);
+  }
+
+  release(worker) {
+    worker.lastUsedAt = Date.now();
+    if (worker.alive && !this.closed) {
+      this.idle.push(worker);
+      worker.idleTimer = setTimeout(() => {
+        if (this.idle.includes(worker)) {
+          this.idle = this.idle.filter(item => item !== worker);
+          worker.kill();
+        }
+      }, this.idleShutdownMs);
+      worker.idleTimer.unref();
+    }
+    this.wakeWaiter();
+  }
+
+  /**
+   * 在池中执行一次请求。worker 在请求中途崩溃时会换一个新 worker 重试一次。
+   * @returns {Promise<{result: any, meta: object}>}
+   */
+  async run(type, payload, options = {}) {
+    const timeoutMs = Number.isFinite(Number(options.timeoutMs)) ? Number(options.timeoutMs) : this.defaultTimeoutMs;
+    const attempts = 2;
+
+    for (let attempt = 1; ; attempt++) {
+      const queuedAt = Date.now();
+      const { worker, cold } = await this.acquire();
+      const startedAt = Date.now();
+
+      try {
+        const response = await worker.request(type, payload, timeoutMs, options.onEvent);
+        const finishedAt = Date.now();
+        return {
+          result: response.result,
+          meta: {
+            mode: 'pool',
+            cold,
+            pid: worker.pid,
+            startupMs: cold ? worker.startupMs : 0,
+            queueMs: startedAt - queuedAt - (cold ? worker.startupMs : 0),
+            roundTripMs: finishedAt - startedAt,
+            computeMs: Number.isFinite(Number(response.elapsedMs)) ? Number(response.elapsedMs) : null,
+            serializeMs: Number.isFinite(Number(response.serializeMs)) ? Number(response.serializeMs) : null,
+            latencyMs: finishedAt - queuedAt,
+            served: worker.served,
+            attempt
+          }
+        };
+      } catch (error) {
+        if (error.code === `${this.workerConfig.codePrefix}_CRASHED` && attempt < attempts) {
+          console.warn(`${this.workerConfig.tag} worker 崩溃，重启后重试: ${error.message}`);
+          continue;
+        }
+        throw error;
+      } finally {
+        this.release(worker);
+      }
+    }
+  }
+
+  shutdown() {
+    this.closed = true;
+    for (const worker of this.workers) {
+      clearTimeout(worker.idleTimer);
+      worker.kill();
+    }
+    this.workers.clear();
+    this.idle = [];
+    while (this.waiters.length) this.wakeWaiter();
+  }
+}
+
+module.exports = {
+  PythonWorker,
+  PythonWorkerPool,
+  resolvePythonCommand
+};
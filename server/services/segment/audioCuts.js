@@ -1,19 +1,25 @@
 /**
  * 音频切点检测服务
- * 通过 FFmpeg 检测音频中的静音段和音量突变点
- * 
+ * 检测音频中的静音段和音量突变点
+ *
+ * 默认由 audio_cut_metrics.py 以 memmap 方式读取 16-bit PCM WAV，一次遍历同时得到
+ * 窗口 RMS、静音区间和音量突变点；Python 不可用或不是 PCM WAV 时回退到 FFmpeg
+ * silencedetect + astats。AUDIO_CUTS_ENGINE=ffmpeg 可强制走 FFmpeg。
+ *
  * 输入: audioPath (WAV文件路径)
  * 输出: audioCuts[] = [{ time, score, reasons }]
  */
 
-const { exec } = require('child_process');
+const { exec, spawn } = require('child_process');
 const util = require('util');
 const fs = require('fs');
 const path = require('path');
 const ffmpegPath = require('@ffmpeg-installer/ffmpeg').path;
+const { resolvePythonCommand } = require('../pythonWorkerPool');
 
 const execPromise = util.promisify(exec);
 const TAG = '[AudioCuts]';
+const SCRIPT_PATH = path.join(__dirname, 'audio_cut_metrics.py');
 
 // ============ 配置常量 ============
 
@@ -27,6 +33,8 @@ const VOLUME_WINDOW_SEC = 1.0;
 const VOLUME_CHANGE_THRESHOLD_DB = 8;
 /** 去重：两个切点间最小间隔 (秒) */
 const MIN_CUT_INTERVAL = 2.0;
+/** audio_cut_metrics.py 超时 (毫秒) */
+const METRICS_TIMEOUT_MS = 60000;
 
 /**
  * 检测音频切点（静音 + 音量变化）
@@ -36,6 +44,8 @@ const MIN_CUT_INTERVAL = 2.0;
  * @param {number} [options.silenceMinDuration=0.5] - 最短静音时长
  * @param {number} [options.volumeWindowSec=1.0] - 音量分析窗口
  * @param {number} [options.volumeChangeThresholdDb=8] - 音量变化阈值
+ * @param {string} [options.engine] - numpy（默认）/ ffmpeg，默认取 AUDIO_CUTS_ENGINE
+ * @param {string} [options.pythonCommand] - Python 可执行文件
  * @returns {Promise<Array<{time: number, score: number, reasons: string[]}>>}
  */
 async function detectAudioCuts(audioPath, options = {}) {
@@ -43,7 +53,8 @@ async function detectAudioCuts(audioPath, options = {}) {
     silenceNoiseDb = SILENCE_NOISE_DB,
     silenceMinDuration = SILENCE_MIN_DURATION,
     volumeWindowSec = VOLUME_WINDOW_SEC,
-    volumeChangeThresholdDb = VOLUME_CHANGE_THRESHOLD_DB
+    volumeChangeThresholdDb = VOLUME_CHANGE_THRESHOLD_DB,
+    engine = process.env.AUDIO_CUTS_ENGINE || 'numpy'
   } = options;
 
   if (!fs.existsSync(audioPath)) {
@@ -52,6 +63,26 @@ async function detectAudioCuts(audioPath, options = {}) {
 
   console.log(`${TAG} 开始检测音频切点: ${audioPath}`);
 
+  if (engine !== 'ffmpeg') {
+    try {
+      const startedAt = Date.now();
+      const { audioCuts, stats } = await runAudioCutMetrics(audioPath, {
+        silenceNoiseDb,
+        silenceMinDuration,
+        volumeWindowSec,
+        volumeChangeThresholdDb,
+        minCutInterval: MIN_CUT_INTERVAL
+      }, options);
+      console.log(
+        `${TAG} 静音切点: ${stats.silenceCuts} 个, 音量切点: ${stats.volumeCuts} 个, ` +
+        `合并去重后: ${audioCuts.length} 个 (NumPy ${stats.timings.analyzeMs}ms, 总计 ${Date.now() - startedAt}ms)`
+      );
+      return audioCuts;
+    } catch (error) {
+      console.warn(`${TAG} NumPy 音频分析失败，回退到 FFmpeg: ${error.message}`);
+    }
+  }
+
   // 并行执行两种检测
   const [silenceCuts, volumeCuts] = await Promise.all([
     detectSilence(audioPath, silenceNoiseDb, silenceMinDuration),
@@ -67,6 +98,60 @@ async function detectAudioCuts(audioPath, options = {}) {
   return merged;
 }
 
+/**
+ * 调用 audio_cut_metrics.py：memmap 读取 WAV，一次遍历完成静音、RMS 和音量突变检测
+ * @returns {Promise<{audioCuts: Array, silences: Array, stats: object}>}
+ */
+function runAudioCutMetrics(audioPath, metricOptions, options = {}) {
+  const pythonCommand = options.pythonCommand || resolvePythonCommand();
+  const timeoutMs = Number(options.timeoutMs) || METRICS_TIMEOUT_MS;
+
+  return new Promise((resolve, reject) => {
+    const child = spawn(pythonCommand, [SCRIPT_PATH], { windowsHide: true });
+    let stdout = '';
+    let stderr = '';
+    let finished = false;
+
+    const finish = (error, result) => {
+      if (finished) return;
+      finished = true;
+      clearTimeout(timer);
+      if (error) reject(error);
+      else resolve(result);
+    };
+
+    const timer = setTimeout(() => {
+      child.kill();
+      finish(new Error(`音频分析超时(${timeoutMs}ms)`));
+    }, timeoutMs);
+
+    child.stdout.on('data', chunk => {
+      stdout += chunk.toString();
+    });
+    child.stderr.on('data', chunk => {
+      stderr += chunk.toString();
+    });
+    child.on('error', error => finish(error));
+    child.on('close', code => {
+      let parsed;
+      try {
+        parsed = JSON.parse(stdout);
+      } catch (error) {
+        finish(new Error(`无法解析音频分析输出 (exit ${code}): ${(stderr || stdout).slice(0, 300)}`));
+        return;
+      }
+      if (code !== 0 || parsed.error) {
+        finish(new Error(parsed.error || `audio_cut_metrics.py 退出码 ${code}`));
+        return;
+      }
+      finish(null, parsed);
+    });
+
+    child.stdin.on('error', () => {});
+    child.stdin.end(JSON.stringify({ audio: path.resolve(audioPath), options: metricOptions }));
+  });
+}
+
 /**
  * 静音检测 - 使用 FFmpeg silencedetect
  * 将静音结束时刻作为候选切点（静音结束 = 新内容开始）
@@ -113,16 +198,8 @@ async function detectSilence(audioPath, noiseDb, minDuration) {
  * 相邻窗口 RMS 差值超过阈值则标记为切点
  */
 async function detectVolumeChanges(audioPath, windowSec, thresholdDb) {
-  // 使用 ffprobe 获取音频时长
-  const duration = await getAudioDuration(audioPath);
-  if (!duration || duration <= 0) {
-    console.warn(`${TAG} 无法获取音频时长`);
-    return [];
-  }
-
-  // 使用 FFmpeg 按固定窗口计算每段 RMS 值
-  // 通过 loudnorm 的 measured_I 或使用 astats 的 RMS_level
-  const rmsValues = await computeRmsPerWindow(audioPath, windowSec, duration);
+  // 使用 FFmpeg 按固定窗口计算每段 RMS 值（astats 的 RMS_level）
+  const rmsValues = await computeRmsPerWindow(audioPath, windowSec);
 
   if (rmsValues.length < 2) {
     return [];
@@ -150,45 +227,11 @@ async function detectVolumeChanges(audioPath, windowSec, thresholdDb) {
   return cuts;
 }
 
-/**
- * 获取音频时长 (秒) - 使用 ffmpeg 解析
- */
-async function getAudioDuration(audioPath) {
-  // 方案 1：用 ffmpeg -i 获取 duration
-  const command = `"${ffmpegPath}" -i "${audioPath}" -f null - 2>&1`;
-  try {
-    const result = await execPromise(command, { shell: true }).catch(e => ({
-      stdout: e.stdout || '',
-      stderr: e.stderr || e.message || ''
-    }));
-    const output = result.stderr || result.stdout || '';
-    // 解析 Duration: 00:01:23.45
-    const match = output.match(/Duration:\s*(\d+):(\d+):([\d.]+)/);
-    if (match) {
-      return parseInt(match[1]) * 3600 + parseInt(match[2]) * 60 + parseFloat(match[3]);
-    }
-  } catch (_) {}
-
-  // 方案 2：用 WAV 文件头计算（仅限 PCM WAV）
-  try {
-    const stats = fs.statSync(audioPath);
-    // WAV PCM 16-bit mono 16kHz: 每秒 32000 字节
-    const headerSize = 44; // 标准 WAV 头
-    const bytesPerSecond = 16000 * 2 * 1; // sampleRate * bytesPerSample * channels
-    const dataSize = stats.size - headerSize;
-    if (dataSize > 0) {
-      return dataSize / bytesPerSecond;
-    }
-  } catch (_) {}
-
-  return 0;
-}
-
 /**
  * 按窗口计算 RMS 能量 (dB)
  * 使用 FFmpeg astats 滤镜 + segment 实现分段统计
  */
-async function computeRmsPerWindow(audioPath, windowSec, totalDuration) {
+async function computeRmsPerWindow(audioPath, windowSec) {
   // 使用 volume filter 输出每帧的 RMS，然后按窗口聚合
   // 更可靠的方案：使用 afade 分段 + astats
   // 实际采用：使用 ebur128 或简单的分段 volumedetect
@@ -222,49 +265,13 @@ async function computeRmsPerWindow(audioPath, windowSec, totalDuration) {
       return allRms;
     }
 
-    // 备选方案：如果 astats 无输出，使用简单的分段 volumedetect
-    return await computeRmsFallback(audioPath, windowSec, totalDuration);
+    // astats 无输出时不再逐段启动 volumedetect（最多 600 个进程），音量切点交给 NumPy 引擎
+    console.warn(`${TAG} astats 无 RMS 输出，跳过音量变化检测`);
+    return [];
   } catch (error) {
-    console.warn(`${TAG} astats 计算失败，使用备选方案:`, error.message);
-    return await computeRmsFallback(audioPath, windowSec, totalDuration);
-  }
-}
-
-/**
- * 备选 RMS 计算方案：逐段提取并使用 volumedetect
- */
-async function computeRmsFallback(audioPath, windowSec, totalDuration) {
-  const windowCount = Math.ceil(totalDuration / windowSec);
-  // 限制最大窗口数，避免执行太多命令
-  const maxWindows = Math.min(windowCount, 600);
-  const actualWindowSec = totalDuration / maxWindows;
-
-  const rmsValues = [];
-
-  // 批量执行，每次处理一段
-  for (let i = 0; i < maxWindows; i++) {
-    const startTime = i * actualWindowSec;
-    const command = `"${ffmpegPath}" -ss ${startTime} -t ${actualWindowSec} -i "${audioPath}" -af volumedetect -f null - 2>&1`;
-
-    try {
-      const result = await execPromise(command, {
-        shell: true,
-        maxBuffer: 1024 * 1024
-      }).catch(e => ({ stdout: '', stderr: e.stderr || e.stdout || '' }));
-
-      const output = result.stderr || result.stdout || '';
-      const meanMatch = output.match(/mean_volume:\s*([-\d.]+)/);
-      if (meanMatch) {
-        rmsValues.push(parseFloat(meanMatch[1]));
-      } else {
-        rmsValues.push(-Infinity);
-      }
-    } catch (_) {
-      rmsValues.push(-Infinity);
-    }
+    console.warn(`${TAG} astats 计算失败，跳过音量变化检测:`, error.message);
+    return [];
   }
-
-  return rmsValues;
 }
 
 /**
@@ -307,5 +314,6 @@ function mergeCuts(silenceCuts, volumeCuts) {
 }
 
 module.exports = {
-  detectAudioCuts
+  detectAudioCuts,
+  runAudioCutMetrics
 };
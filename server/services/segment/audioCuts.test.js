@@ -7,8 +7,10 @@
  * 1. 静音检测
  * 2. 音量变化检测
  * 3. 合并去重逻辑
+ * 4. 末尾不足半个窗口的残余采样不产生音量切点，与 FFmpeg 路径结果一致
  */
 
+const os = require('os');
 const path = require('path');
 const fs = require('fs');
 const { detectAudioCuts } = require('./audioCuts');
@@ -68,6 +70,68 @@ async function testDetectAudioCuts() {
   console.log('\n✓ audioCuts 输出格式验证通过');
 }
 
+/**
+ * 写一个 16 kHz 单声道 16-bit PCM WAV：60s 噪声（20-22s 为近似静音）后接 6 个极小采样，
+ * 与 ffmpeg 抽出的音轨末尾多出几个采样的情况相同（共 960006 个采样）
+ */
+function writeTailFixture(filePath) {
+  const sampleRate = 16000;
+  const count = 60 * sampleRate + 6;
+  const data = Buffer.alloc(count * 2);
+  let seed = 7;
+  const random = () => {
+    seed = (seed * 1103515245 + 12345) % 2147483648;
+    return seed / 2147483648 - 0.5;
+  };
+  for (let i = 0; i < count; i++) {
+    const quiet = (i >= 20 * sampleRate && i < 22 * sampleRate) || i >= 60 * sampleRate;
+    data.writeInt16LE(Math.round(random() * (quiet ? 20 : 8000)), i * 2);
+  }
+
+  const header = Buffer.alloc(44);
+  header.write('RIFF', 0);
+  header.writeUInt32LE(36 + data.length, 4);
+  header.write('WAVE', 8);
+  header.write('fmt ', 12);
+  header.writeUInt32LE(16, 16);
+  header.writeUInt16LE(1, 20);
+  header.writeUInt16LE(1, 22);
+  header.writeUInt32LE(sampleRate, 24);
+  header.writeUInt32LE(sampleRate * 2, 28);
+  header.writeUInt16LE(2, 32);
+  header.writeUInt16LE(16, 34);
+  header.write('data', 36);
+  header.writeUInt32LE(data.length, 40);
+  fs.writeFileSync(filePath, Buffer.concat([header, data]));
+}
+
+async function testTrailingPartialWindow() {
+  console.log('\n=== 测试末尾残余窗口 ===');
+
+  const audioPath = path.join(os.tmpdir(), `audio-cuts-tail-${process.pid}.wav`);
+  writeTailFixture(audioPath);
+
+  try {
+    const numpyCuts = await detectAudioCuts(audioPath, { engine: 'numpy' });
+    const ffmpegCuts = await detectAudioCuts(audioPath, { engine: 'ffmpeg' });
+    console.log(`  NumPy:  ${JSON.stringify(numpyCuts)}`);
+    console.log(`  FFmpeg: ${JSON.stringify(ffmpegCuts)}`);
+
+    const tailCuts = numpyCuts.filter(cut => cut.time >= 59);
+    const silenceTimes = cuts => cuts.filter(cut => cut.reasons.includes('silence')).map(cut => cut.time);
+    const parity = JSON.stringify(silenceTimes(numpyCuts)) === JSON.stringify(silenceTimes(ffmpegCuts));
+
+    if (tailCuts.length === 0 && parity) {
+      console.log('✓ 末尾 6 个采样未产生切点，静音切点与 FFmpeg 路径一致');
+    } else {
+      console.error(`✗ 末尾切点 ${JSON.stringify(tailCuts)}，静音切点一致: ${parity}`);
+      process.exitCode = 1;
+    }
+  } finally {
+    fs.rmSync(audioPath, { force: true });
+  }
+}
+
 async function testErrorHandling() {
   console.log('\n=== 测试错误处理 ===');
 
@@ -83,6 +147,7 @@ async function main() {
   console.log('========== 音频切点检测测试 ==========');
 
   await testErrorHandling();
+  await testTrailingPartialWindow();
   await testDetectAudioCuts();
 
   console.log('\n========== 测试完成 ==========');
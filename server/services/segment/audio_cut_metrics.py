@@ -0,0 +1,310 @@
+import argparse
+import json
+import math
+import os
+import struct
+import sys
+import time
+import traceback
+
+PROCESS_STARTED = time.perf_counter()
+
+import numpy as np
+
+IMPORTS_FINISHED = time.perf_counter()
+
+
+DEFAULT_OPTIONS = {
+    "silenceNoiseDb": -30.0,
+    "silenceMinDuration": 0.5,
+    "volumeWindowSec": 1.0,
+    "volumeChangeThresholdDb": 8.0,
+    "minCutInterval": 2.0,
+    "frameSeconds": 0.01,
+    # Digital silence has no finite level; clamp it so windows stay comparable
+    # and the result stays valid JSON.
+    "floorDb": -100.0,
+    "blockSeconds": 60.0,
+    "includeRms": False,
+}
+
+PCM_FORMAT = 1
+EXTENSIBLE_FORMAT = 0xFFFE
+FULL_SCALE = 32768.0
+
+
+def as_float(value, default=0.0):
+    try:
+        number = float(value)
+        if math.isfinite(number):
+            return number
+    except (TypeError, ValueError):
+        pass
+    return default
+
+
+def elapsed_ms(started):
+    return round((time.perf_counter() - started) * 1000.0, 2)
+
+
+def round2(value):
+    return round(float(value) * 100.0) / 100.0
+
+
+def resolve_options(options):
+    resolved = dict(DEFAULT_OPTIONS)
+    for key, default in DEFAULT_OPTIONS.items():
+        if key not in (options or {}):
+            continue
+        if isinstance(default, bool):
+            resolved[key] = bool(options[key])
+        else:
+            resolved[key] = as_float(options[key], default)
+    return resolved
+
+
+def read_wav_layout(audio_path):
+    fmt = None
+    with open(audio_path, "rb") as handle:
+        header = handle.read(12)
+        if len(header) < 12 or header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+            return None
+        while True:
+            chunk = handle.read(8)
+            if len(chunk) < 8:
+                return None
+            chunk_id, size = chunk[:4], struct.unpack("<I", chunk[4:])[0]
+            if chunk_id == b"data":
+                offset = handle.tell()
+                break
+            if chunk_id == b"fmt " and size >= 16:
+                fmt = struct.unpack("<HHIIHH", handle.read(16))
+                size -= 16
+            handle.seek(size + (size & 1), 1)
+
+    # Streamed WAVs may carry a placeholder data size; trust the file length.
+    length = max(0, min(size, os.path.getsize(audio_path) - offset))
+    return fmt, offset, length
+
+
+def open_pcm16(audio_path):
+    layout = read_wav_layout(audio_path)
+    if layout is None or layout[0] is None:
+        raise ValueError(f"not a RIFF/WAVE file: {audio_path}")
+    (audio_format, channels, sample_rate, _, _, bits), offset, length = layout
+    if audio_format not in (PCM_FORMAT, EXTENSIBLE_FORMAT) or bits != 16 or channels < 1 or sample_rate <= 0:
+        raise ValueError(
+            f"unsupported WAV format (format={audio_format}, bits={bits}, channels={channels}); expected 16-bit PCM"
+        )
+    frames = length // (2 * channels)
+    if frames <= 0:
+        return np.zeros((0, channels), dtype=np.int16), sample_rate
+    samples = np.memmap(audio_path, dtype="<i2", mode="r", offset=offset, shape=(frames, channels))
+    return samples, sample_rate
+
+
+def frame_levels(samples, sample_rate, frame_seconds, block_seconds):
+    # One pass over the memmap: per-frame peak (for silence) and mean square
+    # (for RMS windows). Everything downstream works on these small arrays.
+    frame_size = max(1, int(round(sample_rate * frame_seconds)))
+    frame_count = int(math.ceil(samples.shape[0] / float(frame_size)))
+    peaks = np.zeros(frame_count, dtype=np.float32)
+    energy = np.zeros(frame_count, dtype=np.float64)
+    block_frames = max(1, int(block_seconds * sample_rate) // frame_size)
+    block_size = block_frames * frame_size
+
+    for start in range(0, samples.shape[0], block_size):
+        block = np.asarray(samples[start:start + block_size], dtype=np.float32)
+        first = start // frame_size
+        full = block.shape[0] // frame_size
+        if full:
+            framed = block[: full * frame_size].reshape(full, frame_size * block.shape[1])
+            peaks[first:first + full] = np.abs(framed).max(axis=1)
+            energy[first:first + full] = np.einsum("ij,ij->i", framed, framed, dtype=np.float64)
+        tail = block[full * frame_size:]
+        if tail.size:
+            peaks[first + full] = np.abs(tail).max()
+            energy[first + full] = float(np.dot(tail.ravel(), tail.ravel()))
+
+    channels = max(1, samples.shape[1])
+    return peaks / FULL_SCALE, energy / (FULL_SCALE * FULL_SCALE * channels), frame_size
+
+
+def find_runs(mask):
+    if not mask.size:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    padded = np.concatenate(([False], mask, [False])).astype(np.int8)
+    edges = np.diff(padded)
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def detect_silences(peaks, frame_duration, duration, noise_db, min_duration):
+    # Mirrors ffmpeg silencedetect: a stretch is silent while every sample (on
+    # every channel) stays below the noise amplitude.
+    threshold = 10.0 ** (noise_db / 20.0)
+    starts, ends = find_runs(peaks < threshold)
+    silences = []
+    for start, end in zip(starts, ends):
+        begin = start * frame_duration
+        finish = min(duration, end * frame_duration)
+        if finish - begin >= min_duration:
+            silences.append({"start": begin, "end": finish, "duration": finish - begin})
+    return silences
+
+
+def window_rms_db(energy, frame_size, window_frames, sample_count, floor_db):
+    window_count = int(math.ceil(energy.shape[0] / float(window_frames))) if energy.size else 0
+    if not window_count:
+        return np.zeros(0, dtype=np.float64)
+    padded = np.zeros(window_count * window_frames, dtype=np.float64)
+    padded[: energy.shape[0]] = energy
+    sums = padded.reshape(window_count, window_frames).sum(axis=1)
+    window_size = window_frames * frame_size
+    counts = np.full(window_count, float(window_size))
+    counts[-1] = max(1, sample_count - (window_count - 1) * window_size)
+    if window_count > 1 and counts[-1] < window_size / 2.0:
+        # A trailing window of a few samples would be compared like a full
+        # one and read as a volume jump at the very end; fold it into the
+        # previous window instead.
+        sums[-2] += sums[-1]
+        counts[-2] += counts[-1]
+        sums, counts = sums[:-1], counts[:-1]
+    with np.errstate(divide="ignore"):
+        levels = 10.0 * np.log10(sums / counts)
+    return np.maximum(levels, floor_db)
+
+
+def silence_cuts(silences, min_duration):
+    cuts = []
+    for silence in silences:
+        score = min(0.8, 0.5 + (silence["duration"] - min_duration) * 0.1)
+        cuts.append({
+            "time": round2(silence["end"]),
+            "score": round2(score),
+            "reasons": ["silence"],
+        })
+    return cuts
+
+
+def volume_cuts(levels, window_sec, threshold_db):
+    if levels.shape[0] < 2:
+        return []
+    diffs = np.abs(np.diff(levels))
+    cuts = []
+    for index in np.flatnonzero(diffs >= threshold_db):
+        diff = float(diffs[index])
+        score = min(0.9, 0.3 + (diff - threshold_db) / 20.0 * 0.6)
+        cuts.append({
+            "time": round2((index + 1) * window_sec),
+            "score": round2(score),
+            "reasons": ["volume_change"],
+        })
+    return cuts
+
+
+def merge_cuts(cuts, min_interval):
+    # Same rule as mergeCuts in audioCuts.js: cuts closer than min_interval to
+    # the last kept cut fold into it, keeping the higher score.
+    merged = []
+    for cut in sorted(cuts, key=lambda item: item["time"]):
+        last = merged[-1] if merged else None
+        if last is not None and abs(cut["time"] - last["time"]) < min_interval:
+            last["score"] = max(last["score"], cut["score"])
+            for reason in cut["reasons"]:
+                if reason not in last["reasons"]:
+                    last["reasons"].append(reason)
+        else:
+            merged.append({"time": cut["time"], "score": cut["score"], "reasons": list(cut["reasons"])})
+    return merged
+
+
+def detect_audio_cuts(audio_path, options=None):
+    options = resolve_options(options)
+    started = time.perf_counter()
+    samples, sample_rate = open_pcm16(audio_path)
+    sample_count = samples.shape[0]
+    duration = sample_count / float(sample_rate)
+
+    peaks, energy, frame_size = frame_levels(samples, sample_rate, options["frameSeconds"], options["blockSeconds"])
+    frame_duration = frame_size / float(sample_rate)
+    scan_ms = elapsed_ms(started)
+
+    silences = detect_silences(
+        peaks, frame_duration, duration, options["silenceNoiseDb"], options["silenceMinDuration"]
+    )
+    window_frames = max(1, int(round(options["volumeWindowSec"] / frame_duration)))
+    window_sec = window_frames * frame_duration
+    levels = window_rms_db(energy, frame_size, window_frames, sample_count, options["floorDb"])
+
+    by_silence = silence_cuts(silences, options["silenceMinDuration"])
+    by_volume = volume_cuts(levels, window_sec, options["volumeChangeThresholdDb"])
+    audio_cuts = merge_cuts(by_silence + by_volume, options["minCutInterval"])
+
+    result = {
+        "audioCuts": audio_cuts,
+        "silences": [
+            {key: round(value, 3) for key, value in silence.items()}
+            for silence in silences
+        ],
+        "stats": {
+            "durationSeconds": round(duration, 3),
+            "sampleRate": sample_rate,
+            "channels": int(samples.shape[1]),
+            "frames": int(peaks.shape[0]),
+            "windows": int(levels.shape[0]),
+            "windowSeconds": round(window_sec, 4),
+            "silenceCuts": len(by_silence),
+            "volumeCuts": len(by_volume),
+            "mergedCuts": len(audio_cuts),
+            "timings": {
+                "scanMs": scan_ms,
+                "analyzeMs": elapsed_ms(started),
+            },
+        },
+    }
+    if options["includeRms"]:
+        result["rms"] = [round(float(level), 2) for level in levels]
+    return result
+
+
+def error_payload(error):
+    return {
+        "error": str(error),
+        "traceback": traceback.format_exc(),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Audio cut metrics")
+    parser.add_argument(
+        "--audio",
+        help="16-bit PCM WAV to analyze; without it a JSON payload {audio, options} is read from stdin",
+    )
+    parser.add_argument(
+        "--include-rms",
+        action="store_true",
+        help="include the windowed RMS levels (dBFS) in the result",
+    )
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    try:
+        if args.audio:
+            payload = {"audio": args.audio, "options": {}}
+        else:
+            payload = json.load(sys.stdin)
+        options = dict(payload.get("options") or {})
+        if args.include_rms:
+            options["includeRms"] = True
+        result = detect_audio_cuts(payload["audio"], options)
+        result["stats"]["timings"]["importMs"] = round((IMPORTS_FINISHED - PROCESS_STARTED) * 1000.0, 2)
+        json.dump(result, sys.stdout, ensure_ascii=False)
+    except Exception as error:
+        json.dump(error_payload(error), sys.stdout, ensure_ascii=False)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
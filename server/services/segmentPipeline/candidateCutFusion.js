@@ -1,4 +1,5 @@
 const SOURCE_WEIGHTS = {
+  known: 0.9,
   keyword: 0.9,
   visual: 0.75,
   audio: 0.65,
@@ -57,6 +58,21 @@ function normalizeCut(cut, source) {
   };
 }
 
+// 已标注片段的起止点直接作为候选切点，跨视频复用的边界不必再从其他信号里找
+function knownSegmentCuts(knownSegments) {
+  if (!Array.isArray(knownSegments)) return [];
+  return knownSegments.flatMap(segment => [
+    { time: segment.start, reason: 'known_segment_start' },
+    { time: segment.end, reason: 'known_segment_end' }
+  ].map(({ time, reason }) => ({
+    time,
+    score: SOURCE_WEIGHTS.known,
+    reasons: [reason],
+    sources: ['known'],
+    raw: segment
+  })));
+}
+
 function transcriptSemanticCuts(transcript) {
   const rows = transcriptRows(transcript);
   if (rows.length < 3) return [];
@@ -174,6 +190,7 @@ function generateCandidateCuts(input = {}) {
     ...(Array.isArray(input.visualCuts) ? input.visualCuts.map(cut => normalizeCut(cut, 'visual')) : []),
     ...(Array.isArray(input.audioCuts) ? input.audioCuts.map(cut => normalizeCut(cut, 'audio')) : []),
     ...(Array.isArray(input.keywordCuts) ? input.keywordCuts.map(cut => normalizeCut(cut, 'keyword')) : []),
+    ...knownSegmentCuts(input.knownSegments),
     ...transcriptSemanticCuts(input.transcript || input.transcriptText || '')
   ].filter(Boolean);
 
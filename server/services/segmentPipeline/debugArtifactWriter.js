@@ -2,6 +2,7 @@ const fs = require('fs');
 const path = require('path');
 
 const DEBUG_DIR = path.join(__dirname, '../../debug/segment-pipeline');
+const PROFILE_DIR = path.join(DEBUG_DIR, 'profiles');
 
 function sanitizeId(id) {
   return String(id || 'unknown').replace(/[^a-zA-Z0-9_-]/g, '_').slice(0, 80);
@@ -16,6 +17,7 @@ function compactInputSummary(input = {}) {
     visualCuts: Array.isArray(input.visualCuts) ? input.visualCuts.length : 0,
     audioCuts: Array.isArray(input.audioCuts) ? input.audioCuts.length : 0,
     keywordCuts: Array.isArray(input.keywordCuts) ? input.keywordCuts.length : 0,
+    knownSegments: Array.isArray(input.knownSegments) ? input.knownSegments.length : 0,
     hasTranscript: Boolean(input.transcript),
     modelConfig: input.modelConfig ? {
       textModel: input.modelConfig.textModel,
@@ -41,7 +43,9 @@ function writeDebugArtifacts(input = {}, artifact = {}) {
       finalSegments: artifact.finalSegments || [],
       warnings: artifact.warnings || [],
       mode: artifact.mode || 'fallback',
-      confidence: artifact.confidence || 'low'
+      confidence: artifact.confidence || 'low',
+      timings: input.timings || null,
+      frameSelection: input.frameSelection || null
     };
     fs.writeFileSync(filePath, JSON.stringify(payload, null, 2), 'utf8');
     return { artifactPaths: [filePath], warnings };
@@ -69,5 +73,6 @@ function getLatestDebugArtifact(videoId) {
 module.exports = {
   writeDebugArtifacts,
   getLatestDebugArtifact,
-  DEBUG_DIR
+  DEBUG_DIR,
+  PROFILE_DIR
 };
@@ -92,6 +92,26 @@ function normalizeCuts(cuts) {
     .filter(Boolean);
 }
 
+// 其他视频已标注、画面相同的片段（phashIndex.findKnownSegments，已投影到本视频时间轴）
+function normalizeKnownSegments(segments) {
+  if (!Array.isArray(segments)) return [];
+  return segments
+    .map(segment => {
+      const start = parseTimeToSeconds(segment?.start_time ?? segment?.start);
+      const end = parseTimeToSeconds(segment?.end_time ?? segment?.end);
+      if (!Number.isFinite(start) || !Number.isFinite(end) || end <= start) return null;
+      return {
+        start,
+        end,
+        adType: segment.ad_type || null,
+        sourceBvid: segment.source?.bvid || null,
+        matchedFrames: Number(segment.source?.matchedFrames) || 0
+      };
+    })
+    .filter(Boolean)
+    .sort((a, b) => a.start - b.start);
+}
+
 function inferMode({ visualCuts, audioCuts, keywordCuts, transcript }) {
   const hasVisual = Array.isArray(visualCuts) && visualCuts.length > 0;
   const hasAudio = Array.isArray(audioCuts) && audioCuts.length > 0;
@@ -117,6 +137,7 @@ function buildEvidence(input = {}) {
   const visualCuts = normalizeCuts(input.visualCuts);
   const audioCuts = normalizeCuts(input.audioCuts);
   const keywordCuts = normalizeCuts(input.keywordCuts);
+  const knownSegments = normalizeKnownSegments(input.knownSegments);
   const transcript = normalizeTranscript(input.transcript);
   const transcriptText = transcriptToText(transcript);
   const frameTimes = normalizeFrameTimes(input.frames, input.frameTimes);
@@ -139,11 +160,13 @@ function buildEvidence(input = {}) {
     visualCuts,
     audioCuts,
     keywordCuts,
+    knownSegments,
     availableSources: {
       visual: visualCuts.length > 0,
       audio: audioCuts.length > 0,
       transcript: transcript.length > 0,
-      keyword: keywordCuts.length > 0
+      keyword: keywordCuts.length > 0,
+      known: knownSegments.length > 0
     },
     warnings,
     existingAnalysis: input.existingAnalysis || null,
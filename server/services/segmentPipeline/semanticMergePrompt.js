@@ -21,6 +21,11 @@ function buildSemanticMergePrompt(input = {}) {
       sources: cut.sources || [],
       nearbyEvidence: cut.nearbyEvidence || {}
     })),
+    knownSegments: (input.knownSegments || []).map(segment => ({
+      start: segment.start,
+      end: segment.end,
+      adType: segment.adType
+    })),
     frameTimes: (input.frameTimes || []).slice(0, 120),
     transcriptContext: safeSliceText(transcriptContext)
   };
@@ -35,6 +40,7 @@ function buildSemanticMergePrompt(input = {}) {
 5. 只输出严格 JSON，不要输出 markdown、解释或代码块。
 6. segment type 只能是 intro/content/ad/summary/transition/unknown。
 7. 每个 segment 必须包含 start/end/title/type/summary/confidence/evidence。
+8. knownSegments 是画面与其他已标注视频相同的广告片段（已换算到本视频时间轴，起止点已在 candidateCuts 中），通常应单独成段且 type 为 ad。
 
 输入：
 ${JSON.stringify(payload, null, 2)}
@@ -2,11 +2,16 @@ const lancedb = require('@lancedb/lancedb');
 const path = require('path');
 const fs = require('fs');
 const crypto = require('crypto');
+const frameVectorStore = require('./frameVectorStore');
 
 const dbPath = path.join(__dirname, '../database/lancedb_data');
 const TABLE_NAME = 'visionmark_frames';
+// 本地 CPU 帧描述子（visualCutDetector.computeFrameDescriptors），与 Embedding API 的向量维度不同，单独建表
+const LOCAL_TABLE_NAME = 'visionmark_frames_local';
 
 let dbPromise = null;
+/** 表名 -> 已打开的表，避免每次检索都 tableNames() + openTable() */
+const tableCache = new Map();
 
 /**
  * 确保返回数据库连接
@@ -20,24 +25,34 @@ async function getDb() {
 
 /**
  * 获取表对象，如果存在的话
+ * @param {string} [tableName=TABLE_NAME]
  */
-async function getTable() {
+async function getTable(tableName = TABLE_NAME) {
+  if (tableCache.has(tableName)) return tableCache.get(tableName);
   const db = await getDb();
   const tables = await db.tableNames();
-  if (tables.includes(TABLE_NAME)) {
-    return await db.openTable(TABLE_NAME);
+  if (tables.includes(tableName)) {
+    const table = await db.openTable(tableName);
+    tableCache.set(tableName, table);
+    return table;
   }
   return null;
 }
 
+function bvidFilter(bvid) {
+  return `bvid = '${String(bvid).replace(/'/g, "''")}'`;
+}
+
 /**
  * 将帧特征存入 LanceDB (本地文件存储)
- * @param {string} bvid 
- * @param {Array<{ timestamp: number, vector: number[] }>} points 
+ * @param {string} bvid
+ * @param {Array<{ timestamp: number, vector: number[] }>} points
+ * @param {object} [options={}] - { table: 表名，默认 Embedding API 向量表 }
  */
-async function upsertFramePoints(bvid, points) {
+async function upsertFramePoints(bvid, points, options = {}) {
   if (!points || points.length === 0) return;
-  
+
+  const tableName = options.table || TABLE_NAME;
   const db = await getDb();
   const data = points.map((p) => ({
     id: crypto.randomUUID(),
@@ -46,11 +61,11 @@ async function upsertFramePoints(bvid, points) {
     timestamp: p.timestamp
   }));
 
-  let table = await getTable();
+  let table = await getTable(tableName);
   if (table) {
     try {
       // 删除该视频在向量库中的旧数据（避免重复插入）
-      await table.delete(`bvid = '${bvid}'`);
+      await table.delete(bvidFilter(bvid));
     } catch (err) {
       console.warn(`[VectorDB] 清除旧记录失败或无旧记录可清: ${err.message}`);
     }
@@ -58,30 +73,70 @@ async function upsertFramePoints(bvid, points) {
     await table.add(data);
   } else {
     // 创建新表并存入初始数据
-    table = await db.createTable(TABLE_NAME, data);
+    table = await db.createTable(tableName, data);
+    tableCache.set(tableName, table);
   }
-  
-  console.log(`[VectorDB] 成功插入 ${points.length} 个视频帧向量到 ${bvid} (LanceDB)`);
+
+  // 本地描述子同时写一份 memmap 矩阵，供精确检索快速路径使用
+  if (tableName === LOCAL_TABLE_NAME && frameVectorStore.isFrameVectorStoreEnabled()) {
+    try {
+      await frameVectorStore.writeFrameVectors(bvid, points);
+    } catch (err) {
+      console.warn(`[VectorDB] 写入帧向量矩阵失败，检索将回退到 LanceDB: ${err.message}`);
+    }
+  }
+
+  console.log(`[VectorDB] 成功插入 ${points.length} 个视频帧向量到 ${bvid} (LanceDB ${tableName})`);
 }
 
 /**
- * 根据文本向量搜索最匹配的帧
+ * 根据向量搜索最匹配的帧
  * @param {string} bvid (可选，若不传则全库搜)
- * @param {number[]} queryVector 
- * @param {number} topK 
+ * @param {number[]} queryVector
+ * @param {number} topK
+ * @param {object} [options={}] - { table: 表名，默认 Embedding API 向量表 }
  */
-async function searchSimilarFrames(bvid, queryVector, topK = 5) {
-  const table = await getTable();
+async function searchSimilarFrames(bvid, queryVector, topK = 5, options = {}) {
+  const [results] = await searchSimilarFramesBatch(bvid, [queryVector], topK, options);
+  return results || [];
+}
+
+function useFrameVectorStore(options) {
+  return (options.table || TABLE_NAME) === LOCAL_TABLE_NAME && frameVectorStore.isFrameVectorStoreEnabled();
+}
+
+/**
+ * 多个查询向量一次检索；本地描述子表走 memmap 精确检索，失败或其他表逐条走 LanceDB
+ * @param {string|null} bvid - 为空时全库搜索
+ * @param {number[][]} queryVectors
+ * @param {number} topK
+ * @param {object} [options={}] - { table: 表名，默认 Embedding API 向量表 }
+ * @returns {Promise<Array<Array<{score, bvid, timestamp}>>>} 与 queryVectors 一一对应
+ */
+async function searchSimilarFramesBatch(bvid, queryVectors, topK = 5, options = {}) {
+  if (useFrameVectorStore(options)) {
+    try {
+      const { results } = await frameVectorStore.searchFrameVectors({ bvid, queries: queryVectors, topK });
+      return results.map(item => item.matches || []);
+    } catch (err) {
+      console.warn(`[VectorDB] 帧向量矩阵检索失败，回退到 LanceDB: ${err.message}`);
+    }
+  }
+  return Promise.all(queryVectors.map(vector => searchLanceDb(bvid, vector, topK, options)));
+}
+
+async function searchLanceDb(bvid, queryVector, topK, options) {
+  const table = await getTable(options.table || TABLE_NAME);
   if (!table) return [];
 
-  // LanceDB 默认按 L2，可以通过 .metricType('cosine') 指定使用余弦相似度进行搜索
-  let query = table.search(queryVector).metricType('cosine').limit(topK);
-  
+  // LanceDB 默认按 L2，这里指定余弦距离
+  let query = table.search(queryVector).distanceType('cosine').limit(topK);
+
   if (bvid) {
-    query = query.filter(`bvid = '${bvid}'`);
+    query = query.where(bvidFilter(bvid));
   }
 
-  const results = await query.execute();
+  const results = await query.toArray();
 
   return results.map(r => {
     // 转换为前端可读的相似度百分比
@@ -98,17 +153,92 @@ async function searchSimilarFrames(bvid, queryVector, topK = 5) {
   });
 }
 
+/**
+ * 取指定视频中离 timestamp 最近的一帧（含向量），用于以帧搜帧
+ * @param {string} bvid
+ * @param {number} timestamp - 秒
+ * @param {object} [options={}] - { table: 表名，默认本地描述子表 }
+ * @returns {Promise<{bvid: string, timestamp: number, vector: number[]}|null>}
+ */
+async function getFramePoint(bvid, timestamp, options = {}) {
+  const table = await getTable(options.table || LOCAL_TABLE_NAME);
+  if (!table) return null;
+
+  const rows = await table.query().where(bvidFilter(bvid)).select(['bvid', 'timestamp', 'vector']).toArray();
+  let nearest = null;
+  for (const row of rows) {
+    if (!nearest || Math.abs(row.timestamp - timestamp) < Math.abs(nearest.timestamp - timestamp)) {
+      nearest = row;
+    }
+  }
+  return nearest
+    ? { bvid: nearest.bvid, timestamp: nearest.timestamp, vector: Array.from(nearest.vector) }
+    : null;
+}
+
+/**
+ * 以已入库的帧搜相似帧（本地描述子表），结果中去掉查询帧本身
+ * @param {string} bvid - 查询帧所在视频
+ * @param {number[]} timestamps - 查询帧时间（秒），各取最近的一帧
+ * @param {number} topK
+ * @param {object} [options={}] - { scope: 'video' 只在本视频内搜索，默认全库 }
+ * @returns {Promise<{engine: string, results: Array<{query: object|null, results: Array}>}>}
+ */
+async function searchSimilarToFrames(bvid, timestamps, topK = 5, options = {}) {
+  const scopeBvid = options.scope === 'video' ? bvid : null;
+  const withoutSelf = (query, matches) => (matches || [])
+    .filter(item => !(query && item.bvid === query.bvid && Math.abs(item.timestamp - query.timestamp) < 0.001))
+    .slice(0, topK);
+
+  if (frameVectorStore.isFrameVectorStoreEnabled()) {
+    try {
+      const { results, stats } = await frameVectorStore.searchFrameVectors({
+        bvid: scopeBvid,
+        queryFrames: timestamps.map(timestamp => ({ bvid, timestamp })),
+        // 多取一个，去掉查询帧本身
+        topK: topK + 1
+      });
+      // 矩阵里没有该视频（例如在启用矩阵之前入库）时回退到 LanceDB
+      if (results.some(item => item.query)) {
+        return {
+          engine: 'npy',
+          searchMs: stats?.searchMs ?? null,
+          results: results.map(item => ({ query: item.query, results: withoutSelf(item.query, item.matches) }))
+        };
+      }
+    } catch (err) {
+      console.warn(`[VectorDB] 帧向量矩阵检索失败，回退到 LanceDB: ${err.message}`);
+    }
+  }
+
+  const startedAt = Date.now();
+  const results = [];
+  for (const timestamp of timestamps) {
+    const frame = await getFramePoint(bvid, timestamp);
+    if (!frame) {
+      results.push({ query: null, results: [] });
+      continue;
+    }
+    const query = { bvid: frame.bvid, timestamp: frame.timestamp };
+    const matches = await searchLanceDb(scopeBvid, frame.vector, topK + 1, { table: LOCAL_TABLE_NAME });
+    results.push({ query, results: withoutSelf(query, matches) });
+  }
+  return { engine: 'lancedb', searchMs: Date.now() - startedAt, results };
+}
+
 /**
  * 获取指定视频的所有帧时间戳 (用于调试展示)
+ * @param {string} bvid
+ * @param {object} [options={}] - { table: 表名，默认 Embedding API 向量表 }
  */
-async function getAllFrames(bvid) {
-  const table = await getTable();
+async function getAllFrames(bvid, options = {}) {
+  const table = await getTable(options.table || TABLE_NAME);
   if (!table) return [];
 
   // 获取表中的所有该 bvid 的记录
   // 不取 vector 字段以减少返回数据量
-  const query = table.query().filter(`bvid = '${bvid}'`).select(['bvid', 'timestamp']);
-  const results = await query.execute();
+  const query = table.query().where(bvidFilter(bvid)).select(['bvid', 'timestamp']);
+  const results = await query.toArray();
   return results.map(r => ({
     bvid: r.bvid,
     timestamp: r.timestamp
@@ -116,9 +246,14 @@ async function getAllFrames(bvid) {
 }
 
 module.exports = {
+  TABLE_NAME,
+  LOCAL_TABLE_NAME,
   getDb,
   upsertFramePoints,
   searchSimilarFrames,
+  searchSimilarFramesBatch,
+  searchSimilarToFrames,
+  getFramePoint,
   getAllFrames,
   isReady: () => true // LanceDB 本地运行不依赖环境变量，始终Ready
 };
@@ -10,10 +10,21 @@ const { ossClient, hasOssConfig } = require('../utils/oss');
 const EmbeddingService = require('./embeddingService');
 const vectorDb = require('./vectorDb');
 const BilibiliDownloader = require('./bilibiliDownloader');
-const { analyzeVisualCuts, analyzeSceneCutsWithFfmpeg } = require('./visualCutDetector');
+const {
+  analyzeVisualCuts,
+  analyzeVisualCutsFromVideo,
+  analyzeMediaPass,
+  analyzeSceneCutsWithFfmpeg,
+  computeFrameDescriptors,
+  dedupeKeyframes,
+  exportKeyframes,
+  framesFromTimestampedDirectory
+} = require('./visualCutDetector');
 const keywordCutService = require('./segment/keywordCuts');
 const { detectAudioCuts } = require('./segment/audioCuts');
 const { runSegmentPipeline } = require('./segmentPipeline');
+const transcriptCache = require('./asr/transcriptCache');
+const { findKnownSegments, isPhashIndexEnabled, resolveIndexProbe } = require('./phashIndex');
 
 const execPromise = util.promisify(exec);
 
@@ -47,6 +58,28 @@ function parsePtsTimes(text) {
     .filter((time, index, list) => index === 0 || Math.abs(time - list[index - 1]) > 0.001);
 }
 
+/**
+ * 视觉检测帧的采样计划：按 sampleFps 均匀采样，总帧数不超过 maxFrames
+ */
+function resolveVisualProbePlan(duration, options = {}) {
+  const sampleFps = Number.isFinite(Number(options.sampleFps)) && Number(options.sampleFps) > 0
+    ? Number(options.sampleFps)
+    : 1;
+  const maxFrames = Number.isFinite(Number(options.maxFrames)) && Number(options.maxFrames) > 1
+    ? Math.floor(Number(options.maxFrames))
+    : 900;
+  const scaleWidth = Number.isFinite(Number(options.scaleWidth)) && Number(options.scaleWidth) > 0
+    ? Math.floor(Number(options.scaleWidth))
+    : 320;
+  const safeDuration = Number.isFinite(Number(duration)) && Number(duration) > 0
+    ? Number(duration)
+    : 300;
+  const targetFrames = Math.max(2, Math.min(maxFrames, Math.ceil(safeDuration * sampleFps)));
+  const effectiveFps = targetFrames / safeDuration;
+
+  return { sampleFps, maxFrames, scaleWidth, safeDuration, targetFrames, effectiveFps };
+}
+
 function buildFallbackAnalysisResult(reason, transcript = null, visualCuts = [], visualCutStats = null) {
   const transcriptPreview = typeof transcript === 'string'
     ? transcript
@@ -99,20 +132,10 @@ class VideoAnalyzer {
     };
     
     // 通过 WebSocket 推送给所有连接的客户端
-    if (this.wss) {
-      this.wss.clients.forEach((client) => {
-        if (client.readyState === WebSocket.OPEN) {
-          try {
-            client.send(JSON.stringify({
-              type: 'progress',
-              data: progressData
-            }));
-          } catch (error) {
-            console.warn('[VideoAnalyzer] WebSocket 推送失败:', error.message);
-          }
-        }
-      });
-    }
+    this.broadcast({
+      type: 'progress',
+      data: progressData
+    });
     
     // 保持原有的回调方式兼容
     if (typeof onProgress === 'function') {
@@ -124,6 +147,50 @@ class VideoAnalyzer {
     }
   }
 
+  broadcast(message) {
+    if (!this.wss) return;
+    this.wss.clients.forEach((client) => {
+      if (client.readyState === WebSocket.OPEN) {
+        try {
+          client.send(JSON.stringify(message));
+        } catch (error) {
+          console.warn('[VideoAnalyzer] WebSocket 推送失败:', error.message);
+        }
+      }
+    });
+  }
+
+  sendToUser(userId, message) {
+    if (!this.wss || userId === null || userId === undefined) return;
+    this.wss.clients.forEach((client) => {
+      if (client.userId === userId && client.readyState === WebSocket.OPEN) {
+        try {
+          client.send(JSON.stringify(message));
+        } catch (error) {
+          console.warn('[VideoAnalyzer] WebSocket 推送失败:', error.message);
+        }
+      }
+    });
+  }
+
+  /**
+   * 在线视觉检测每确认一个切点就推送一次，分析结束前插件即可先展示部分切点
+   * 只推给发起分析的用户，其他用户的插件不会收到别的视频的切点
+   */
+  reportVisualCut(userId, bvid, cut, index) {
+    this.sendToUser(userId, {
+      type: 'visual_cut',
+      data: {
+        bvid,
+        index,
+        time: cut.time,
+        score: cut.score,
+        method: cut.method,
+        reasons: cut.reasons
+      }
+    });
+  }
+
   ensureDownloadDir() {
     if (!fs.existsSync(this.downloadDir)) {
       fs.mkdirSync(this.downloadDir, { recursive: true });
@@ -386,8 +453,9 @@ class VideoAnalyzer {
    * 使用ffmpeg提取视频关键帧
    * @param {string} videoPath - 视频路径
    * @param {string} bvid - 视频BV号
+   * @param {object} [known={}] - 统一媒体分析已得到的 { duration, keyframeTimestamps }，传入则不再单独解码
    */
-  async extractFrames(videoPath, bvid, onProgress = null) {
+  async extractFrames(videoPath, bvid, onProgress = null, known = {}) {
     const framesDir = path.join(this.downloadDir, `${bvid}_frames`);
 
     if (!fs.existsSync(framesDir)) {
@@ -399,14 +467,18 @@ class VideoAnalyzer {
 
     try {
       // 获取视频实际时长
-      const duration = await this.getVideoDuration(videoPath);
+      const duration = Number(known.duration) > 0 ? Number(known.duration) : await this.getVideoDuration(videoPath);
       this.reportProgress(onProgress, 'frames', 24, '正在定位关键帧');
 
       // 尝试使用ffprobe获取关键帧时间戳（更接近场景切换）
-      let timestamps = await this.extractKeyframeTimestamps(videoPath);
+      let timestamps = Array.isArray(known.keyframeTimestamps) && known.keyframeTimestamps.length >= 2
+        ? [...known.keyframeTimestamps]
+        : await this.extractKeyframeTimestamps(videoPath);
 
       // 如果ffprobe失败或者数据过少，退回到均匀采样
+      let fromKeyframes = true;
       if (!timestamps || timestamps.length < 2) {
+        fromKeyframes = false;
         const interval = 5;
         const frameCount = Math.ceil(duration / interval);
         timestamps = Array.from({ length: frameCount }, (_, i) => i * interval);
@@ -423,15 +495,34 @@ class VideoAnalyzer {
       console.log(`[VideoAnalyzer] 将提取 ${timestamps.length} 张关键帧（基于场景/关键帧，间隔可变）`);
       this.reportProgress(onProgress, 'frames', 25, `正在抽帧 0/${timestamps.length}`);
 
-      // 提取关键帧截图，文件名包含时间戳（毫秒），便于后续排序和提示
-      for (let i = 0; i < timestamps.length; i++) {
-        const ts = timestamps[i];
+      // 提取关键帧截图，文件名包含时间戳（毫秒），便于后续排序和提示。
+      // 默认一次顺序解码批量导出（时间点都是关键帧时只解码关键帧），KEYFRAME_EXPORT=seek 时逐帧 seek
+      let pending = timestamps.map((time, i) => ({ index: i + 1, time }));
+      if (process.env.KEYFRAME_EXPORT !== 'seek') {
+        try {
+          const exported = await exportKeyframes(videoPath, timestamps, {
+            outputDir: framesDir,
+            keyframesOnly: fromKeyframes
+          });
+          pending = exported.missing;
+          console.log(
+            `[VideoAnalyzer] 批量导出关键帧 ${exported.frames.length}/${timestamps.length} 张` +
+            `（解码 ${exported.stats?.decodedFrames ?? '-'} 帧, ${exported.stats?.timings?.exportMs ?? '-'}ms）`
+          );
+          this.reportProgress(onProgress, 'frames', 25 + (exported.frames.length / timestamps.length) * 15, `正在抽帧 ${exported.frames.length}/${timestamps.length}`);
+        } catch (error) {
+          console.warn('[VideoAnalyzer] 批量导出关键帧失败，改为逐帧 seek:', error.message);
+        }
+      }
+
+      // 批量导出没有覆盖的时间点（失败或超出视频末尾）逐个 seek 补齐
+      for (const { index, time: ts } of pending) {
         const ms = Math.round(ts * 1000);
-        const outputPath = path.join(framesDir, `frame_${String(i + 1).padStart(3, '0')}_${ms}.jpg`);
+        const outputPath = path.join(framesDir, `frame_${String(index).padStart(3, '0')}_${ms}.jpg`);
         const command = `"${ffmpegPath}" -ss ${ts} -i "${videoPath}" -frames:v 1 -q:v 2 -vf "scale=640:-1" "${outputPath}" -y`;
         await execPromise(command, { shell: true });
-        const framePercent = 25 + ((i + 1) / Math.max(timestamps.length, 1)) * 15;
-        this.reportProgress(onProgress, 'frames', framePercent, `正在抽帧 ${i + 1}/${timestamps.length}`);
+        const framePercent = 25 + (index / Math.max(timestamps.length, 1)) * 15;
+        this.reportProgress(onProgress, 'frames', framePercent, `正在抽帧 ${index}/${timestamps.length}`);
       }
 
       console.log(`[VideoAnalyzer] 关键帧提取完成，保存在: ${framesDir}`);
@@ -450,20 +541,14 @@ class VideoAnalyzer {
   async extractVisualProbeFrames(videoPath, bvid, duration, onProgress = null, options = {}) {
     const framesDir = path.join(this.downloadDir, `${bvid}_visual_frames`);
     const manifestPath = path.join(framesDir, 'manifest.json');
-    const sampleFps = Number.isFinite(Number(options.sampleFps)) && Number(options.sampleFps) > 0
-      ? Number(options.sampleFps)
-      : 1;
-    const maxFrames = Number.isFinite(Number(options.maxFrames)) && Number(options.maxFrames) > 1
-      ? Math.floor(Number(options.maxFrames))
-      : 900;
-    const scaleWidth = Number.isFinite(Number(options.scaleWidth)) && Number(options.scaleWidth) > 0
-      ? Math.floor(Number(options.scaleWidth))
-      : 320;
-    const safeDuration = Number.isFinite(Number(duration)) && Number(duration) > 0
-      ? Number(duration)
-      : 300;
-    const targetFrames = Math.max(2, Math.min(maxFrames, Math.ceil(safeDuration * sampleFps)));
-    const effectiveFps = targetFrames / safeDuration;
+    const {
+      sampleFps,
+      maxFrames,
+      scaleWidth,
+      safeDuration,
+      targetFrames,
+      effectiveFps
+    } = resolveVisualProbePlan(duration, options);
 
     if (fs.existsSync(manifestPath)) {
       try {
@@ -502,6 +587,8 @@ class VideoAnalyzer {
         fs.unlinkSync(path.join(framesDir, file));
       }
     }
+    // 重新抽帧后旧的特征缓存必然失效，直接清理
+    fs.rmSync(path.join(framesDir, '.feature_cache'), { recursive: true, force: true });
 
     console.log(`[VideoAnalyzer] 抽取视觉检测帧: target=${targetFrames}, fps=${effectiveFps.toFixed(4)}`);
     this.reportProgress(onProgress, 'visual', 41, '正在抽取视觉检测帧');
@@ -541,6 +628,110 @@ class VideoAnalyzer {
     return frames;
   }
 
+  /**
+   * 视觉候选切点检测。visualProbe.mode === 'stream' 时由 Python 直接读取
+   * ffmpeg 原始帧管道，否则先抽取 JPEG 检测帧再分析。
+   */
+  async detectVisualCuts(videoPath, bvid, duration, onProgress = null, options = {}) {
+    const probeOptions = options?.visualProbe || {};
+
+    if (probeOptions.mode === 'adaptive') {
+      // 粗采样率与时长无关地固定得很低，细采样只发生在有画面变化的窗口里
+      const { targetFrames, effectiveFps } = resolveVisualProbePlan(duration, {
+        ...probeOptions,
+        sampleFps: probeOptions.coarseFps || 0.25
+      });
+      console.log(`[VideoAnalyzer] 粗到细视觉检测: coarse=${targetFrames}, fps=${effectiveFps.toFixed(4)}`);
+      this.reportProgress(onProgress, 'visual', 41, '正在分两遍分析视觉切点');
+      const result = await analyzeVisualCutsFromVideo(videoPath, {
+        ...(options?.visualCuts || {}),
+        sampleFps: effectiveFps,
+        maxFrames: targetFrames,
+        pixFmt: probeOptions.pixFmt,
+        adaptive: {
+          refineFps: probeOptions.refineFps,
+          refineScore: probeOptions.refineScore,
+          refineStdFactor: probeOptions.refineStdFactor,
+          maxWindows: probeOptions.maxRefineWindows
+        }
+      });
+      const adaptiveStats = result.stats?.adaptive;
+      if (adaptiveStats) {
+        const [coarsePass, refinePass] = adaptiveStats.passes;
+        console.log(
+          `[VideoAnalyzer] 粗到细视觉检测完成: 粗采样 ${coarsePass.framesDecoded} 帧, ` +
+          `细采样 ${refinePass.framesDecoded} 帧/${refinePass.windows} 窗口, ` +
+          `切点精度 ${adaptiveStats.precision.coarseSeconds}s -> ${adaptiveStats.precision.refinedSeconds}s`
+        );
+      }
+      return result;
+    }
+
+    if (probeOptions.mode === 'stream') {
+      const { targetFrames, effectiveFps } = resolveVisualProbePlan(duration, probeOptions);
+      console.log(`[VideoAnalyzer] 流式视觉检测: target=${targetFrames}, fps=${effectiveFps.toFixed(4)}`);
+      this.reportProgress(onProgress, 'visual', 41, '正在流式分析视觉切点');
+      return analyzeVisualCutsFromVideo(videoPath, {
+        ...(options?.visualCuts || {}),
+        sampleFps: effectiveFps,
+        maxFrames: targetFrames,
+        pixFmt: probeOptions.pixFmt,
+        expectedDuration: duration,
+        online: probeOptions.online,
+        onCut: probeOptions.online ? (cut, index) => this.reportVisualCut(options?.userId, bvid, cut, index) : undefined
+      });
+    }
+
+    const visualFrames = await this.extractVisualProbeFrames(
+      videoPath,
+      bvid,
+      duration,
+      onProgress,
+      probeOptions
+    );
+    return analyzeVisualCuts(visualFrames, options?.visualCuts);
+  }
+
+  /**
+   * 是否走单次解码的统一媒体分析。显式指定 visualProbe.mode（stream / adaptive / jpeg）、
+   * options.mediaPass === false 或 MEDIA_PASS=separate 时保持原来的分步流程。
+   */
+  shouldUseMediaPass(options = {}) {
+    if (options?.mediaPass === false || process.env.MEDIA_PASS === 'separate') return false;
+    const mode = options?.visualProbe?.mode;
+    return !mode || mode === 'unified';
+  }
+
+  /**
+   * 统一媒体分析：一次解码得到时长、关键帧时间戳、视觉切点、scene 分数，
+   * 需要音频时同时写出 {bvid}.wav 并计算音频切点。结果缓存在 {bvid}_media/manifest.json
+   */
+  async runMediaPass(videoPath, bvid, onProgress = null, options = {}, withAudio = false) {
+    const probeOptions = options?.visualProbe || {};
+    const audioPath = withAudio ? path.join(this.downloadDir, `${bvid}.wav`) : null;
+
+    console.log(`[VideoAnalyzer] 统一媒体分析（单次解码）: ${videoPath}`);
+    this.reportProgress(onProgress, 'frames', 22, '正在分析视频画面与音频');
+
+    const manifest = await analyzeMediaPass(videoPath, {
+      ...(options?.visualCuts || {}),
+      outputDir: path.join(this.downloadDir, `${bvid}_media`),
+      audioPath,
+      sampleFps: probeOptions.sampleFps,
+      maxFrames: probeOptions.maxFrames,
+      pixFmt: probeOptions.pixFmt
+    });
+
+    const timings = manifest.stats?.timings || {};
+    console.log(
+      `[VideoAnalyzer] 统一媒体分析${manifest.cached ? '（manifest 缓存）' : ''}完成: ` +
+      `时长 ${Number(manifest.duration || 0).toFixed(2)}s, 关键帧 ${manifest.keyframes.length} 个, ` +
+      `视觉切点 ${manifest.visualCuts.length} 个, scene 切点 ${manifest.scene?.visualCuts?.length || 0} 个, ` +
+      `音频切点 ${manifest.audio ? manifest.audio.audioCuts.length : '-'} 个, 耗时 ${timings.mediaMs}ms`
+    );
+    return manifest;
+  }
+
   /**
    * 从视频中提取音频
    * @param {string} videoPath - 视频路径
@@ -590,6 +781,32 @@ class VideoAnalyzer {
     const modelConfig = this.getEffectiveModelConfig(userConfig);
     const asrApiKey = modelConfig.apiKey;
 
+    // 同一音频（按 PCM 内容哈希）已转写过时直接复用，跳过 OSS 上传和 paraformer。
+    // 这里的转录是 "[m:ss] 文本" 字符串，和 asr 模块的段数组分开缓存
+    let cacheKey = null;
+    const cacheKeyParts = { provider: 'dashscope-text', model: modelConfig.asrModel, language: 'zh,en' };
+    if (transcriptCache.isTranscriptCacheEnabled()) {
+      try {
+        const audioHash = await transcriptCache.hashAudioContent(audioPath);
+        cacheKey = transcriptCache.buildCacheKey({ audioHash, ...cacheKeyParts });
+        const cached = transcriptCache.getCachedTranscript(cacheKey);
+        if (cached && typeof cached.transcript === 'string' && cached.transcript) {
+          console.log('[VideoAnalyzer] 命中转录缓存，跳过语音识别');
+          this.reportProgress(onProgress, 'speech', 58, '语音识别完成（缓存）');
+          return cached.transcript;
+        }
+        cacheKeyParts.audioHash = audioHash;
+      } catch (error) {
+        console.warn('[VideoAnalyzer] 转录缓存不可用:', error.message);
+        cacheKey = null;
+      }
+    }
+    const saveTranscript = (transcript) => {
+      if (cacheKey && transcript) {
+        transcriptCache.setCachedTranscript(cacheKey, { ...cacheKeyParts, transcript });
+      }
+    };
+
     try {
       if (!ossClient) {
         console.warn('[VideoAnalyzer] OSS client unavailable, skip transcription.');
@@ -763,6 +980,7 @@ class VideoAnalyzer {
                   console.log('[VideoAnalyzer] 语音识别完成（从transcription_url下载）');
                   console.log('[VideoAnalyzer] 转录内容预览:', transcriptText.substring(0, 500).replace(/\n/g, ' '));
                   this.reportProgress(onProgress, 'speech', 58, '语音识别完成');
+                  saveTranscript(transcriptText);
                   return transcriptText;
                 } catch (error) {
                   console.error('[VideoAnalyzer] 下载转录结果失败:', error.message);
@@ -783,6 +1001,7 @@ class VideoAnalyzer {
                 console.log('[VideoAnalyzer] 语音识别完成');
                 console.log('[VideoAnalyzer] 转录内容预览:', transcript.substring(0, 500).replace(/\n/g, ' '));
                 this.reportProgress(onProgress, 'speech', 58, '语音识别完成');
+                saveTranscript(transcript);
                 return transcript;
               }
             }
@@ -952,7 +1171,7 @@ ${transcript}
     const client = this.createOpenAIClient(modelConfig);
 
     // 获取所有帧图片，并从文件名中解析时间戳（毫秒）
-    const frames = fs.readdirSync(framesDir)
+    const allFrames = fs.readdirSync(framesDir)
       .filter(f => f.endsWith('.jpg'))
       .map(f => {
         const match = f.match(/frame_\d+_(\d+)\.jpg$/);
@@ -963,11 +1182,15 @@ ${transcript}
       })
       .sort((a, b) => a.timestampMs - b.timestampMs);
 
-    if (frames.length === 0) {
+    if (allFrames.length === 0) {
       throw new Error('没有找到关键帧图片');
     }
 
-    console.log(`[VideoAnalyzer] 共有 ${frames.length} 张关键帧`);
+    // 静态画面会产生多张几乎相同的关键帧，发送前按 pHash/SSIM 去重以减少图片数和 token
+    const frameSelection = await this.selectModelFrames(framesDir, allFrames, progressOptions.frameDedup);
+    const frames = frameSelection.frames;
+
+    console.log(`[VideoAnalyzer] 共有 ${allFrames.length} 张关键帧，发送 ${frames.length} 张`);
     this.reportProgress(onProgress, 'model', modelStartPercent + 2, `正在准备 ${frames.length} 张关键帧`);
 
     // 生成时间戳（秒）列表，供提示词使用
@@ -1052,10 +1275,12 @@ ${visualCutsText}
     ];
 
     // 添加图片（使用base64编码）
+    const frameSelectionInfo = frameSelection.info;
     for (const frame of frames) {
       const framePath = path.join(framesDir, frame.file);
       const imageBuffer = fs.readFileSync(framePath);
       const base64Image = imageBuffer.toString('base64');
+      frameSelectionInfo.payloadBytes += base64Image.length;
 
       content.push({
         type: 'image_url',
@@ -1067,6 +1292,7 @@ ${visualCutsText}
 
     try {
       this.reportProgress(onProgress, 'model', modelStartPercent + 4, '大模型分析中');
+      const requestStartedAt = Date.now();
       // 使用OpenAI兼容模式调用通义千问
       const completion = await client.chat.completions.create({
         model: modelConfig.visionModel,
@@ -1079,6 +1305,11 @@ ${visualCutsText}
         max_tokens: 3000,
         timeout: 300000 // 5分钟超时
       });
+      frameSelectionInfo.modelRoundTripMs = Date.now() - requestStartedAt;
+      console.log(
+        `[VideoAnalyzer] 大模型往返 ${frameSelectionInfo.modelRoundTripMs}ms, ` +
+        `图片 ${frameSelectionInfo.framesSent} 张 / ${(frameSelectionInfo.payloadBytes / 1024 / 1024).toFixed(2)}MB`
+      );
 
       if (completion && completion.choices && completion.choices[0]) {
         const aiResponse = completion.choices[0].message.content;
@@ -1106,6 +1337,7 @@ ${visualCutsText}
               hot_words: parsed.hot_words || [],
               visual_cuts: visualCuts,
               visual_cut_stats: progressOptions.visualCutStats || null,
+              frame_selection: frameSelectionInfo,
               raw_response: aiResponse // 包含原始响应以便前端调试
             };
 
@@ -1158,6 +1390,7 @@ ${visualCutsText}
             hot_words: [],
             visual_cuts: visualCuts,
             visual_cut_stats: progressOptions.visualCutStats || null,
+            frame_selection: frameSelectionInfo,
             raw_response: aiResponse,
             parse_error: '无法提取JSON格式的分析结果'
           };
@@ -1172,6 +1405,7 @@ ${visualCutsText}
             hot_words: [],
             visual_cuts: visualCuts,
             visual_cut_stats: progressOptions.visualCutStats || null,
+            frame_selection: frameSelectionInfo,
             raw_response: aiResponse,
             parse_error: parseError.message
           };
@@ -1182,88 +1416,100 @@ ${visualCutsText}
     } catch (error) {
       console.error('[VideoAnalyzer] API调用失败:', error.response?.data || error.message);
       this.reportProgress(onProgress, 'model', 96, '大模型分析失败，使用降级结果继续');
-      return buildFallbackAnalysisResult(
-        `AI分析失败: ${error.message}`,
-        transcript,
-        visualCuts,
-        progressOptions.visualCutStats || null
+      return {
+        ...buildFallbackAnalysisResult(
+          `AI分析失败: ${error.message}`,
+          transcript,
+          visualCuts,
+          progressOptions.visualCutStats || null
+        ),
+        frame_selection: frameSelectionInfo
+      };
+    }
+  }
+
+  /**
+   * 选出发送给视觉大模型的关键帧：近似重复帧去重（visualCutDetector.dedupeKeyframes），
+   * 可设帧数上限。KEYFRAME_DEDUP=0 或 options === false 时全部发送；去重失败时也全部发送。
+   * @param {string} framesDir
+   * @param {Array<{file: string, timestampMs: number}>} frames - 已按时间排序
+   * @param {object|false} [options] - { windowSeconds, phashThreshold, ssimThreshold, budget }
+   * @returns {Promise<{frames: Array, info: object}>} info 写入分析结果和分段调试产物
+   */
+  async selectModelFrames(framesDir, frames, options = {}) {
+    const info = {
+      framesAvailable: frames.length,
+      framesSent: frames.length,
+      removed: [],
+      dedup: null,
+      payloadBytes: 0,
+      modelRoundTripMs: null
+    };
+    if (options === false || process.env.KEYFRAME_DEDUP === '0' || frames.length < 2) {
+      return { frames, info };
+    }
+
+    const envBudget = Number(process.env.KEYFRAME_DEDUP_BUDGET);
+    try {
+      const result = await dedupeKeyframes(
+        frames.map(frame => ({ framePath: path.join(framesDir, frame.file), time: frame.timestampMs / 1000 })),
+        {
+          budget: Number.isFinite(envBudget) && envBudget > 0 ? envBudget : undefined,
+          ...(options || {})
+        }
+      );
+      const keptFiles = new Set(result.kept.map(frame => path.basename(frame.framePath)));
+      const kept = frames.filter(frame => keptFiles.has(frame.file));
+      if (!kept.length) return { frames, info };
+
+      info.framesSent = kept.length;
+      info.removed = result.removed.map(({ framePath, ...rest }) => rest);
+      info.dedup = result.stats;
+      console.log(
+        `[VideoAnalyzer] 关键帧去重: ${frames.length} -> ${kept.length} 张` +
+        `（重复 ${result.stats?.duplicateCount ?? 0}，超出上限 ${result.stats?.budgetDropped ?? 0}）`
       );
+      return { frames: kept, info };
+    } catch (error) {
+      console.warn('[VideoAnalyzer] 关键帧去重失败，发送全部关键帧:', error.message);
+      return { frames, info };
     }
   }
 
   /**
    * 将提取的帧转存为向量DB
+   * 向量为本地 CPU 帧描述子（computeFrameDescriptors），不调用多模态 Embedding API，
+   * 写入 vectorDb.LOCAL_TABLE_NAME，供以帧搜帧使用。FRAME_VECTORS=0 关闭。
    */
   async storeFrameVectors(bvid, framesDir, onVectorProgress = null) {
-    // 跳过图像向量提取，因为多模态API不稳定
-    console.log('[VideoAnalyzer] 跳过图像向量提取（多模态API暂时禁用）');
-    if (onVectorProgress) {
-      onVectorProgress(100, 'completed', '图像向量提取已禁用');
-    }
-    return;
-    
-    /* 
-    // 原始代码已注释
-    if (!vectorDb.isReady()) {
-      console.warn('[VideoAnalyzer] VectorDB 未初始化，跳过帧向量提取');
-      if (onVectorProgress) onVectorProgress(100, 'error', 'VectorDB 未初始化，跳过帧向量提取');
-      return;
-    }
-    const embeddingService = new EmbeddingService();
-    if (!embeddingService.isReady()) {
-      console.warn('[VideoAnalyzer] 未配置 DASHSCOPE_API_KEY，跳过帧向量提取');
-      if (onVectorProgress) onVectorProgress(100, 'error', '未配置环境变量 DASHSCOPE_API_KEY，跳过语义搜索功能');
+    if (process.env.FRAME_VECTORS === '0') {
+      if (onVectorProgress) onVectorProgress(100, 'completed', '帧向量提取已关闭');
       return;
     }
 
     try {
-      if (onVectorProgress) onVectorProgress(5, 'running', '正在读取视频帧...');
-      const files = fs.readdirSync(framesDir).filter(f => f.endsWith('.jpg')).sort();
-      if (files.length === 0) {
+      const startedAt = Date.now();
+      if (onVectorProgress) onVectorProgress(5, 'running', '正在计算帧描述子...');
+      const frames = framesFromTimestampedDirectory(framesDir);
+      if (frames.length === 0) {
         if (onVectorProgress) onVectorProgress(100, 'completed', '没有可以入库的帧');
         return;
       }
 
-      console.log(`[VideoAnalyzer] 开始提取并存储 ${files.length} 个帧向量...`);
-      const points = [];
-      const total = files.length;
-
-      for (let i = 0; i < total; i++) {
-        const file = files[i];
-        // 文件名格式 frame_001_12345.jpg，其中12345是毫秒
-        const match = file.match(/_(\d+)\.jpg$/);
-        if (!match) continue;
-        const timestampMs = parseInt(match[1], 10);
-        const timestampSec = timestampMs / 1000.0;
-        const filePath = path.join(framesDir, file);
-
-        try {
-          const vector = await embeddingService.embedLocalImage(bvid, timestampMs, filePath);
-          if (vector) {
-            points.push({
-              timestamp: timestampSec,
-              vector: vector
-            });
-          }
-        } catch (err) {
-          console.error(`[VideoAnalyzer] embedLocalImage 失败: ${file}`, err.message);
-        }
-
-        const percent = 5 + Math.round(((i + 1) / total) * 90);
-        if (onVectorProgress) onVectorProgress(percent, 'running', `正在调用百炼多模态模型向量化画面: ${i + 1}/${total} 帧...`);
-      }
+      const { descriptors, stats } = await computeFrameDescriptors(frames);
+      const points = descriptors.map(item => ({ timestamp: item.time, vector: item.vector }));
+      if (onVectorProgress) onVectorProgress(80, 'running', '正在存入本地LanceDB向量数据库...');
+      await vectorDb.upsertFramePoints(bvid, points, { table: vectorDb.LOCAL_TABLE_NAME });
 
-      if (points.length > 0) {
-        if (onVectorProgress) onVectorProgress(96, 'running', '正在存入本地LanceDB向量数据库...');
-        await vectorDb.upsertFramePoints(bvid, points);
-      }
-      
-      if (onVectorProgress) onVectorProgress(100, 'completed', '多模态帧向量提取完毕！现在可以正常使用语义搜索了。');
+      console.log(
+        `[VideoAnalyzer] 帧向量入库完成: ${points.length} 帧 × ${stats?.dimensions ?? 0} 维，` +
+        `描述子 ${stats?.timings?.descriptorMs ?? '-'}ms，总计 ${Date.now() - startedAt}ms`
+      );
+      if (onVectorProgress) onVectorProgress(100, 'completed', '帧向量提取完毕，可以按画面搜索相似帧');
     } catch (error) {
       console.error('[VideoAnalyzer] storeFrameVectors 失败:', error.message);
       if (onVectorProgress) onVectorProgress(100, 'error', `后台提取失败: ${error.message}`);
     }
-    */
   }
 
   /**
@@ -1274,6 +1520,14 @@ ${visualCutsText}
     const bilibiliCookies = options?.bilibiliCookies; // 接收前端传来的 cookies
     let bvid = null;
     let tempCookiesPath = null;
+    // 各阶段墙钟耗时，写入分段调试产物便于事后排查慢任务
+    const stageTimings = {};
+    let stageStartedAt = Date.now();
+    const markStage = stage => {
+      const now = Date.now();
+      stageTimings[stage] = now - stageStartedAt;
+      stageStartedAt = now;
+    };
     
     try {
       // 1. 提取视频信息
@@ -1299,9 +1553,29 @@ ${visualCutsText}
 
       // 3. 下载视频（传递 cookies 路径）- 使用混合策略
       const videoPath = await this.downloadVideoHybrid(bvid, url, onProgress, tempCookiesPath);
+      markStage('downloadMs');
+
+      const shouldAnalyzeAudio = Boolean(useAudio && hasOssConfig);
+
+      // 3.5 统一媒体分析：一次解码同时完成时长/关键帧/视觉切点/音频抽取，失败时回退到分步流程
+      let mediaPass = null;
+      if (this.shouldUseMediaPass(options)) {
+        try {
+          mediaPass = await this.runMediaPass(videoPath, bvid, onProgress, options, shouldAnalyzeAudio);
+        } catch (error) {
+          console.warn('[VideoAnalyzer] 统一媒体分析失败，回退到分步解码:', error.message);
+        }
+        markStage('mediaPassMs');
+      }
 
       // 4. 提取关键帧（用于视觉理解）
-      const { framesDir, duration } = await this.extractFrames(videoPath, bvid, onProgress);
+      const { framesDir, duration } = await this.extractFrames(
+        videoPath,
+        bvid,
+        onProgress,
+        mediaPass ? { duration: mediaPass.duration, keyframeTimestamps: mediaPass.keyframes } : {}
+      );
+      markStage('keyframesMs');
 
       // 后台异步执行向量提取
       this.storeFrameVectors(bvid, framesDir, options?.onVectorProgress).catch(err => {
@@ -1312,14 +1586,7 @@ ${visualCutsText}
       let visualCuts = [];
       let visualCutStats = null;
       try {
-        const visualFrames = await this.extractVisualProbeFrames(
-          videoPath,
-          bvid,
-          duration,
-          onProgress,
-          options?.visualProbe
-        );
-        const visualResult = await analyzeVisualCuts(visualFrames, options?.visualCuts);
+        const visualResult = mediaPass || await this.detectVisualCuts(videoPath, bvid, duration, onProgress, options);
         visualCuts = visualResult.visualCuts || [];
         visualCutStats = visualResult.stats || null;
         console.log(`[VideoAnalyzer] 视觉候选切点检测完成: ${visualCuts.length} 个`);
@@ -1345,9 +1612,27 @@ ${visualCutsText}
         }
       }
 
+      markStage('visualCutsMs');
+
+      // 5.5 跨视频 pHash 索引：探测帧命中已标注视频时复用对方的广告片段，同时把本视频加入索引
+      let knownSegments = null;
+      if (isPhashIndexEnabled() && options?.phashIndex !== false) {
+        try {
+          const probe = resolveIndexProbe({
+            mediaPass,
+            probeDir: path.join(this.downloadDir, `${bvid}_visual_frames`),
+            videoPath,
+            keyframesDir: framesDir
+          });
+          knownSegments = await findKnownSegments(bvid, probe, duration, options?.phashIndex || {});
+        } catch (error) {
+          console.warn('[VideoAnalyzer] pHash 索引查询失败，继续分析:', error.message);
+        }
+        markStage('phashIndexMs');
+      }
+
       // 6. 提取音频并进行语音识别（可选）
       let transcript = null;
-      const shouldAnalyzeAudio = Boolean(useAudio && hasOssConfig);
 
       if (shouldAnalyzeAudio) {
         try {
@@ -1361,6 +1646,8 @@ ${visualCutsText}
         this.reportProgress(onProgress, 'model', 42, '跳过音频，准备大模型分析');
       }
 
+      markStage('speechMs');
+
       let keywordCuts = [];
       let audioCuts = [];
       if (transcript) {
@@ -1379,7 +1666,10 @@ ${visualCutsText}
       if (shouldAnalyzeAudio) {
         try {
           const audioPathForCuts = path.join(this.downloadDir, `${bvid}.wav`);
-          if (fs.existsSync(audioPathForCuts)) {
+          if (mediaPass?.audio) {
+            audioCuts = mediaPass.audio.audioCuts;
+            console.log(`[VideoAnalyzer] 音频切点来自统一媒体分析: ${audioCuts.length} 个`);
+          } else if (fs.existsSync(audioPathForCuts)) {
             audioCuts = await detectAudioCuts(audioPathForCuts);
             console.log(`[VideoAnalyzer] 音频切点检测完成: ${audioCuts.length} 个`);
           }
@@ -1388,13 +1678,18 @@ ${visualCutsText}
         }
       }
 
+      markStage('audioCutsMs');
+
       // 7. AI分析（基于关键帧、时长、视觉切点和音频转录），知识点和热词从分析结果中获取
       const analysisResult = await this.analyzeWithQwen(videoPath, framesDir, duration, transcript, userConfig, onProgress, {
         modelStartPercent: shouldAnalyzeAudio ? 60 : 42,
         visualCuts,
-        visualCutStats
+        visualCutStats,
+        frameDedup: options?.frameDedup
       });
 
+      markStage('modelMs');
+
       // 8. 整合所有分析结果
       this.reportProgress(onProgress, 'finalize', 98, '正在整理分析结果');
       let segmentPipeline = null;
@@ -1416,8 +1711,18 @@ ${visualCutsText}
           visualCuts,
           audioCuts,
           keywordCuts,
+          knownSegments: knownSegments?.segments || [],
+          frameSelection: analysisResult.frame_selection || null,
           existingAnalysis: analysisResult,
-          modelConfig
+          modelConfig,
+          timings: {
+            stages: stageTimings,
+            visual: visualCutStats?.timings || null,
+            visualWorker: visualCutStats?.worker || null,
+            visualProfile: visualCutStats?.profile || null,
+            mediaPass: mediaPass ? { cached: mediaPass.cached, manifestPath: mediaPass.manifestPath, ...mediaPass.stats?.timings } : null,
+            phashIndex: knownSegments?.stats || null
+          }
         }, {
           modelClient: this.createOpenAIClient(modelConfig)
         });
@@ -1434,6 +1739,9 @@ ${visualCutsText}
         visual_cuts: visualCuts,
         visual_cut_stats: visualCutStats,
         candidateCuts: segmentPipeline?.candidateCuts || [],
+        // 其他视频已标注、画面相同的片段（已投影到本视频时间轴）
+        known_segments: knownSegments?.segments || [],
+        known_segment_matches: knownSegments?.matches || [],
         segmentPipeline,
         final_segments: segmentPipeline?.segments || []
       };
@@ -1,7 +1,18 @@
 const fs = require('fs');
 const path = require('path');
-const { spawn, spawnSync } = require('child_process');
+const readline = require('readline');
+const { spawn } = require('child_process');
 const ffmpegPath = require('@ffmpeg-installer/ffmpeg').path;
+const {
+  runVisualWorkerTask,
+  isVisualWorkerPoolEnabled,
+  shutdownVisualCutWorkers,
+  resolvePythonCommand
+} = require('./visualCutWorkerPool');
+const { PROFILE_DIR } = require('./segmentPipeline/debugArtifactWriter');
+
+const SCRIPT_PATH = path.join(__dirname, 'visual_cut_metrics.py');
+const FRAME_EXPORT_SCRIPT_PATH = path.join(__dirname, 'visual_frame_export.py');
 
 const DEFAULT_VISUAL_CUT_OPTIONS = Object.freeze({
   histBins: 16,
@@ -47,6 +58,16 @@ function normalizeFrames(frames) {
     .sort((a, b) => a.time - b.time);
 }
 
+/**
+ * cProfile 输出目录：options.profile 为路径时直接使用，为 true 或设置了
+ * VISUAL_CUT_PROFILE=1 时写到分段调试目录下的 profiles/
+ */
+function resolveProfileTarget(profile) {
+  if (typeof profile === 'string' && profile) return path.resolve(profile);
+  if (profile === true || (profile === undefined && process.env.VISUAL_CUT_PROFILE === '1')) return PROFILE_DIR;
+  return undefined;
+}
+
 function mergeOptions(options = {}) {
   return {
     ...DEFAULT_VISUAL_CUT_OPTIONS,
@@ -54,45 +75,28 @@ function mergeOptions(options = {}) {
     weights: {
       ...DEFAULT_VISUAL_CUT_OPTIONS.weights,
       ...(options.weights || {})
-    }
+    },
+    profile: resolveProfileTarget(options.profile)
   };
 }
 
-function resolvePythonCommand() {
-  const candidates = ['python3', 'python'];
-  for (const command of candidates) {
-    const result = spawnSync(command, ['--version'], { encoding: 'utf8' });
-    if (!result.error && result.status === 0) return command;
-  }
-  return 'python';
+function buildVisualCutResult(parsed, workerStats) {
+  return {
+    visualCuts: Array.isArray(parsed.visualCuts) ? parsed.visualCuts : [],
+    stats: parsed.stats ? { ...parsed.stats, worker: workerStats } : null,
+    transitions: Array.isArray(parsed.transitions) ? parsed.transitions : undefined
+  };
 }
 
-async function analyzeVisualCuts(frames, options = {}) {
-  const normalizedFrames = normalizeFrames(frames);
-  if (normalizedFrames.length < 2) {
-    return {
-      visualCuts: [],
-      stats: {
-        frameCount: normalizedFrames.length,
-        transitionCount: 0,
-        threshold: null,
-        meanScore: 0,
-        stdScore: 0
-      }
-    };
-  }
-
-  const scriptPath = path.join(__dirname, 'visual_cut_metrics.py');
-  const timeoutMs = Number.isFinite(Number(options.timeoutMs)) ? Number(options.timeoutMs) : 120000;
-  const payload = JSON.stringify({
-    frames: normalizedFrames,
-    options: mergeOptions(options),
-    includeDebug: Boolean(options.includeDebug)
-  });
-  const pythonCommand = options.pythonCommand || resolvePythonCommand();
+/**
+ * 单次启动 Python 进程执行视觉切点检测（worker 池不可用时的兜底路径）
+ */
+function runVisualCutProcess(payload, options = {}) {
+  const { timeoutMs, pythonCommand, onEvent, scriptPath = SCRIPT_PATH } = options;
+  const ndjson = typeof onEvent === 'function';
 
   return new Promise((resolve, reject) => {
-    const child = spawn(pythonCommand, [scriptPath], {
+    const child = spawn(pythonCommand, ndjson ? [scriptPath, '--ndjson'] : [scriptPath], {
       cwd: path.join(__dirname, '..', '..'),
       windowsHide: true
     });
@@ -100,6 +104,7 @@ async function analyzeVisualCuts(frames, options = {}) {
     let stdout = '';
     let stderr = '';
     let finished = false;
+    let finalMessage = null;
 
     const timer = setTimeout(() => {
       if (finished) return;
@@ -108,9 +113,28 @@ async function analyzeVisualCuts(frames, options = {}) {
       reject(new Error(`视觉切点检测超时(${timeoutMs}ms)`));
     }, timeoutMs);
 
-    child.stdout.on('data', chunk => {
-      stdout += chunk.toString();
-    });
+    if (ndjson) {
+      // --ndjson 模式下逐行输出事件，最后一行是 result / error
+      readline.createInterface({ input: child.stdout }).on('line', line => {
+        if (!line.trim()) return;
+        let message;
+        try {
+          message = JSON.parse(line);
+        } catch (error) {
+          console.warn(`[VisualCutDetector] 无法解析输出: ${line.slice(0, 200)}`);
+          return;
+        }
+        if (message.type === 'event') {
+          onEvent(message);
+        } else {
+          finalMessage = message;
+        }
+      });
+    } else {
+      child.stdout.on('data', chunk => {
+        stdout += chunk.toString();
+      });
+    }
 
     child.stderr.on('data', chunk => {
       stderr += chunk.toString();
@@ -136,7 +160,11 @@ async function analyzeVisualCuts(frames, options = {}) {
 
       let parsed = null;
       try {
-        parsed = stdout ? JSON.parse(stdout) : null;
+        if (ndjson) {
+          parsed = finalMessage?.type === 'result' ? finalMessage.result : finalMessage;
+        } else {
+          parsed = stdout ? JSON.parse(stdout) : null;
+        }
       } catch (error) {
         reject(new Error(`视觉切点检测输出解析失败: ${error.message}; stderr=${stderr}`));
         return;
@@ -147,15 +175,11 @@ async function analyzeVisualCuts(frames, options = {}) {
         return;
       }
 
-      resolve({
-        visualCuts: Array.isArray(parsed.visualCuts) ? parsed.visualCuts : [],
-        stats: parsed.stats || null,
-        transitions: Array.isArray(parsed.transitions) ? parsed.transitions : undefined
-      });
+      resolve(parsed);
     });
 
     try {
-      child.stdin.write(payload);
+      child.stdin.write(JSON.stringify(payload));
       child.stdin.end();
     } catch (error) {
       if (finished) return;
@@ -166,6 +190,342 @@ async function analyzeVisualCuts(frames, options = {}) {
   });
 }
 
+const BUDGET_RESERVE_MS = 3000;
+
+/**
+ * Python 侧的时间预算：默认取 timeoutMs 减去进程启动、导入和结果回传的余量（10%，至少 3 秒），
+ * visual_cut_metrics.py 按预算降级（停用 pHash / SSIM、抽稀帧），到点返回已完成的部分，
+ * 不会被超时杀掉。options.timeBudgetMs 显式指定（<= 0 关闭）；VISUAL_CUT_BUDGET=0 时不设预算
+ */
+function resolveTimeBudgetMs(options = {}) {
+  if (options.timeBudgetMs !== undefined && options.timeBudgetMs !== null) {
+    const explicit = Number(options.timeBudgetMs);
+    return Number.isFinite(explicit) && explicit > 0 ? explicit : undefined;
+  }
+  if (process.env.VISUAL_CUT_BUDGET === '0') return undefined;
+
+  const timeoutMs = Number.isFinite(Number(options.timeoutMs)) ? Number(options.timeoutMs) : 120000;
+  const budgetMs = timeoutMs - Math.max(BUDGET_RESERVE_MS, timeoutMs * 0.1);
+  return budgetMs > 0 ? Math.floor(budgetMs) : undefined;
+}
+
+/**
+ * 基于已抽取的帧图片做视觉切点检测
+ * @param {Array<{framePath: string, time: number}>} frames - 帧图片及其时间（秒）
+ * @param {object} [options={}] - 检测参数（见 DEFAULT_VISUAL_CUT_OPTIONS），另外支持：
+ * @param {number} [options.timeoutMs=120000] - 请求超时
+ * @param {number} [options.timeBudgetMs] - Python 侧时间预算，默认由 timeoutMs 推算（见 resolveTimeBudgetMs）；
+ *   降级时 stats.coverage < 1 或 stats.degradedMetrics 非空，细节见 stats.budget
+ */
+async function analyzeVisualCuts(frames, options = {}) {
+  const normalizedFrames = normalizeFrames(frames);
+  if (normalizedFrames.length < 2) {
+    return {
+      visualCuts: [],
+      stats: {
+        frameCount: normalizedFrames.length,
+        transitionCount: 0,
+        threshold: null,
+        meanScore: 0,
+        stdScore: 0
+      }
+    };
+  }
+
+  const payload = {
+    frames: normalizedFrames,
+    options: { ...mergeOptions(options), timeBudgetMs: resolveTimeBudgetMs(options) },
+    includeDebug: Boolean(options.includeDebug)
+  };
+
+  const result = await runVisualCutRequest(payload, options);
+  const stats = result.stats || {};
+  if (stats.budget && (stats.coverage < 1 || (stats.degradedMetrics || []).length)) {
+    console.warn(
+      `[VisualCutDetector] 时间预算 ${stats.budget.timeBudgetMs}ms 内降级完成: 覆盖 ${(stats.coverage * 100).toFixed(1)}%，` +
+      `抽帧间隔 ${stats.budget.frameStride}，停用指标 ${(stats.degradedMetrics || []).join(', ') || '无'}`
+    );
+  }
+  return result;
+}
+
+/**
+ * 流式视觉切点检测：Python 直接从 ffmpeg 管道读取 160x90 原始帧，
+ * 不落盘 JPEG、不二次解码。时间戳由采样率推算。
+ * @param {string} videoPath - 视频路径
+ * @param {object} [options={}] - 与 analyzeVisualCuts 相同的检测参数，另外支持：
+ * @param {number} [options.sampleFps=1] - 采样帧率
+ * @param {number} [options.maxFrames] - 最多读取的帧数
+ * @param {string} [options.pixFmt='rgb24'] - 管道像素格式（rgb24 / gray）
+ * @param {boolean|object} [options.online] - 在线检测：滚动窗口统计 + 前瞻确认，边读帧边输出切点，
+ *   可传 { windowSize, lookahead }
+ * @param {Function} [options.onCut] - 在线模式下每确认一个切点回调 (cut, index)，传入即开启在线模式
+ * @param {number} [options.expectedDuration] - 视频时长，在线模式用于片尾保护（ignoreEndSeconds）
+ * @param {boolean|object} [options.adaptive] - 两遍粗到细采样：sampleFps 作为粗采样率，
+ *   再按 seek 对候选峰值附近窗口做 { refineFps, refineScore, refineStdFactor, maxWindows } 细采样
+ */
+async function analyzeVisualCutsFromVideo(videoPath, options = {}) {
+  const absoluteVideoPath = path.resolve(String(videoPath || ''));
+  if (!fs.existsSync(absoluteVideoPath)) {
+    throw new Error(`视频文件不存在: ${absoluteVideoPath}`);
+  }
+
+  const sampleFps = Number.isFinite(Number(options.sampleFps)) && Number(options.sampleFps) > 0
+    ? Number(options.sampleFps)
+    : 1;
+  const onCut = typeof options.onCut === 'function' ? options.onCut : null;
+  const online = options.online || onCut
+    ? { enabled: true, ...(typeof options.online === 'object' ? options.online : {}) }
+    : undefined;
+  const adaptive = options.adaptive
+    ? { enabled: true, ...(typeof options.adaptive === 'object' ? options.adaptive : {}) }
+    : undefined;
+  const payload = {
+    video: {
+      videoPath: absoluteVideoPath,
+      ffmpegPath,
+      fps: sampleFps,
+      maxFrames: Number.isFinite(Number(options.maxFrames)) ? Math.floor(Number(options.maxFrames)) : 0,
+      pixFmt: options.pixFmt === 'gray' ? 'gray' : 'rgb24',
+      expectedDuration: Number.isFinite(Number(options.expectedDuration)) ? Number(options.expectedDuration) : null
+    },
+    options: { ...mergeOptions(options), online, adaptive },
+    includeDebug: Boolean(options.includeDebug)
+  };
+
+  const onEvent = onCut
+    ? message => {
+      if (message.event !== 'cut' || !message.cut) return;
+      try {
+        onCut(message.cut, message.index);
+      } catch (error) {
+        console.warn(`[VisualCutDetector] onCut 回调异常: ${error.message}`);
+      }
+    }
+    : null;
+
+  return runVisualCutRequest(payload, { ...options, onEvent });
+}
+
+/**
+ * 默认走常驻 worker 池；options.worker === false 或 VISUAL_CUT_WORKERS=0 时
+ * 每次单独启动 Python 进程。返回 Python 的原始结果和 worker 统计。
+ */
+async function runVisualMetricsRequest(payload, options = {}) {
+  const timeoutMs = Number.isFinite(Number(options.timeoutMs)) ? Number(options.timeoutMs) : 120000;
+  const pythonCommand = options.pythonCommand || resolvePythonCommand();
+
+  if (options.worker !== false && isVisualWorkerPoolEnabled()) {
+    try {
+      const { result, meta } = await runVisualWorkerTask(options.type || 'analyze', payload, {
+        timeoutMs,
+        pythonCommand,
+        onEvent: options.onEvent
+      });
+      return { parsed: result || {}, workerStats: meta };
+    } catch (error) {
+      if (error.code !== 'VISUAL_WORKER_START_FAILED') throw error;
+      console.warn(`[VisualCutDetector] worker 池不可用，改为单次进程: ${error.message}`);
+    }
+  }
+
+  const startedAt = Date.now();
+  const parsed = await runVisualCutProcess(payload, {
+    timeoutMs,
+    pythonCommand,
+    onEvent: options.onEvent,
+    scriptPath: options.scriptPath
+  });
+  const roundTripMs = Date.now() - startedAt;
+  return {
+    parsed,
+    workerStats: {
+      mode: 'spawn',
+      cold: true,
+      roundTripMs,
+      latencyMs: roundTripMs
+    }
+  };
+}
+
+async function runVisualCutRequest(payload, options = {}) {
+  const { parsed, workerStats } = await runVisualMetricsRequest(payload, options);
+  return buildVisualCutResult(parsed, workerStats);
+}
+
+/**
+ * 单次解码的统一媒体分析：Python 只解码一遍视频，同时得到视觉检测帧特征与切点、
+ * 关键帧时间戳、ffmpeg scene 分数，并按需写出 16kHz 单声道 WAV 及其 RMS/静音/音量切点。
+ * 结果写入 outputDir/manifest.json，视频和参数不变时直接读取。
+ * @param {string} videoPath - 视频路径
+ * @param {object} [options={}] - 与 analyzeVisualCuts 相同的检测参数，另外支持：
+ * @param {string} options.outputDir - manifest 目录
+ * @param {string} [options.audioPath] - 需要音频时的 WAV 路径，已存在则直接分析
+ * @param {number} [options.sampleFps=1] - 视觉检测采样帧率（按 maxFrames 自动降低）
+ * @param {number} [options.maxFrames=900] - 视觉检测最多帧数
+ * @param {string} [options.pixFmt='rgb24'] - 管道像素格式（rgb24 / gray）
+ * @param {number|false} [options.sceneThreshold=0.32] - ffmpeg scene 阈值，false 关闭 scene 分支
+ * @param {object} [options.audioCuts] - 传给 audio_cut_metrics.py 的参数
+ * @returns {Promise<object>} manifest: { duration, keyframes, scene, visualCuts, stats, audio, cached, manifestPath }
+ */
+async function analyzeMediaPass(videoPath, options = {}) {
+  const absoluteVideoPath = path.resolve(String(videoPath || ''));
+  if (!fs.existsSync(absoluteVideoPath)) {
+    throw new Error(`视频文件不存在: ${absoluteVideoPath}`);
+  }
+
+  const sceneEnabled = options.sceneThreshold !== false;
+  const payload = {
+    media: {
+      videoPath: absoluteVideoPath,
+      ffmpegPath,
+      outputDir: path.resolve(String(options.outputDir)),
+      audioPath: options.audioPath ? path.resolve(options.audioPath) : null,
+      sampleFps: Number.isFinite(Number(options.sampleFps)) && Number(options.sampleFps) > 0 ? Number(options.sampleFps) : 1,
+      maxFrames: Number.isFinite(Number(options.maxFrames)) ? Math.floor(Number(options.maxFrames)) : 900,
+      pixFmt: options.pixFmt === 'gray' ? 'gray' : 'rgb24',
+      scene: sceneEnabled,
+      sceneThreshold: sceneEnabled && Number.isFinite(Number(options.sceneThreshold)) ? Number(options.sceneThreshold) : undefined,
+      audioCuts: options.audioCuts || undefined
+    },
+    options: mergeOptions(options),
+    includeDebug: Boolean(options.includeDebug)
+  };
+
+  // 整段解码，耗时随视频长度增长，默认超时比单项检测宽松
+  const timeoutMs = Number.isFinite(Number(options.timeoutMs)) ? Number(options.timeoutMs) : 600000;
+  const { parsed, workerStats } = await runVisualMetricsRequest(payload, { ...options, timeoutMs });
+  return {
+    ...parsed,
+    visualCuts: Array.isArray(parsed.visualCuts) ? parsed.visualCuts : [],
+    keyframes: Array.isArray(parsed.keyframes) ? parsed.keyframes : [],
+    stats: parsed.stats ? { ...parsed.stats, worker: workerStats } : null
+  };
+}
+
+/**
+ * 发给视觉大模型前剔除近似重复的关键帧：时间窗口内 pHash 与 SSIM 距离都很小的帧
+ * 归为一簇，每簇保留最早的一帧；超过 budget 时再去掉与前一帧差异最小的代表帧。
+ * @param {Array<{framePath: string, time: number}>} frames
+ * @param {object} [options={}]
+ * @param {number} [options.windowSeconds=30] - 只和该时间窗口内的簇比较
+ * @param {number} [options.phashThreshold=0.125] - pHash 汉明距离占比上限
+ * @param {number} [options.ssimThreshold=0.1] - 1 - SSIM 上限
+ * @param {number} [options.budget=0] - 最多保留帧数，0 表示不限
+ * @returns {Promise<{kept: Array, removed: Array, stats: object}>}
+ */
+async function dedupeKeyframes(frames, options = {}) {
+  const normalizedFrames = normalizeFrames(frames);
+  if (normalizedFrames.length < 2) {
+    return {
+      kept: normalizedFrames.map(frame => ({ ...frame, clusterSize: 1 })),
+      removed: [],
+      stats: { frameCount: normalizedFrames.length, keptCount: normalizedFrames.length, duplicateCount: 0, budgetDropped: 0 }
+    };
+  }
+
+  const payload = {
+    dedupe: {
+      frames: normalizedFrames,
+      options: {
+        windowSeconds: options.windowSeconds,
+        phashThreshold: options.phashThreshold,
+        ssimThreshold: options.ssimThreshold,
+        budget: options.budget
+      }
+    },
+    options: mergeOptions()
+  };
+  const { parsed, workerStats } = await runVisualMetricsRequest(payload, {
+    timeoutMs: options.timeoutMs,
+    pythonCommand: options.pythonCommand,
+    worker: options.worker
+  });
+  return {
+    kept: Array.isArray(parsed.kept) ? parsed.kept : normalizedFrames,
+    removed: Array.isArray(parsed.removed) ? parsed.removed : [],
+    stats: parsed.stats ? { ...parsed.stats, worker: workerStats } : null
+  };
+}
+
+/**
+ * 批量导出关键帧：Python 从头顺序解码一遍，select 只放行每个时间点之后的第一帧，
+ * 在线程池里编码 JPEG，文件名沿用 frame_NNN_<ms>.jpg（NNN 按 timestamps 顺序，ms 取请求时间）。
+ * 代替每个时间点单独起一次 ffmpeg -ss 的做法，耗时随视频长度增长而不是随帧数 × seek 开销。
+ * @param {string} videoPath - 视频路径
+ * @param {number[]} timestamps - 需要导出的时间点（秒）
+ * @param {object} options
+ * @param {string} options.outputDir - 输出目录
+ * @param {number} [options.width=640] - 输出宽度
+ * @param {number} [options.quality=95] - JPEG 质量
+ * @param {number} [options.workers] - JPEG 编码线程数，默认 min(CPU, 4)
+ * @param {boolean} [options.keyframesOnly=false] - 时间点都是关键帧时只解码关键帧
+ * @returns {Promise<{frames: Array<{index, time, frameTime, framePath}>, missing: Array<{index, time}>, stats: object}>}
+ */
+async function exportKeyframes(videoPath, timestamps, options = {}) {
+  const absoluteVideoPath = path.resolve(String(videoPath || ''));
+  if (!fs.existsSync(absoluteVideoPath)) {
+    throw new Error(`视频文件不存在: ${absoluteVideoPath}`);
+  }
+
+  const payload = {
+    videoPath: absoluteVideoPath,
+    ffmpegPath,
+    outputDir: path.resolve(String(options.outputDir)),
+    timestamps: Array.isArray(timestamps) ? timestamps.map(Number) : [],
+    options: {
+      width: options.width,
+      quality: options.quality,
+      workers: options.workers,
+      keyframesOnly: Boolean(options.keyframesOnly)
+    }
+  };
+  const timeoutMs = Number.isFinite(Number(options.timeoutMs)) ? Number(options.timeoutMs) : 600000;
+  const { parsed, workerStats } = await runVisualMetricsRequest(payload, {
+    timeoutMs,
+    pythonCommand: options.pythonCommand,
+    worker: options.worker,
+    type: 'export_frames',
+    scriptPath: FRAME_EXPORT_SCRIPT_PATH
+  });
+  return {
+    frames: Array.isArray(parsed.frames) ? parsed.frames : [],
+    missing: Array.isArray(parsed.missing) ? parsed.missing : [],
+    stats: parsed.stats ? { ...parsed.stats, worker: workerStats } : null
+  };
+}
+
+/**
+ * 本地帧描述子：复用视觉切点检测解码出的特征（RGB 直方图、DCT 低频系数、灰度缩略图），
+ * 拼成定长 float32 向量（各部分归一化后整体 L2 归一化，适合余弦距离），不依赖任何网络接口。
+ * @param {Array<{framePath: string, time: number}>} frames
+ * @param {object} [options={}] - { weights: { hist, dct, thumb }, timeoutMs, pythonCommand, worker }
+ * @returns {Promise<{descriptors: Array<{time: number, framePath: string, vector: number[]}>, stats: object}>}
+ */
+async function computeFrameDescriptors(frames, options = {}) {
+  const normalizedFrames = normalizeFrames(frames);
+  if (normalizedFrames.length === 0) {
+    return { descriptors: [], stats: { frameCount: 0, dimensions: 0 } };
+  }
+
+  const payload = {
+    descriptors: {
+      frames: normalizedFrames,
+      options: { weights: options.weights }
+    },
+    options: mergeOptions()
+  };
+  const { parsed, workerStats } = await runVisualMetricsRequest(payload, {
+    timeoutMs: options.timeoutMs,
+    pythonCommand: options.pythonCommand,
+    worker: options.worker
+  });
+  return {
+    descriptors: Array.isArray(parsed.descriptors) ? parsed.descriptors : [],
+    stats: parsed.stats ? { ...parsed.stats, worker: workerStats } : null
+  };
+}
+
 async function getVisualCuts(frames, options = {}) {
   const result = await analyzeVisualCuts(frames, options);
   return result.visualCuts;
@@ -301,7 +661,15 @@ function framesFromTimestampedDirectory(framesDir) {
 module.exports = {
   DEFAULT_VISUAL_CUT_OPTIONS,
   analyzeVisualCuts,
+  analyzeVisualCutsFromVideo,
+  analyzeMediaPass,
   analyzeSceneCutsWithFfmpeg,
+  computeFrameDescriptors,
+  dedupeKeyframes,
+  exportKeyframes,
   getVisualCuts,
-  framesFromTimestampedDirectory
+  framesFromTimestampedDirectory,
+  resolveTimeBudgetMs,
+  runVisualMetricsRequest,
+  shutdownVisualCutWorkers
 };
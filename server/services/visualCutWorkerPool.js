@@ -0,0 +1,80 @@
+/**
+ * 常驻 visual_cut_metrics.py worker 池
+ *
+ * 每个 worker 以 `--worker` 模式常驻，协议见 pythonWorkerPool.js。
+ * 避免每个视频都重新启动 Python、重新 import numpy/PIL。
+ */
+
+const path = require('path');
+const { PythonWorkerPool, resolvePythonCommand } = require('./pythonWorkerPool');
+
+const SCRIPT_PATH = path.join(__dirname, 'visual_cut_metrics.py');
+const WORKER_CWD = path.join(__dirname, '..', '..');
+
+/** worker 启动（import numpy/PIL）超时 */
+const READY_TIMEOUT_MS = 30000;
+/** 空闲超过该时长的 worker 自动退出，释放内存 */
+const IDLE_SHUTDOWN_MS = 10 * 60 * 1000;
+
+function getDefaultPoolSize() {
+  const configured = Number(process.env.VISUAL_CUT_WORKERS);
+  if (Number.isFinite(configured) && configured >= 0) return Math.floor(configured);
+  return 2;
+}
+
+class VisualCutWorkerPool extends PythonWorkerPool {
+  constructor(options = {}) {
+    super({
+      size: Number(options.size) || getDefaultPoolSize() || 1,
+      pythonCommand: options.pythonCommand,
+      args: [SCRIPT_PATH, '--worker'],
+      cwd: WORKER_CWD,
+      label: '视觉切点 worker',
+      tag: '[VisualWorker]',
+      codePrefix: 'VISUAL_WORKER',
+      readyTimeoutMs: READY_TIMEOUT_MS,
+      idleShutdownMs: IDLE_SHUTDOWN_MS
+    });
+  }
+}
+
+const pools = new Map();
+
+function getVisualCutWorkerPool(pythonCommand = null) {
+  const command = pythonCommand || resolvePythonCommand();
+  if (!pools.has(command)) {
+    pools.set(command, new VisualCutWorkerPool({ pythonCommand: command }));
+  }
+  return pools.get(command);
+}
+
+/**
+ * 通过常驻 worker 池执行 visual_cut_metrics.py 请求
+ * @param {string} type - 请求类型（analyze 等）
+ * @param {object} payload - 请求内容
+ * @param {object} [options={}]
+ * @param {number} [options.timeoutMs=120000] - 单次请求超时
+ * @param {string} [options.pythonCommand] - Python 可执行文件
+ * @param {Function} [options.onEvent] - 请求完成前 worker 推送的 event 消息回调
+ */
+async function runVisualWorkerTask(type, payload, options = {}) {
+  return getVisualCutWorkerPool(options.pythonCommand).run(type, payload, options);
+}
+
+function isVisualWorkerPoolEnabled() {
+  return getDefaultPoolSize() > 0;
+}
+
+function shutdownVisualCutWorkers() {
+  for (const pool of pools.values()) pool.shutdown();
+  pools.clear();
+}
+
+module.exports = {
+  VisualCutWorkerPool,
+  getVisualCutWorkerPool,
+  runVisualWorkerTask,
+  isVisualWorkerPoolEnabled,
+  shutdownVisualCutWorkers,
+  resolvePythonCommand
+};
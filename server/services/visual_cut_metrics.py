@@ -1,12 +1,32 @@
+import argparse
+import cProfile
+import hashlib
 import json
 import math
+import os
+import pstats
+import re
+import subprocess
 import sys
+import threading
+import time
 import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
 
+PROCESS_STARTED = time.perf_counter()
+
 import numpy as np
 from PIL import Image
 
+IMPORTS_FINISHED = time.perf_counter()
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
 
 DEFAULT_OPTIONS = {
     "histBins": 16,
@@ -56,6 +76,10 @@ def clamp(value, low=0.0, high=1.0):
     return max(low, min(high, value))
 
 
+def elapsed_ms(started):
+    return round((time.perf_counter() - started) * 1000.0, 2)
+
+
 def load_image_features(frame_path, hist_bins):
     image = Image.open(frame_path).convert("RGB")
 
@@ -142,6 +166,217 @@ def phash_diff(left, right):
     return clamp(float(distance / max(left.size, 1)))
 
 
+# Batched engine: all frames are stacked and every metric is computed as
+# whole-array operations. Results match the per-pair helpers above within
+# floating point tolerance.
+ANALYSIS_SIZE = (160, 90)
+PHASH_SIZE = (32, 32)
+FEATURE_CHUNK = 128
+POPCOUNT_8 = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+
+
+def open_analysis_image(frame_path, draft=True):
+    with Image.open(frame_path) as source:
+        if draft:
+            # JPEG only (no-op otherwise): libjpeg decodes at the smallest DCT
+            # scale that still covers the analysis size, so 320px probe frames
+            # are never fully decoded just to be shrunk again.
+            source.draft("RGB", ANALYSIS_SIZE)
+        return source.convert("RGB")
+
+
+def analysis_rgb(image):
+    return np.asarray(image.resize(ANALYSIS_SIZE, Image.Resampling.BILINEAR), dtype=np.uint8)
+
+
+def phash_gray(image):
+    return np.asarray(image.convert("L").resize(PHASH_SIZE, Image.Resampling.LANCZOS), dtype=np.uint8)
+
+
+def decode_frame(frame_path, draft=True, phash=True):
+    image = open_analysis_image(frame_path, draft)
+    # Budgeted runs that dropped pHash skip its LANCZOS resize, which costs
+    # about as much as the JPEG decode itself.
+    return analysis_rgb(image), phash_gray(image) if phash else None
+
+
+def decode_chunk(frame_paths, draft=True, phash=True):
+    return [decode_frame(frame_path, draft, phash) for frame_path in frame_paths]
+
+
+DECODE_CHUNK_MIN = 16
+EXECUTORS = {}
+
+
+def resolve_worker_count(options):
+    configured = int(as_float(options.get("workers"), 0))
+    if configured > 0:
+        return configured
+    return max(1, min(os.cpu_count() or 1, 8))
+
+
+def get_executor(backend, workers):
+    # Executors are kept for the lifetime of the process so a --worker
+    # process pays the pool start-up cost once, not per request.
+    key = (backend, workers)
+    if key not in EXECUTORS:
+        executor_class = ProcessPoolExecutor if backend == "process" else ThreadPoolExecutor
+        EXECUTORS[key] = executor_class(max_workers=workers)
+    return EXECUTORS[key]
+
+
+def decode_frames(frame_paths, options, phash=True):
+    workers = resolve_worker_count(options)
+    backend = "process" if options.get("parallelBackend") == "process" else "thread"
+    draft = options.get("draftDecode", True) is not False
+
+    if workers <= 1 or len(frame_paths) < 2 * DECODE_CHUNK_MIN:
+        return decode_chunk(frame_paths, draft, phash), {"workers": 1, "backend": "serial", "chunkSize": len(frame_paths)}
+
+    # A few chunks per worker keeps the pool balanced without paying
+    # per-frame task overhead; map() yields chunks back in time order.
+    chunk_size = max(DECODE_CHUNK_MIN, math.ceil(len(frame_paths) / (workers * 4)))
+    chunks = [frame_paths[start:start + chunk_size] for start in range(0, len(frame_paths), chunk_size)]
+    decoded = []
+    for part in get_executor(backend, workers).map(decode_chunk, chunks, [draft] * len(chunks), [phash] * len(chunks)):
+        decoded.extend(part)
+    return decoded, {"workers": workers, "backend": backend, "chunkSize": chunk_size}
+
+
+def grayscale_batch(rgb):
+    luma = np.asarray([0.299, 0.587, 0.114], dtype=np.float32) / np.float32(255.0)
+    gray = np.empty(rgb.shape[:3], dtype=np.float32)
+    for start in range(0, rgb.shape[0], FEATURE_CHUNK):
+        np.matmul(rgb[start:start + FEATURE_CHUNK], luma, out=gray[start:start + FEATURE_CHUNK])
+    return gray
+
+
+def histogram_batch(rgb, hist_bins):
+    # Quantize through a lookup table (same bin edges as np.histogram over
+    # [0, 1]) and offset each channel so one bincount covers all three.
+    count = rgb.shape[0]
+    quantize = np.minimum((np.arange(256) * hist_bins) // 255, hist_bins - 1).astype(np.uint8)
+    channel_offsets = np.arange(3, dtype=np.uint8) * np.uint8(hist_bins)
+    hist = np.empty((count, 3 * hist_bins), dtype=np.float64)
+
+    for start in range(0, count, FEATURE_CHUNK):
+        block = quantize[rgb[start:start + FEATURE_CHUNK]] + channel_offsets
+        block = block.reshape(block.shape[0], -1)
+        for offset, indices in enumerate(block):
+            hist[start + offset] = np.bincount(indices, minlength=3 * hist_bins)
+
+    per_channel = hist.reshape(count, 3, hist_bins)
+    per_channel /= per_channel.sum(axis=2, keepdims=True) + 1e-12
+    return hist
+
+
+def perceptual_hash_batch(gray_32):
+    dct = np.matmul(np.matmul(DCT_32, gray_32.astype(np.float64)), DCT_32.T)
+    low = dct[:, :8, :8].reshape(gray_32.shape[0], 64)
+    median = np.median(low[:, 1:], axis=1, keepdims=True)
+    return np.packbits(low > median, axis=1)
+
+
+def ssim_diff_batch(gray):
+    count = gray.shape[0]
+    flat = gray.reshape(count, -1)
+    pixels = flat.shape[1]
+    diffs = np.empty(max(count - 1, 0), dtype=np.float64)
+    c1 = 0.01 ** 2
+    c2 = 0.03 ** 2
+
+    for start in range(0, count - 1, FEATURE_CHUNK):
+        stop = min(count, start + FEATURE_CHUNK + 1)
+        block = flat[start:stop].astype(np.float64)
+        means = block.mean(axis=1)
+        centered = block - means[:, None]
+        variances = np.einsum("ij,ij->i", centered, centered) / pixels
+        covariance = np.einsum("ij,ij->i", centered[:-1], centered[1:]) / pixels
+
+        mean_x, mean_y = means[:-1], means[1:]
+        numerator = (2 * mean_x * mean_y + c1) * (2 * covariance + c2)
+        denominator = (mean_x * mean_x + mean_y * mean_y + c1) * (variances[:-1] + variances[1:] + c2)
+        similarity = np.divide(numerator, denominator, out=np.ones_like(numerator), where=denominator != 0)
+        diffs[start:stop - 1] = 1.0 - np.clip(similarity, 0.0, 1.0)
+
+    return np.clip(diffs, 0.0, 1.0)
+
+
+def histogram_diff_batch(hist):
+    return np.clip(np.abs(np.diff(hist, axis=0)).sum(axis=1) / 6.0, 0.0, 1.0)
+
+
+def phash_diff_batch(packed):
+    distance = POPCOUNT_8[np.bitwise_xor(packed[1:], packed[:-1])].sum(axis=1)
+    return np.clip(distance / 64.0, 0.0, 1.0)
+
+
+def build_feature_arrays(rgb_frames, phash_frames, hist_bins, metrics=None):
+    # metrics limits the work to the transitions that will be scored; the
+    # histogram is always built since every caller scores it.
+    rgb = np.stack(rgb_frames)
+    features = {"hist": histogram_batch(rgb, hist_bins)}
+    if metrics is None or "ssimDiff" in metrics:
+        features["gray"] = grayscale_batch(rgb)
+    if metrics is None or "phashDiff" in metrics:
+        features["phash"] = perceptual_hash_batch(np.stack(phash_frames))
+    return features
+
+
+def extract_features(frame_paths, hist_bins, options=None):
+    options = options or {}
+    started = time.perf_counter()
+    decoded, parallel = decode_frames(frame_paths, options)
+    decoded_at = time.perf_counter()
+    features = build_feature_arrays(
+        [item[0] for item in decoded],
+        [item[1] for item in decoded],
+        hist_bins,
+    )
+    info = {
+        **parallel,
+        "draftDecode": options.get("draftDecode", True) is not False,
+        "timings": {
+            "decodeMs": round((decoded_at - started) * 1000.0, 2),
+            "featureMs": elapsed_ms(decoded_at),
+        },
+    }
+    return features, info
+
+
+def score_transitions_batch(features):
+    # A feature left out by build_feature_arrays scores as no change.
+    skipped = np.zeros(max(features["hist"].shape[0] - 1, 0), dtype=np.float64)
+    return {
+        "ssimDiff": ssim_diff_batch(features["gray"]) if "gray" in features else skipped,
+        "histDiff": histogram_diff_batch(features["hist"]),
+        "phashDiff": phash_diff_batch(features["phash"]) if "phash" in features else skipped.copy(),
+    }
+
+
+def score_transitions_pairwise(frame_paths, hist_bins):
+    features = [load_image_features(frame_path, hist_bins) for frame_path in frame_paths]
+    ssim, hist, phash = [], [], []
+    for index in range(1, len(features)):
+        hist.append(histogram_diff(features[index - 1]["hist"], features[index]["hist"]))
+        ssim.append(ssim_diff(features[index - 1]["gray"], features[index]["gray"]))
+        phash.append(phash_diff(features[index - 1]["phash"], features[index]["phash"]))
+    return {
+        "ssimDiff": np.asarray(ssim, dtype=np.float64),
+        "histDiff": np.asarray(hist, dtype=np.float64),
+        "phashDiff": np.asarray(phash, dtype=np.float64),
+    }
+
+
+def combine_scores(metrics, weights):
+    score = (
+        as_float(weights.get("ssim"), 0.45) * metrics["ssimDiff"]
+        + as_float(weights.get("histogram"), 0.35) * metrics["histDiff"]
+        + as_float(weights.get("phash"), 0.20) * metrics["phashDiff"]
+    )
+    return np.clip(score, 0.0, 1.0)
+
+
 def build_reasons(point, options, threshold):
     reasons = ["visual_change"]
 
@@ -176,11 +411,7 @@ def dominant_method(point, weights):
     return max(contributions, key=contributions.get)
 
 
-def detect_visual_cuts(frames, options):
-    hist_bins = int(as_float(options.get("histBins"), 16))
-    hist_bins = max(4, min(64, hist_bins))
-    weights = options.get("weights") or DEFAULT_OPTIONS["weights"]
-
+def collect_frames(frames):
     valid_frames = []
     for frame in frames:
         frame_path = Path(str(frame.get("framePath") or frame.get("path") or ""))
@@ -194,48 +425,74 @@ def detect_visual_cuts(frames, options):
         )
 
     valid_frames.sort(key=lambda item: item["time"])
+    return valid_frames
 
-    if len(valid_frames) < 2:
-        return {
-            "visualCuts": [],
-            "stats": {
-                "frameCount": len(valid_frames),
-                "transitionCount": 0,
-                "threshold": None,
-                "meanScore": 0.0,
-                "stdScore": 0.0,
-            },
-        }
 
-    features = []
-    for frame in valid_frames:
-        features.append(load_image_features(frame["framePath"], hist_bins))
-
-    transitions = []
-    for index in range(1, len(valid_frames)):
-        prev_features = features[index - 1]
-        next_features = features[index]
-        hist = histogram_diff(prev_features["hist"], next_features["hist"])
-        ssim = ssim_diff(prev_features["gray"], next_features["gray"])
-        phash = phash_diff(prev_features["phash"], next_features["phash"])
-        score = (
-            as_float(weights.get("ssim"), 0.45) * ssim
-            + as_float(weights.get("histogram"), 0.35) * hist
-            + as_float(weights.get("phash"), 0.20) * phash
-        )
-        transitions.append(
-            {
-                "index": index,
-                "previousTime": valid_frames[index - 1]["time"],
-                "time": valid_frames[index]["time"],
-                "score": clamp(score),
-                "ssimDiff": ssim,
-                "histDiff": hist,
-                "phashDiff": phash,
-            }
-        )
+def empty_result(frame_count):
+    return {
+        "visualCuts": [],
+        "stats": {
+            "frameCount": frame_count,
+            "transitionCount": 0,
+            "threshold": None,
+            "meanScore": 0.0,
+            "stdScore": 0.0,
+        },
+    }
+
+
+def resolve_hist_bins(options):
+    hist_bins = int(as_float(options.get("histBins"), 16))
+    return max(4, min(64, hist_bins))
+
+
+def metric_triggered(point, options):
+    return (
+        point["ssimDiff"] >= as_float(options.get("ssimThreshold"), 0.6)
+        or point["histDiff"] >= as_float(options.get("histThreshold"), 0.38)
+        or point["phashDiff"] >= as_float(options.get("phashThreshold"), 0.32)
+    )
+
+
+def build_cut(point, previous_time, options, threshold, weights):
+    return {
+        "time": round(point["time"], 3),
+        "score": round(point["score"], 4),
+        "reasons": build_reasons(point, options, threshold),
+        "method": dominant_method(point, weights),
+        "metrics": {
+            "ssimDiff": round(point["ssimDiff"], 4),
+            "histDiff": round(point["histDiff"], 4),
+            "phashDiff": round(point["phashDiff"], 4),
+        },
+        "previousTime": round(previous_time, 3),
+    }
+
+
+def merge_nearby_cuts(peaks, min_gap_seconds, max_cuts):
+    selected = []
+    for peak in sorted(peaks, key=lambda item: item["time"]):
+        if selected and peak["time"] - selected[-1]["time"] < min_gap_seconds:
+            if peak["score"] > selected[-1]["score"]:
+                selected[-1] = peak
+            continue
+        selected.append(peak)
+
+    if max_cuts > 0 and len(selected) > max_cuts:
+        selected = sorted(selected, key=lambda item: item["score"], reverse=True)[:max_cuts]
+        selected.sort(key=lambda item: item["time"])
+    return selected
+
+
+def select_cuts(times, metrics, options, end_time=None):
+    weights = options.get("weights") or DEFAULT_OPTIONS["weights"]
+    times = np.asarray(times, dtype=np.float64)
+    scores = combine_scores(metrics, weights)
+    ssim = metrics["ssimDiff"]
+    hist = metrics["histDiff"]
+    phash = metrics["phashDiff"]
+    point_times = times[1:]
 
-    scores = np.asarray([item["score"] for item in transitions], dtype=np.float64)
     mean_score = float(scores.mean()) if scores.size else 0.0
     std_score = float(scores.std()) if scores.size else 0.0
     base_threshold = as_float(options.get("baseThreshold"), 0.55)
@@ -249,57 +506,44 @@ def detect_visual_cuts(frames, options):
     ignore_end_seconds = as_float(options.get("ignoreEndSeconds"), 0.0)
     ignore_end_min_duration = as_float(options.get("ignoreEndMinDuration"), 60.0)
     max_cuts = int(as_float(options.get("maxCuts"), 80))
-    video_end_time = valid_frames[-1]["time"] if valid_frames else 0.0
+    # end_time is the real end of the video when times only cover part of it.
+    video_end_time = float(end_time) if end_time is not None else float(times[-1]) if times.size else 0.0
     should_guard_video_end = video_end_time >= ignore_end_min_duration and ignore_end_seconds > 0
 
-    peaks = []
-    for index, point in enumerate(transitions):
-        if point["time"] < warmup_seconds:
-            continue
-        if should_guard_video_end and video_end_time - point["time"] <= ignore_end_seconds:
-            continue
-
-        prev_score = transitions[index - 1]["score"] if index > 0 else -1.0
-        next_score = transitions[index + 1]["score"] if index + 1 < len(transitions) else -1.0
-        is_local_peak = point["score"] >= prev_score and point["score"] >= next_score
-        has_metric_trigger = (
-            point["ssimDiff"] >= as_float(options.get("ssimThreshold"), 0.6)
-            or point["histDiff"] >= as_float(options.get("histThreshold"), 0.38)
-            or point["phashDiff"] >= as_float(options.get("phashThreshold"), 0.32)
-        )
-
-        if point["score"] >= threshold and is_local_peak and has_metric_trigger:
-            candidate = {
-                "time": round(point["time"], 3),
-                "score": round(point["score"], 4),
-                "reasons": build_reasons(point, options, threshold),
-                "method": dominant_method(point, weights),
-                "metrics": {
-                    "ssimDiff": round(point["ssimDiff"], 4),
-                    "histDiff": round(point["histDiff"], 4),
-                    "phashDiff": round(point["phashDiff"], 4),
-                },
-                "previousTime": round(point["previousTime"], 3),
-            }
-            peaks.append(candidate)
+    padded = np.concatenate(([-1.0], scores, [-1.0]))
+    is_local_peak = (scores >= padded[:-2]) & (scores >= padded[2:])
+    has_metric_trigger = (
+        (ssim >= as_float(options.get("ssimThreshold"), 0.6))
+        | (hist >= as_float(options.get("histThreshold"), 0.38))
+        | (phash >= as_float(options.get("phashThreshold"), 0.32))
+    )
+    candidate_mask = (
+        (point_times >= warmup_seconds)
+        & (scores >= threshold)
+        & is_local_peak
+        & has_metric_trigger
+    )
+    if should_guard_video_end:
+        candidate_mask &= video_end_time - point_times > ignore_end_seconds
 
-    selected = []
-    for peak in sorted(peaks, key=lambda item: item["time"]):
-        if selected and peak["time"] - selected[-1]["time"] < min_gap_seconds:
-            if peak["score"] > selected[-1]["score"]:
-                selected[-1] = peak
-            continue
-        selected.append(peak)
+    peaks = []
+    for index in np.flatnonzero(candidate_mask):
+        point = {
+            "time": float(point_times[index]),
+            "score": float(scores[index]),
+            "ssimDiff": float(ssim[index]),
+            "histDiff": float(hist[index]),
+            "phashDiff": float(phash[index]),
+        }
+        peaks.append(build_cut(point, float(times[index]), options, threshold, weights))
 
-    if max_cuts > 0 and len(selected) > max_cuts:
-        selected = sorted(selected, key=lambda item: item["score"], reverse=True)[:max_cuts]
-        selected.sort(key=lambda item: item["time"])
+    selected = merge_nearby_cuts(peaks, min_gap_seconds, max_cuts)
 
     return {
         "visualCuts": selected,
         "stats": {
-            "frameCount": len(valid_frames),
-            "transitionCount": len(transitions),
+            "frameCount": int(times.size),
+            "transitionCount": int(scores.size),
             "threshold": round(threshold, 4),
             "meanScore": round(mean_score, 4),
             "stdScore": round(std_score, 4),
@@ -312,35 +556,1910 @@ def detect_visual_cuts(frames, options):
         },
         "transitions": [
             {
-                "time": round(item["time"], 3),
-                "score": round(item["score"], 4),
-                "ssimDiff": round(item["ssimDiff"], 4),
-                "histDiff": round(item["histDiff"], 4),
-                "phashDiff": round(item["phashDiff"], 4),
+                "time": round(float(point_times[index]), 3),
+                "score": round(float(scores[index]), 4),
+                "ssimDiff": round(float(ssim[index]), 4),
+                "histDiff": round(float(hist[index]), 4),
+                "phashDiff": round(float(phash[index]), 4),
             }
-            for item in transitions
+            for index in range(scores.size)
         ],
     }
 
 
-def main():
+# Per-frame features and raw transition metrics are cached next to the
+# manifest.json written by extractVisualProbeFrames. Threshold or weight
+# changes then only re-run select_cuts on the cached transitions.
+FEATURE_CACHE_DIRNAME = ".feature_cache"
+FEATURE_CACHE_VERSION = 1
+TRANSITION_METRICS = ("ssimDiff", "histDiff", "phashDiff")
+
+
+def resolve_cache_dir(frame_paths, options):
+    if options.get("featureCache") is False:
+        return None
+    if options.get("featureCacheDir"):
+        return Path(str(options["featureCacheDir"]))
+
+    parents = {Path(frame_path).parent for frame_path in frame_paths}
+    if len(parents) != 1:
+        return None
+    parent = parents.pop()
+    if not (parent / "manifest.json").exists():
+        return None
+    return parent / FEATURE_CACHE_DIRNAME
+
+
+def cache_signature(frame_paths, hist_bins, options):
+    frames = []
+    for frame_path in frame_paths:
+        stat = os.stat(frame_path)
+        frames.append([Path(frame_path).name, stat.st_mtime_ns, stat.st_size])
+    return {
+        "version": FEATURE_CACHE_VERSION,
+        "histBins": hist_bins,
+        "draftDecode": options.get("draftDecode", True) is not False,
+        "frames": frames,
+    }
+
+
+def load_feature_cache(cache_dir, signature):
     try:
-        payload = json.load(sys.stdin)
-        options = deep_merge(DEFAULT_OPTIONS, payload.get("options") or {})
-        frames = payload.get("frames") or []
-        result = detect_visual_cuts(frames, options)
-        if not payload.get("includeDebug"):
-            result.pop("transitions", None)
-        json.dump(result, sys.stdout, ensure_ascii=False)
-    except Exception as error:
-        json.dump(
+        index = json.loads((cache_dir / "index.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    if index != signature:
+        return None
+
+    try:
+        arrays = {
+            name: np.load(cache_dir / f"{name}.npy", mmap_mode="r")
+            for name in ("hist", "phash", "gray", "transitions")
+        }
+    except (OSError, ValueError):
+        return None
+
+    if arrays["transitions"].shape != (len(signature["frames"]) - 1, len(TRANSITION_METRICS)):
+        return None
+    return arrays
+
+
+def save_feature_cache(cache_dir, signature, features, metrics):
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    index_path = cache_dir / "index.json"
+    # The index is the commit marker: drop it first, write it last.
+    if index_path.exists():
+        index_path.unlink()
+
+    arrays = {
+        "hist": features["hist"],
+        "phash": features["phash"],
+        "gray": np.round(features["gray"] * 255.0).astype(np.uint8),
+        "transitions": np.stack([metrics[name] for name in TRANSITION_METRICS], axis=1),
+    }
+    for name, array in arrays.items():
+        temp_path = cache_dir / f"{name}.tmp.npy"
+        np.save(temp_path, array)
+        os.replace(temp_path, cache_dir / f"{name}.npy")
+
+    temp_index = cache_dir / "index.tmp.json"
+    temp_index.write_text(json.dumps(signature), encoding="utf-8")
+    os.replace(temp_index, index_path)
+
+
+def lookup_feature_cache(frame_paths, hist_bins, options, info):
+    cache_dir = resolve_cache_dir(frame_paths, options)
+    cache = {"status": "disabled"}
+    signature = None
+
+    if cache_dir is not None:
+        started = time.perf_counter()
+        signature = cache_signature(frame_paths, hist_bins, options)
+        cached = load_feature_cache(cache_dir, signature)
+        info["timings"]["cacheLoadMs"] = elapsed_ms(started)
+        cache = {"status": "miss", "dir": str(cache_dir)}
+        if cached is not None:
+            cache["status"] = "hit"
+            transitions = cached["transitions"]
+            metrics = {
+                name: np.asarray(transitions[:, column], dtype=np.float64)
+                for column, name in enumerate(TRANSITION_METRICS)
+            }
+            return metrics, cache_dir, signature, cache
+
+    return None, cache_dir, signature, cache
+
+
+def load_cached_phash(frame_paths):
+    # Packed pHashes of these frames for phash_index.py. Only the frame list
+    # has to match the cache; histogram bins do not affect the hash.
+    cache_dir = resolve_cache_dir(frame_paths, {})
+    if cache_dir is None:
+        return None
+    try:
+        index = json.loads((cache_dir / "index.json").read_text(encoding="utf-8"))
+        if index.get("version") != FEATURE_CACHE_VERSION:
+            return None
+        if index.get("frames") != cache_signature(frame_paths, None, {})["frames"]:
+            return None
+        return np.load(cache_dir / "phash.npy")
+    except (OSError, ValueError):
+        return None
+
+
+def compute_metrics(frame_paths, hist_bins, options):
+    engine = str(options.get("engine") or "batch")
+    info = {"engine": engine, "workers": 1, "parallelBackend": "serial", "timings": {}}
+
+    if engine == "pairwise":
+        started = time.perf_counter()
+        metrics = score_transitions_pairwise(frame_paths, hist_bins)
+        info["timings"]["pairwiseMs"] = elapsed_ms(started)
+        return metrics, info
+
+    info["engine"] = "batch"
+    metrics, cache_dir, signature, cache = lookup_feature_cache(frame_paths, hist_bins, options, info)
+    if metrics is not None:
+        info["featureCache"] = cache
+        return metrics, info
+
+    if options.get("rescoreOnly"):
+        raise ValueError("rescoreOnly requested but the feature cache is missing or stale")
+
+    features, extraction = extract_features(frame_paths, hist_bins, options)
+    info.update(
+        {
+            "workers": extraction["workers"],
+            "parallelBackend": extraction["backend"],
+            "chunkSize": extraction["chunkSize"],
+            "draftDecode": extraction["draftDecode"],
+        }
+    )
+    info["timings"].update(extraction["timings"])
+
+    started = time.perf_counter()
+    metrics = score_transitions_batch(features)
+    info["timings"]["metricsMs"] = elapsed_ms(started)
+
+    if cache_dir is not None:
+        started = time.perf_counter()
+        try:
+            save_feature_cache(cache_dir, signature, features, metrics)
+        except OSError as error:
+            cache["status"] = "write_failed"
+            cache["error"] = str(error)
+        info["timings"]["cacheWriteMs"] = elapsed_ms(started)
+
+    info["featureCache"] = cache
+    return metrics, info
+
+
+# Time budget (options.timeBudgetMs): the first frames are decoded and scored
+# stage by stage to measure per-frame cost, then the rest is planned to fit
+# the remaining time. pHash goes first (its resize costs about a JPEG
+# decode), then SSIM, then frames are thinned out up to one per minGap.
+# Extraction runs chunk by chunk against the deadline, and whatever was
+# covered when time runs out is still scored and returned.
+BUDGET_PROBE_FRAMES = 24
+BUDGET_CHUNK = 256
+BUDGET_PLAN_SHARE = 0.85
+BUDGET_RESERVE_MS = 50.0
+BUDGET_METRIC_SETS = (
+    ("ssimDiff", "histDiff", "phashDiff"),
+    ("ssimDiff", "histDiff"),
+    ("histDiff",),
+)
+METRIC_WEIGHT_KEYS = {"ssimDiff": "ssim", "histDiff": "histogram", "phashDiff": "phash"}
+
+
+def probe_frame_costs(frame_paths, hist_bins, draft):
+    decode_seconds = resize_seconds = 0.0
+    rgb_frames, phash_frames = [], []
+    for frame_path in frame_paths:
+        started = time.perf_counter()
+        image = open_analysis_image(frame_path, draft)
+        rgb_frames.append(analysis_rgb(image))
+        decoded_at = time.perf_counter()
+        phash_frames.append(phash_gray(image))
+        decode_seconds += decoded_at - started
+        resize_seconds += time.perf_counter() - decoded_at
+
+    count = float(len(frame_paths))
+    # Milliseconds per frame. decode and phashResize run in the decode pool;
+    # each metric entry (feature plus transition score) runs serially.
+    costs = {"decode": decode_seconds * 1000.0 / count, "phashResize": resize_seconds * 1000.0 / count}
+    rgb = np.stack(rgb_frames)
+    features = {}
+
+    started = time.perf_counter()
+    features["hist"] = histogram_batch(rgb, hist_bins)
+    histogram_diff_batch(features["hist"])
+    costs["histDiff"] = (time.perf_counter() - started) * 1000.0 / count
+
+    started = time.perf_counter()
+    features["gray"] = grayscale_batch(rgb)
+    ssim_diff_batch(features["gray"])
+    costs["ssimDiff"] = (time.perf_counter() - started) * 1000.0 / count
+
+    started = time.perf_counter()
+    features["phash"] = perceptual_hash_batch(np.stack(phash_frames))
+    phash_diff_batch(features["phash"])
+    costs["phashDiff"] = (time.perf_counter() - started) * 1000.0 / count
+    return features, costs
+
+
+def frame_cost(costs, metric_set, workers):
+    parallel = costs["decode"] + (costs["phashResize"] if "phashDiff" in metric_set else 0.0)
+    return parallel / max(1, workers) + sum(costs[name] for name in metric_set)
+
+
+def plan_budget(costs, remaining, available_ms, workers, max_stride):
+    # Keep the frame density as long as possible: at each stride try every
+    # metric set before thinning the frames out.
+    for stride in range(1, max_stride + 1):
+        count = math.ceil(remaining / stride)
+        for metric_set in BUDGET_METRIC_SETS:
+            estimate = count * frame_cost(costs, metric_set, workers)
+            if estimate <= available_ms:
+                return stride, metric_set, estimate
+    metric_set = BUDGET_METRIC_SETS[-1]
+    return max_stride, metric_set, math.ceil(remaining / max_stride) * frame_cost(costs, metric_set, workers)
+
+
+def max_budget_stride(times, options):
+    # Frames are never spaced further apart than minGapSeconds, the closest
+    # two cuts can be anyway.
+    intervals = np.diff(np.asarray(times, dtype=np.float64))
+    interval = float(np.median(intervals)) if intervals.size else 0.0
+    if interval <= 0:
+        return 1
+    return max(1, int(as_float(options.get("minGapSeconds"), 2.0) / interval))
+
+
+def budget_weights(weights, metric_set):
+    values = {
+        key: as_float(weights.get(key), DEFAULT_OPTIONS["weights"][key])
+        for key in METRIC_WEIGHT_KEYS.values()
+    }
+    kept = {METRIC_WEIGHT_KEYS[name] for name in metric_set}
+    kept_total = sum(values[key] for key in kept)
+    if kept_total <= 0:
+        return values
+    # Rescale the remaining weights so scores keep the same range and the
+    # configured thresholds still apply.
+    scale = sum(values.values()) / kept_total
+    return {key: round(value * scale, 6) if key in kept else 0.0 for key, value in values.items()}
+
+
+def compute_metrics_within_budget(frame_paths, times, hist_bins, options, deadline):
+    info = {"engine": "batch", "workers": 1, "parallelBackend": "serial", "timings": {}}
+    metrics, cache_dir, signature, cache = lookup_feature_cache(frame_paths, hist_bins, options, info)
+    info["featureCache"] = cache
+    if metrics is not None:
+        return metrics, info, list(range(len(frame_paths))), {"plan": "featureCache", "stoppedEarly": False}
+    if options.get("rescoreOnly"):
+        raise ValueError("rescoreOnly requested but the feature cache is missing or stale")
+
+    draft = options.get("draftDecode", True) is not False
+    workers = resolve_worker_count(options)
+    # Kept back for select_cuts and the reply; small budgets keep 5%.
+    reserve_ms = min(BUDGET_RESERVE_MS, as_float(options.get("timeBudgetMs"), 0.0) * 0.05)
+    started = time.perf_counter()
+    probe_count = min(len(frame_paths), BUDGET_PROBE_FRAMES)
+    probe_features, costs = probe_frame_costs(frame_paths[:probe_count], hist_bins, draft)
+    info["timings"]["probeMs"] = elapsed_ms(started)
+
+    available_ms = (deadline - time.perf_counter()) * 1000.0 * BUDGET_PLAN_SHARE - reserve_ms
+    stride, metric_set, estimate = plan_budget(
+        costs, len(frame_paths) - probe_count, available_ms, workers, max_budget_stride(times, options)
+    )
+    feature_names = {"hist"}
+    feature_names.update({"ssimDiff": "gray", "phashDiff": "phash"}[name] for name in metric_set if name != "histDiff")
+
+    kept = list(range(0, probe_count, stride))
+    blocks = [{name: probe_features[name][kept] for name in feature_names}]
+    pending = list(range(kept[-1] + stride, len(frame_paths), stride))
+    last = len(frame_paths) - 1
+    if (pending[-1] if pending else kept[-1]) != last:
+        # Always end on the last frame so a thinned run still spans the video.
+        pending.append(last)
+
+    started = time.perf_counter()
+    per_frame_ms = frame_cost(costs, metric_set, workers)
+    spent_seconds = 0.0
+    position = 0
+    while position < len(pending):
+        if position:
+            # Observed cost replaces the estimate once a chunk has run.
+            per_frame_ms = spent_seconds * 1000.0 / position
+        remaining_ms = (deadline - time.perf_counter()) * 1000.0 - reserve_ms
+        size = min(BUDGET_CHUNK, int(remaining_ms / per_frame_ms) if per_frame_ms > 0 else BUDGET_CHUNK)
+        if size < 1:
+            break
+        chunk = pending[position:position + size]
+        chunk_started = time.perf_counter()
+        decoded, parallel = decode_frames(
+            [frame_paths[index] for index in chunk], options, phash="phashDiff" in metric_set
+        )
+        blocks.append(build_feature_arrays(
+            [item[0] for item in decoded],
+            [item[1] for item in decoded],
+            hist_bins,
+            metric_set,
+        ))
+        spent_seconds += time.perf_counter() - chunk_started
+        info.update({"workers": parallel["workers"], "parallelBackend": parallel["backend"]})
+        kept.extend(chunk)
+        position += len(chunk)
+    info["timings"]["extractMs"] = elapsed_ms(started)
+
+    started = time.perf_counter()
+    features = {name: np.concatenate([block[name] for block in blocks]) for name in feature_names}
+    metrics = score_transitions_batch(features)
+    info["timings"]["metricsMs"] = elapsed_ms(started)
+
+    stopped_early = position < len(pending)
+    complete = stride == 1 and len(metric_set) == len(TRANSITION_METRICS) and not stopped_early
+    if complete and cache_dir is not None and time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            save_feature_cache(cache_dir, signature, features, metrics)
+        except OSError as error:
+            cache["status"] = "write_failed"
+            cache["error"] = str(error)
+        info["timings"]["cacheWriteMs"] = elapsed_ms(started)
+
+    budget = {
+        "probeFrames": probe_count,
+        "frameCostMs": {name: round(value, 4) for name, value in costs.items()},
+        "frameStride": stride,
+        "metrics": list(metric_set),
+        "estimatedMs": round(estimate, 2),
+        "stoppedEarly": stopped_early,
+    }
+    return metrics, info, kept, budget
+
+
+def detect_visual_cuts_within_budget(frame_paths, times, hist_bins, options, deadline):
+    metrics, info, kept, budget = compute_metrics_within_budget(frame_paths, times, hist_bins, options, deadline)
+    metric_set = budget.get("metrics", TRANSITION_METRICS)
+    degraded = [name for name in TRANSITION_METRICS if name not in metric_set]
+    if degraded:
+        options = {**options, "weights": budget_weights(options.get("weights") or {}, metric_set)}
+
+    started = time.perf_counter()
+    kept_times = [times[index] for index in kept]
+    # The ignoreEnd guard must use the real end of the video, not the last
+    # frame reached before the deadline.
+    result = select_cuts(kept_times, metrics, options, end_time=times[-1])
+    info["timings"]["selectMs"] = elapsed_ms(started)
+
+    span = times[-1] - times[0]
+    budget["timeBudgetMs"] = as_float(options.get("timeBudgetMs"), 0.0)
+    if degraded:
+        budget["weights"] = options["weights"]
+    result["stats"].update(info)
+    result["stats"].update(
+        {
+            "inputFrameCount": len(times),
+            "coverage": round((kept_times[-1] - times[0]) / span, 4) if span > 0 else 1.0,
+            "degradedMetrics": degraded,
+            "budget": budget,
+        }
+    )
+    return result
+
+
+def detect_visual_cuts(frames, options):
+    started = time.perf_counter()
+    hist_bins = resolve_hist_bins(options)
+    valid_frames = collect_frames(frames)
+
+    if len(valid_frames) < 2:
+        return empty_result(len(valid_frames))
+
+    frame_paths = [frame["framePath"] for frame in valid_frames]
+    times = [frame["time"] for frame in valid_frames]
+    budget_ms = as_float(options.get("timeBudgetMs"), 0.0)
+    if budget_ms > 0 and options.get("engine") != "pairwise":
+        return detect_visual_cuts_within_budget(frame_paths, times, hist_bins, options, started + budget_ms / 1000.0)
+
+    metrics, info = compute_metrics(frame_paths, hist_bins, options)
+
+    started = time.perf_counter()
+    result = select_cuts(times, metrics, options)
+    info["timings"]["selectMs"] = elapsed_ms(started)
+    result["stats"].update(info)
+    return result
+
+
+# Streaming ingest: ffmpeg decodes the video, samples it at the probe rate
+# and scales it straight to the analysis size, writing raw frames to a pipe.
+# No JPEGs are written or decoded; features are computed block by block.
+class TransitionAccumulator:
+    def __init__(self, hist_bins, keep_history=True, keep_hashes=False):
+        self.hist_bins = hist_bins
+        self.keep_history = keep_history
+        self.previous = None
+        self.frame_count = 0
+        self.blocks = {name: [] for name in TRANSITION_METRICS}
+        # Packed 64-bit pHash per frame (8 bytes each), for the cross-video
+        # index in phash_index.py.
+        self.hash_blocks = [] if keep_hashes else None
+
+    def add_block(self, rgb_frames, phash_frames):
+        if not rgb_frames:
+            return None
+        features = build_feature_arrays(rgb_frames, phash_frames, self.hist_bins)
+        if self.hash_blocks is not None:
+            self.hash_blocks.append(features["phash"])
+        if self.previous is not None:
+            features = {
+                name: np.concatenate([self.previous[name], values])
+                for name, values in features.items()
+            }
+        self.previous = {name: values[-1:].copy() for name, values in features.items()}
+        self.frame_count += len(rgb_frames)
+
+        if features["gray"].shape[0] < 2:
+            return None
+        metrics = score_transitions_batch(features)
+        if self.keep_history:
+            for name in TRANSITION_METRICS:
+                self.blocks[name].append(metrics[name])
+        return metrics
+
+    def metrics(self):
+        return {
+            name: np.concatenate(blocks) if blocks else np.zeros(0, dtype=np.float64)
+            for name, blocks in self.blocks.items()
+        }
+
+    def hashes(self):
+        if not self.hash_blocks:
+            return np.zeros((0, 8), dtype=np.uint8)
+        return np.concatenate(self.hash_blocks)
+
+
+def ffmpeg_frame_command(ffmpeg_path, video_path, fps, pix_fmt="rgb24", start=None, duration=None):
+    width, height = ANALYSIS_SIZE
+    command = [ffmpeg_path, "-hide_banner", "-loglevel", "error", "-nostdin"]
+    if start is not None:
+        command += ["-ss", f"{max(0.0, start):.3f}"]
+    command += ["-i", str(video_path)]
+    if duration is not None:
+        command += ["-t", f"{max(0.0, duration):.3f}"]
+    command += [
+        "-an",
+        "-vf", f"fps={fps:.6f},scale={width}:{height}:flags=bilinear",
+        "-pix_fmt", pix_fmt,
+        "-f", "rawvideo",
+        "pipe:1",
+    ]
+    return command
+
+
+def read_exact(stream, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    filled = 0
+    while filled < size:
+        read = stream.readinto(view[filled:])
+        if not read:
+            return None
+        filled += read
+    return buffer
+
+
+def drain_stream(stream, sink):
+    for line in iter(stream.readline, b""):
+        sink.append(line.decode("utf-8", "replace"))
+
+
+def iter_raw_frames(command, pix_fmt="rgb24", stderr_sink=None):
+    width, height = ANALYSIS_SIZE
+    channels = 1 if pix_fmt == "gray" else 3
+    frame_bytes = width * height * channels
+    process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stderr_lines = stderr_sink if stderr_sink is not None else []
+    stderr_thread = threading.Thread(target=drain_stream, args=(process.stderr, stderr_lines), daemon=True)
+    stderr_thread.start()
+    exhausted = False
+
+    try:
+        while True:
+            buffer = read_exact(process.stdout, frame_bytes)
+            if buffer is None:
+                exhausted = True
+                break
+            frame = np.frombuffer(buffer, dtype=np.uint8).reshape(height, width, channels)
+            if channels == 1:
+                frame = np.repeat(frame, 3, axis=2)
+            yield frame
+    finally:
+        process.stdout.close()
+        if not exhausted:
+            process.kill()
+        process.wait()
+        stderr_thread.join(timeout=1.0)
+
+    if process.returncode != 0:
+        detail = "".join(stderr_lines).strip()[-500:]
+        raise RuntimeError(f"ffmpeg exited with code {process.returncode}: {detail}")
+
+
+def phash_source(rgb_frame):
+    return np.asarray(
+        Image.fromarray(rgb_frame).convert("L").resize(PHASH_SIZE, Image.Resampling.LANCZOS),
+        dtype=np.uint8,
+    )
+
+
+def stream_video_metrics(video, hist_bins, on_block=None, keep_history=True, command=None, stderr_sink=None,
+                         hash_sink=None):
+    fps = as_float(video.get("fps"), 1.0)
+    if fps <= 0:
+        raise ValueError("video.fps must be positive")
+    pix_fmt = "gray" if video.get("pixFmt") == "gray" else "rgb24"
+    if command is None:
+        command = ffmpeg_frame_command(
+            str(video.get("ffmpegPath") or "ffmpeg"),
+            video["videoPath"],
+            fps,
+            pix_fmt,
+            start=video.get("start"),
+            duration=video.get("duration"),
+        )
+    max_frames = int(as_float(video.get("maxFrames"), 0))
+    accumulator = TransitionAccumulator(hist_bins, keep_history=keep_history, keep_hashes=hash_sink is not None)
+    rgb_frames, phash_frames = [], []
+    feature_seconds = 0.0
+    started = time.perf_counter()
+
+    def flush():
+        nonlocal feature_seconds
+        block_started = time.perf_counter()
+        first_index = max(accumulator.frame_count - 1, 0)
+        metrics = accumulator.add_block(rgb_frames, phash_frames)
+        feature_seconds += time.perf_counter() - block_started
+        rgb_frames.clear()
+        phash_frames.clear()
+        if metrics is not None and on_block is not None:
+            on_block(first_index, metrics)
+
+    frames = iter_raw_frames(command, pix_fmt, stderr_sink)
+    try:
+        for frame in frames:
+            rgb_frames.append(frame)
+            phash_frames.append(phash_source(frame))
+            if len(rgb_frames) >= FEATURE_CHUNK:
+                flush()
+            if max_frames and accumulator.frame_count + len(rgb_frames) >= max_frames:
+                break
+    finally:
+        frames.close()
+    flush()
+    if hash_sink is not None:
+        hash_sink.append(accumulator.hashes())
+
+    offset = as_float(video.get("start"), 0.0)
+    times = offset + np.arange(accumulator.frame_count, dtype=np.float64) / fps
+    total_ms = elapsed_ms(started)
+    info = {
+        "frameCount": accumulator.frame_count,
+        "engine": "batch",
+        "ingest": "ffmpeg_stream",
+        "pixFmt": pix_fmt,
+        "sampleFps": fps,
+        "timings": {
+            "streamMs": total_ms,
+            "featureMs": round(feature_seconds * 1000.0, 2),
+            "decodeMs": round(total_ms - feature_seconds * 1000.0, 2),
+        },
+    }
+    return np.round(times, 3), accumulator.metrics(), info
+
+
+class OnlineCutDetector:
+    def __init__(self, options, emit=None, expected_duration=None):
+        online = options.get("online") or {}
+        self.options = options
+        self.emit = emit
+        self.weights = options.get("weights") or DEFAULT_OPTIONS["weights"]
+        self.window_size = max(2, int(as_float(online.get("windowSize"), 120)))
+        self.lookahead = max(1, int(as_float(online.get("lookahead"), 1)))
+        self.base_threshold = as_float(options.get("baseThreshold"), 0.55)
+        self.peak_std_factor = as_float(options.get("peakStdFactor"), 1.35)
+        self.max_dynamic_threshold = as_float(options.get("maxDynamicThreshold"), 0.92)
+        self.warmup_seconds = as_float(options.get("warmupSeconds"), 1.5)
+        self.min_gap_seconds = as_float(options.get("minGapSeconds"), 2.0)
+        self.max_cuts = int(as_float(options.get("maxCuts"), 80))
+
+        # The video length is only known up front when the caller provides it,
+        # so the end-of-video guard is skipped otherwise.
+        ignore_end_seconds = as_float(options.get("ignoreEndSeconds"), 0.0)
+        expected_duration = as_float(expected_duration, 0.0)
+        self.ignore_end_seconds = ignore_end_seconds if (
+            ignore_end_seconds > 0
+            and expected_duration >= as_float(options.get("ignoreEndMinDuration"), 60.0)
+        ) else 0.0
+        self.expected_duration = expected_duration
+
+        self.history = deque(maxlen=self.window_size)
+        self.window_sum = 0.0
+        self.window_sq = 0.0
+        self.pending = deque()
+        self.held = None
+        self.cuts = []
+        self.dropped = 0
+        self.threshold = self.base_threshold
+        self.transition_count = 0
+        self.score_sum = 0.0
+        self.score_sq = 0.0
+        self.max_confirm_delay = 0.0
+
+    def feed(self, previous_times, times, metrics):
+        scores = combine_scores(metrics, self.weights)
+        for index in range(scores.size):
+            self.push(
+                {
+                    "time": float(times[index]),
+                    "previousTime": float(previous_times[index]),
+                    "score": float(scores[index]),
+                    "ssimDiff": float(metrics["ssimDiff"][index]),
+                    "histDiff": float(metrics["histDiff"][index]),
+                    "phashDiff": float(metrics["phashDiff"][index]),
+                }
+            )
+
+    def push(self, point):
+        self.transition_count += 1
+        self.score_sum += point["score"]
+        self.score_sq += point["score"] * point["score"]
+        self.pending.append(point)
+        if len(self.pending) > self.lookahead:
+            self.evaluate(self.pending.popleft(), point["time"])
+
+    def rolling_threshold(self):
+        count = len(self.history)
+        if count == 0:
+            return self.base_threshold
+        mean = self.window_sum / count
+        std = math.sqrt(max(self.window_sq / count - mean * mean, 0.0))
+        return min(self.max_dynamic_threshold, max(self.base_threshold, mean + self.peak_std_factor * std))
+
+    def evaluate(self, point, now):
+        if self.held is not None and point["time"] - self.held["time"] >= self.min_gap_seconds:
+            self.release(now)
+
+        self.threshold = self.rolling_threshold()
+        score = point["score"]
+        past = (self.history[-offset] for offset in range(1, min(self.lookahead, len(self.history)) + 1))
+        is_peak = all(score >= value for value in past) and all(score >= item["score"] for item in self.pending)
+        if (
+            point["time"] >= self.warmup_seconds
+            and score >= self.threshold
+            and is_peak
+            and metric_triggered(point, self.options)
+            and not (self.ignore_end_seconds and self.expected_duration - point["time"] <= self.ignore_end_seconds)
+        ):
+            cut = build_cut(point, point["previousTime"], self.options, self.threshold, self.weights)
+            if self.held is not None and cut["time"] - self.held["time"] < self.min_gap_seconds:
+                if cut["score"] > self.held["score"]:
+                    self.held = cut
+            else:
+                self.release(now)
+                self.held = cut
+
+        if len(self.history) == self.history.maxlen:
+            oldest = self.history[0]
+            self.window_sum -= oldest
+            self.window_sq -= oldest * oldest
+        self.history.append(score)
+        self.window_sum += score
+        self.window_sq += score * score
+
+    def release(self, now):
+        cut, self.held = self.held, None
+        if cut is None:
+            return
+        if self.max_cuts > 0 and len(self.cuts) >= self.max_cuts:
+            self.dropped += 1
+            return
+        self.max_confirm_delay = max(self.max_confirm_delay, now - cut["time"])
+        self.cuts.append(cut)
+        if self.emit is not None:
+            self.emit({"event": "cut", "index": len(self.cuts) - 1, "cut": cut})
+
+    def finish(self, frame_count):
+        now = self.pending[-1]["time"] if self.pending else None
+        while self.pending:
+            self.evaluate(self.pending.popleft(), now)
+        self.release(now if now is not None else 0.0)
+
+        count = self.transition_count
+        mean_score = self.score_sum / count if count else 0.0
+        std_score = math.sqrt(max(self.score_sq / count - mean_score * mean_score, 0.0)) if count else 0.0
+        return {
+            "visualCuts": self.cuts,
+            "stats": {
+                "frameCount": int(frame_count),
+                "transitionCount": count,
+                "threshold": round(self.threshold, 4),
+                "meanScore": round(mean_score, 4),
+                "stdScore": round(std_score, 4),
+                "baseThreshold": self.base_threshold,
+                "peakStdFactor": self.peak_std_factor,
+                "minGapSeconds": self.min_gap_seconds,
+                "warmupSeconds": self.warmup_seconds,
+                "ignoreEndSeconds": self.ignore_end_seconds,
+                "ignoreEndMinDuration": as_float(self.options.get("ignoreEndMinDuration"), 60.0),
+                "online": {
+                    "windowSize": self.window_size,
+                    "lookahead": self.lookahead,
+                    "emittedCuts": len(self.cuts),
+                    "droppedCuts": self.dropped,
+                    "maxConfirmDelaySeconds": round(self.max_confirm_delay, 3),
+                },
+            },
+            "transitions": [],
+        }
+
+
+def detect_visual_cuts_online(video, options, emit=None):
+    hist_bins = resolve_hist_bins(options)
+    fps = as_float(video.get("fps"), 1.0)
+    offset = as_float(video.get("start"), 0.0)
+    detector = OnlineCutDetector(options, emit=emit, expected_duration=video.get("expectedDuration"))
+
+    def on_block(first_index, metrics):
+        indices = first_index + np.arange(metrics["ssimDiff"].size, dtype=np.float64)
+        detector.feed(offset + indices / fps, offset + (indices + 1) / fps, metrics)
+
+    _, _, info = stream_video_metrics(video, hist_bins, on_block=on_block, keep_history=False)
+    started = time.perf_counter()
+    result = detector.finish(info["frameCount"])
+    info["timings"]["selectMs"] = elapsed_ms(started)
+    result["stats"].update(info)
+    return result
+
+
+def plan_refine_windows(times, scores, coarse_cuts, adaptive):
+    if scores.size == 0:
+        return []
+    refine_score = as_float(adaptive.get("refineScore"), 0.35)
+    refine_std_factor = as_float(adaptive.get("refineStdFactor"), 1.0)
+    max_windows = int(as_float(adaptive.get("maxWindows"), 60))
+    active_threshold = min(refine_score, float(scores.mean() + refine_std_factor * scores.std()))
+
+    # The fps filter labels each sample with the nearest output slot, so a
+    # sample at t may show content from up to half an interval later.
+    half_interval = float(times[1] - times[0]) * 0.5 if times.size > 1 else 0.0
+    cut_by_time = {cut["time"]: cut for cut in coarse_cuts}
+    windows = []
+    for index in np.flatnonzero(scores >= active_threshold):
+        windows.append(
+            {
+                "start": max(0.0, float(times[index]) - half_interval),
+                "end": float(times[index + 1]) + half_interval,
+                "score": float(scores[index]),
+                "coarseCut": cut_by_time.get(round(float(times[index + 1]), 3)),
+            }
+        )
+    # Windows around accepted coarse cuts always get refined; the remaining
+    # budget goes to the most active near-misses.
+    windows.sort(key=lambda item: (item["coarseCut"] is None, -item["score"]))
+    if max_windows > 0:
+        windows = windows[:max_windows]
+    windows.sort(key=lambda item: item["start"])
+    return windows
+
+
+def refine_window(video, window, refine_fps, hist_bins, weights):
+    interval = 1.0 / refine_fps
+    fine_video = dict(video)
+    fine_video.update(
+        {
+            "fps": refine_fps,
+            "start": window["start"],
+            "duration": window["end"] - window["start"] + interval * 0.5,
+            "maxFrames": 0,
+        }
+    )
+    times, metrics, _ = stream_video_metrics(fine_video, hist_bins)
+    if times.size < 2:
+        return None, int(times.size)
+
+    scores = combine_scores(metrics, weights)
+    index = int(np.argmax(scores))
+    point = {
+        "time": float(times[index + 1]),
+        "score": float(scores[index]),
+        "ssimDiff": float(metrics["ssimDiff"][index]),
+        "histDiff": float(metrics["histDiff"][index]),
+        "phashDiff": float(metrics["phashDiff"][index]),
+    }
+    return (point, float(times[index])), int(times.size)
+
+
+def detect_visual_cuts_adaptive(video, options):
+    adaptive = options.get("adaptive") or {}
+    hist_bins = resolve_hist_bins(options)
+    weights = options.get("weights") or DEFAULT_OPTIONS["weights"]
+    coarse_fps = as_float(video.get("fps"), 1.0)
+    refine_fps = max(as_float(adaptive.get("refineFps"), 4.0), coarse_fps)
+
+    started = time.perf_counter()
+    times, metrics, info = stream_video_metrics(video, hist_bins)
+    if times.size < 2:
+        result = empty_result(int(times.size))
+        result["stats"].update(info)
+        return result
+    coarse = select_cuts(times, metrics, options)
+    coarse_ms = elapsed_ms(started)
+
+    stats = coarse["stats"]
+    threshold = stats["threshold"]
+    end_time = float(times[-1])
+    windows = plan_refine_windows(times, combine_scores(metrics, weights), coarse["visualCuts"], adaptive)
+
+    started = time.perf_counter()
+    refined_frames = 0
+    shifts = []
+    new_cuts = 0
+    peaks = []
+    for window in windows:
+        refined, frame_count = refine_window(video, window, refine_fps, hist_bins, weights)
+        refined_frames += frame_count
+        coarse_cut = window["coarseCut"]
+        if refined is None:
+            if coarse_cut is not None:
+                peaks.append(coarse_cut)
+            continue
+
+        point, previous_time = refined
+        if coarse_cut is not None:
+            cut = build_cut(point, previous_time, options, threshold, weights)
+            cut["coarseTime"] = coarse_cut["time"]
+            shifts.append(abs(cut["time"] - coarse_cut["time"]))
+            peaks.append(cut)
+            continue
+
+        guarded = stats["ignoreEndSeconds"] > 0 and end_time - point["time"] <= stats["ignoreEndSeconds"]
+        if (
+            point["time"] >= stats["warmupSeconds"]
+            and point["score"] >= threshold
+            and metric_triggered(point, options)
+            and not guarded
+        ):
+            cut = build_cut(point, previous_time, options, threshold, weights)
+            cut["coarseTime"] = None
+            peaks.append(cut)
+            new_cuts += 1
+
+    # Coarse cuts that fell outside the window budget are kept unrefined.
+    refined_times = {cut["coarseTime"] for cut in peaks if cut.get("coarseTime") is not None}
+    peaks.extend(cut for cut in coarse["visualCuts"] if cut["time"] not in refined_times and cut not in peaks)
+    selected = merge_nearby_cuts(
+        peaks,
+        stats["minGapSeconds"],
+        int(as_float(options.get("maxCuts"), 80)),
+    )
+    refine_ms = elapsed_ms(started)
+
+    stats.update(info)
+    stats["adaptive"] = {
+        "passes": [
+            {"pass": "coarse", "fps": coarse_fps, "framesDecoded": int(times.size), "ms": coarse_ms},
+            {
+                "pass": "refine",
+                "fps": refine_fps,
+                "windows": len(windows),
+                "framesDecoded": refined_frames,
+                "ms": refine_ms,
+            },
+        ],
+        "framesDecoded": int(times.size) + refined_frames,
+        "uniformFramesAtRefineFps": int(math.ceil(end_time * refine_fps)) + 1,
+        "refinedCuts": len(shifts),
+        "newCuts": sum(1 for cut in selected if "coarseTime" in cut and cut["coarseTime"] is None),
+        "candidateNewCuts": new_cuts,
+        "precision": {
+            "coarseSeconds": round(1.0 / coarse_fps, 3),
+            "refinedSeconds": round(1.0 / refine_fps, 3),
+            "meanShiftSeconds": round(float(np.mean(shifts)), 3) if shifts else 0.0,
+            "maxShiftSeconds": round(float(np.max(shifts)), 3) if shifts else 0.0,
+        },
+    }
+    return {
+        "visualCuts": selected,
+        "stats": stats,
+        "transitions": coarse["transitions"],
+    }
+
+
+def detect_visual_cuts_from_video(video, options, emit=None):
+    hist_bins = resolve_hist_bins(options)
+    if not video.get("videoPath") or not Path(str(video["videoPath"])).exists():
+        raise FileNotFoundError(f"video not found: {video.get('videoPath')}")
+    if (options.get("adaptive") or {}).get("enabled"):
+        return detect_visual_cuts_adaptive(video, options)
+    if (options.get("online") or {}).get("enabled"):
+        return detect_visual_cuts_online(video, options, emit=emit)
+
+    times, metrics, info = stream_video_metrics(video, hist_bins)
+    if times.size < 2:
+        result = empty_result(int(times.size))
+        result["stats"].update(info)
+        return result
+
+    started = time.perf_counter()
+    result = select_cuts(times, metrics, options)
+    info["timings"]["selectMs"] = elapsed_ms(started)
+    result["stats"].update(info)
+    return result
+
+
+# Keyframe dedup for the vision model: static scenes yield runs of nearly
+# identical keyframes. Frames are clustered greedily in time order; a frame
+# joins an earlier cluster within the window when both its pHash and SSIM
+# distance to that cluster's representative are small. One representative
+# (the earliest frame) is kept per cluster, then the least novel
+# representatives are dropped until the frame budget is met.
+DEFAULT_DEDUPE_OPTIONS = {
+    "windowSeconds": 30.0,
+    "phashThreshold": 0.125,
+    "ssimThreshold": 0.1,
+    "budget": 0,
+}
+
+
+def representative_novelty(features, kept, position):
+    if position == 0:
+        return float("inf")
+    left, right = features[kept[position - 1]], features[kept[position]]
+    return phash_diff(left["phash"], right["phash"]) + ssim_diff(left["gray"], right["gray"])
+
+
+def dedupe_keyframes(dedupe, options):
+    started = time.perf_counter()
+    settings = dict(DEFAULT_DEDUPE_OPTIONS)
+    settings.update({key: value for key, value in (dedupe.get("options") or {}).items() if value is not None})
+    window = as_float(settings["windowSeconds"], 30.0)
+    phash_threshold = as_float(settings["phashThreshold"], 0.125)
+    ssim_threshold = as_float(settings["ssimThreshold"], 0.1)
+    budget = int(as_float(settings["budget"], 0))
+    frames = collect_frames(dedupe.get("frames") or [])
+    hist_bins = resolve_hist_bins(options)
+
+    features = [load_image_features(frame["framePath"], hist_bins) for frame in frames]
+    decode_ms = elapsed_ms(started)
+
+    clusters = []
+    removed = []
+    for index, frame in enumerate(frames):
+        match = None
+        for cluster in reversed(clusters):
+            representative = frames[cluster["representative"]]
+            if frame["time"] - representative["time"] > window:
+                break
+            phash_distance = phash_diff(features[index]["phash"], features[cluster["representative"]]["phash"])
+            if phash_distance > phash_threshold:
+                continue
+            ssim_distance = ssim_diff(features[index]["gray"], features[cluster["representative"]]["gray"])
+            if ssim_distance <= ssim_threshold:
+                match = (cluster, phash_distance, ssim_distance)
+                break
+        if match is None:
+            clusters.append({"representative": index, "members": [index]})
+            continue
+        cluster, phash_distance, ssim_distance = match
+        cluster["members"].append(index)
+        removed.append(
+            {
+                "time": frame["time"],
+                "framePath": frame["framePath"],
+                "reason": "duplicate",
+                "representativeTime": frames[cluster["representative"]]["time"],
+                "phashDiff": round(phash_distance, 4),
+                "ssimDiff": round(ssim_distance, 4),
+            }
+        )
+
+    kept = [cluster["representative"] for cluster in clusters]
+    budget_dropped = 0
+    while budget > 0 and len(kept) > budget:
+        novelty = [representative_novelty(features, kept, position) for position in range(len(kept))]
+        position = int(np.argmin(novelty))
+        dropped = kept.pop(position)
+        budget_dropped += 1
+        removed.append(
+            {
+                "time": frames[dropped]["time"],
+                "framePath": frames[dropped]["framePath"],
+                "reason": "budget",
+                "previousTime": frames[kept[position - 1]]["time"],
+                "novelty": round(novelty[position], 4),
+            }
+        )
+
+    members = {cluster["representative"]: cluster["members"] for cluster in clusters}
+    removed.sort(key=lambda item: item["time"])
+    return {
+        "kept": [
             {
-                "error": str(error),
-                "traceback": traceback.format_exc(),
+                "framePath": frames[index]["framePath"],
+                "time": frames[index]["time"],
+                "clusterSize": len(members[index]),
+            }
+            for index in kept
+        ],
+        "removed": removed,
+        "stats": {
+            "frameCount": len(frames),
+            "keptCount": len(kept),
+            "clusterCount": len(clusters),
+            "duplicateCount": len(frames) - len(clusters),
+            "budgetDropped": budget_dropped,
+            "options": {
+                "windowSeconds": window,
+                "phashThreshold": phash_threshold,
+                "ssimThreshold": ssim_threshold,
+                "budget": budget,
             },
-            sys.stdout,
-            ensure_ascii=False,
+            "timings": {"decodeMs": decode_ms, "dedupeMs": elapsed_ms(started)},
+        },
+    }
+
+
+# Local frame descriptors for vector search, built from the features cut
+# detection already decodes: color histograms (square-rooted so cosine acts
+# like the Hellinger distance), the low-frequency DCT of the pHash input
+# without its DC term, and a mean-removed 9x16 gray thumbnail. Each block is
+# L2-normalized and weighted so no block dominates the cosine distance.
+DESCRIPTOR_VERSION = 1
+DESCRIPTOR_THUMB = (9, 16)
+DESCRIPTOR_WEIGHTS = {"hist": 1.0, "dct": 1.0, "thumb": 1.0}
+
+
+def normalize_rows(block):
+    norms = np.linalg.norm(block, axis=1, keepdims=True)
+    return block / np.maximum(norms, 1e-12)
+
+
+def descriptor_batch(rgb, phash_gray, hist_bins, weights=None):
+    weights = {**DESCRIPTOR_WEIGHTS, **(weights or {})}
+    count = rgb.shape[0]
+    hist = np.sqrt(histogram_batch(rgb, hist_bins))
+    dct = np.matmul(np.matmul(DCT_32, phash_gray.astype(np.float64)), DCT_32.T)
+    dct = dct[:, :8, :8].reshape(count, 64)[:, 1:]
+    gray = grayscale_batch(rgb)
+    rows, cols = DESCRIPTOR_THUMB
+    thumb = gray.reshape(count, rows, gray.shape[1] // rows, cols, gray.shape[2] // cols).mean(axis=(2, 4))
+    thumb = thumb.reshape(count, rows * cols).astype(np.float64)
+    thumb -= thumb.mean(axis=1, keepdims=True)
+
+    blocks = [
+        normalize_rows(hist) * weights["hist"],
+        normalize_rows(dct) * weights["dct"],
+        normalize_rows(thumb) * weights["thumb"],
+    ]
+    return normalize_rows(np.concatenate(blocks, axis=1)).astype(np.float32)
+
+
+def frame_descriptors(request, options):
+    started = time.perf_counter()
+    frames = collect_frames(request.get("frames") or [])
+    hist_bins = resolve_hist_bins(options)
+    if not frames:
+        return {"descriptors": [], "stats": {"frameCount": 0, "dimensions": 0, "version": DESCRIPTOR_VERSION}}
+
+    decoded, parallel = decode_frames([frame["framePath"] for frame in frames], options)
+    decode_ms = elapsed_ms(started)
+    described = time.perf_counter()
+    vectors = descriptor_batch(
+        np.stack([item[0] for item in decoded]),
+        np.stack([item[1] for item in decoded]),
+        hist_bins,
+        (request.get("options") or {}).get("weights"),
+    )
+    descriptor_ms = elapsed_ms(described)
+
+    return {
+        "descriptors": [
+            {"time": frame["time"], "framePath": frame["framePath"], "vector": [round(float(value), 6) for value in vector]}
+            for frame, vector in zip(frames, vectors)
+        ],
+        "stats": {
+            "frameCount": len(frames),
+            "dimensions": int(vectors.shape[1]),
+            "version": DESCRIPTOR_VERSION,
+            "parallel": parallel,
+            "timings": {"decodeMs": decode_ms, "descriptorMs": descriptor_ms},
+        },
+    }
+
+
+# Unified media pass: a single demux/decode of the source feeds the visual
+# probe frames, ffmpeg scene scores, keyframe timestamps and the 16 kHz WAV
+# used for ASR and audio cuts. The results are written to one manifest so a
+# re-run of the same video with the same options is a file read. The packed
+# pHash of every probe frame is kept next to it for the cross-video index.
+MEDIA_MANIFEST = "manifest.json"
+MEDIA_MANIFEST_VERSION = 2
+MEDIA_PROBE_HASHES = "probe_phash.npy"
+DEFAULT_SCENE_THRESHOLD = 0.32
+PTS_TIME_PATTERN = re.compile(r"pts_time:\s*(-?[0-9.]+)")
+SCENE_SCORE_PATTERN = re.compile(r"lavfi\.scene_score=([0-9.]+)")
+DURATION_PATTERN = re.compile(r"Duration:\s*(\d+):(\d+):([\d.]+)")
+
+
+class MediaLog:
+    # Line sink for drain_stream: parses keyframe and scene lines as they
+    # arrive instead of buffering the whole stderr of a long decode.
+    def __init__(self):
+        self.keyframes = []
+        self.scene_scores = []
+        self.tail = deque(maxlen=40)
+        self.pending_scene_time = None
+
+    def append(self, line):
+        if line.startswith("[showinfo@keys"):
+            match = PTS_TIME_PATTERN.search(line)
+            if match:
+                self.keyframes.append(float(match.group(1)))
+            return
+        if line.startswith("[metadata@scene"):
+            match = PTS_TIME_PATTERN.search(line)
+            if match:
+                self.pending_scene_time = float(match.group(1))
+                return
+            match = SCENE_SCORE_PATTERN.search(line)
+            if match and self.pending_scene_time is not None:
+                self.scene_scores.append((self.pending_scene_time, float(match.group(1))))
+                self.pending_scene_time = None
+            return
+        self.tail.append(line)
+
+    def __iter__(self):
+        return iter(self.tail)
+
+
+def probe_media(ffmpeg_path, video_path):
+    # Reads the container header only; ffmpeg exits with an error because no
+    # output is given, which is expected.
+    completed = subprocess.run(
+        [ffmpeg_path, "-hide_banner", "-nostdin", "-i", str(video_path)],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        check=False,
+    )
+    header = completed.stderr.decode("utf-8", "replace")
+    match = DURATION_PATTERN.search(header)
+    duration = None
+    if match:
+        duration = int(match.group(1)) * 3600 + int(match.group(2)) * 60 + float(match.group(3))
+    return {
+        "duration": duration,
+        "hasVideo": re.search(r"Stream #\S+.*: Video:", header) is not None,
+        "hasAudio": re.search(r"Stream #\S+.*: Audio:", header) is not None,
+    }
+
+
+def resolve_media_fps(media, duration):
+    # Same plan as resolveVisualProbePlan in videoAnalyzer.js: sample at
+    # sampleFps but never produce more than maxFrames probe frames.
+    sample_fps = as_float(media.get("sampleFps"), 1.0)
+    if sample_fps <= 0:
+        sample_fps = 1.0
+    max_frames = int(as_float(media.get("maxFrames"), 900))
+    if not duration or duration <= 0 or max_frames <= 1:
+        return sample_fps
+    target_frames = max(2, min(max_frames, int(math.ceil(duration * sample_fps))))
+    return target_frames / duration
+
+
+def ffmpeg_media_command(ffmpeg_path, video_path, fps, pix_fmt, scene_threshold, audio_path):
+    width, height = ANALYSIS_SIZE
+    branches = ["probe", "keys"] + (["scene"] if scene_threshold is not None else [])
+    graph = [
+        f"[0:v:0]split={len(branches)}" + "".join(f"[{name}]" for name in branches),
+        f"[probe]fps={fps:.6f},scale={width}:{height}:flags=bilinear[frames]",
+        "[keys]select='eq(key,1)',showinfo@keys,nullsink",
+    ]
+    if scene_threshold is not None:
+        # Scene scores only compare consecutive frames, so they are computed
+        # on a small copy; the full-size frames are never converted.
+        graph.append(
+            f"[scene]scale={width}:{height}:flags=bilinear,"
+            f"select='gt(scene,{scene_threshold:.4f})',metadata@scene=print:key=lavfi.scene_score,nullsink"
+        )
+    command = [
+        ffmpeg_path, "-hide_banner", "-nostats", "-nostdin", "-loglevel", "info",
+        "-i", str(video_path),
+        "-filter_complex", ";".join(graph),
+        "-map", "[frames]", "-pix_fmt", pix_fmt, "-f", "rawvideo", "pipe:1",
+    ]
+    if audio_path:
+        command += [
+            "-map", "0:a:0", "-vn", "-ac", "1", "-ar", "16000",
+            "-c:a", "pcm_s16le", "-f", "wav", "-y", str(audio_path),
+        ]
+    return command
+
+
+def select_scene_cuts(scene_scores, threshold, min_gap_seconds):
+    # Mirrors analyzeSceneCutsWithFfmpeg in visualCutDetector.js so the
+    # manifest can stand in for that separate decode.
+    selected = []
+    for scene_time, _ in scene_scores:
+        if selected and scene_time - selected[-1]["time"] < min_gap_seconds:
+            continue
+        selected.append(
+            {
+                "time": round(scene_time, 3),
+                "score": round(clamp(threshold + 0.35, 0.45, 0.9), 3),
+                "reasons": ["visual_change", "scene_change", "ffmpeg_scene"],
+                "method": "ffmpeg_scene",
+                "metrics": {"sceneThreshold": threshold},
+            }
+        )
+    return selected
+
+
+def dedupe_times(values, tolerance=0.001):
+    result = []
+    for value in sorted(values):
+        if value < 0:
+            continue
+        if result and value - result[-1] <= tolerance:
+            continue
+        result.append(round(value, 3))
+    return result
+
+
+def load_audio_cut_metrics():
+    segment_dir = str(Path(__file__).resolve().parent / "segment")
+    if segment_dir not in sys.path:
+        sys.path.insert(0, segment_dir)
+    import audio_cut_metrics
+
+    return audio_cut_metrics
+
+
+def media_signature(media, video_path, fps, scene_threshold, options):
+    stat = os.stat(video_path)
+    return {
+        "version": MEDIA_MANIFEST_VERSION,
+        "video": str(Path(video_path).resolve()),
+        "size": stat.st_size,
+        "mtimeNs": stat.st_mtime_ns,
+        "fps": round(fps, 6),
+        "pixFmt": media.get("pixFmt") or "rgb24",
+        "sceneThreshold": scene_threshold,
+        "audio": bool(media.get("audioPath")),
+        "options": {key: options.get(key) for key in sorted(DEFAULT_OPTIONS)},
+    }
+
+
+def load_media_manifest(manifest_path, signature, audio_path):
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as handle:
+            manifest = json.load(handle)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("signature") != signature:
+        return None
+    if audio_path and not Path(audio_path).exists():
+        return None
+    if not Path((manifest.get("probeHashes") or {}).get("path") or "").exists():
+        return None
+    return manifest
+
+
+def write_probe_hashes(path, hashes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(f"{path.stem}.{os.getpid()}.tmp.npy")
+    np.save(temp_path, hashes)
+    os.replace(temp_path, path)
+
+
+def write_media_manifest(manifest_path, manifest):
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = manifest_path.with_name(f"{manifest_path.name}.{os.getpid()}.tmp")
+    with open(temp_path, "w", encoding="utf-8") as handle:
+        json.dump(manifest, handle, ensure_ascii=False)
+    os.replace(temp_path, manifest_path)
+
+
+def analyze_media(media, options, emit=None):
+    started = time.perf_counter()
+    video_path = str(media.get("videoPath") or "")
+    if not video_path or not Path(video_path).exists():
+        raise FileNotFoundError(f"video not found: {video_path or None}")
+    ffmpeg_path = str(media.get("ffmpegPath") or "ffmpeg")
+    hist_bins = resolve_hist_bins(options)
+
+    probe = probe_media(ffmpeg_path, video_path)
+    if not probe["hasVideo"]:
+        raise ValueError(f"no video stream: {video_path}")
+    fps = resolve_media_fps(media, probe["duration"])
+    scene_threshold = None
+    if media.get("scene", True):
+        scene_threshold = as_float(media.get("sceneThreshold"), DEFAULT_SCENE_THRESHOLD)
+    audio_path = media.get("audioPath") if probe["hasAudio"] else None
+    reuse_audio = bool(audio_path) and Path(audio_path).exists()
+
+    default_dir = Path(video_path).with_name(f"{Path(video_path).stem}_media")
+    output_dir = Path(media.get("outputDir") or default_dir).resolve()
+    manifest_path = output_dir / MEDIA_MANIFEST
+    signature = media_signature(media, video_path, fps, scene_threshold, options)
+    cached = load_media_manifest(manifest_path, signature, audio_path)
+    if cached is not None:
+        cached["stats"].setdefault("timings", {})["mediaMs"] = elapsed_ms(started)
+        cached["cached"] = True
+        cached["manifestPath"] = str(manifest_path)
+        return cached
+
+    # An existing WAV (e.g. from an earlier run without this pass) is kept;
+    # otherwise it is written next to its final name and renamed on success
+    # so a failed pass never leaves a truncated file that looks cached.
+    audio_temp = None
+    if audio_path and not reuse_audio:
+        audio_temp = f"{audio_path}.{os.getpid()}.part"
+    pix_fmt = "gray" if media.get("pixFmt") == "gray" else "rgb24"
+    command = ffmpeg_media_command(ffmpeg_path, video_path, fps, pix_fmt, scene_threshold, audio_temp)
+    log = MediaLog()
+    video = {"videoPath": video_path, "fps": fps, "pixFmt": pix_fmt}
+    hash_blocks = []
+    try:
+        times, metrics, info = stream_video_metrics(
+            video, hist_bins, command=command, stderr_sink=log, hash_sink=hash_blocks
+        )
+    except Exception:
+        if audio_temp and Path(audio_temp).exists():
+            os.remove(audio_temp)
+        raise
+    if audio_temp:
+        os.replace(audio_temp, audio_path)
+    info["ingest"] = "media_pass"
+    info["timings"]["passMs"] = info["timings"].pop("streamMs")
+
+    select_started = time.perf_counter()
+    if times.size < 2:
+        visual = empty_result(int(times.size))
+    else:
+        visual = select_cuts(times, metrics, options)
+    info["timings"]["selectMs"] = elapsed_ms(select_started)
+    visual["stats"].update(info)
+
+    duration = probe["duration"]
+    if duration is None and times.size:
+        duration = float(times[-1] + 1.0 / fps)
+    scene = None
+    if scene_threshold is not None:
+        scene = {
+            "threshold": scene_threshold,
+            "scores": [{"time": round(t, 3), "score": round(score, 4)} for t, score in log.scene_scores],
+            "visualCuts": select_scene_cuts(
+                log.scene_scores, scene_threshold, as_float(options.get("minGapSeconds"), 15.0)
+            ),
+        }
+
+    audio = None
+    if audio_path:
+        audio_started = time.perf_counter()
+        audio_result = load_audio_cut_metrics().detect_audio_cuts(
+            audio_path, {**(media.get("audioCuts") or {}), "includeRms": True}
         )
+        audio = {
+            "path": str(Path(audio_path).resolve()),
+            "extracted": not reuse_audio,
+            "audioCuts": audio_result["audioCuts"],
+            "silences": audio_result["silences"],
+            "rms": audio_result["rms"],
+            "windowSeconds": audio_result["stats"]["windowSeconds"],
+            "stats": audio_result["stats"],
+        }
+        visual["stats"]["timings"]["audioMs"] = elapsed_ms(audio_started)
+
+    probe_hashes = output_dir / MEDIA_PROBE_HASHES
+    write_probe_hashes(probe_hashes, hash_blocks[0])
+
+    visual["stats"]["timings"]["mediaMs"] = elapsed_ms(started)
+    manifest = {
+        "version": MEDIA_MANIFEST_VERSION,
+        "generatedAt": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "signature": signature,
+        "sourceVideo": signature["video"],
+        "duration": round(duration, 3) if duration else None,
+        "sampleFps": round(fps, 6),
+        "keyframes": dedupe_times(log.keyframes),
+        "probeHashes": {"path": str(probe_hashes), "count": int(hash_blocks[0].shape[0])},
+        "scene": scene,
+        "visualCuts": visual["visualCuts"],
+        "stats": visual["stats"],
+        "audio": audio,
+        "cached": False,
+    }
+    if "transitions" in visual:
+        manifest["transitions"] = visual["transitions"]
+    write_media_manifest(manifest_path, {key: value for key, value in manifest.items() if key != "transitions"})
+    manifest["manifestPath"] = str(manifest_path)
+    return manifest
+
+
+def memory_usage():
+    usage = {"rssMb": None, "peakRssMb": None}
+    if resource is not None:
+        # ru_maxrss is KiB on Linux and bytes on macOS
+        scale = 1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0
+        usage["peakRssMb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1)
+    try:
+        with open("/proc/self/statm", encoding="ascii") as statm:
+            pages = int(statm.read().split()[1])
+        usage["rssMb"] = round(pages * os.sysconf("SC_PAGE_SIZE") / 1024.0 / 1024.0, 1)
+    except (OSError, ValueError, AttributeError):
+        pass
+    return usage
+
+
+DEFAULT_PROFILE_DIR = Path("debug") / "profiles"
+
+
+def finish_profile(profiler, target, limit=12):
+    directory = Path(target) if isinstance(target, str) else DEFAULT_PROFILE_DIR
+    directory.mkdir(parents=True, exist_ok=True)
+    profile_path = directory / f"visual_cut_{os.getpid()}_{int(time.time() * 1000)}.prof"
+    profiler.dump_stats(str(profile_path))
+
+    # Only the request thread is profiled; decode work running on the thread
+    # pool shows up as time spent waiting in executor.map.
+    entries = sorted(pstats.Stats(profiler).stats.items(), key=lambda item: item[1][3], reverse=True)
+    top = [
+        {
+            "function": f"{Path(filename).name}:{line}({name})",
+            "calls": calls,
+            "cumMs": round(cumulative * 1000.0, 2),
+            "selfMs": round(total * 1000.0, 2),
+        }
+        for (filename, line, name), (_, calls, total, cumulative, _) in entries[:limit]
+    ]
+    return {"path": str(profile_path.resolve()), "top": top}
+
+
+def run_request(payload, emit=None):
+    started = time.perf_counter()
+    options = deep_merge(DEFAULT_OPTIONS, payload.get("options") or {})
+    profiler = cProfile.Profile() if options.get("profile") else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        if payload.get("media"):
+            result = analyze_media(payload["media"], options, emit=emit)
+        elif payload.get("dedupe"):
+            result = dedupe_keyframes(payload["dedupe"], options)
+        elif payload.get("descriptors"):
+            result = frame_descriptors(payload["descriptors"], options)
+        elif payload.get("video"):
+            result = detect_visual_cuts_from_video(payload["video"], options, emit=emit)
+        else:
+            result = detect_visual_cuts(payload.get("frames") or [], options)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+
+    stats = result.setdefault("stats", {})
+    if profiler is not None:
+        stats["profile"] = finish_profile(profiler, options.get("profile"))
+    timings = stats.setdefault("timings", {})
+    timings.update(
+        {
+            "importMs": round((IMPORTS_FINISHED - PROCESS_STARTED) * 1000.0, 2),
+            "requestMs": elapsed_ms(started),
+            "frames": stats.get("frameCount", 0),
+            **memory_usage(),
+        }
+    )
+    if not payload.get("includeDebug"):
+        result.pop("transitions", None)
+    return result
+
+
+def error_payload(error):
+    return {
+        "error": str(error),
+        "traceback": traceback.format_exc(),
+    }
+
+
+def run_export_request(payload, emit=None):
+    # Frame export lives in its own module so it can also run as a
+    # standalone script; resident workers serve it to skip process start-up.
+    from visual_frame_export import export_frames
+
+    return export_frames(payload, emit=emit)
+
+
+def run_phash_index_request(payload, emit=None):
+    from phash_index import handle_request
+
+    return handle_request(payload, emit=emit, metrics=sys.modules[__name__])
+
+
+def run_frame_vectors_request(payload, emit=None):
+    from frame_vector_store import handle_request
+
+    return handle_request(payload, emit=emit)
+
+
+WORKER_HANDLERS = {
+    "analyze": run_request,
+    "export_frames": run_export_request,
+    "phash_index": run_phash_index_request,
+    "frame_vectors": run_frame_vectors_request,
+}
+
+
+def write_message(stream, message):
+    stream.write(json.dumps(message, ensure_ascii=False) + "\n")
+    stream.flush()
+
+
+def serve_worker():
+    # stdout carries the newline-delimited protocol only; anything else the
+    # handlers print is redirected to stderr so it cannot corrupt a response.
+    protocol = sys.stdout
+    sys.stdout = sys.stderr
+    served = 0
+
+    write_message(
+        protocol,
+        {
+            "type": "ready",
+            "pid": os.getpid(),
+            "startupMs": elapsed_ms(PROCESS_STARTED),
+        },
+    )
+
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+
+        parse_started = time.perf_counter()
+        try:
+            message = json.loads(line)
+        except ValueError as error:
+            write_message(protocol, {"id": None, "type": "error", "error": f"invalid request: {error}"})
+            continue
+
+        request_id = message.get("id")
+        kind = message.get("type") or "analyze"
+
+        if kind == "ping":
+            write_message(protocol, {"id": request_id, "type": "pong", "pid": os.getpid(), "served": served})
+            continue
+        if kind == "shutdown":
+            break
+
+        handler = WORKER_HANDLERS.get(kind)
+        if handler is None:
+            write_message(protocol, {"id": request_id, "type": "error", "error": f"unknown request type: {kind}"})
+            continue
+
+        def emit(event, request_id=request_id):
+            write_message(protocol, {"id": request_id, "type": "event", **event})
+
+        parse_ms = elapsed_ms(parse_started)
+        started = time.perf_counter()
+        try:
+            result = handler(message.get("payload") or {}, emit=emit)
+            served += 1
+            elapsed = elapsed_ms(started)
+            if isinstance(result.get("stats"), dict):
+                result["stats"].setdefault("timings", {})["parseMs"] = parse_ms
+
+            # The result is encoded on its own so serialization cost can be
+            # reported in the envelope that carries it.
+            serialize_started = time.perf_counter()
+            encoded = json.dumps(result, ensure_ascii=False)
+            envelope = json.dumps(
+                {
+                    "id": request_id,
+                    "type": "result",
+                    "elapsedMs": elapsed,
+                    "serializeMs": elapsed_ms(serialize_started),
+                    "served": served,
+                },
+                ensure_ascii=False,
+            )
+            protocol.write(f'{envelope[:-1]}, "result": {encoded}}}\n')
+            protocol.flush()
+        except Exception as error:
+            write_message(protocol, {"id": request_id, "type": "error", **error_payload(error)})
+
+
+# Batch/backfill mode: re-run cut detection over many existing frame
+# directories (or their manifest.json) on a process pool, one video per task.
+# Each finished video gets its own result file and a line in checkpoint.jsonl;
+# a rerun with the same options skips everything already marked done, so an
+# interrupted backfill resumes where it stopped. Features are still read from
+# each directory's .feature_cache, so option changes that only affect cut
+# selection do not decode any JPEG again.
+BATCH_CHECKPOINT = "checkpoint.jsonl"
+TIMESTAMPED_FRAME = re.compile(r"^frame_\d+_(\d+)\.(?:jpe?g|png)$", re.IGNORECASE)
+IMAGE_FILE = re.compile(r"\.(?:jpe?g|png)$", re.IGNORECASE)
+
+
+def expand_batch_sources(entries):
+    # Entries are frame directories, manifest.json files, or .txt lists of them.
+    sources = []
+    for entry in entries:
+        if entry == "-" or entry.endswith(".txt"):
+            lines = sys.stdin.read().splitlines() if entry == "-" else Path(entry).read_text("utf-8").splitlines()
+            sources.extend(line.strip() for line in lines if line.strip() and not line.lstrip().startswith("#"))
+        else:
+            sources.append(entry)
+    # Every source is reduced to its frames directory before deduping, so
+    # "dir" and "dir/manifest.json" stay one video and never share a
+    # .feature_cache between two jobs.
+    unique = []
+    seen = set()
+    for source in sources:
+        resolved = Path(source).resolve()
+        frames_dir = str(resolved.parent if resolved.is_file() else resolved)
+        if frames_dir not in seen:
+            seen.add(frames_dir)
+            unique.append(frames_dir)
+    return unique
+
+
+def batch_frames(source):
+    path = Path(source)
+    manifest = path if path.is_file() else path / "manifest.json"
+    frames_dir = manifest.parent
+    if manifest.is_file():
+        data = json.loads(manifest.read_text("utf-8"))
+        frames = [
+            {"framePath": str(frames_dir / frame["file"]), "time": as_float(frame.get("time"), 0.0)}
+            for frame in data.get("frames") or []
+            if frame.get("file")
+        ]
+        if frames:
+            return frames
+    if not frames_dir.is_dir():
+        raise FileNotFoundError(f"no frames at {source}")
+
+    # No manifest: keyframe exports carry their time in the name; anything
+    # else falls back to its position, as framesFromTimestampedDirectory does.
+    names = sorted(name for name in os.listdir(frames_dir) if IMAGE_FILE.search(name))
+    frames = []
+    for index, name in enumerate(names):
+        match = TIMESTAMPED_FRAME.match(name)
+        frames.append({
+            "framePath": str(frames_dir / name),
+            "time": int(match.group(1)) / 1000.0 if match else float(index),
+        })
+    if not frames:
+        raise FileNotFoundError(f"no frames at {source}")
+    return frames
+
+
+def batch_result_name(source, taken):
+    path = Path(source)
+    base = re.sub(r"[^A-Za-z0-9_.-]", "_", (path.parent if path.is_file() else path).name) or "frames"
+    name = base
+    suffix = 2
+    while name in taken:
+        name = f"{base}-{suffix}"
+        suffix += 1
+    taken.add(name)
+    return f"{name}.json"
+
+
+def options_signature(options):
+    encoded = json.dumps(options, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha1(encoded).hexdigest()[:16]
+
+
+def read_checkpoint(path, signature):
+    done = {}
+    if not path.exists():
+        return done
+    with open(path, "r", encoding="utf-8") as handle:
+        for line in handle:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # a line cut short by the interruption
+            if entry.get("status") == "done" and entry.get("options") == signature:
+                done[entry["source"]] = entry
+    return done
+
+
+def append_checkpoint(handle, entry):
+    handle.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    handle.flush()
+    os.fsync(handle.fileno())
+
+
+def write_json_atomic(path, value):
+    temp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(temp, "w", encoding="utf-8") as handle:
+        json.dump(value, handle, ensure_ascii=False)
+    os.replace(temp, path)
+
+
+def run_batch_entry(source, options):
+    started = time.perf_counter()
+    frames = batch_frames(source)
+    result = detect_visual_cuts(frames, options)
+    result["source"] = source
+    result.setdefault("stats", {})["batchMs"] = elapsed_ms(started)
+    return result, len(frames)
+
+
+def run_batch(entries, output_dir, options, jobs, log=None):
+    log = log or (lambda message: print(message, file=sys.stderr, flush=True))
+    started = time.perf_counter()
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    signature = options_signature(options)
+    checkpoint_path = output_dir / BATCH_CHECKPOINT
+    done = read_checkpoint(checkpoint_path, signature)
+
+    taken = set()
+    names = {source: batch_result_name(source, taken) for source in expand_batch_sources(entries)}
+    pending = [source for source in names if source not in done]
+    summary = {"videos": len(names), "skipped": len(names) - len(pending), "done": 0, "failed": 0, "frames": 0}
+    log(f"[batch] {len(names)} videos, {summary['skipped']} already done, {len(pending)} to run on {jobs} processes")
+
+    with open(checkpoint_path, "a", encoding="utf-8") as checkpoint, ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(run_batch_entry, source, options): source for source in pending}
+        try:
+            for future in as_completed(futures):
+                source = futures[future]
+                entry = {"source": source, "options": signature, "finishedAt": time.strftime("%Y-%m-%dT%H:%M:%S")}
+                try:
+                    result, frame_count = future.result()
+                    result_path = output_dir / names[source]
+                    write_json_atomic(result_path, result)
+                    entry.update({
+                        "status": "done",
+                        "result": str(result_path),
+                        "frames": frame_count,
+                        "cuts": len(result.get("visualCuts") or []),
+                        "ms": result["stats"].get("batchMs"),
+                    })
+                    summary["done"] += 1
+                    summary["frames"] += frame_count
+                except Exception as error:
+                    entry.update({"status": "error", "error": str(error)})
+                    summary["failed"] += 1
+                append_checkpoint(checkpoint, entry)
+                finished = summary["done"] + summary["failed"]
+                log(f"[batch] {finished}/{len(pending)} {entry['status']} {source}")
+        except KeyboardInterrupt:
+            for future in futures:
+                future.cancel()
+            raise
+
+    seconds = time.perf_counter() - started
+    summary.update({
+        "outputDir": str(output_dir),
+        "checkpoint": str(checkpoint_path),
+        "options": signature,
+        "jobs": jobs,
+        "elapsedSeconds": round(seconds, 2),
+        "videosPerMinute": round(summary["done"] / seconds * 60.0, 2) if seconds else 0.0,
+        "framesPerSecond": round(summary["frames"] / seconds, 1) if seconds else 0.0,
+    })
+    return summary
+
+
+def resolve_batch_options(value):
+    # --options takes inline JSON or @path to a JSON file.
+    if not value:
+        overrides = {}
+    elif value.startswith("@"):
+        overrides = json.loads(Path(value[1:]).read_text("utf-8"))
+    else:
+        overrides = json.loads(value)
+    options = deep_merge(DEFAULT_OPTIONS, overrides)
+    # Videos already run in parallel; decoding inside each one stays serial
+    # unless asked otherwise.
+    options.setdefault("workers", 1)
+    return options
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Visual cut metrics")
+    parser.add_argument(
+        "--worker",
+        action="store_true",
+        help="serve newline-delimited JSON requests on stdin/stdout until EOF",
+    )
+    parser.add_argument(
+        "--ndjson",
+        action="store_true",
+        help="write events and the final result as newline-delimited JSON",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="DIR",
+        help="dump a cProfile .prof file for the request into DIR",
+    )
+    parser.add_argument(
+        "--batch",
+        nargs="+",
+        metavar="SOURCE",
+        help="backfill: frame directories, manifest.json files, or .txt lists of them ('-' reads the list from stdin)",
+    )
+    parser.add_argument(
+        "--output-dir",
+        default="visual_cut_batch",
+        help="batch mode: directory for per-video results and checkpoint.jsonl",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=0,
+        help="batch mode: worker processes (default: CPU count)",
+    )
+    parser.add_argument(
+        "--options",
+        help="batch mode: detection options as JSON or @file.json",
+    )
+    return parser.parse_args(argv)
+
+
+def read_payload(args):
+    started = time.perf_counter()
+    payload = json.load(sys.stdin)
+    if args.profile:
+        payload.setdefault("options", {})["profile"] = args.profile
+    return payload, elapsed_ms(started)
+
+
+def with_parse_time(result, parse_ms):
+    result.setdefault("stats", {}).setdefault("timings", {})["parseMs"] = parse_ms
+    return result
+
+
+def main():
+    args = parse_args()
+    if args.worker:
+        serve_worker()
+        return
+
+    if args.batch:
+        jobs = args.jobs if args.jobs > 0 else max(1, os.cpu_count() or 1)
+        try:
+            summary = run_batch(args.batch, args.output_dir, resolve_batch_options(args.options), jobs)
+        except KeyboardInterrupt:
+            print("[batch] interrupted; rerun the same command to resume", file=sys.stderr)
+            sys.exit(130)
+        json.dump(summary, sys.stdout, ensure_ascii=False)
+        sys.stdout.write("\n")
+        sys.exit(1 if summary["failed"] else 0)
+
+    if args.ndjson:
+        try:
+            payload, parse_ms = read_payload(args)
+            result = run_request(payload, emit=lambda event: write_message(sys.stdout, {"type": "event", **event}))
+            write_message(sys.stdout, {"type": "result", "result": with_parse_time(result, parse_ms)})
+        except Exception as error:
+            write_message(sys.stdout, {"type": "error", **error_payload(error)})
+            sys.exit(1)
+        return
+
+    try:
+        payload, parse_ms = read_payload(args)
+        json.dump(with_parse_time(run_request(payload), parse_ms), sys.stdout, ensure_ascii=False)
+    except Exception as error:
+        json.dump(error_payload(error), sys.stdout, ensure_ascii=False)
         sys.exit(1)
 
 
@@ -0,0 +1,312 @@
+import argparse
+import json
+import math
+import os
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+PROCESS_STARTED = time.perf_counter()
+
+from PIL import Image
+
+IMPORTS_FINISHED = time.perf_counter()
+
+
+# Batched keyframe export: ffmpeg decodes the video once from the start and a
+# select filter passes through only the first frame at or after each requested
+# timestamp. Frames come back as PPM over a pipe (the header carries the size,
+# so the scaled height need not be predicted) and are JPEG-encoded on a small
+# thread pool; Pillow releases the GIL while encoding.
+DEFAULT_OPTIONS = {
+    "width": 640,
+    "quality": 95,
+    "workers": 0,
+    "keyframesOnly": False,
+    "namePrefix": "frame",
+}
+# Requested keyframe times come from ffprobe with microsecond precision.
+MATCH_TOLERANCE = 0.0005
+MAX_IN_FLIGHT_PER_WORKER = 2
+
+
+def as_float(value, default=0.0):
+    try:
+        number = float(value)
+        if math.isfinite(number):
+            return number
+    except (TypeError, ValueError):
+        pass
+    return default
+
+
+def elapsed_ms(started):
+    return round((time.perf_counter() - started) * 1000.0, 2)
+
+
+def resolve_worker_count(options):
+    configured = int(as_float(options.get("workers"), 0))
+    if configured > 0:
+        return configured
+    return max(1, min(os.cpu_count() or 1, 4))
+
+
+def frame_file_name(prefix, index, timestamp):
+    return f"{prefix}_{index:03d}_{int(round(timestamp * 1000))}.jpg"
+
+
+def select_expression(targets):
+    # One term per distinct target: true for the first decoded frame whose
+    # time reaches the target (prev_t is NAN on the very first frame).
+    terms = [
+        f"gte(t,{target - MATCH_TOLERANCE:.6f})*(isnan(prev_t)+lt(prev_t,{target - MATCH_TOLERANCE:.6f}))"
+        for target in targets
+    ]
+    return "+".join(terms) if terms else "0"
+
+
+def ffmpeg_export_command(ffmpeg_path, video_path, targets, width, keyframes_only):
+    command = [ffmpeg_path, "-hide_banner", "-nostats", "-nostdin", "-loglevel", "info"]
+    if keyframes_only:
+        # Targets are keyframe times, so everything between them can be
+        # skipped by the decoder instead of decoded and dropped.
+        command += ["-skip_frame", "nokey"]
+    command += [
+        "-i", str(video_path),
+        "-map", "0:v:0", "-an",
+        "-vf", f"select='{select_expression(targets)}',showinfo@export,scale={int(width)}:-1",
+        "-vsync", "vfr",
+        "-c:v", "ppm", "-f", "image2pipe", "pipe:1",
+    ]
+    return command
+
+
+class SelectedTimes:
+    # stderr sink: showinfo runs right after select, so its n-th line is the
+    # n-th frame written to stdout. Readers wait here until it has arrived.
+    def __init__(self):
+        self.times = []
+        self.tail = deque(maxlen=40)
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def append(self, line):
+        if line.startswith("[showinfo@export") and "pts_time:" in line:
+            value = line.split("pts_time:", 1)[1].split()[0]
+            with self.condition:
+                self.times.append(as_float(value, float("nan")))
+                self.condition.notify_all()
+            return
+        self.tail.append(line)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def wait_for(self, index, timeout=30.0):
+        with self.condition:
+            self.condition.wait_for(lambda: len(self.times) > index or self.closed, timeout=timeout)
+            return self.times[index] if len(self.times) > index else None
+
+    def __iter__(self):
+        return iter(self.tail)
+
+
+def drain_stream(stream, sink):
+    try:
+        for line in iter(stream.readline, b""):
+            sink.append(line.decode("utf-8", "replace"))
+    finally:
+        sink.close()
+
+
+def read_token(stream):
+    token = bytearray()
+    while True:
+        char = stream.read(1)
+        if not char:
+            return None if not token else bytes(token)
+        if char == b"#":
+            stream.readline()
+            continue
+        if char.isspace():
+            if token:
+                return bytes(token)
+            continue
+        token += char
+
+
+def read_exact(stream, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    filled = 0
+    while filled < size:
+        read = stream.readinto(view[filled:])
+        if not read:
+            return None
+        filled += read
+    return buffer
+
+
+def iter_ppm_frames(stream):
+    while True:
+        magic = read_token(stream)
+        if magic is None:
+            return
+        if magic != b"P6":
+            raise RuntimeError(f"unexpected frame header from ffmpeg: {magic[:16]!r}")
+        width, height, max_value = (int(read_token(stream) or 0) for _ in range(3))
+        if width <= 0 or height <= 0 or max_value != 255:
+            raise RuntimeError(f"unsupported PPM frame {width}x{height} max={max_value}")
+        buffer = read_exact(stream, width * height * 3)
+        if buffer is None:
+            return
+        yield Image.frombuffer("RGB", (width, height), bytes(buffer), "raw", "RGB", 0, 1)
+
+
+def save_jpeg(image, path, quality):
+    started = time.perf_counter()
+    image.save(path, "JPEG", quality=quality)
+    return time.perf_counter() - started
+
+
+def assign_targets(pending, frame_time):
+    # A selected frame serves every outstanding target it has reached; when
+    # two targets fall within one frame interval they share the frame.
+    matched = []
+    while pending and pending[0][1] - MATCH_TOLERANCE <= frame_time:
+        matched.append(pending.popleft())
+    return matched
+
+
+def export_frames(payload, emit=None):
+    started = time.perf_counter()
+    options = dict(DEFAULT_OPTIONS)
+    options.update({key: value for key, value in (payload.get("options") or {}).items() if value is not None})
+    video_path = str(payload.get("videoPath") or "")
+    if not video_path or not Path(video_path).exists():
+        raise FileNotFoundError(f"video not found: {video_path or None}")
+    output_dir = Path(payload.get("outputDir") or ".")
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    # Output numbering follows the caller's order; decoding needs time order.
+    requested = [as_float(value, -1.0) for value in payload.get("timestamps") or []]
+    indexed = sorted(
+        ((index + 1, timestamp) for index, timestamp in enumerate(requested) if timestamp >= 0),
+        key=lambda item: item[1],
+    )
+    if not indexed:
+        return {"frames": [], "missing": [], "stats": {"requested": len(requested), "exported": 0}}
+
+    distinct = sorted({round(timestamp, 6) for _, timestamp in indexed})
+    width = int(as_float(options.get("width"), 640))
+    quality = int(as_float(options.get("quality"), 95))
+    workers = resolve_worker_count(options)
+    command = ffmpeg_export_command(
+        str(payload.get("ffmpegPath") or "ffmpeg"), video_path, distinct, width, bool(options.get("keyframesOnly"))
+    )
+
+    pending = deque(indexed)
+    exported = []
+    in_flight = deque()
+    selected_times = SelectedTimes()
+    encode_seconds = 0.0
+    process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stderr_thread = threading.Thread(target=drain_stream, args=(process.stderr, selected_times), daemon=True)
+    stderr_thread.start()
+
+    def settle(limit):
+        nonlocal encode_seconds
+        while len(in_flight) > limit:
+            encode_seconds += in_flight.popleft().result()
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for frame_index, image in enumerate(iter_ppm_frames(process.stdout)):
+                frame_time = selected_times.wait_for(frame_index)
+                if frame_time is None or not math.isfinite(frame_time):
+                    raise RuntimeError(f"no timestamp for exported frame {frame_index}")
+                for index, timestamp in assign_targets(pending, frame_time):
+                    path = output_dir / frame_file_name(options["namePrefix"], index, timestamp)
+                    settle(workers * MAX_IN_FLIGHT_PER_WORKER - 1)
+                    in_flight.append(executor.submit(save_jpeg, image, path, quality))
+                    exported.append(
+                        {"index": index, "time": timestamp, "frameTime": round(frame_time, 3), "framePath": str(path)}
+                    )
+                if emit is not None:
+                    emit({"event": "progress", "exported": len(exported), "total": len(indexed)})
+                if not pending:
+                    break
+            settle(0)
+    finally:
+        process.stdout.close()
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+        stderr_thread.join(timeout=1.0)
+
+    if pending and process.returncode not in (0, -9):
+        detail = "".join(selected_times).strip()[-500:]
+        raise RuntimeError(f"ffmpeg exited with code {process.returncode}: {detail}")
+
+    exported.sort(key=lambda frame: frame["index"])
+    return {
+        "frames": exported,
+        "missing": [{"index": index, "time": timestamp} for index, timestamp in pending],
+        "stats": {
+            "requested": len(requested),
+            "exported": len(exported),
+            "decodedFrames": len(selected_times.times),
+            "workers": workers,
+            "keyframesOnly": bool(options.get("keyframesOnly")),
+            "timings": {
+                "importMs": round((IMPORTS_FINISHED - PROCESS_STARTED) * 1000.0, 2),
+                "encodeMs": round(encode_seconds * 1000.0, 2),
+                "exportMs": elapsed_ms(started),
+            },
+        },
+    }
+
+
+def error_payload(error):
+    return {
+        "error": str(error),
+        "traceback": traceback.format_exc(),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Batched keyframe export")
+    parser.add_argument("--video", help="video to read; without it a JSON payload is read from stdin")
+    parser.add_argument("--output-dir", help="directory for frame_NNN_<ms>.jpg files")
+    parser.add_argument("--timestamps", help="comma separated timestamps in seconds")
+    parser.add_argument("--keyframes-only", action="store_true", help="timestamps are keyframes; skip other frames")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    try:
+        if args.video:
+            payload = {
+                "videoPath": args.video,
+                "outputDir": args.output_dir or ".",
+                "timestamps": [float(value) for value in (args.timestamps or "").split(",") if value],
+                "options": {"keyframesOnly": args.keyframes_only},
+            }
+        else:
+            payload = json.load(sys.stdin)
+        json.dump(export_frames(payload), sys.stdout, ensure_ascii=False)
+    except Exception as error:
+        json.dump(error_payload(error), sys.stdout, ensure_ascii=False)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()